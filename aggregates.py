@@ -0,0 +1,410 @@
+"""
+Incremental windowed aggregate attributes.
+
+An aggregate attribute is declared with ``@aggregate_attribute`` on a
+function named like any attribute function (``State__ResidentCount``)
+whose one parameter names the attribute it aggregates
+(``Person__UserID``). The function maps each value written to that
+attribute to the value aggregated; ``None`` is skipped. The docstring
+config says how::
+
+    --
+    config:
+        aggregate: distinct   # count, sum, min, max or distinct
+        group_by: LivesIn     # entity (the default) or a relationship
+        window: 3600          # seconds; leave out to aggregate all time
+        bucket: 60            # seconds per bucket of a sliding window
+        mode: sliding         # or tumbling
+
+Aggregates are over the facts written, not over current values: each put
+of the input attribute counts once. Grouped by entity, the aggregate is
+an attribute of the entity the fact is about. Grouped by a relationship,
+it is an attribute of every target of the entity's outgoing edges of that
+relationship, and when a new edge appears the source's current value is
+added to the new target.
+
+Windows are in the facts' ``created_at`` time and kept as buckets, each
+holding a partial aggregate. A sliding window keeps ``window / bucket``
+buckets and drops the oldest as time moves on, so it covers between
+``window - bucket`` and ``window`` seconds. A tumbling window starts over
+at every multiple of ``window``. Facts older than the oldest bucket are
+ignored. Buckets are dropped as facts arrive, so call
+``FactStore.advance_aggregates`` periodically for values to decay while a
+group receives nothing.
+
+The state lives in memory in the store that maintains it. The shards of a
+``ShardedFactStore`` each keep the groups whose entity they own, and send
+values for other groups to the owning shard.
+"""
+from __future__ import annotations
+
+import collections
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import METRICS
+from registry import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+__MISSING__ = "__MISSING__"
+
+COUNT = "count"
+SUM = "sum"
+MIN = "min"
+MAX = "max"
+DISTINCT = "distinct"
+AGGREGATE_FUNCTIONS = (COUNT, SUM, MIN, MAX, DISTINCT)
+
+SLIDING = "sliding"
+TUMBLING = "tumbling"
+
+# Buckets per sliding window when the config gives no ``bucket``.
+DEFAULT_BUCKETS = 60
+
+
+class Aggregate:
+    """
+    Resolved declaration of one aggregate attribute.
+    """
+
+    def __init__(self, function: Callable, config: dict):
+        self.function = function
+        self.name = function._function_name
+        self.entity_type, self.attribute = REGISTRY.entity_attribute(
+            self.name
+        )
+        parameters = list(function._function_signature.parameters)
+        if len(parameters) != 1:
+            raise ValueError(
+                f"{self.name}: an aggregate reads exactly one attribute"
+            )
+        self.parameter = parameters[0]
+        self.input = REGISTRY.entity_attribute(self.parameter)
+        if self.input == (self.entity_type, self.attribute):
+            raise ValueError(f"{self.name}: an aggregate can not read itself")
+        self.kind = config.get("aggregate")
+        if self.kind not in AGGREGATE_FUNCTIONS:
+            raise ValueError(
+                f"{self.name}: aggregate must be one of "
+                f"{AGGREGATE_FUNCTIONS}, not {self.kind!r}"
+            )
+        group_by = config.get("group_by", "entity")
+        if group_by == "entity":
+            self.relationship = None
+            if self.input[0] is not self.entity_type:
+                raise ValueError(
+                    f"{self.name}: grouped by entity, the aggregate must be "
+                    f"on {self.input[0].__name__}"
+                )
+        else:
+            self.relationship = REGISTRY.relationships[group_by]
+        window = config.get("window")
+        mode = config.get("mode", SLIDING)
+        if mode not in (SLIDING, TUMBLING):
+            raise ValueError(
+                f"{self.name}: mode must be {SLIDING!r} or {TUMBLING!r}"
+            )
+        if window is None:
+            # One bucket that never expires.
+            self.width: Optional[float] = None
+            self.span = 1
+        elif window <= 0:
+            raise ValueError(f"{self.name}: window must be positive")
+        elif mode == TUMBLING:
+            self.width = float(window)
+            self.span = 1
+        else:
+            bucket = config.get("bucket", window / DEFAULT_BUCKETS)
+            if not 0 < bucket <= window:
+                raise ValueError(
+                    f"{self.name}: bucket must be between 0 and the window"
+                )
+            self.width = float(bucket)
+            self.span = math.ceil(window / bucket)
+
+    def __repr__(self):
+        return f"Aggregate({self.name}, {self.kind})"
+
+
+class WindowedAggregate:
+    """
+    One group's aggregate as time buckets of partial aggregates, oldest
+    evicted first. Counts and sums are kept as running totals, distinct
+    values as a running counter; minimum and maximum are recomputed from
+    the buckets when one is evicted.
+    """
+
+    __slots__ = ("kind", "width", "span", "buckets", "newest", "total")
+
+    def __init__(self, kind: str, width: Optional[float], span: int):
+        self.kind = kind
+        self.width = width
+        self.span = span
+        # bucket index -> partial aggregate, in ascending index order
+        self.buckets: Dict[int, Any] = {}
+        self.newest: Optional[int] = None
+        self.total: Any = (
+            collections.Counter() if kind == DISTINCT else None
+        )
+
+    @property
+    def value(self) -> Any:
+        if self.kind == DISTINCT:
+            return len(self.total)
+        if self.total is None and self.kind in (COUNT, SUM):
+            return 0
+        return self.total
+
+    def _index(self, timestamp: float) -> int:
+        return 0 if self.width is None else int(timestamp // self.width)
+
+    def add(self, value: Any, timestamp: float):
+        index = self._index(timestamp)
+        if self.newest is None or index > self.newest:
+            self.newest = index
+            self._evict()
+        elif index <= self.newest - self.span:
+            return
+        kind = self.kind
+        buckets = self.buckets
+        partial = buckets.get(index)
+        if partial is None and index != self.newest:
+            # A late fact for a bucket that is not there yet; keep the
+            # buckets in ascending order.
+            buckets[index] = None
+            self.buckets = dict(sorted(buckets.items()))
+            buckets = self.buckets
+        if kind == COUNT:
+            buckets[index] = (partial or 0) + 1
+            self.total = (self.total or 0) + 1
+        elif kind == SUM:
+            buckets[index] = value if partial is None else partial + value
+            self.total = value if self.total is None else self.total + value
+        elif kind == DISTINCT:
+            if partial is None:
+                partial = buckets[index] = collections.Counter()
+            partial[value] += 1
+            self.total[value] += 1
+        else:
+            better = min if kind == MIN else max
+            buckets[index] = value if partial is None else better(
+                partial, value
+            )
+            self.total = (
+                value if self.total is None else better(self.total, value)
+            )
+
+    def advance(self, timestamp: float):
+        """
+        Moves the window up to ``timestamp`` without adding anything.
+        """
+        index = self._index(timestamp)
+        if self.newest is not None and index > self.newest:
+            self.newest = index
+            self._evict()
+
+    def _evict(self):
+        oldest = self.newest - self.span
+        buckets = self.buckets
+        if not buckets or next(iter(buckets)) > oldest:
+            return
+        kind = self.kind
+        for index in [index for index in buckets if index <= oldest]:
+            partial = buckets.pop(index)
+            if kind == COUNT:
+                self.total -= partial
+            elif kind == DISTINCT:
+                self.total.subtract(partial)
+        if kind == DISTINCT:
+            self.total = +self.total
+        elif kind == SUM:
+            # Summed afresh rather than subtracted, so float error does
+            # not build up.
+            self.total = sum(buckets.values()) if buckets else None
+        elif kind in (MIN, MAX):
+            better = min if kind == MIN else max
+            self.total = better(buckets.values()) if buckets else None
+        elif not buckets:
+            self.total = None
+
+
+class AggregateMaintainer:
+    """
+    Keeps a store's aggregate attributes up to date as facts are written
+    to it. ``FactStore`` creates one when aggregates are declared.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # (aggregate, entity id it is on) -> window
+        self._windows: Dict[Tuple[Aggregate, Any], WindowedAggregate] = {}
+        # (relationship, source, target) edges already fed to aggregates
+        self._edges: set = set()
+        self._registered = -1
+        self._by_input: Dict[Tuple[type, type], List[Aggregate]] = {}
+        self._by_relationship: Dict[type, List[Aggregate]] = {}
+        # Set by stores that keep only some groups: whether the group on
+        # (entity type, entity id) is kept here. Values for the other
+        # groups are queued in ``outbox`` as (aggregate name, entity id,
+        # value, timestamp), to be passed to ``merge`` where they are kept.
+        self.owns: Optional[Callable[[type, Any], bool]] = None
+        self.outbox: List[tuple] = []
+
+    def _tables(self):
+        functions = REGISTRY.aggregate_functions
+        if len(functions) != self._registered:
+            by_input = collections.defaultdict(list)
+            by_relationship = collections.defaultdict(list)
+            for function in functions.values():
+                aggregate = function._aggregate
+                by_input[aggregate.input].append(aggregate)
+                if aggregate.relationship is not None:
+                    by_relationship[aggregate.relationship].append(aggregate)
+            self._by_input = dict(by_input)
+            self._by_relationship = dict(by_relationship)
+            self._registered = len(functions)
+
+    def _add(self, aggregate: Aggregate, entity_id, value, timestamp: float):
+        key = (aggregate, entity_id)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = WindowedAggregate(
+                aggregate.kind, aggregate.width, aggregate.span
+            )
+            before = None
+        else:
+            before = window.value
+        window.add(value, timestamp)
+        after = window.value
+        if after != before:
+            self._write(aggregate, entity_id, after)
+
+    def _add_target(
+        self, aggregate: Aggregate, entity_id, value, timestamp: float
+    ):
+        if self.owns is None or self.owns(aggregate.entity_type, entity_id):
+            self._add(aggregate, entity_id, value, timestamp)
+        else:
+            self.outbox.append((aggregate.name, entity_id, value, timestamp))
+
+    def merge(self, updates: List[tuple]):
+        """
+        Adds values another store queued in its ``outbox``.
+        """
+        functions = REGISTRY.aggregate_functions
+        for name, entity_id, value, timestamp in updates:
+            self._add(functions[name]._aggregate, entity_id, value, timestamp)
+
+    def _write(self, aggregate: Aggregate, entity_id, value):
+        self.store._put_derived(
+            aggregate.entity_type, aggregate.attribute, entity_id, value
+        )
+        if METRICS.enabled:
+            METRICS.inc("fact_store.aggregates.updated")
+
+    def observe_attribute(self, fact):
+        """
+        Feeds an attribute fact just written to the aggregates that read
+        its attribute.
+        """
+        self._tables()
+        aggregates = self._by_input.get((fact.entity_type, fact.attribute))
+        if not aggregates:
+            return
+        timestamp = _timestamp(fact)
+        for aggregate in aggregates:
+            value = aggregate.function(**{aggregate.parameter: fact.value})
+            if value is None:
+                continue
+            if aggregate.relationship is None:
+                self._add(aggregate, fact.entity_id, value, timestamp)
+                continue
+            for edge in self.store.edges(
+                aggregate.relationship,
+                fact.entity_type,
+                fact.entity_id,
+                direction="out",
+            ):
+                if edge.target_entity_type is aggregate.entity_type:
+                    self._add_target(
+                        aggregate, edge.target_entity_id, value, timestamp
+                    )
+
+    def observe_relationship(self, fact):
+        """
+        Feeds the source's current values to aggregates grouped by the
+        relationship of a new edge.
+        """
+        self._tables()
+        aggregates = self._by_relationship.get(fact.relationship)
+        if not aggregates:
+            return
+        key = _edge(fact)
+        if key in self._edges:
+            return
+        self._edges.add(key)
+        timestamp = _timestamp(fact)
+        for aggregate in aggregates:
+            if (
+                aggregate.input[0] is not fact.source_entity_type
+                or aggregate.entity_type is not fact.target_entity_type
+            ):
+                continue
+            current = self.store.get_attribute(
+                entity_type=fact.source_entity_type,
+                attribute=aggregate.input[1],
+                entity_id=fact.source_entity_id,
+            )
+            if current is __MISSING__:
+                continue
+            value = aggregate.function(**{aggregate.parameter: current.value})
+            if value is not None:
+                self._add_target(
+                    aggregate, fact.target_entity_id, value, timestamp
+                )
+
+    def forget_edge(self, fact):
+        """
+        Forgets a removed edge, so that it feeds the aggregates again if
+        it comes back.
+        """
+        self._edges.discard(_edge(fact))
+
+    def advance(self, now: float = None) -> int:
+        """
+        Moves every window up to ``now`` (default: the current time),
+        writing the values that changed. Returns how many changed.
+        """
+        now = time.time() if now is None else now
+        changed = 0
+        for (aggregate, entity_id), window in self._windows.items():
+            before = window.value
+            window.advance(now)
+            after = window.value
+            if after != before:
+                self._write(aggregate, entity_id, after)
+                changed += 1
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Advanced aggregates: %d changed", changed)
+        return changed
+
+    def __len__(self):
+        return len(self._windows)
+
+
+def _edge(fact) -> tuple:
+    return (
+        fact.relationship,
+        fact.source_entity_type,
+        fact.source_entity_id,
+        fact.target_entity_type,
+        fact.target_entity_id,
+    )
+
+
+def _timestamp(fact) -> float:
+    created_at = getattr(fact, "created_at", None)
+    return created_at.timestamp() if created_at is not None else time.time()
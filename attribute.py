@@ -10,17 +10,20 @@ import hashlib
 import inspect
 import logging
 import textwrap
+import time
 from typing import Any, List, Optional, Type
 from uuid import UUID, uuid4
-import yaml
 
+from aggregates import Aggregate
 from entities import EntityType, Person, State
-from message import Message, UserTableMessageType
+from message import Message, compile_keypath
+from metrics import METRICS
+from registry import CONFIG_CACHE, REGISTRY
 
-logging.basicConfig(level=logging.DEBUG)
-
-_MESSAGE_TYPE_CLS_LIST_DICT: dict = collections.defaultdict(list)
-_MESSAGE_TYPE_FUNCTION_TO_DICT: dict = collections.defaultdict(dict)
+# Both keyed by message type *name*, so that message types can be replaced
+# (e.g. reloaded from YAML) without re-registering attribute functions.
+_MESSAGE_TYPE_CLS_LIST_DICT: dict = REGISTRY.message_type_functions
+_MESSAGE_TYPE_FUNCTION_TO_DICT: dict = REGISTRY.function_message_configs
 
 __MISSING__ = "__MISSING__"
 
@@ -32,6 +35,13 @@ class Attribute:
 
     attribute_type: Optional[Type] = None
     value: Any = __MISSING__
+    # Seconds a fact is kept after it is created; ``None`` keeps it until
+    # it is replaced. Enforced by ``MemoryFactStore``.
+    ttl: Optional[float] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        REGISTRY.register_attribute(cls)
 
     def _validate(self):
         assert isinstance(self.value, self.attribute_type)
@@ -43,6 +53,13 @@ class Relationship:
     """
 
     relationship_type: Optional[Type] = None
+    # Seconds an edge is kept after it is created; ``None`` keeps it.
+    # Enforced by ``MemoryFactStore``.
+    ttl: Optional[float] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        REGISTRY.register_relationship(cls)
 
     def _validate(self):
         assert isinstance(self.value, self.relationship_type)
@@ -102,6 +119,26 @@ def inductive_attribute(f):
     setattr(f, "_attribute_function", True)
     setattr(f, "_function_name", f.__name__)
     setattr(f, "_function_signature", inspect.signature(f))
+    REGISTRY.register_attribute_function(f)
+    return f
+
+
+def aggregate_attribute(f):
+    """
+    Decorator for incremental aggregate attributes, maintained as the
+    attribute named by the function's parameter is written; see
+    ``aggregates`` for the config.
+    """
+    docstring_lines = textwrap.dedent(f.__doc__ or "").split("\n")
+    if "--" not in docstring_lines:
+        raise ValueError(f"No config in aggregate attribute {f.__name__}")
+    start_index = docstring_lines.index("--")
+    config_lines = "\n".join(docstring_lines[start_index + 1 :])  # noqa:E203
+    setattr(f, "_function_name", f.__name__)
+    setattr(f, "_function_signature", inspect.signature(f))
+    config = CONFIG_CACHE(config_lines)["config"]
+    setattr(f, "_aggregate", Aggregate(f, config))
+    REGISTRY.register_aggregate_function(f)
     return f
 
 
@@ -119,35 +156,35 @@ def attribute(f):
 
     start_index = docstring_lines.index("--")
     config_lines = "\n".join(docstring_lines[start_index + 1 :])  # noqa:E203
-    function_config = yaml.load(config_lines, yaml.FullLoader)["config"]
-    message_type_cls_list = [
-        globals()[message_type]
-        for message_type in function_config["message_types"]
-    ]
+    function_config = CONFIG_CACHE(config_lines)["config"]
 
-    entity_type_name, attribute_cls_name = f.__name__.split("__")
-    entity_type = globals()[entity_type_name]
-    attribute_cls = globals()[attribute_cls_name]
+    entity_type, attribute_cls = REGISTRY.entity_attribute(f.__name__)
+
+    function_args = frozenset(inspect.getfullargspec(f).args)
+    histogram_name = f"attribute_function.{f.__name__}"
 
     def inner(**inner_kwargs):
         intersected_kwargs = {
             name: value
             for name, value in inner_kwargs.items()
-            if name in inspect.getfullargspec(f).args
+            if name in function_args
         }
-        raw_output = f(**intersected_kwargs)
+        if METRICS.enabled:
+            start = time.perf_counter()
+            raw_output = f(**intersected_kwargs)
+            METRICS.observe(histogram_name, time.perf_counter() - start)
+        else:
+            raw_output = f(**intersected_kwargs)
         return raw_output, attribute_cls
 
-    for message_type_cls in message_type_cls_list:
-        _MESSAGE_TYPE_CLS_LIST_DICT[message_type_cls].append(inner)
-
     _MESSAGE_TYPE_FUNCTION_TO_DICT[inner] = {}
     for message_type_name, id_keypath in function_config[
         "message_types"
     ].items():
-        message_type_cls = globals()[message_type_name]
-        _MESSAGE_TYPE_FUNCTION_TO_DICT[inner][message_type_cls] = {
+        _MESSAGE_TYPE_CLS_LIST_DICT[message_type_name].append(inner)
+        _MESSAGE_TYPE_FUNCTION_TO_DICT[inner][message_type_name] = {
             "id_keypath": id_keypath,
+            "id_extractor": compile_keypath(id_keypath),
             "entity_type": entity_type,
         }
 
@@ -156,6 +193,7 @@ def attribute(f):
     setattr(inner, "_function_name", f.__name__)
     setattr(inner, "_function_signature", inspect.signature(f))
     setattr(inner, "_callbacks", [])
+    REGISTRY.register_attribute_function(inner)
     return inner
 
 
@@ -216,3 +254,6 @@ def Person__LuckyNumber(user_id: str = None, user_name=None):
             UserTableMessageType: [cdc, columns, id]
     """
     return len(user_name) + int(user_id)
+
+
+CONFIG_CACHE.save()
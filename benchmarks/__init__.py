@@ -0,0 +1,3 @@
+"""
+Benchmarks. Run from the repository root with ``python -m benchmarks.run``.
+"""
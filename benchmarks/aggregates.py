@@ -0,0 +1,54 @@
+"""
+Example aggregate attributes over the generated ``users`` tables.
+
+Importing this module declares them; ``python -m benchmarks.run
+--aggregates`` does so to measure what maintaining them costs.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+from attribute import Attribute, aggregate_attribute
+
+
+class NameUpdates(Attribute):
+    """
+    Recent changes of name
+    """
+
+    value: Optional[int] = None
+
+
+class ResidentCount(Attribute):
+    """
+    People living somewhere
+    """
+
+    value: Optional[int] = None
+
+
+@aggregate_attribute
+def Person__NameUpdates(Person__FirstName: str = None):
+    """
+    How many times the name was written in the last hour.
+
+    --
+    config:
+        aggregate: count
+        window: 3600
+        bucket: 60
+    """
+    return Person__FirstName
+
+
+@aggregate_attribute
+def State__ResidentCount(Person__UserID: int = None):
+    """
+    Number of different people recorded as living in the state.
+
+    --
+    config:
+        aggregate: distinct
+        group_by: LivesIn
+    """
+    return Person__UserID
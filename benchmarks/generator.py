@@ -0,0 +1,132 @@
+"""
+Seeded generator of synthetic ``users``-table CDC messages.
+"""
+from __future__ import annotations
+
+import functools
+import random
+from typing import Iterator, List
+
+from attribute import _MESSAGE_TYPE_CLS_LIST_DICT, _MESSAGE_TYPE_FUNCTION_TO_DICT
+from message import UserTableMessageType
+from route import MessageRoundabout, Route
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi",
+    "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil",
+    "Trent", "Victor", "Walter", "Yolanda",
+]  # fmt: skip
+
+LAST_NAMES = [
+    "Smith", "Jones", "Brown", "Garcia", "Miller", "Davis", "Lopez",
+    "Wilson", "Moore", "Clark",
+]  # fmt: skip
+
+STATES = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID",
+    "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS",
+    "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH", "OK",
+    "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV",
+    "WI", "WY",
+]  # fmt: skip
+
+
+def table_names(table_count: int = 1) -> List[str]:
+    """
+    ``users`` followed by ``users_1``, ``users_2``, ...
+    """
+    return ["users"] + [f"users_{i}" for i in range(1, table_count)]
+
+
+@functools.lru_cache(maxsize=None)
+def user_table_message_type(table_name: str):
+    """
+    Message type for a generated table. ``users`` maps to
+    ``UserTableMessageType``; every other table gets a subclass that shares
+    its argument mapping and attribute functions.
+    """
+    if table_name == "users":
+        return UserTableMessageType
+    message_type = type(
+        f"UserTableMessageType_{table_name}", (UserTableMessageType,), {}
+    )
+    base_name = UserTableMessageType.__name__
+    attribute_functions = _MESSAGE_TYPE_CLS_LIST_DICT[base_name]
+    _MESSAGE_TYPE_CLS_LIST_DICT[message_type.__name__] = list(
+        attribute_functions
+    )
+    for attribute_function in attribute_functions:
+        function_config = _MESSAGE_TYPE_FUNCTION_TO_DICT[attribute_function]
+        function_config[message_type.__name__] = function_config[base_name]
+    return message_type
+
+
+def build_roundabout(table_count: int = 1) -> MessageRoundabout:
+    """
+    A ``MessageRoundabout`` with one route per generated table.
+    """
+    roundabout = MessageRoundabout()
+    for table_name in table_names(table_count):
+        roundabout.add_route(
+            Route(
+                message_type=user_table_message_type(table_name),
+                keypath=["metadata", "table"],
+                value_match=table_name,
+            )
+        )
+    return roundabout
+
+
+class CDCGenerator:
+    """
+    Yields CDC messages shaped like ``SAMPLE_MESSAGE`` in ``session.py``.
+
+    ``entity_cardinality`` bounds the number of distinct user ids. Each
+    message updates an already-seen user with probability ``update_ratio``
+    and otherwise inserts a new one (until the cardinality is exhausted).
+    Messages are spread uniformly over ``table_count`` tables.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        entity_cardinality: int = 1000,
+        update_ratio: float = 0.5,
+        table_count: int = 1,
+        state_cardinality: int = len(STATES),
+    ):
+        self.seed = seed
+        self.entity_cardinality = entity_cardinality
+        self.update_ratio = update_ratio
+        self.table_count = table_count
+        self.states = STATES[: max(1, min(state_cardinality, len(STATES)))]
+        self.tables = table_names(table_count)
+
+    def __call__(self, message_count: int) -> Iterator[dict]:
+        rng = random.Random(self.seed)
+        next_user_id = 0
+        for _ in range(message_count):
+            is_update = next_user_id > 0 and (
+                next_user_id >= self.entity_cardinality
+                or rng.random() < self.update_ratio
+            )
+            if is_update:
+                user_id = rng.randrange(next_user_id)
+            else:
+                user_id = next_user_id
+                next_user_id += 1
+            yield {
+                "cdc": {
+                    "columns": {
+                        "id": user_id,
+                        "name": (
+                            f"{rng.choice(FIRST_NAMES)} "
+                            f"{rng.choice(LAST_NAMES)}"
+                        ),
+                        "age": rng.randint(18, 90),
+                        "state": rng.choice(self.states),
+                    },
+                    "operation": "update" if is_update else "insert",
+                },
+                "metadata": {"table": rng.choice(self.tables)},
+            }
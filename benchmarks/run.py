@@ -0,0 +1,344 @@
+"""
+Ingest and lookup benchmarks for each ``FactStore`` backend.
+
+Usage::
+
+    python -m benchmarks.run --messages 2000 --output before.json
+    python -m benchmarks.run --messages 2000 --compare before.json
+
+Each backend runs in its own process so that peak RSS is not shared between
+backends.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+from benchmarks import startup
+from benchmarks.generator import CDCGenerator, build_roundabout
+from caching import CachingFactStore
+from fact import AttributeFact
+from fact_store import MemoryFactStore
+from session import Session
+from sqlite_fact_store import SqliteFactStore
+
+
+def _memory_kwargs(_directory: str) -> dict:
+    return {}
+
+
+def _sqlite_kwargs(directory: str) -> dict:
+    return {"path": os.path.join(directory, "facts.db")}
+
+
+def _cached_sqlite_kwargs(directory: str) -> dict:
+    return {
+        "fact_store_cls": SqliteFactStore,
+        "fact_store_kwargs": _sqlite_kwargs(directory),
+    }
+
+
+def _spill_kwargs(directory: str) -> dict:
+    # Small enough that the default run spills.
+    return {"memory_budget": 2 * 1024 * 1024, "spill_directory": directory}
+
+
+# Backend name -> (fact store class, factory for its constructor kwargs
+# from a scratch directory that is removed after the run).
+BACKENDS: Dict[str, tuple] = {
+    "memory": (MemoryFactStore, _memory_kwargs),
+    "memory+spill": (MemoryFactStore, _spill_kwargs),
+    "sqlite": (SqliteFactStore, _sqlite_kwargs),
+    "sqlite+cache": (CachingFactStore, _cached_sqlite_kwargs),
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[
+        int(q * 100) - 1
+    ]
+
+
+def _session(backend: str, params: dict, directory: str) -> Session:
+    fact_store_cls, kwargs_factory = BACKENDS[backend]
+    return Session(
+        fact_store_cls=fact_store_cls,
+        fact_store_kwargs=kwargs_factory(directory),
+        message_roundabout=build_roundabout(params["tables"]),
+    )
+
+
+def _count_puts(store) -> List[int]:
+    """
+    Counts the facts written to ``store`` from now on, derived attributes
+    included, in the one-item list returned. Unlike iterating the store
+    afterwards, this does not depend on how the backend keeps versions.
+    """
+    count = [0]
+    put = store.put
+
+    def counted_put(fact):
+        count[0] += 1
+        return put(fact)
+
+    store.put = counted_put
+    return count
+
+
+def _close(session: Session):
+    session.fact_store.flush()
+    close = getattr(session.fact_store, "close", None)
+    if close is not None:
+        close()
+
+
+def _ingest(session: Session, params: dict):
+    generator = CDCGenerator(
+        seed=params["seed"],
+        entity_cardinality=params["entities"],
+        update_ratio=params["update_ratio"],
+        table_count=params["tables"],
+    )
+    for message in generator(params["messages"]):
+        session(message)
+    session.fact_store.flush()
+
+
+def _measure(session: Session, messages: List[dict], params: dict) -> dict:
+    puts = _count_puts(session.fact_store)
+    start = time.perf_counter()
+    for message in messages:
+        session(message)
+    # Write-behind stores finish writing inside the timed section.
+    session.fact_store.flush()
+    elapsed = time.perf_counter() - start
+    fact_count = puts[0]
+
+    attribute_keys = list(
+        {
+            (fact.entity_type, fact.attribute, fact.entity_id)
+            for fact in session.fact_store
+            if isinstance(fact, AttributeFact)
+        }
+    )
+    rng = random.Random(params["seed"])
+    lookup_samples = []
+    get_attribute = session.fact_store.get_attribute
+    for _ in range(min(params["lookups"], len(attribute_keys) * 10)):
+        entity_type, attribute, entity_id = rng.choice(attribute_keys)
+        lookup_start = time.perf_counter()
+        get_attribute(
+            entity_type=entity_type,
+            attribute=attribute,
+            entity_id=entity_id,
+        )
+        lookup_samples.append(time.perf_counter() - lookup_start)
+    entity_keys = list(
+        {
+            (entity_type, entity_id)
+            for entity_type, _, entity_id in attribute_keys
+        }
+    )
+    entity_samples = []
+    get_entity = session.fact_store.get_entity
+    for _ in range(min(params["lookups"], len(entity_keys) * 10)):
+        entity_type, entity_id = rng.choice(entity_keys)
+        lookup_start = time.perf_counter()
+        get_entity(entity_type, entity_id)
+        entity_samples.append(time.perf_counter() - lookup_start)
+
+    return {
+        "messages": len(messages),
+        "facts": fact_count,
+        "ingest_seconds": elapsed,
+        "messages_per_second": len(messages) / elapsed if elapsed else 0.0,
+        "facts_per_second": fact_count / elapsed if elapsed else 0.0,
+        "get_attribute_p50_us": _percentile(lookup_samples, 0.50) * 1e6,
+        "get_attribute_p99_us": _percentile(lookup_samples, 0.99) * 1e6,
+        "get_entity_p50_us": _percentile(entity_samples, 0.50) * 1e6,
+        "get_entity_p99_us": _percentile(entity_samples, 0.99) * 1e6,
+    }
+
+
+def run_backend(backend: str, params: dict) -> dict:
+    """
+    Runs one backend and returns its measurements.
+    """
+    if params.get("aggregates"):
+        # Declared in the worker process, which is spawned.
+        importlib.import_module("benchmarks.aggregates")
+    messages = list(
+        CDCGenerator(
+            seed=params["seed"],
+            entity_cardinality=params["entities"],
+            update_ratio=params["update_ratio"],
+            table_count=params["tables"],
+        )(params["messages"])
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        session = _session(backend, params, directory)
+        try:
+            result = _measure(session, messages, params)
+        finally:
+            _close(session)
+    result["backend"] = backend
+    result["peak_rss_bytes"] = _peak_rss_bytes()
+    if params["memory"]:
+        # Traced separately: tracemalloc slows allocation considerably.
+        with tempfile.TemporaryDirectory() as directory:
+            tracemalloc.start()
+            baseline, _ = tracemalloc.get_traced_memory()
+            session = _session(backend, params, directory)
+            try:
+                _ingest(session, params)
+                current, _ = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                _close(session)
+        result["bytes_per_fact"] = (current - baseline) / max(
+            result["facts"], 1
+        )
+    return result
+
+
+def _run_in_subprocess(backend: str, params: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_backend, (backend, params))
+
+
+def run(params: dict, backends: List[str] = None) -> dict:
+    """
+    Runs every requested backend and returns the full result document.
+    """
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "params": params,
+        "results": {
+            backend: _run_in_subprocess(backend, params)
+            for backend in (backends or list(BACKENDS))
+        },
+        "startup": startup.measure(repeat=3),
+    }
+
+
+# Metrics where a larger number is better.
+_HIGHER_IS_BETTER = {"messages_per_second", "facts_per_second"}
+
+# Workload sizes, not measurements.
+_NOT_COMPARED = {"messages", "facts"}
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    """
+    Lines describing the relative change of each metric between two runs.
+    """
+    lines = [f"{old.get('commit', '?')[:10]} -> {new.get('commit', '?')[:10]}"]
+    for backend, new_result in new["results"].items():
+        old_result = old["results"].get(backend)
+        if old_result is None:
+            continue
+        for metric, new_value in new_result.items():
+            old_value = old_result.get(metric)
+            if metric in _NOT_COMPARED:
+                continue
+            if not isinstance(new_value, (int, float)) or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            better = (change > 0) == (metric in _HIGHER_IS_BETTER)
+            lines.append(
+                f"{backend:>10} {metric:<24} {old_value:>14.2f} "
+                f"{new_value:>14.2f} {change:>+8.1%}"
+                + ("" if change == 0 else " better" if better else " worse")
+            )
+    return lines
+
+
+def main(argv: List[str] = None):
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--entities", type=int, default=500)
+    parser.add_argument("--update-ratio", type=float, default=0.5)
+    parser.add_argument("--tables", type=int, default=1)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backend", action="append", choices=sorted(BACKENDS)
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip the tracemalloc pass that measures bytes per fact.",
+    )
+    parser.add_argument(
+        "--aggregates",
+        action="store_true",
+        help="Declare the example aggregates in benchmarks/aggregates.py.",
+    )
+    parser.add_argument("--output", help="Write the JSON results here.")
+    parser.add_argument("--compare", help="Earlier JSON results to diff.")
+    args = parser.parse_args(argv)
+
+    params = {
+        "messages": args.messages,
+        "entities": args.entities,
+        "update_ratio": args.update_ratio,
+        "tables": args.tables,
+        "lookups": args.lookups,
+        "seed": args.seed,
+        "memory": not args.no_memory,
+        "aggregates": args.aggregates,
+    }
+    results = run(params, backends=args.backend)
+    out = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(out)
+    else:
+        print(out)
+    if args.compare:
+        with open(args.compare) as compare_file:
+            print("\n".join(compare(json.load(compare_file), results)))
+
+
+if __name__ == "__main__":
+    main()
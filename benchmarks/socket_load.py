@@ -0,0 +1,219 @@
+"""
+Load generator for the socket ingestion server (``server.py``).
+
+Usage::
+
+    python -m benchmarks.socket_load --messages 20000 --concurrency 64
+    python -m benchmarks.socket_load --socket /tmp/facts.sock
+
+Without ``--socket`` a server for ``--backend`` is started in its own
+process on a temporary socket, with routes for the generated tables. Then
+``--concurrency`` tasks put the generated messages through a
+``ClientPool`` of ``--connections`` connections, each waiting for its
+acknowledgement, and afterwards make ``--lookups`` random reads. Reports
+throughput and per-request latency as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Iterator, List
+
+from benchmarks.generator import CDCGenerator, build_roundabout
+from benchmarks.run import BACKENDS, _git_commit, _percentile
+from server import ClientPool
+
+# Seconds to wait for a started server to listen.
+_STARTUP_TIMEOUT = 30.0
+
+
+def _serve(path: str, backend: str, tables: int):
+    # Imported here so that the load generator itself does not load
+    # ``session``.
+    from server import run  # pylint: disable=import-outside-toplevel
+    from session import Session  # pylint: disable=import-outside-toplevel
+
+    fact_store_cls, kwargs_factory = BACKENDS[backend]
+    with Session(
+        fact_store_cls=fact_store_cls,
+        fact_store_kwargs=kwargs_factory(),
+        message_roundabout=build_roundabout(tables),
+        message_loader=None,
+    ) as session:
+        run(session, path)
+
+
+def _start_server(path: str, backend: str, tables: int):
+    process = multiprocessing.get_context("spawn").Process(
+        target=_serve, args=(path, backend, tables)
+    )
+    process.start()
+    deadline = time.monotonic() + _STARTUP_TIMEOUT
+    while not os.path.exists(path):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("Server did not start")
+        time.sleep(0.05)
+    return process
+
+
+def _stop_server(process):
+    # The server commits and acknowledges what it has before exiting.
+    process.terminate()
+    process.join(_STARTUP_TIMEOUT)
+    if process.is_alive():
+        process.kill()
+
+
+async def _drive(
+    concurrency: int,
+    requests: Iterator[Callable[[], Awaitable[Any]]],
+    samples: List[float],
+):
+    # ``concurrency`` tasks take requests from one iterator, each waiting
+    # for its response before taking the next.
+    async def worker():
+        for request in requests:
+            start = time.perf_counter()
+            await request()
+            samples.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_load(path: str, params: dict) -> dict:
+    """
+    Drives the server at ``path`` and returns the measurements.
+    """
+    messages = list(
+        CDCGenerator(
+            seed=params["seed"],
+            entity_cardinality=params["entities"],
+            update_ratio=params["update_ratio"],
+            table_count=params["tables"],
+        )(params["messages"])
+    )
+    pool = ClientPool(path, params["connections"])
+    try:
+        put_samples: List[float] = []
+        start = time.perf_counter()
+        await _drive(
+            params["concurrency"],
+            (
+                lambda message=message: pool.put(message)
+                for message in messages
+            ),
+            put_samples,
+        )
+        elapsed = time.perf_counter() - start
+
+        rng = random.Random(params["seed"])
+        entity_ids = sorted(
+            {message["cdc"]["columns"]["id"] for message in messages}
+        )
+        attribute_samples: List[float] = []
+        await _drive(
+            params["concurrency"],
+            (
+                lambda entity_id=rng.choice(entity_ids): pool.get_attribute(
+                    "Person", "FirstName", entity_id
+                )
+                for _ in range(params["lookups"])
+            ),
+            attribute_samples,
+        )
+        entity_samples: List[float] = []
+        await _drive(
+            params["concurrency"],
+            (
+                lambda entity_id=rng.choice(entity_ids): pool.get_entity(
+                    "Person", entity_id
+                )
+                for _ in range(params["lookups"])
+            ),
+            entity_samples,
+        )
+    finally:
+        await pool.close()
+    return {
+        "messages": len(messages),
+        "ingest_seconds": elapsed,
+        "messages_per_second": len(messages) / elapsed if elapsed else 0.0,
+        "put_p50_us": _percentile(put_samples, 0.50) * 1e6,
+        "put_p99_us": _percentile(put_samples, 0.99) * 1e6,
+        "get_attribute_p50_us": _percentile(attribute_samples, 0.50) * 1e6,
+        "get_attribute_p99_us": _percentile(attribute_samples, 0.99) * 1e6,
+        "get_entity_p50_us": _percentile(entity_samples, 0.50) * 1e6,
+        "get_entity_p99_us": _percentile(entity_samples, 0.99) * 1e6,
+    }
+
+
+def main(argv: List[str] = None):
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--socket", help="Drive a running server instead.")
+    parser.add_argument(
+        "--backend", default="memory", choices=sorted(BACKENDS)
+    )
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--entities", type=int, default=500)
+    parser.add_argument("--update-ratio", type=float, default=0.5)
+    parser.add_argument("--tables", type=int, default=1)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results here.")
+    args = parser.parse_args(argv)
+
+    params = {
+        "backend": args.backend,
+        "messages": args.messages,
+        "entities": args.entities,
+        "update_ratio": args.update_ratio,
+        "tables": args.tables,
+        "lookups": args.lookups,
+        "connections": args.connections,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+    }
+    process = None
+    path = args.socket
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "facts.sock")
+        process = _start_server(path, args.backend, args.tables)
+    try:
+        result = asyncio.run(run_load(path, params))
+    finally:
+        if process is not None:
+            _stop_server(process)
+    out = json.dumps(
+        {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "params": params,
+            "result": result,
+        },
+        indent=2,
+        sort_keys=True,
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
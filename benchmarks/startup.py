@@ -0,0 +1,109 @@
+"""
+Startup time, from importing ``session`` to a constructed ``Session``, by
+phase, each measured in a fresh interpreter.
+
+Usage::
+
+    python -m benchmarks.startup --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import List
+
+from configs import CONFIG_CACHE_PATH
+
+# Times each startup phase and records which phase imported yaml (the
+# config cache exists to keep it out of a warm start) and what the cache
+# held beforehand.
+_PROBE = """
+import json, os, sys, time
+from configs import CONFIG_CACHE_PATH
+cached = os.path.exists(CONFIG_CACHE_PATH)
+phases = {}
+yaml_imported_in = None
+
+def timed(phase, run):
+    global yaml_imported_in
+    start = time.perf_counter()
+    result = run()
+    phases[phase + "_seconds"] = time.perf_counter() - start
+    if yaml_imported_in is None and "yaml" in sys.modules:
+        yaml_imported_in = phase
+    return result
+
+session = timed("import", lambda: __import__("session"))
+timed("message_configs", session.DEFAULT_LOADER.load)
+from fact_store import MemoryFactStore
+from route import MessageRoundabout
+timed(
+    "session_init",
+    lambda: session.Session(
+        fact_store_cls=MemoryFactStore, message_roundabout=MessageRoundabout()
+    ),
+)
+print(json.dumps({
+    **phases,
+    "total_seconds": sum(phases.values()),
+    "yaml_imported_in": yaml_imported_in,
+    "cache_existed": cached,
+    "attribute_functions": len(session.REGISTRY.attribute_functions),
+}))
+"""
+
+
+def _probe(env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(repeat: int = 5) -> dict:
+    """
+    Median time of each startup phase (importing ``session``, loading the
+    message type files, constructing a ``Session``) and their total, with
+    a cold and a warm config cache, and the phase that imported yaml.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    results = {}
+    for label in ("cold_config_cache", "warm_config_cache"):
+        samples: List[dict] = []
+        for _ in range(repeat):
+            if label == "cold_config_cache" and os.path.exists(
+                CONFIG_CACHE_PATH
+            ):
+                os.remove(CONFIG_CACHE_PATH)
+            samples.append(_probe(env))
+        results[label] = {
+            key: (
+                statistics.median(sample[key] for sample in samples)
+                if key.endswith("_seconds")
+                else samples[-1][key]
+            )
+            for key in samples[0]
+        }
+    return results
+
+
+def main(argv: List[str] = None):
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    print(json.dumps(measure(args.repeat), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Bloom filters for answering "definitely absent" without touching storage.
+
+A ``BloomFilter`` holds a bit array sized for ``capacity`` keys at a
+target false-positive rate. ``key in bloom`` is ``False`` only if the key
+was never added, so a store can skip its lookup for those keys; a ``True``
+still needs the lookup. Keys can not be removed, and the false-positive
+rate climbs once more than ``capacity`` keys are added, so the owner
+rebuilds the filter from its storage, at a new capacity, when it compacts
+or when ``saturated`` turns true.
+
+Keys are hashed with the built-in ``hash``, so a filter is only valid in
+the process that built it.
+"""
+from __future__ import annotations
+
+import math
+from typing import Hashable, Iterable, Iterator
+
+_MASK = 0xFFFFFFFF
+
+
+class BloomFilter:
+    """
+    Bloom filter over hashable keys.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.bit_count = max(bits, 8)
+        self.hash_count = max(
+            round(self.bit_count / capacity * math.log(2)), 1
+        )
+        self._rounds = range(self.hash_count)
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._count = 0
+
+    @classmethod
+    def from_keys(
+        cls, keys: Iterable[Hashable], capacity: int, error_rate: float = 0.01
+    ) -> "BloomFilter":
+        """
+        Filter holding ``keys``.
+        """
+        bloom = cls(capacity, error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key: Hashable) -> Iterator[int]:
+        # Kirsch-Mitzenmacher: k positions from the two halves of one hash.
+        hashed = hash(key)
+        position = hashed & _MASK
+        step = ((hashed >> 32) & _MASK) | 1
+        bit_count = self.bit_count
+        for _ in self._rounds:
+            yield position % bit_count
+            position += step
+
+    def add(self, key: Hashable):
+        bits = self._bits
+        new = False
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        # Keys already in the filter, like rewritten attributes, do not
+        # use up capacity.
+        if new:
+            self._count += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        # ``_positions`` inlined: this runs on every lookup.
+        hashed = hash(key)
+        position = hashed & _MASK
+        step = ((hashed >> 32) & _MASK) | 1
+        bit_count = self.bit_count
+        bits = self._bits
+        for _ in self._rounds:
+            index = position % bit_count
+            if not bits[index >> 3] >> (index & 7) & 1:
+                return False
+            position += step
+        return True
+
+    def __len__(self) -> int:
+        """
+        Approximate number of distinct keys added.
+        """
+        return self._count
+
+    @property
+    def saturated(self) -> bool:
+        """
+        Whether more keys were added than the filter was sized for.
+        """
+        return self._count > self.capacity
+
+    def size_bytes(self) -> int:
+        return len(self._bits)
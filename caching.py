@@ -0,0 +1,245 @@
+"""
+Write-behind buffering and a read-through row cache around any fact store.
+
+``CachingFactStore`` wraps a backend built from ``fact_store_cls`` and
+``fact_store_kwargs``. Facts written to it run their callbacks right away
+but are buffered in memory, then written to the backend in one backend
+transaction per batch. A batch goes out once ``max_pending`` facts are
+waiting or the oldest has waited ``max_age`` seconds (checked as facts
+arrive), on ``flush``, and when a ``Session`` exits. With
+``flush_on_commit`` every commit (one per message under a ``Session``) is
+flushed, so a message is in the backend once it has been processed.
+
+``get_attribute`` and ``get_entity`` read whole entity rows through an LRU
+of ``cache_size`` rows. A row loaded from the backend is overlaid with the
+entity's buffered writes, and cached rows are updated as facts arrive, so
+reads always see buffered writes. All other reads flush first and then go
+to the backend.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from configs import ENTITY_CACHE_SIZE
+from fact import AttributeFact, Fact
+from fact_store import FactStore
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+__MISSING__ = "__MISSING__"
+
+# Facts buffered before they are written to the backend.
+MAX_PENDING = 1000
+
+# Seconds a buffered fact may wait before the buffer is written.
+MAX_AGE = 1.0
+
+
+class CachingFactStore(FactStore):
+    """
+    Write-behind, read-through wrapper around a ``fact_store_cls``
+    backend.
+    """
+
+    def __init__(
+        self,
+        fact_store_cls: type = None,
+        fact_store_kwargs: dict = None,
+        max_pending: int = MAX_PENDING,
+        max_age: Optional[float] = MAX_AGE,
+        cache_size: int = ENTITY_CACHE_SIZE,
+        flush_on_commit: bool = False,
+    ):
+        self.entity_cache_size = max(cache_size, 1)
+        super().__init__()
+        if fact_store_cls is None:
+            raise ValueError("CachingFactStore needs a fact_store_cls")
+        self.backend: FactStore = fact_store_cls(**(fact_store_kwargs or {}))
+        # Rows are cached here, with the buffered writes laid over them;
+        # ``flush`` writes through ``backend.put``, which would leave rows
+        # the backend cached itself stale.
+        self.backend.entity_cache = None
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.flush_on_commit = flush_on_commit
+        self._pending: List[Fact] = []
+        # (entity type, entity id) -> attribute -> buffered fact
+        self._pending_rows: Dict[Tuple[Any, Any], Dict[Any, Any]] = {}
+        self._oldest: Optional[float] = None
+        self._depth = 0
+        self.metrics_label = METRICS.register_gauges(
+            self, {"fact_store.pending": self.pending_count}
+        )
+
+    @property
+    def index_version(self):
+        return self.backend.index_version
+
+    def pending_count(self) -> int:
+        """
+        Number of facts buffered and not yet written to the backend.
+        """
+        return len(self._pending)
+
+    # Writes
+
+    def put(self, fact: Fact):
+        if not isinstance(fact, Fact):
+            raise TypeError("Tried to put a non-Fact into the store.")
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append(fact)
+        if isinstance(fact, AttributeFact):
+            self._pending_rows.setdefault(
+                (fact.entity_type, fact.entity_id), {}
+            )[fact.attribute] = fact
+        if len(self._pending) >= self.max_pending or (
+            self.max_age is not None
+            and time.monotonic() - self._oldest >= self.max_age
+        ):
+            self.flush()
+
+    def begin(self):
+        self._depth += 1
+
+    def commit(self):
+        self._depth -= 1
+        if not self._depth and self.flush_on_commit:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered facts to the backend in one transaction.
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        self.backend.begin()
+        try:
+            for fact in pending:
+                self.backend.put(fact)
+        finally:
+            self.backend.commit()
+        self.backend.flush()
+        self._pending = []
+        self._pending_rows = {}
+        self._oldest = None
+        if timing:
+            METRICS.observe("stage.flush", time.perf_counter() - start)
+            METRICS.inc("fact_store.flushed", len(pending))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Flushed %d facts", len(pending))
+
+    def begin_bulk(self):
+        self.flush()
+        self.backend.begin_bulk()
+        super().begin_bulk()
+
+    def end_bulk(self):
+        # The backend recomputes derived attributes from its own reads and
+        # builds its indexes itself, so cached rows are stale afterwards.
+        self.flush()
+        if self.backend.entity_cache is not None:
+            self.backend.entity_cache.clear()
+        try:
+            self.backend.end_bulk()
+        finally:
+            self.bulk = False
+            self.entity_cache.clear()
+        for standing_query in self.standing_queries:
+            standing_query.reload()
+
+    def close(self):
+        """
+        Flushes, then closes the backend if it can be closed, and drops the
+        store's gauge.
+        """
+        self.flush()
+        METRICS.unregister_gauges(self.metrics_label)
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # Reads through the row cache
+
+    def _row(self, entity_type, entity_id) -> Dict[Any, AttributeFact]:
+        key = (entity_type, entity_id)
+        row = self.entity_cache.get(key)
+        if METRICS.enabled:
+            METRICS.inc(
+                "fact_store.entity_cache.miss"
+                if row is None
+                else "fact_store.entity_cache.hit"
+            )
+        if row is None:
+            row = dict(self.backend.get_entity(entity_type, entity_id))
+            row.update(self._pending_rows.get(key, ()))
+            self.entity_cache.put(key, row)
+        return row
+
+    def _get_attribute(self, entity_type=None, attribute=None, entity_id=None):
+        fact = self._row(entity_type, entity_id).get(attribute)
+        return __MISSING__ if fact is None else fact
+
+    def get_entity(self, entity_type, entity_id) -> Dict[Any, AttributeFact]:
+        return dict(self._row(entity_type, entity_id))
+
+    # Everything else goes to the backend once the buffer is written
+
+    def has_entity(self, entity_type, entity_id) -> bool:
+        if (entity_type, entity_id) in self._pending_rows:
+            return True
+        self.flush()
+        return self.backend.has_entity(entity_type, entity_id)
+
+    def entity_ids(self, entity_type=None):
+        self.flush()
+        return self.backend.entity_ids(entity_type)
+
+    def edges(self, *args, **kwargs):
+        self.flush()
+        return self.backend.edges(*args, **kwargs)
+
+    def traverse(self, *args, **kwargs):
+        self.flush()
+        return self.backend.traverse(*args, **kwargs)
+
+    def attribute_index(self, attribute):
+        self.flush()
+        return self.backend.attribute_index(attribute)
+
+    def create_index(self, attribute):
+        """
+        Creates a value index on the backend.
+        """
+        self.flush()
+        return self.backend.create_index(attribute)
+
+    def compact(self):
+        """
+        Flushes, then compacts the backend if it can be compacted.
+        """
+        self.flush()
+        compact = getattr(self.backend, "compact", None)
+        if compact is not None:
+            compact()
+
+    def statistics(self):
+        self.flush()
+        return self.backend.statistics()
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.backend)
@@ -0,0 +1,205 @@
+"""
+Cardinality statistics the query planner uses to order pattern expansion.
+"""
+from __future__ import annotations
+
+import collections
+from typing import Any, Dict, Optional, Tuple
+
+
+class CardinalityStatistics:
+    """
+    Entity counts per type and edge counts per relationship, kept up to
+    date by the fact store as facts arrive.
+
+    ``generation`` changes whenever the total number of entities and edges
+    crosses a power of two, or falls well below one after edges expire, so
+    cached plans can be re-planned when the data has changed enough for the
+    estimates to matter.
+    """
+
+    def __init__(self):
+        self.entity_counts: Dict[Any, int] = collections.Counter()
+        # (relationship, source type, target type) -> distinct edges
+        self.edge_counts: Dict[Tuple[Any, Any, Any], int] = (
+            collections.Counter()
+        )
+        # (relationship, source type, target type) -> distinct endpoints
+        self.source_counts: Dict[Tuple[Any, Any, Any], int] = (
+            collections.Counter()
+        )
+        self.target_counts: Dict[Tuple[Any, Any, Any], int] = (
+            collections.Counter()
+        )
+        self.generation = 0
+        self._total = 0
+        self._next_generation_at = 1
+
+    def _grow(self, amount: int = 1):
+        self._total += amount
+        while self._total >= self._next_generation_at:
+            self.generation += 1
+            self._next_generation_at *= 2
+
+    def _shrink(self, amount: int = 1):
+        # Shrinking to a quarter of the size that last moved the
+        # generation moves it again.
+        self._total -= amount
+        while self._next_generation_at > 1 and (
+            self._total < self._next_generation_at // 4
+        ):
+            self.generation += 1
+            self._next_generation_at //= 2
+
+    def observe_entity(self, entity_type: Any):
+        """
+        A new entity of ``entity_type`` was stored.
+        """
+        self.entity_counts[entity_type] += 1
+        self._grow()
+
+    def observe_edge(
+        self,
+        relationship: Any,
+        source_type: Any,
+        target_type: Any,
+        new_source: bool,
+        new_target: bool,
+    ):
+        """
+        A new distinct edge was stored. ``new_source`` / ``new_target`` say
+        whether this is the first edge of ``relationship`` for that
+        endpoint.
+        """
+        key = (relationship, source_type, target_type)
+        self.edge_counts[key] += 1
+        if new_source:
+            self.source_counts[key] += 1
+        if new_target:
+            self.target_counts[key] += 1
+        self._grow()
+
+    def forget_edge(
+        self,
+        relationship: Any,
+        source_type: Any,
+        target_type: Any,
+        last_source: bool,
+        last_target: bool,
+    ):
+        """
+        A distinct edge was removed. ``last_source`` / ``last_target`` say
+        whether it was the last edge of ``relationship`` for that endpoint.
+        """
+        key = (relationship, source_type, target_type)
+        self.edge_counts[key] -= 1
+        if last_source:
+            self.source_counts[key] -= 1
+        if last_target:
+            self.target_counts[key] -= 1
+        self._shrink()
+
+    def add_counts(
+        self,
+        entity_counts: Dict[Any, int],
+        edge_counts: Dict[Tuple[Any, Any, Any], Tuple[int, int, int]],
+    ):
+        """
+        Adds counts gathered in bulk, e.g. when a persistent store is
+        reopened: entities per type, and ``(edges, distinct sources,
+        distinct targets)`` per ``(relationship, source type, target
+        type)``.
+        """
+        for entity_type, count in entity_counts.items():
+            self.entity_counts[entity_type] += count
+            self._grow(count)
+        for key, (edges, sources, targets) in edge_counts.items():
+            self.edge_counts[key] += edges
+            self.source_counts[key] += sources
+            self.target_counts[key] += targets
+            self._grow(edges)
+
+    def entity_count(self, entity_type: Optional[Any] = None) -> int:
+        """
+        Number of entities of ``entity_type`` (all types if ``None``).
+        """
+        if entity_type is None:
+            return sum(self.entity_counts.values())
+        return self.entity_counts.get(entity_type, 0)
+
+    def _matching(self, counts, relationship, source_type, target_type):
+        return sum(
+            count
+            for (
+                count_relationship,
+                count_source,
+                count_target,
+            ), count in counts.items()
+            if (relationship is None or count_relationship is relationship)
+            and (source_type is None or count_source is source_type)
+            and (target_type is None or count_target is target_type)
+        )
+
+    def edge_count(
+        self,
+        relationship: Optional[Any] = None,
+        source_type: Optional[Any] = None,
+        target_type: Optional[Any] = None,
+    ) -> int:
+        """
+        Number of distinct edges; ``None`` arguments match anything.
+        """
+        return self._matching(
+            self.edge_counts, relationship, source_type, target_type
+        )
+
+    def average_degree(
+        self,
+        relationship: Optional[Any] = None,
+        direction: str = "out",
+        source_type: Optional[Any] = None,
+        target_type: Optional[Any] = None,
+    ) -> float:
+        """
+        Average number of ``relationship`` edges per entity that has at
+        least one, leaving it (``"out"``) or entering it (``"in"``).
+        """
+        edges = self.edge_count(relationship, source_type, target_type)
+        endpoints = self._matching(
+            self.source_counts if direction == "out" else self.target_counts,
+            relationship,
+            source_type,
+            target_type,
+        )
+        return edges / endpoints if endpoints else 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Plain-data view, e.g. for logging or ``EXPLAIN`` output.
+        """
+
+        def name(obj):
+            return getattr(obj, "__name__", str(obj))
+
+        return {
+            "entities": {
+                name(entity_type): count
+                for entity_type, count in self.entity_counts.items()
+            },
+            "edges": {
+                f"{name(relationship)}({name(source)}->{name(target)})": {
+                    "edges": count,
+                    "average_out_degree": self.average_degree(
+                        relationship, "out", source, target
+                    ),
+                    "average_in_degree": self.average_degree(
+                        relationship, "in", source, target
+                    ),
+                }
+                for (
+                    relationship,
+                    source,
+                    target,
+                ), count in self.edge_counts.items()
+            },
+        }
@@ -0,0 +1,860 @@
+"""
+Columnar export and import of fact stores.
+
+``export`` writes the facts visible in a store into a directory of column
+files: ``entities.col`` with one id column per entity type, one
+``attribute.<Attribute>.col`` per attribute class and one
+``relationship.<Relationship>.col`` per relationship class. Each file is a
+JSON header followed by 8-byte aligned sections, and every section is one
+typed column: ``int64`` and ``float64`` values are native ``array``
+buffers, strings and other values are an offsets column over a UTF-8 or
+pickle data column. ``manifest.json`` is written last, so a directory is
+readable once it exists; export into a new directory rather than over one
+that readers have open.
+
+``ColumnarFactStore`` maps those files read-only and is queryable as soon
+as it is constructed: nothing is decoded up front, and lookups are binary
+searches over the mapped columns. Analytics can take the columns
+themselves with ``ids``, ``column`` and ``edge_columns``; numeric columns
+are ``memoryview`` casts of the mapping, which ``numpy.frombuffer`` wraps
+without a copy.
+
+Within an entity type, ids are sorted when they are all ints or all
+strings, and attribute and edge columns refer to entities by their
+position (row) in that order. Attribute columns are sorted by row, edge
+columns by source row, with a second copy of the edges sorted by target
+row for incoming lookups.
+"""
+from __future__ import annotations
+
+import bisect
+import datetime
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cardinality import CardinalityStatistics
+from fact import RelationshipFact
+from fact_store import FactStore
+from indexes import EQUALS, _family
+from registry import REGISTRY
+from replica import ReplicaAttributeFact
+
+LOGGER = logging.getLogger(__name__)
+
+__MISSING__ = "__MISSING__"
+
+MAGIC = b"FACTCOL1"
+MANIFEST = "manifest.json"
+FORMAT = 1
+_PREAMBLE = struct.Struct("=8sQ")
+
+_U32 = "I" if array("I").itemsize == 4 else "L"
+
+# Column kinds.
+INT64 = "int64"
+FLOAT64 = "float64"
+STR = "str"
+OBJECT = "object"
+
+_TYPECODES = {INT64: "q", FLOAT64: "d"}
+_FAMILIES = {INT64: "number", FLOAT64: "number", STR: "str"}
+
+
+def _column_kind(values: List[Any]) -> str:
+    """
+    Narrowest kind holding every value; ``None`` is allowed in any kind.
+    """
+    types = {type(value) for value in values if value is not None}
+    if types == {int} and all(
+        -(2**63) <= value < 2**63 for value in values if value is not None
+    ):
+        return INT64
+    if types == {float}:
+        return FLOAT64
+    if types == {str}:
+        return STR
+    return OBJECT
+
+
+def _encode_column(prefix: str, kind: str, values: List[Any]) -> dict:
+    """
+    Sections holding ``values`` as a column of ``kind``.
+    """
+    sections = {}
+    if kind in _TYPECODES:
+        zero = 0 if kind == INT64 else 0.0
+        sections[f"{prefix}.values"] = array(
+            _TYPECODES[kind],
+            (zero if value is None else value for value in values),
+        ).tobytes()
+    else:
+        offsets = array("Q", [0])
+        data = bytearray()
+        for value in values:
+            if kind == STR:
+                data += b"" if value is None else value.encode("utf-8")
+            else:
+                data += pickle.dumps(value)
+            offsets.append(len(data))
+        sections[f"{prefix}.offsets"] = offsets.tobytes()
+        sections[f"{prefix}.data"] = bytes(data)
+    if kind != OBJECT and any(value is None for value in values):
+        sections[f"{prefix}.nulls"] = bytes(
+            value is None for value in values
+        )
+    return sections
+
+
+def _write(path: str, header: dict, sections: Dict[str, bytes]):
+    body = bytearray()
+    header["sections"] = {}
+    for name, data in sections.items():
+        body += bytes(-len(body) % 8)
+        header["sections"][name] = [len(body), len(data)]
+        body += data
+    encoded_header = json.dumps(header).encode("utf-8")
+    encoded_header += b" " * (-len(encoded_header) % 8)
+    with open(path + ".tmp", "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, len(encoded_header)))
+        file.write(encoded_header)
+        file.write(body)
+    os.replace(path + ".tmp", path)
+
+
+def _timestamp(fact) -> float:
+    created_at = getattr(fact, "created_at", None)
+    return created_at.timestamp() if created_at is not None else 0.0
+
+
+def export(store, directory: str) -> dict:
+    """
+    Writes the facts in ``store`` to ``directory`` as column files, read
+    through a snapshot when the store supports them. Returns the
+    manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    try:
+        view = store.snapshot()
+    except NotImplementedError:
+        view = store
+    try:
+        manifest = _export(view, directory)
+    finally:
+        if view is not store:
+            view.release()
+    with open(
+        os.path.join(directory, MANIFEST + ".tmp"), "w", encoding="utf-8"
+    ) as file:
+        json.dump(manifest, file)
+    os.replace(
+        os.path.join(directory, MANIFEST + ".tmp"),
+        os.path.join(directory, MANIFEST),
+    )
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info(
+            "Exported %d entity types, %d attributes and %d relationships "
+            "to %s",
+            len(manifest["entity_types"]),
+            len(manifest["attributes"]),
+            len(manifest["relationships"]),
+            directory,
+        )
+    return manifest
+
+
+def _export(store, directory: str) -> dict:
+    entity_header = {}
+    entity_sections: Dict[str, bytes] = {}
+    # entity type -> entity id -> row
+    rows: Dict[type, Dict[Any, int]] = {}
+    for entity_type in REGISTRY.entity_types.values():
+        entity_ids = list(store.entity_ids(entity_type))
+        if not entity_ids:
+            continue
+        kind = _column_kind(entity_ids)
+        ordered = kind in (INT64, STR) and None not in entity_ids
+        if ordered:
+            entity_ids.sort()
+        else:
+            kind = OBJECT
+        name = entity_type.__name__
+        entity_header[name] = {
+            "kind": kind,
+            "count": len(entity_ids),
+            "sorted": ordered,
+        }
+        entity_sections.update(_encode_column(name, kind, entity_ids))
+        rows[entity_type] = {
+            entity_id: row for row, entity_id in enumerate(entity_ids)
+        }
+    _write(
+        os.path.join(directory, "entities.col"),
+        {"entity_types": entity_header},
+        entity_sections,
+    )
+
+    # attribute -> entity type -> [(row, fact)]
+    attribute_rows: Dict[type, Dict[type, list]] = {}
+    # (relationship, source type, target type) -> [(source, target, time)]
+    edge_rows: Dict[Tuple[type, type, type], list] = {}
+    for entity_type, by_id in rows.items():
+        for entity_id, row in by_id.items():
+            for attribute, fact in store.get_entity(
+                entity_type, entity_id
+            ).items():
+                attribute_rows.setdefault(attribute, {}).setdefault(
+                    entity_type, []
+                ).append((row, fact))
+            for fact in store.edges(
+                entity_type=entity_type, entity_id=entity_id, direction="out"
+            ):
+                target = rows.get(fact.target_entity_type, {}).get(
+                    fact.target_entity_id
+                )
+                if target is None:
+                    continue
+                edge_rows.setdefault(
+                    (fact.relationship, entity_type, fact.target_entity_type),
+                    [],
+                ).append((row, target, _timestamp(fact)))
+
+    attributes = {}
+    for attribute, by_type in attribute_rows.items():
+        header = {}
+        sections: Dict[str, bytes] = {}
+        for entity_type, entries in by_type.items():
+            entries.sort(key=lambda entry: entry[0])
+            name = entity_type.__name__
+            values = [fact.value for _, fact in entries]
+            kind = _column_kind(values)
+            sections[f"{name}.rows"] = array(
+                _U32, (row for row, _ in entries)
+            ).tobytes()
+            sections.update(_encode_column(name, kind, values))
+            uuids = bytearray()
+            for _, fact in entries:
+                fact_uuid = getattr(fact, "uuid", None)
+                uuids += (
+                    fact_uuid.bytes if fact_uuid is not None else bytes(16)
+                )
+            sections[f"{name}.uuid"] = bytes(uuids)
+            sections[f"{name}.created_at"] = array(
+                "d", (_timestamp(fact) for _, fact in entries)
+            ).tobytes()
+            ordered = kind in _FAMILIES
+            if ordered:
+                # Positions of the non-null values in value order, for
+                # ``ColumnIndex``.
+                sections[f"{name}.order"] = array(
+                    _U32,
+                    sorted(
+                        (
+                            position
+                            for position, value in enumerate(values)
+                            if value is not None
+                        ),
+                        key=values.__getitem__,
+                    ),
+                ).tobytes()
+            header[name] = {
+                "kind": kind,
+                "count": len(entries),
+                "ordered": ordered,
+            }
+        file_name = f"attribute.{attribute.__name__}.col"
+        _write(
+            os.path.join(directory, file_name), {"segments": header}, sections
+        )
+        attributes[attribute.__name__] = file_name
+
+    relationships = {}
+    by_relationship: Dict[type, list] = {}
+    for key, edges in edge_rows.items():
+        by_relationship.setdefault(key[0], []).append((key, edges))
+    for relationship, segments in by_relationship.items():
+        header = []
+        sections = {}
+        for number, ((_, source_type, target_type), edges) in enumerate(
+            segments
+        ):
+            for direction, ordered_edges in (
+                ("out", sorted(edges)),
+                ("in", sorted(edges, key=lambda edge: (edge[1], edge[0]))),
+            ):
+                sections[f"{number}.{direction}.source"] = array(
+                    _U32, (edge[0] for edge in ordered_edges)
+                ).tobytes()
+                sections[f"{number}.{direction}.target"] = array(
+                    _U32, (edge[1] for edge in ordered_edges)
+                ).tobytes()
+                sections[f"{number}.{direction}.created_at"] = array(
+                    "d", (edge[2] for edge in ordered_edges)
+                ).tobytes()
+            header.append(
+                {
+                    "source": source_type.__name__,
+                    "target": target_type.__name__,
+                    "count": len(edges),
+                    "sources": len({edge[0] for edge in edges}),
+                    "targets": len({edge[1] for edge in edges}),
+                }
+            )
+        file_name = f"relationship.{relationship.__name__}.col"
+        _write(
+            os.path.join(directory, file_name), {"segments": header}, sections
+        )
+        relationships[relationship.__name__] = file_name
+
+    return {
+        "format": FORMAT,
+        "entity_types": sorted(entity_header),
+        "attributes": attributes,
+        "relationships": relationships,
+    }
+
+
+class _MappedFile:
+    """
+    One column file mapped read-only.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a column file")
+        self._body = _PREAMBLE.size + header_length
+        self.header = json.loads(bytes(self._map[_PREAMBLE.size : self._body]))
+        self._views: List[memoryview] = [memoryview(self._map)]
+
+    def has(self, name: str) -> bool:
+        return name in self.header["sections"]
+
+    def section(self, name: str, cast: str = None) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self._body + offset
+        view = self._views[0][start : start + length]
+        self._views.append(view)
+        if cast is not None:
+            view = view.cast(cast)
+            self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+
+class Column:
+    """
+    A mapped column of ``kind`` as a read-only sequence of values.
+    ``values`` is the typed ``memoryview`` of a numeric column (``None``
+    otherwise), where null positions hold zero.
+    """
+
+    def __init__(self, mapped: _MappedFile, prefix: str, kind: str):
+        self.kind = kind
+        self.values: Optional[memoryview] = None
+        self._offsets = self._data = None
+        if kind in _TYPECODES:
+            self.values = mapped.section(f"{prefix}.values", _TYPECODES[kind])
+            self._length = len(self.values)
+        else:
+            self._offsets = mapped.section(f"{prefix}.offsets", "Q")
+            self._data = mapped.section(f"{prefix}.data")
+            self._length = len(self._offsets) - 1
+        self.nulls = (
+            mapped.section(f"{prefix}.nulls")
+            if mapped.has(f"{prefix}.nulls")
+            else None
+        )
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, position: int) -> Any:
+        if self.nulls is not None and self.nulls[position]:
+            return None
+        if self.values is not None:
+            return self.values[position]
+        start = self._offsets[position]
+        end = self._offsets[position + 1]
+        if self.kind == STR:
+            return str(self._data[start:end], "utf-8")
+        return pickle.loads(self._data[start:end])
+
+    def __iter__(self) -> Iterator[Any]:
+        for position in range(self._length):
+            yield self[position]
+
+
+class _Ordered:
+    """
+    The non-null values of a column in value order, for ``bisect``.
+    """
+
+    def __init__(self, column: Column, order: memoryview):
+        self.column = column
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position: int):
+        return self.column[self.order[position]]
+
+
+class _AttributeSegment:
+    """
+    The values of one attribute class for one entity type.
+    """
+
+    def __init__(self, mapped: _MappedFile, name: str, spec: dict):
+        self.rows = mapped.section(f"{name}.rows", _U32)
+        self.values = Column(mapped, name, spec["kind"])
+        self.uuids = mapped.section(f"{name}.uuid")
+        self.created_at = mapped.section(f"{name}.created_at", "d")
+        self.ordered = (
+            _Ordered(self.values, mapped.section(f"{name}.order", _U32))
+            if spec["ordered"]
+            else None
+        )
+
+    def position(self, row: int) -> Optional[int]:
+        position = bisect.bisect_left(self.rows, row)
+        if position < len(self.rows) and self.rows[position] == row:
+            return position
+        return None
+
+
+class _EdgeSegment:
+    """
+    The edges of one relationship class between two entity types.
+    """
+
+    def __init__(self, mapped: _MappedFile, number: int, spec: dict):
+        self.source_type = REGISTRY.entity_types[spec["source"]]
+        self.target_type = REGISTRY.entity_types[spec["target"]]
+        self.spec = spec
+        self.columns = {
+            direction: tuple(
+                mapped.section(f"{number}.{direction}.{column}", cast)
+                for column, cast in (
+                    ("source", _U32),
+                    ("target", _U32),
+                    ("created_at", "d"),
+                )
+            )
+            for direction in ("out", "in")
+        }
+
+
+def _edge_fact(relationship, source, target, created_at) -> RelationshipFact:
+    fact = RelationshipFact.__new__(RelationshipFact)
+    fact.relationship = relationship
+    fact.source_entity_type, fact.source_entity_id = source
+    fact.target_entity_type, fact.target_entity_id = target
+    fact.created_at = datetime.datetime.fromtimestamp(created_at)
+    return fact
+
+
+def _matches(found: Any, relation: str, value: Any) -> bool:
+    # Same semantics as ``AttributeValueIndex``: ranges only compare
+    # values of one family.
+    if relation == EQUALS:
+        return found == value
+    family = _family(value)
+    if family is None or _family(found) != family:
+        return False
+    if relation == "LT":
+        return found < value
+    if relation == "LTE":
+        return found <= value
+    if relation == "GT":
+        return found > value
+    if relation == "GTE":
+        return found >= value
+    raise ValueError(f"Unknown relation: {relation}")
+
+
+class ColumnIndex:
+    """
+    Value index on one attribute class, answered from the sorted value
+    order kept in its column file. Same interface as
+    ``AttributeValueIndex``. Columns of mixed types have no order and are
+    scanned.
+    """
+
+    def __init__(self, store: "ColumnarFactStore", attribute: type):
+        self.store = store
+        self.attribute = attribute
+
+    @staticmethod
+    def _bounds(segment, relation, value) -> Optional[Tuple[int, int]]:
+        """
+        Span of ``segment.ordered`` satisfying the constraint, or ``None``
+        if it has to be scanned.
+        """
+        ordered = segment.ordered
+        if ordered is None:
+            return None
+        if value is None:
+            # Nulls are not in the order, only in the null mask.
+            return None if segment.values.nulls is not None else (0, 0)
+        if _family(value) != _FAMILIES[segment.values.kind]:
+            return (0, 0)
+        if relation == EQUALS:
+            return (
+                bisect.bisect_left(ordered, value),
+                bisect.bisect_right(ordered, value),
+            )
+        if relation == "LT":
+            return (0, bisect.bisect_left(ordered, value))
+        if relation == "LTE":
+            return (0, bisect.bisect_right(ordered, value))
+        if relation == "GT":
+            return (bisect.bisect_right(ordered, value), len(ordered))
+        if relation == "GTE":
+            return (bisect.bisect_left(ordered, value), len(ordered))
+        raise ValueError(f"Unknown relation: {relation}")
+
+    def _positions(self, segment, relation, value) -> Iterator[int]:
+        bounds = self._bounds(segment, relation, value)
+        if bounds is not None:
+            order = segment.ordered.order
+            return (order[position] for position in range(*bounds))
+        column = segment.values
+        return (
+            position
+            for position in range(len(column))
+            if _matches(column[position], relation, value)
+        )
+
+    def lookup(
+        self, entity_type: Any, relation: str, value: Any
+    ) -> Iterator[Any]:
+        """
+        Ids of ``entity_type`` entities whose value satisfies
+        ``value <relation> constant``.
+        """
+        segment = self.store._segment(self.attribute, entity_type)
+        if segment is None:
+            return iter(())
+        ids = self.store.ids(entity_type)
+        rows = segment.rows
+        return (
+            ids[rows[position]]
+            for position in self._positions(segment, relation, value)
+        )
+
+    def contains(
+        self, entity_type: Any, entity_id: Any, relation: str, value: Any
+    ) -> Optional[bool]:
+        """
+        Whether ``entity_id`` passes an ``EQUALS`` constraint; ``None`` for
+        other relations.
+        """
+        if relation != EQUALS:
+            return None
+        found = self.store._get_attribute(
+            entity_type=entity_type,
+            attribute=self.attribute,
+            entity_id=entity_id,
+        )
+        return found is not __MISSING__ and found.value == value
+
+    def estimate(self, entity_type: Any, relation: str, value: Any) -> float:
+        """
+        Number of entities a lookup returns; exact for ordered columns,
+        the column length for scanned ones.
+        """
+        segment = self.store._segment(self.attribute, entity_type)
+        if segment is None:
+            return 0.0
+        bounds = self._bounds(segment, relation, value)
+        if bounds is None:
+            return float(len(segment.rows))
+        return float(bounds[1] - bounds[0])
+
+    def size(self, entity_type: Any) -> int:
+        """
+        Number of indexed ``entity_type`` entities.
+        """
+        segment = self.store._segment(self.attribute, entity_type)
+        return 0 if segment is None else len(segment.rows)
+
+    def __repr__(self):
+        return f"ColumnIndex({self.attribute.__name__})"
+
+
+class ColumnarFactStore(FactStore):
+    """
+    Read-only fact store over the column files ``export`` wrote to
+    ``directory``.
+    """
+
+    entity_cache_size = None
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        with open(
+            os.path.join(directory, MANIFEST), encoding="utf-8"
+        ) as file:
+            manifest = json.load(file)
+        if manifest.get("format") != FORMAT:
+            raise ValueError(
+                f"Unsupported columnar format {manifest.get('format')!r}"
+            )
+        self._files: List[_MappedFile] = []
+        entities = self._map("entities.col")
+        self._ids: Dict[type, Column] = {}
+        self._sorted: Dict[type, bool] = {}
+        # entity type -> entity id -> row, for ids that are not sorted;
+        # built on first use.
+        self._row_maps: Dict[type, Dict[Any, int]] = {}
+        entity_counts = {}
+        for name, spec in entities.header["entity_types"].items():
+            entity_type = REGISTRY.entity_types[name]
+            self._ids[entity_type] = Column(entities, name, spec["kind"])
+            self._sorted[entity_type] = spec["sorted"]
+            entity_counts[entity_type] = spec["count"]
+        # attribute -> entity type -> segment
+        self._attributes: Dict[type, Dict[type, _AttributeSegment]] = {}
+        for name, file_name in manifest["attributes"].items():
+            mapped = self._map(file_name)
+            self._attributes[REGISTRY.attributes[name]] = {
+                REGISTRY.entity_types[type_name]: _AttributeSegment(
+                    mapped, type_name, spec
+                )
+                for type_name, spec in mapped.header["segments"].items()
+            }
+        self._indexes = {
+            attribute: ColumnIndex(self, attribute)
+            for attribute in self._attributes
+        }
+        # relationship -> segments
+        self._relationships: Dict[type, List[_EdgeSegment]] = {}
+        edge_counts = {}
+        for name, file_name in manifest["relationships"].items():
+            mapped = self._map(file_name)
+            relationship = REGISTRY.relationships[name]
+            segments = self._relationships[relationship] = [
+                _EdgeSegment(mapped, number, spec)
+                for number, spec in enumerate(mapped.header["segments"])
+            ]
+            for segment in segments:
+                edge_counts[
+                    (relationship, segment.source_type, segment.target_type)
+                ] = (
+                    segment.spec["count"],
+                    segment.spec["sources"],
+                    segment.spec["targets"],
+                )
+        self._statistics = CardinalityStatistics()
+        self._statistics.add_counts(entity_counts, edge_counts)
+
+    def _map(self, file_name: str) -> _MappedFile:
+        mapped = _MappedFile(os.path.join(self.directory, file_name))
+        self._files.append(mapped)
+        return mapped
+
+    def close(self):
+        """
+        Unmaps the column files.
+        """
+        for mapped in self._files:
+            mapped.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def put(self, _):
+        raise TypeError("Columnar stores are read-only; export again.")
+
+    # Columns
+
+    def ids(self, entity_type) -> Column:
+        """
+        Ids of the ``entity_type`` entities, by row.
+        """
+        return self._ids[entity_type]
+
+    def column(self, attribute, entity_type) -> Tuple[memoryview, Column]:
+        """
+        ``(rows, values)``: the rows of the ``entity_type`` entities that
+        have ``attribute``, in ascending order, and their values.
+        """
+        segment = self._attributes[attribute][entity_type]
+        return segment.rows, segment.values
+
+    def edge_columns(
+        self, relationship
+    ) -> List[Tuple[type, type, memoryview, memoryview]]:
+        """
+        ``(source type, target type, source rows, target rows)`` for each
+        pair of entity types ``relationship`` connects, sorted by source
+        row.
+        """
+        return [
+            (segment.source_type, segment.target_type)
+            + segment.columns["out"][:2]
+            for segment in self._relationships.get(relationship, ())
+        ]
+
+    # Decoding
+
+    def _row(self, entity_type, entity_id) -> Optional[int]:
+        ids = self._ids.get(entity_type)
+        if ids is None:
+            return None
+        if not self._sorted[entity_type]:
+            row_map = self._row_maps.get(entity_type)
+            if row_map is None:
+                row_map = self._row_maps[entity_type] = {
+                    value: row for row, value in enumerate(ids)
+                }
+            try:
+                return row_map.get(entity_id)
+            except TypeError:  # unhashable
+                return None
+        if type(entity_id) is not (int if ids.kind == INT64 else str):
+            return None
+        sequence = ids.values if ids.values is not None else ids
+        row = bisect.bisect_left(sequence, entity_id)
+        if row < len(ids) and sequence[row] == entity_id:
+            return row
+        return None
+
+    def _segment(self, attribute, entity_type) -> Optional[_AttributeSegment]:
+        return self._attributes.get(attribute, {}).get(entity_type)
+
+    def _fact(self, entity_type, entity_id, attribute, segment, position):
+        return ReplicaAttributeFact(
+            entity_type,
+            entity_id,
+            attribute,
+            segment.values[position],
+            bytes(segment.uuids[position * 16 : position * 16 + 16]),
+            segment.created_at[position],
+        )
+
+    # FactStore reads
+
+    def _get_attribute(self, entity_type=None, attribute=None, entity_id=None):
+        segment = self._segment(attribute, entity_type)
+        if segment is None:
+            return __MISSING__
+        row = self._row(entity_type, entity_id)
+        position = None if row is None else segment.position(row)
+        if position is None:
+            return __MISSING__
+        return self._fact(entity_type, entity_id, attribute, segment, position)
+
+    def _get_entity(self, entity_type, entity_id):
+        out = {}
+        row = self._row(entity_type, entity_id)
+        if row is None:
+            return out
+        for attribute, by_type in self._attributes.items():
+            segment = by_type.get(entity_type)
+            if segment is None:
+                continue
+            position = segment.position(row)
+            if position is not None:
+                out[attribute] = self._fact(
+                    entity_type, entity_id, attribute, segment, position
+                )
+        return out
+
+    def has_entity(self, entity_type, entity_id) -> bool:
+        return self._row(entity_type, entity_id) is not None
+
+    def entity_ids(self, entity_type=None) -> Iterator[Any]:
+        ids = self._ids.get(entity_type)
+        if ids is not None:
+            yield from ids
+
+    def edges(
+        self,
+        relationship=None,
+        entity_type=None,
+        entity_id=None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        row = self._row(entity_type, entity_id)
+        if row is None:
+            return
+        relationships = (
+            self._relationships.items()
+            if relationship is None
+            else [(relationship, self._relationships.get(relationship, ()))]
+        )
+        for edge_relationship, segments in relationships:
+            for segment in segments:
+                if direction == "out":
+                    if segment.source_type is not entity_type:
+                        continue
+                    anchors, others, created_at = segment.columns["out"]
+                    other_type = segment.target_type
+                else:
+                    if segment.target_type is not entity_type:
+                        continue
+                    others, anchors, created_at = segment.columns["in"]
+                    other_type = segment.source_type
+                other_ids = self._ids[other_type]
+                for position in range(
+                    bisect.bisect_left(anchors, row),
+                    bisect.bisect_right(anchors, row),
+                ):
+                    other = (other_type, other_ids[others[position]])
+                    source, target = (
+                        ((entity_type, entity_id), other)
+                        if direction == "out"
+                        else (other, (entity_type, entity_id))
+                    )
+                    yield _edge_fact(
+                        edge_relationship, source, target, created_at[position]
+                    )
+
+    def attribute_index(self, attribute) -> Optional[ColumnIndex]:
+        return self._indexes.get(attribute)
+
+    def statistics(self) -> CardinalityStatistics:
+        return self._statistics
+
+    def __iter__(self):
+        for attribute, by_type in self._attributes.items():
+            for entity_type, segment in by_type.items():
+                ids = self._ids[entity_type]
+                for position, row in enumerate(segment.rows):
+                    yield self._fact(
+                        entity_type, ids[row], attribute, segment, position
+                    )
+        for relationship, segments in self._relationships.items():
+            for segment in segments:
+                source_ids = self._ids[segment.source_type]
+                target_ids = self._ids[segment.target_type]
+                for source, target, created_at in zip(
+                    *segment.columns["out"]
+                ):
+                    yield _edge_fact(
+                        relationship,
+                        (segment.source_type, source_ids[source]),
+                        (segment.target_type, target_ids[target]),
+                        created_at,
+                    )
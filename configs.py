@@ -1,5 +1,46 @@
 '''
 Just some variables.
 '''
+import os
 
 MESSAGE_CONFIG_DIRECTORY = 'message_configs'
+
+# Parsed attribute-function configs, so that startup skips YAML parsing.
+CONFIG_CACHE_PATH = os.environ.get(
+    'FACT_CONFIG_CACHE',
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '__pycache__',
+        'attribute_configs.json',
+    ),
+)
+
+# Number of compiled queries kept by ``query.compile_query``.
+QUERY_CACHE_SIZE = 256
+
+# Entity rows kept by ``FactStore.get_entity`` for stores that do not hold
+# them in memory.
+ENTITY_CACHE_SIZE = 10000
+
+# Target false-positive rate of the negative-lookup filters disk-backed
+# fact stores keep, and the fewest keys a filter is sized for.
+BLOOM_ERROR_RATE = 0.01
+BLOOM_MIN_CAPACITY = 65536
+
+# Messages ``Session.backfill`` commits to the fact store at a time.
+BACKFILL_BATCH_SIZE = 10000
+
+# Fraction of its memory budget ``MemoryFactStore.spill`` brings the store
+# down to, so that spills do not run at every commit.
+SPILL_TARGET = 0.8
+
+# ``server.IngestServer``: messages committed per batch at most, messages
+# waiting for a batch before connections stop being read, and the largest
+# frame accepted, in bytes.
+SERVER_BATCH_SIZE = 1000
+SERVER_QUEUE_SIZE = 10000
+SERVER_MAX_FRAME = 1 << 24
+
+# Seconds per tick of the timing wheel that expires facts of attribute and
+# relationship classes with a ``ttl``: facts go at most this late.
+TTL_TICK = 1.0
@@ -1,10 +1,19 @@
 """
 Just trying stuff.
+
+The lexer and parser are built on first use by ``get_parser``, not at
+import. Parse tables are written next to this file as
+``decision_parsetab.py`` and reused while the grammar is unchanged.
 """
 
+import os
+import sys
+
 from ply import lex
 import ply.yacc as yacc
 
+PARSE_TABLE_MODULE = "decision_parsetab"
+
 
 tokens = (
     "NUMBER",
@@ -31,6 +40,15 @@ tokens = (
     "RSQUARE",
     "LEFT_ARROW_HEAD",
     "RIGHT_ARROW_HEAD",
+    "STRING",
+    "DOT",
+    "LT",
+    "GT",
+    "LTE",
+    "GTE",
+    "STAR",
+    "RANGE",
+    "LIMIT",
 )
 
 
@@ -44,7 +62,9 @@ t_LCURLY = r"\{"
 t_RCURLY = r"\}"
 t_LSQUARE = r"\["
 t_RSQUARE = r"\]"
-t_WHERE = r"WHERE"
+t_DOT = r"\."
+t_RANGE = r"\.\."
+t_STAR = r"\*"
 t_LEFT_RIGHT_ARROW_PLAIN = r"-->"
 t_RIGHT_LEFT_ARROW_PLAIN = r"<--"
 t_RIGHT_ARROW_HEAD = r"->"
@@ -52,6 +72,10 @@ t_LEFT_ARROW_HEAD = r"<-"
 
 
 t_EQUALS = r"="
+t_LTE = r"<="
+t_GTE = r">="
+t_LT = r"<"
+t_GT = r">"
 
 
 def t_NUMBER(t):
@@ -93,12 +117,37 @@ def t_MATCH(t):
     return t
 
 
+def t_WHERE(t):
+    r"WHERE"
+    return t
+
+
+def t_LIMIT(t):
+    r"LIMIT"
+    return t
+
+
+def t_STRING(t):
+    r"\"[^\"]*\"|'[^']*'"
+    t.value = t.value[1:-1]
+    return t
+
+
 def t_NAME(t):
     r"[A-Za-z]+"
     return t
 
 
-lexer = lex.lex()
+def t_error(t):
+    raise QuerySyntaxError(
+        f"Illegal character {t.value[0]!r} at position {t.lexpos}"
+    )
+
+
+class QuerySyntaxError(Exception):
+    """
+    The query text does not match the grammar.
+    """
 
 
 class Expression:
@@ -122,6 +171,8 @@ def p_expression(p):
     | node
     | relationship_list
     | match
+    | match_where
+    | limited
     """
     p[0] = Expression(p[1], getattr(p, "variable_mapping", {}))
 
@@ -132,6 +183,9 @@ class Where:
     def __init__(self, constraint_list=None):
         self.constraint_list = constraint_list
 
+    def __repr__(self):
+        return f"WHERE {self.constraint_list}"
+
 
 class Variable:
     """Superclass for all variables"""
@@ -161,25 +215,58 @@ class Node:
 
 class AtomicConstraint:
     """
-    Simplest constraint.
+    Simplest constraint. ``attribute`` is set for ``name.attribute``
+    constraints in a WHERE clause.
     """
 
     def __init__(
-        self, name: str = None, relation: str = None, value: float = None
+        self,
+        name: str = None,
+        relation: str = None,
+        value: float = None,
+        attribute: str = None,
     ):
         self.name = name
         self.relation = relation
         self.value = value
+        self.attribute = attribute
 
     def __repr__(self):
-        return f"Constraint: {self.name} {self.relation}  {self.value}"
+        name = self.name if self.attribute is None else (
+            f"{self.name}.{self.attribute}"
+        )
+        return f"Constraint: {name} {self.relation}  {self.value}"
 
 
 def p_constraint_subexpression(p):
-    """constraint : NAME EQUALS value"""
-    p[0] = AtomicConstraint(
-        name=variable_factory(p, p[1]), relation="EQUALS", value=p[3]
-    )
+    """constraint : NAME comparison literal
+    | NAME DOT NAME comparison literal"""
+    if len(p) == 4:
+        p[0] = AtomicConstraint(
+            name=variable_factory(p, p[1]), relation=p[2], value=p[3]
+        )
+    else:
+        p[0] = AtomicConstraint(
+            name=variable_factory(p, p[1]),
+            attribute=p[3],
+            relation=p[4],
+            value=p[5],
+        )
+
+
+def p_comparison(p):
+    """comparison : EQUALS
+    | LT
+    | GT
+    | LTE
+    | GTE"""
+    p[0] = p.slice[1].type
+
+
+def p_literal(p):
+    """literal : value
+    | STRING"""
+    p[0] = p[1]
 
 
 class ConstraintList:
@@ -268,17 +355,26 @@ def p_boolean_literal(p):
 
 
 class RelationshipSpec:
-    """The part in the square brackets"""
+    """The part in the square brackets. ``max_hops`` is ``None`` for an
+    unbounded variable-length relationship (``*`` or ``*2..``)."""
 
     def __init__(
-        self, relationship_type: str = None, relationship_name: str = None
+        self,
+        relationship_type: str = None,
+        relationship_name: str = None,
+        min_hops: int = 1,
+        max_hops: int = 1,
     ):
         self.relationship_name = relationship_name
         self.relationship_type = relationship_type
+        self.min_hops = min_hops
+        self.max_hops = max_hops
 
     def __repr__(self):
-        out = f"[Name: {self.relationship_name}]"
-        return out
+        out = f"[Name: {self.relationship_name}"
+        if (self.min_hops, self.max_hops) != (1, 1):
+            out += f" *{self.min_hops}..{self.max_hops or ''}"
+        return out + "]"
 
 
 class Relationship:
@@ -333,7 +429,9 @@ def p_relationship_list(p):  # A Relationship between nodes
     | node MINUS relationship_spec RIGHT_ARROW_HEAD node
     | node LEFT_ARROW_HEAD relationship_spec MINUS node
     | relationship_list LEFT_RIGHT_ARROW_PLAIN node
-    | relationship_list RIGHT_LEFT_ARROW_PLAIN node"""
+    | relationship_list RIGHT_LEFT_ARROW_PLAIN node
+    | relationship_list MINUS relationship_spec RIGHT_ARROW_HEAD node
+    | relationship_list LEFT_ARROW_HEAD relationship_spec MINUS node"""
 
     relationship_obj = None
     if len(p) == 4 and p[2] == "-->" and isinstance(p[1], (Node,)):
@@ -394,6 +492,18 @@ def p_relationship_list(p):  # A Relationship between nodes
         )
         p[1].relationship_list.append(relationship_obj)
         relationship_obj = p[1]
+    elif len(p) == 6 and isinstance(p[1], (RelationshipList,)):
+        previous = p[1].relationship_list[-1].right_node
+        source, target = (previous, p[5]) if p[2] == "-" else (p[5], previous)
+        relationship_obj = Relationship(
+            source=source,
+            target=target,
+            relationship_spec=p[3],
+            left_node=previous,
+            right_node=p[5],
+        )
+        p[1].relationship_list.append(relationship_obj)
+        relationship_obj = p[1]
     else:
         raise Exception("Unreachable in relationship")
     p[0] = relationship_obj
@@ -414,19 +524,47 @@ def variable_factory(p, variable_name):
 
 def p_relationship_spec(p):
     """relationship_spec : LSQUARE NAME RSQUARE
-    | LSQUARE NAME COLON NAME RSQUARE"""
-    if len(p) == 4:
-        p[2] = variable_factory(p, p[2])
-        relationship_spec = RelationshipSpec(
-            relationship_name=variable_factory(p, p[2])
-        )
-    elif len(p) == 6:
-        relationship_spec = RelationshipSpec(
-            relationship_type=p[4], relationship_name=variable_factory(p, p[2])
-        )
+    | LSQUARE NAME COLON NAME RSQUARE
+    | LSQUARE COLON NAME RSQUARE
+    | LSQUARE hops RSQUARE
+    | LSQUARE NAME hops RSQUARE
+    | LSQUARE NAME COLON NAME hops RSQUARE
+    | LSQUARE COLON NAME hops RSQUARE"""
+    symbols = [symbol.type for symbol in p.slice[1:]]
+    hops = p[len(p) - 2] if "hops" in symbols else (1, 1)
+    name = None
+    relationship_type = None
+    if symbols[1] == "NAME":
+        name = variable_factory(p, p[2])
+        if symbols[2] == "COLON":
+            relationship_type = p[4]
+    elif symbols[1] == "COLON":
+        relationship_type = p[3]
+    p[0] = RelationshipSpec(
+        relationship_type=relationship_type,
+        relationship_name=name,
+        min_hops=hops[0],
+        max_hops=hops[1],
+    )
+
+
+def p_hops(p):
+    """hops : STAR
+    | STAR NUMBER
+    | STAR NUMBER RANGE NUMBER
+    | STAR RANGE NUMBER
+    | STAR NUMBER RANGE"""
+    symbols = [symbol.type for symbol in p.slice[2:]]
+    if symbols == []:
+        p[0] = (1, None)
+    elif symbols == ["NUMBER"]:
+        p[0] = (p[2], p[2])
+    elif symbols == ["NUMBER", "RANGE", "NUMBER"]:
+        p[0] = (p[2], p[4])
+    elif symbols == ["RANGE", "NUMBER"]:
+        p[0] = (1, p[3])
     else:
-        raise Exception("unreachable in relationship_spec")
-    p[0] = relationship_spec
+        p[0] = (p[2], None)
 
 
 class Match:
@@ -459,41 +597,94 @@ class MatchWhere:
         self.pattern = pattern
         self.where = where
 
+    def __repr__(self):
+        return f"{self.pattern} {self.where}"
+
 
 def p_match_where(p):
     """match_where : match where_clause"""
     p[0] = MatchWhere(pattern=p[1], where=p[2])
 
 
-parser = yacc.yacc()
-result = parser.parse("((1 + 1) + 10)")
-print(result)
-result = parser.parse("(TRUE OR (TRUE AND FALSE))")
-print(result)
-result = parser.parse("(thing:foo)")
-print(result)
-result = parser.parse("(THING:FOO {Bar = ((2 + 2) - 1), Baz = 1})")
-print(result)
-result = parser.parse("(THING: Foo)-->(OTHER: Whatever)")
-print(result)
-result = parser.parse("(THING: Foo)<--(OTHER: Whatever)")
-print(result)
-result = parser.parse("(THING: Foo)-[r]->(OTHER: Whatever)")
-print(result)
-result = parser.parse("(thing: foo)<-[r]-(other: whatever)")
-print(result)
-result = parser.parse("(thing: foo)<-[r: IMARELATIONSHIP]-(other: whatever)")
-print(result)
-result = parser.parse(
-    "(thing: foo)<-[r: imarelationship]-(other: whatever)-->(p)"
-)
-print(result)
-result = parser.parse("(a)-->(b)-->(c)<--(d)")
-print(result)
-result = parser.parse("MATCH (a)-->(b)-->(c)<--(d)")
-print(result)
-result = parser.parse("MATCH (a)-->(b)-->(c)<--(d) WHERE a = 1")
-print(result)
+class Limit:
+    """MATCH ... LIMIT count"""
+
+    def __init__(self, query=None, count: int = None):
+        self.query = query
+        self.count = count
+
+    def __repr__(self):
+        return f"{self.query} LIMIT {self.count}"
+
+
+def p_limited(p):
+    """limited : match LIMIT NUMBER
+    | match_where LIMIT NUMBER"""
+    p[0] = Limit(query=p[1], count=p[3])
+
+
+def p_error(p):
+    if p is None:
+        raise QuerySyntaxError("Unexpected end of query")
+    raise QuerySyntaxError(
+        f"Unexpected {p.type} {p.value!r} at position {p.lexpos}"
+    )
+
+
+_LEXER = None
+_PARSER = None
+
+
+def get_parser():
+    """
+    Returns the parser, building the lexer and parser the first time.
+    """
+    global _LEXER, _PARSER  # pylint: disable=global-statement
+    if _PARSER is None:
+        module = sys.modules[__name__]
+        _LEXER = lex.lex(module=module)
+        _PARSER = yacc.yacc(
+            module=module,
+            debug=False,
+            write_tables=True,
+            tabmodule=PARSE_TABLE_MODULE,
+            outputdir=os.path.dirname(os.path.abspath(__file__)),
+            errorlog=yacc.NullLogger(),
+        )
+    return _PARSER
+
+
+def parse(text: str):
+    """
+    Parses ``text`` into an ``Expression``.
+    """
+    parser = get_parser()
+    return parser.parse(text, lexer=_LEXER.clone())
+
+
+SAMPLE_QUERIES = [
+    "((1 + 1) + 10)",
+    "(TRUE OR (TRUE AND FALSE))",
+    "(thing:foo)",
+    "(THING:FOO {Bar = ((2 + 2) - 1), Baz = 1})",
+    "(THING: Foo)-->(OTHER: Whatever)",
+    "(THING: Foo)<--(OTHER: Whatever)",
+    "(THING: Foo)-[r]->(OTHER: Whatever)",
+    "(thing: foo)<-[r]-(other: whatever)",
+    "(thing: foo)<-[r: IMARELATIONSHIP]-(other: whatever)",
+    "(thing: foo)<-[r: imarelationship]-(other: whatever)-->(p)",
+    "(a)-->(b)-->(c)<--(d)",
+    "MATCH (a)-->(b)-->(c)<--(d)",
+    "MATCH (a)-->(b)-->(c)<--(d) WHERE a = 1",
+    "MATCH (a:Person)-->(b:State) WHERE a.LuckyNumber >= 10, b = 'FL'",
+    "MATCH (a:Person)-[:LivesIn*1..3]->(b)<-[r:LivesIn]-(c:Person)",
+    "MATCH (a:Person)-->(b:State) WHERE b = 'FL' LIMIT 10",
+]
+
 
 if __name__ == "__main__":
-    pass
+    for sample_query in SAMPLE_QUERIES:
+        try:
+            print(parse(sample_query))
+        except QuerySyntaxError as error:
+            print(f"{sample_query}: {error}")
@@ -1,12 +1,19 @@
 '''
 Entities
 '''
+from registry import REGISTRY
+
 
 class EntityType:
     """
     Mix-in for all entities.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        REGISTRY.register_entity_type(cls)
+
+
 class Person(EntityType):
     """
     A person.
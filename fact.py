@@ -12,8 +12,6 @@ from dataclasses import dataclass
 from entities import EntityType
 from attribute import Attribute, Relationship
 
-logging.basicConfig(level=logging.DEBUG)
-
 _MESSAGE_TYPE_CLS_LIST_DICT: dict = collections.defaultdict(list)
 _MESSAGE_TYPE_FUNCTION_TO_DICT: dict = collections.defaultdict(dict)
 
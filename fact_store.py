@@ -3,32 +3,104 @@ facts
 """
 from fact import Fact, AttributeFact, RelationshipFact
 from entities import Person, EntityType
-from attribute import Attribute, FirstName, FirstNameCaps
+from aggregates import AggregateMaintainer
+from attribute import Attribute, FirstName, FirstNameCaps, Relationship
+from cardinality import CardinalityStatistics
+from configs import ENTITY_CACHE_SIZE, SPILL_TARGET, TTL_TICK
 from fact import AttributeFact
-from typing import Any, List
+from indexes import AttributeValueIndex
+from memory import MemoryAccount
+from metrics import METRICS
+from registry import REGISTRY
+from spill import DiskTier
+from timing_wheel import TimingWheel
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import collections
+import contextlib
+import itertools
+import math
 
 import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
 
 __MISSING__ = "__MISSING__"
 
 
 def get_entity_parameters(func):
     """
-    Inspect the signature etc.
+    Inspect the signature etc. Resolved once per function by the registry.
+    """
+    return REGISTRY.parameters(func)
+
+
+class EntityRowCache:
     """
-    sig = dict(func._function_signature.parameters.items())
-    out = {}
-    for parameter in sig.keys():
-        entity_name, attribute_name = parameter.split("__")
-        entity_obj = globals()[entity_name]
-        attribute_obj = globals()[attribute_name]
-        logging.debug(entity_obj)
-        logging.debug(attribute_obj)
-        out[parameter] = (
-            entity_obj,
-            attribute_obj,
+    LRU-bounded cache of entity rows, (entity type, entity id) ->
+    attribute class -> current ``AttributeFact``. Facts written through
+    ``FactStore.__call__`` update rows that are already cached; rows that
+    are not are read whole on their next miss.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._rows: Dict[Tuple[Any, Any], Dict[Any, Any]] = (
+            collections.OrderedDict()
         )
-    return out
+
+    def get(self, key: Tuple[Any, Any]) -> Optional[Dict[Any, Any]]:
+        """
+        The cached row for ``key``, or ``None``.
+        """
+        row = self._rows.get(key)
+        if row is not None:
+            self._rows.move_to_end(key)
+        return row
+
+    def put(self, key: Tuple[Any, Any], row: Dict[Any, Any]):
+        """
+        Caches ``row``, evicting the least recently used rows beyond
+        ``max_size``.
+        """
+        self._rows[key] = row
+        self._rows.move_to_end(key)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+
+    def update(self, fact: AttributeFact):
+        """
+        Applies a put to the entity's row if it is cached.
+        """
+        row = self._rows.get((fact.entity_type, fact.entity_id))
+        if row is not None:
+            row[fact.attribute] = fact
+
+    def discard(self, key: Tuple[Any, Any]):
+        """
+        Drops the row for ``key``, if cached.
+        """
+        self._rows.pop(key, None)
+
+    def clear(self):
+        """
+        Drops every row.
+        """
+        self._rows.clear()
+
+    def __len__(self):
+        return len(self._rows)
 
 
 class FactStore:
@@ -36,10 +108,27 @@ class FactStore:
     Superclass for all back-end storage engines.
     """
 
+    # Bumped whenever an index is created, so cached plans are re-planned.
+    index_version = 0
+
+    # Rows kept by ``get_entity`` for stores that do not hold them in
+    # memory; ``None`` turns the cache off.
+    entity_cache_size: Optional[int] = ENTITY_CACHE_SIZE
+
     def __init__(self, feature_functions: dict = None):
         self.feature_functions = feature_functions or {}
         self.fact_store = None
         self.session: Any = None
+        self.standing_queries: List[Any] = []
+        # Set between ``begin_bulk`` and ``end_bulk``.
+        self.bulk = False
+        # Created when the first fact arrives if aggregates are declared.
+        self.aggregates: Optional[AggregateMaintainer] = None
+        self.entity_cache: Optional[EntityRowCache] = (
+            EntityRowCache(self.entity_cache_size)
+            if self.entity_cache_size
+            else None
+        )
 
     def put(self, _):
         """
@@ -47,11 +136,199 @@ class FactStore:
         """
         raise NotImplementedError("`put` method must be implemented.")
 
+    def begin(self):
+        """
+        Opens a transaction; transactions nest, and only the outermost
+        ``commit`` publishes the writes. Stores without snapshots apply
+        writes as they arrive, so the default does nothing.
+        """
+
+    def commit(self):
+        """
+        Closes the transaction opened by the matching ``begin``.
+        """
+
+    def flush(self):
+        """
+        Writes any facts the store buffers to where it keeps them. The
+        default buffers nothing.
+        """
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Commits the facts written inside the block atomically. Writes are
+        not rolled back if the block raises; what was written is committed.
+        """
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def begin_bulk(self):
+        """
+        Starts a bulk load. Until ``end_bulk``, facts written through
+        ``__call__`` are stored without running callbacks or notifying
+        standing queries, and stores may stop maintaining their indexes.
+        """
+        self.bulk = True
+
+    def end_bulk(self):
+        """
+        Ends a bulk load: recomputes every derived attribute, builds the
+        indexes ``begin_bulk`` stopped maintaining and reloads the
+        standing queries, whose subscribers get the difference.
+        """
+        try:
+            self.recompute_derived()
+            self.build_deferred_indexes()
+        finally:
+            self.bulk = False
+        for standing_query in self.standing_queries:
+            standing_query.reload()
+
+    @contextlib.contextmanager
+    def bulk_load(self):
+        """
+        Runs the block as a bulk load (see ``begin_bulk``).
+        """
+        self.begin_bulk()
+        try:
+            yield self
+        finally:
+            self.end_bulk()
+
+    def build_deferred_indexes(self):
+        """
+        Builds the indexes not maintained during a bulk load. The default
+        has none.
+        """
+
+    def recompute_derived(self) -> int:
+        """
+        Recomputes every derived attribute from the current values of the
+        attributes it reads, one dependency level at a time, so a level
+        sees the values the level before it wrote. As with callbacks,
+        entities missing any of a function's parameters are skipped.
+        Returns the number of facts written.
+        """
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        written = 0
+        for level in REGISTRY.derived_levels():
+            # Read every input of the level before writing any output;
+            # functions on one level do not read each other.
+            computed = []
+            for function in level:
+                entity_type, attribute = REGISTRY.entity_attribute(
+                    function._function_name
+                )
+                parameters = get_entity_parameters(function)
+                entity_ids, columns = self._derived_inputs(parameters)
+                computed.append(
+                    (
+                        entity_type,
+                        attribute,
+                        entity_ids,
+                        [function(**kwargs) for kwargs in columns],
+                    )
+                )
+            for entity_type, attribute, entity_ids, values in computed:
+                for entity_id, value in zip(entity_ids, values):
+                    fact = AttributeFact(
+                        entity_type=entity_type,
+                        attribute=attribute,
+                        value=value,
+                        entity_id=entity_id,
+                    )
+                    self.put(fact)
+                    if self.entity_cache is not None:
+                        self.entity_cache.update(fact)
+                written += len(entity_ids)
+        if timing:
+            METRICS.observe(
+                "stage.recompute_derived", time.perf_counter() - start
+            )
+            METRICS.inc("fact_store.derived.recomputed", written)
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info("Recomputed %d derived attributes", written)
+        return written
+
+    def _derived_inputs(
+        self, parameters: Dict[str, Tuple[Any, Any]]
+    ) -> Tuple[List[Any], List[Dict[str, Any]]]:
+        """
+        Ids of the entities that have every parameter, and the keyword
+        arguments for each.
+        """
+        entity_types = {entity_type for entity_type, _ in parameters.values()}
+        # Every parameter is read off the same entity id, so only ids of
+        # the first parameter's entity type can have them all.
+        first_type = next(iter(parameters.values()))[0]
+        entity_ids = []
+        columns = []
+        for entity_id in list(self.entity_ids(first_type)):
+            rows = {
+                entity_type: self.get_entity(entity_type, entity_id)
+                for entity_type in entity_types
+            }
+            kwargs = {}
+            for parameter, (entity_type, attribute) in parameters.items():
+                fact = rows[entity_type].get(attribute)
+                if fact is None:
+                    break
+                kwargs[parameter] = fact.value
+            else:
+                entity_ids.append(entity_id)
+                columns.append(kwargs)
+        return entity_ids, columns
+
+    def snapshot(self) -> "FactStore":
+        """
+        A read-only view of the store as of the last commit, which later
+        writes do not change. Release it (or leave its ``with`` block) when
+        done so the versions it pins can be reclaimed.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support snapshots"
+        )
+
     def __call__(self, fact: Fact):
         """
         Wraps the `put` methods so we can do callbacks and side-effects.
+        The fact and the facts derived from it commit together.
         """
-        self.put(fact)
+        self.begin()
+        try:
+            self._apply(fact)
+        finally:
+            self.commit()
+
+    def _apply(self, fact: Fact):
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+            self.put(fact)
+            METRICS.observe("stage.put", time.perf_counter() - start)
+            METRICS.inc(
+                "fact_store.put.attribute"
+                if isinstance(fact, AttributeFact)
+                else "fact_store.put.relationship"
+            )
+        else:
+            self.put(fact)
+        if self.entity_cache is not None and isinstance(fact, AttributeFact):
+            self.entity_cache.update(fact)
+        if REGISTRY.aggregate_functions:
+            # Also during bulk loads: aggregates can not be recomputed.
+            self._aggregate(fact)
+        if self.bulk:
+            # ``end_bulk`` does the rest for the whole load.
+            return
+        if self.standing_queries:
+            self._notify(fact)
         # Call updates on dependent features and relationships
         callbacks = (
             self.session.callback_dict[
@@ -67,34 +344,133 @@ class FactStore:
             entity_parameters = get_entity_parameters(callback)
             callback_attrs = {
                 parameter: self.get_attribute(
-                    entity_type=fact.entity_type,
-                    attribute=fact.attribute,
+                    entity_type=parameter_entity_type,
+                    attribute=parameter_attribute,
                     entity_id=fact.entity_id,
                 )
-                for parameter in entity_parameters
+                for parameter, (
+                    parameter_entity_type,
+                    parameter_attribute,
+                ) in entity_parameters.items()
             }
             if any(value == __MISSING__ for value in callback_attrs.values()):
-                logging.debug("Missing at least one parameter in callback.")
+                if LOGGER.isEnabledFor(logging.DEBUG):
+                    LOGGER.debug("Missing at least one parameter in callback.")
+                if timing:
+                    METRICS.inc("fact_store.callback.skipped")
                 continue
 
             callback_kwargs = {
                 key: attribute.value
                 for key, attribute in callback_attrs.items()
             }
-            callback_value = callback(**callback_kwargs)
-            entity_type_name, attribute_cls_name = callback.__name__.split(
-                "__"
+            if timing:
+                callback_start = time.perf_counter()
+                callback_value = callback(**callback_kwargs)
+                METRICS.observe(
+                    f"attribute_function.{callback.__name__}",
+                    time.perf_counter() - callback_start,
+                )
+            else:
+                callback_value = callback(**callback_kwargs)
+            entity_type, attribute_cls = REGISTRY.entity_attribute(
+                callback._function_name
             )
-            entity_type = globals()[entity_type_name]
-            attribute_cls = globals()[attribute_cls_name]
-            fact_from_callback = AttributeFact(
-                entity_type=entity_type,
-                attribute=attribute_cls,
-                value=callback_value,
-                entity_id=fact.entity_id,
+            self._put_derived(
+                entity_type, attribute_cls, fact.entity_id, callback_value
             )
-            self.put(fact_from_callback)
-            logging.debug(fact_from_callback)
+
+    def _put_derived(
+        self, entity_type, attribute, entity_id, value
+    ) -> AttributeFact:
+        """
+        Writes an attribute computed from other facts. Standing queries
+        and aggregates see it, but it runs no callbacks.
+        """
+        fact = AttributeFact(
+            entity_type=entity_type,
+            attribute=attribute,
+            value=value,
+            entity_id=entity_id,
+        )
+        self.put(fact)
+        if self.entity_cache is not None:
+            self.entity_cache.update(fact)
+        if self.standing_queries and not self.bulk:
+            self._notify(fact)
+        if REGISTRY.aggregate_functions:
+            self._aggregate(fact)
+        if METRICS.enabled:
+            METRICS.inc("fact_store.put.attribute")
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("%s", fact)
+        return fact
+
+    def _aggregate(self, fact: Fact):
+        if self.aggregates is None:
+            self.aggregates = AggregateMaintainer(self)
+        if isinstance(fact, AttributeFact):
+            self.aggregates.observe_attribute(fact)
+        else:
+            self.aggregates.observe_relationship(fact)
+
+    def advance_aggregates(self, now: float = None) -> int:
+        """
+        Moves every aggregate window up to ``now`` (default: the current
+        time), so aggregates that received nothing lately decay. Returns
+        how many values changed; they commit as one version.
+        """
+        if self.aggregates is None:
+            return 0
+        with self.transaction():
+            return self.aggregates.advance(now)
+
+    def expire(self, now: float = None) -> int:
+        """
+        Removes the facts whose class ``ttl`` ran out by ``now`` (default:
+        the current time). Returns how many were removed; stores that do
+        not expire facts keep them all.
+        """
+        return 0
+
+    def subscribe(self, query, subscriber=None):
+        """
+        Registers ``query`` (text, parsed AST or ``Plan``) as a standing
+        query that is kept up to date as facts arrive through ``__call__``.
+        ``subscriber(added, removed)`` is called with the rows that change.
+        Returns the ``StandingQuery``.
+        """
+        # Imported here so that the query engine is only loaded when used.
+        from standing import (  # pylint: disable=import-outside-toplevel
+            StandingQuery,
+        )
+
+        standing_query = StandingQuery(self, query)
+        if subscriber is not None:
+            standing_query.subscribe(subscriber)
+        self.standing_queries.append(standing_query)
+        return standing_query
+
+    def unsubscribe(self, standing_query):
+        """
+        Stops maintaining ``standing_query``.
+        """
+        self.standing_queries.remove(standing_query)
+
+    def _notify(self, fact: Fact):
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        for standing_query in self.standing_queries:
+            standing_query.observe(fact)
+        if timing:
+            METRICS.observe(
+                "stage.standing_queries", time.perf_counter() - start
+            )
+
+    def _retract(self, fact: Fact):
+        for standing_query in self.standing_queries:
+            standing_query.retract(fact)
 
     def _get_attribute(
         self,
@@ -115,38 +491,886 @@ class FactStore:
         '''
         Calls ``_get_attribute``, which has to be provided in the child class.
         '''
-        return self._get_attribute(
+        if not METRICS.enabled:
+            return self._get_attribute(
+                entity_type=entity_type,
+                attribute=attribute,
+                entity_id=entity_id,
+            )
+        start = time.perf_counter()
+        out = self._get_attribute(
             entity_type=entity_type, attribute=attribute, entity_id=entity_id
         )
+        METRICS.observe("stage.get_attribute", time.perf_counter() - start)
+        METRICS.inc(
+            "fact_store.get_attribute.miss"
+            if out is __MISSING__
+            else "fact_store.get_attribute.hit"
+        )
+        return out
+
+    def _get_entity(
+        self, entity_type: EntityType, entity_id: Any
+    ) -> Dict[Attribute, AttributeFact]:
+        """
+        Assembles the entity's row. The default calls ``get_attribute``
+        once per registered attribute class; stores that keep rows per
+        entity should override this.
+        """
+        row = {}
+        for attribute in REGISTRY.attributes.values():
+            fact = self.get_attribute(
+                entity_type=entity_type,
+                attribute=attribute,
+                entity_id=entity_id,
+            )
+            if fact is not __MISSING__:
+                row[attribute] = fact
+        return row
+
+    def get_entity(
+        self, entity_type: EntityType, entity_id: Any
+    ) -> Dict[Attribute, AttributeFact]:
+        """
+        Every current attribute of the entity in one call, as attribute
+        class -> ``AttributeFact`` (empty if it has none). Rows come from
+        the ``entity_cache`` when it holds them, otherwise from
+        ``_get_entity``, and are then cached.
+        """
+        cache = self.entity_cache
+        if cache is None:
+            return self._get_entity(entity_type, entity_id)
+        key = (entity_type, entity_id)
+        row = cache.get(key)
+        if METRICS.enabled:
+            METRICS.inc(
+                "fact_store.entity_cache.miss"
+                if row is None
+                else "fact_store.entity_cache.hit"
+            )
+        if row is None:
+            row = self._get_entity(entity_type, entity_id)
+            cache.put(key, row)
+        return dict(row)
+
+    def entity_ids(self, entity_type: EntityType = None) -> Iterator[Any]:
+        """
+        Ids of every entity of ``entity_type`` that appears in an attribute
+        or relationship fact. Subclasses with an entity index should
+        override this; the default scans every fact.
+        """
+        seen = set()
+        for fact in self:
+            if isinstance(fact, AttributeFact):
+                candidates = ((fact.entity_type, fact.entity_id),)
+            else:
+                candidates = (
+                    (fact.source_entity_type, fact.source_entity_id),
+                    (fact.target_entity_type, fact.target_entity_id),
+                )
+            for candidate_type, candidate_id in candidates:
+                if candidate_type is entity_type and candidate_id not in seen:
+                    seen.add(candidate_id)
+                    yield candidate_id
+
+    def edges(
+        self,
+        relationship: Relationship = None,
+        entity_type: EntityType = None,
+        entity_id: Any = None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        """
+        Relationship facts leaving (``direction="out"``) or entering
+        (``"in"``) the given entity. ``relationship=None`` matches any
+        relationship class. The default scans every fact.
+        """
+        seen = set()
+        for fact in self:
+            if not isinstance(fact, RelationshipFact):
+                continue
+            if (
+                relationship is not None
+                and fact.relationship is not relationship
+            ):
+                continue
+            if direction == "out":
+                endpoint = (fact.source_entity_type, fact.source_entity_id)
+            else:
+                endpoint = (fact.target_entity_type, fact.target_entity_id)
+            if endpoint != (entity_type, entity_id):
+                continue
+            key = _edge_key(fact)
+            if key not in seen:
+                seen.add(key)
+                yield fact
+
+    def traverse(
+        self,
+        entity_type: EntityType,
+        entity_id: Any,
+        relationship: Relationship = None,
+        direction: str = "out",
+        min_hops: int = 1,
+        max_hops: Optional[int] = None,
+    ) -> Iterator[Tuple[Any, Any, int]]:
+        """
+        Breadth-first walk along ``relationship`` edges (any relationship
+        if ``None``) from the given entity. Yields ``(entity_type,
+        entity_id, hops)`` once per reachable entity, at its shortest
+        distance, for distances from ``min_hops`` to ``max_hops``
+        (unbounded if ``None``). Each level is expanded as a whole
+        frontier and visited entities are never expanded twice, so cycles
+        terminate. The default expands through ``edges``.
+        """
+        start = (entity_type, entity_id)
+        visited = {start}
+        frontier = [start]
+        if min_hops == 0:
+            yield entity_type, entity_id, 0
+        hops = 0
+        while frontier and (max_hops is None or hops < max_hops):
+            hops += 1
+            next_frontier = []
+            for frontier_type, frontier_id in frontier:
+                for fact in self.edges(
+                    relationship=relationship,
+                    entity_type=frontier_type,
+                    entity_id=frontier_id,
+                    direction=direction,
+                ):
+                    if direction == "out":
+                        other = (
+                            fact.target_entity_type,
+                            fact.target_entity_id,
+                        )
+                    else:
+                        other = (
+                            fact.source_entity_type,
+                            fact.source_entity_id,
+                        )
+                    if other not in visited:
+                        visited.add(other)
+                        next_frontier.append(other)
+            if hops >= min_hops:
+                for other_type, other_id in next_frontier:
+                    yield other_type, other_id, hops
+            frontier = next_frontier
+
+    def has_entity(self, entity_type: EntityType, entity_id: Any) -> bool:
+        """
+        Whether any fact mentions the entity. The default scans
+        ``entity_ids``.
+        """
+        return any(
+            candidate == entity_id
+            for candidate in self.entity_ids(entity_type)
+        )
+
+    def attribute_index(
+        self, attribute: Attribute
+    ) -> Optional[AttributeValueIndex]:
+        """
+        The value index on ``attribute``, or ``None`` if there is none (the
+        query engine then filters with ``get_attribute``).
+        """
+        return None
+
+    def statistics(self) -> CardinalityStatistics:
+        """
+        Cardinality statistics for the query planner, or ``None`` if the
+        store does not keep them (the planner then expands patterns left to
+        right).
+        """
+        return None
+
+
+def _edge_key(fact: RelationshipFact) -> tuple:
+    return (
+        fact.relationship,
+        fact.source_entity_type,
+        fact.source_entity_id,
+        fact.target_entity_type,
+        fact.target_entity_id,
+    )
 
 
 class MemoryFactStore(FactStore):
     """
-    Fact store in-memory.
+    Fact store in-memory. ``indexed_attributes`` lists the attribute
+    classes to keep value indexes on; more can be added with
+    ``create_index``. ``memory_budget`` caps the estimated bytes of the
+    facts held (see ``memory_usage``): past it, ``spill`` moves old fact
+    versions and then the rows of the entities used least recently to a
+    ``spill.DiskTier`` in ``spill_directory``, and rows are read back when
+    their entity is accessed.
     """
 
-    def __init__(self):
+    # Rows are resident or read back from the disk tier, so ``get_entity``
+    # needs no cache.
+    entity_cache_size = None
+
+    def __init__(
+        self,
+        indexed_attributes: Iterable[Attribute] = (),
+        memory_budget: Optional[int] = None,
+        spill_directory: Optional[str] = None,
+    ):
         self.attributes: List[AttributeFact] = []
         self.relationships: List[RelationshipFact] = []
+        # Current value of every attribute, per entity.
+        self._rows: Dict[Tuple[Any, Any], Dict[Any, AttributeFact]] = {}
+        # entity type -> entity ids in insertion order; append-only, so
+        # ``entity_ids`` can stream it while writes continue.
+        self._entities: Dict[Any, List[Any]] = collections.defaultdict(list)
+        # relationship -> (entity type, entity id) -> edge key -> fact
+        self._outgoing: Dict[Any, Dict[tuple, Dict[tuple, Any]]] = (
+            collections.defaultdict(lambda: collections.defaultdict(dict))
+        )
+        self._incoming: Dict[Any, Dict[tuple, Dict[tuple, Any]]] = (
+            collections.defaultdict(lambda: collections.defaultdict(dict))
+        )
+        # Dictionary encoding of (entity type, entity id) as dense ints,
+        # and relationship -> code -> neighbour codes, for ``traverse``.
+        self._codes: Dict[Tuple[Any, Any], int] = {}
+        self._entity_keys: List[Tuple[Any, Any]] = []
+        self._adjacency: Dict[str, Dict[Any, Dict[int, set]]] = {
+            "out": collections.defaultdict(dict),
+            "in": collections.defaultdict(dict),
+        }
+        self._statistics = CardinalityStatistics()
+        self._indexes: Dict[Any, AttributeValueIndex] = {}
+        # Indexes set aside during a bulk load.
+        self._deferred_indexes: Dict[Any, AttributeValueIndex] = {}
+        # Snapshots: ``_version`` is the last committed version, and writes
+        # since then belong to ``_version + 1``. ``_history`` maps each
+        # (entity type, entity id, attribute) cell to the facts its writes
+        # replaced, as (version of the write, replaced fact), oldest first;
+        # ``_touched`` holds the same entries in write order so they can be
+        # reclaimed once no pinned snapshot is older than them. Expiry also
+        # records the attributes it removes from each (entity type, entity
+        # id), and the edges it removes from each (relationship, direction,
+        # entity type, entity id), since the current rows no longer lead to
+        # them.
+        self._version = 0
+        self._depth = 0
+        self._history: Dict[tuple, List[Tuple[int, Any]]] = {}
+        self._touched: Deque[Tuple[int, tuple]] = collections.deque()
+        # Version each entity (by code) and each edge (by key) appeared in.
+        self._entity_versions: List[int] = []
+        self._edge_versions: Dict[tuple, int] = {}
+        # Pinned version -> number of snapshots holding it.
+        self._pins: Dict[int, int] = collections.Counter()
+        self._pin_lock = threading.Lock()
+        # Timers for the facts of classes with a ``ttl``, created with the
+        # first one, and expired facts by ``id`` until they are compacted
+        # out of ``attributes`` and ``relationships`` (holding them keeps
+        # the ids from being reused).
+        self._wheel: Optional[TimingWheel] = None
+        self._expired: Dict[int, Fact] = {}
+        # Memory: the estimated bytes held, and the disk tier, created by
+        # the first spill. ``_hot`` holds the keys of the rows used since
+        # the last spill and is ``None`` while there is nothing to spill
+        # to; ``_row_only`` the ``id`` of facts held only by rows read back
+        # from the tier; ``_spilled`` the rows on disk per entity type.
+        self.memory_budget = memory_budget
+        self.spill_directory = spill_directory
+        self._memory = MemoryAccount()
+        self._tier: Optional[DiskTier] = None
+        self._hot: Optional[set] = set() if memory_budget else None
+        self._row_only: set = set()
+        self._spilled: Dict[Any, int] = collections.Counter()
+        # The total past which a commit spills: the budget, or more if the
+        # last spill could not get under it (edges are not spilled).
+        self._spill_at = math.inf if memory_budget is None else memory_budget
         self.session = None
         super().__init__()
+        for attribute in indexed_attributes:
+            self.create_index(attribute)
+        self.metrics_label = METRICS.register_gauges(
+            self,
+            {
+                "fact_store.attributes": self.attribute_count,
+                "fact_store.relationships": self.relationship_count,
+                "fact_store.mvcc.history": self.history_size,
+                "fact_store.ttl.pending": self.ttl_pending,
+                "fact_store.memory.bytes": self.memory_bytes,
+                "fact_store.memory.spilled_rows": self.spilled_rows,
+            },
+        )
+
+    def attribute_count(self) -> int:
+        """
+        Number of attribute facts held.
+        """
+        return len(self.attributes)
+
+    def relationship_count(self) -> int:
+        """
+        Number of relationship facts held.
+        """
+        return len(self.relationships)
+
+    def history_size(self) -> int:
+        """
+        Number of replaced values kept for snapshots.
+        """
+        return len(self._touched)
+
+    def ttl_pending(self) -> int:
+        """
+        Number of facts waiting to expire, counting replaced ones.
+        """
+        return len(self._wheel) if self._wheel is not None else 0
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated bytes of the facts held in memory.
+        """
+        return self._memory.total
+
+    def spilled_rows(self) -> int:
+        """
+        Number of entity rows only on disk.
+        """
+        return sum(self._spilled.values())
+
+    def memory_usage(self) -> dict:
+        """
+        Estimated bytes of the facts held in memory, in total and per
+        entity type, attribute class and relationship class (see
+        ``memory.MemoryAccount``), with the budget and what was spilled.
+        """
+        usage = self._memory.as_dict()
+        usage["budget"] = self.memory_budget
+        usage["spilled"] = {
+            "rows": {
+                entity_type.__name__: count
+                for entity_type, count in self._spilled.items()
+                if count
+            },
+            "facts": 0 if self._tier is None else self._tier.fact_count,
+            "bytes": 0 if self._tier is None else self._tier.size_bytes(),
+        }
+        return usage
+
+    def begin(self):
+        if (
+            not self._depth
+            and self._wheel is not None
+            and time.time() >= self._wheel.due
+        ):
+            # Expired facts go in a version of their own.
+            self.expire()
+        self._depth += 1
+
+    def commit(self):
+        self._depth -= 1
+        if self._depth:
+            return
+        with self._pin_lock:
+            self._version += 1
+            horizon = min(self._pins) if self._pins else self._version
+        self._reclaim(horizon)
+        if self._memory.total > self._spill_at:
+            self.spill()
+
+    def _reclaim(self, horizon: int):
+        # Only the writer mutates the history, so snapshots reading it
+        # concurrently see whole entries.
+        touched = self._touched
+        if not touched or touched[0][0] > horizon:
+            return
+        if touched[-1][0] <= horizon:
+            self._history.clear()
+            touched.clear()
+            return
+        history = self._history
+        while touched and touched[0][0] <= horizon:
+            _, cell = touched.popleft()
+            entries = history[cell]
+            del entries[0]
+            if not entries:
+                del history[cell]
+
+    def snapshot(self) -> "MemorySnapshot":
+        with self._pin_lock:
+            version = self._version
+            self._pins[version] += 1
+        return MemorySnapshot(self, version)
+
+    def _unpin(self, version: int):
+        # Reclaiming waits for the writer's next commit.
+        with self._pin_lock:
+            self._pins[version] -= 1
+            if not self._pins[version]:
+                del self._pins[version]
+
+    def _remember(self, cell: tuple, entry: tuple):
+        # ``entry`` starts with the version of the write that needs it.
+        entries = self._history.get(cell)
+        if entries is None:
+            self._history[cell] = [entry]
+        else:
+            entries.append(entry)
+        self._touched.append((entry[0], cell))
 
     def _put_attribute_fact(self, attribute_fact: AttributeFact):
         """
         Won't be used by the user.
         """
         self.attributes.append(attribute_fact)
+        self._memory.charge(attribute_fact)
+        key = (attribute_fact.entity_type, attribute_fact.entity_id)
+        row = self._row(key) if self._hot is not None else self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = {}
+            self._add_entity(*key)
+        attribute = attribute_fact.attribute
+        old_fact = row.get(attribute)
+        if self._row_only and id(old_fact) in self._row_only:
+            self._row_only.discard(id(old_fact))
+            self._memory.credit(old_fact)
+        # Keep the replaced value for snapshots before overwriting it.
+        version = self._version + 1
+        cell = (key[0], key[1], attribute)
+        entries = self._history.get(cell)
+        if entries is None or entries[-1][0] != version:
+            entry = (version, __MISSING__ if old_fact is None else old_fact)
+            if entries is None:
+                self._history[cell] = [entry]
+            else:
+                entries.append(entry)
+            self._touched.append((version, cell))
+        index = self._indexes.get(attribute)
+        if index is not None:
+            index.update(
+                attribute_fact.entity_type,
+                attribute_fact.entity_id,
+                __MISSING__ if old_fact is None else old_fact.value,
+                attribute_fact.value,
+            )
+        row[attribute] = attribute_fact
+        if attribute.ttl is not None:
+            self._schedule(attribute_fact, attribute.ttl)
+
+    def create_index(self, attribute: Attribute) -> AttributeValueIndex:
+        """
+        Builds (or returns the existing) value index on ``attribute`` from
+        the current rows. During a bulk load the index is built by
+        ``end_bulk``.
+        """
+        index = self._indexes.get(attribute) or self._deferred_indexes.get(
+            attribute
+        )
+        if index is None:
+            index = AttributeValueIndex(attribute)
+            if self.bulk:
+                self._deferred_indexes[attribute] = index
+                return index
+            self._rebuild_index(index)
+            self._indexes[attribute] = index
+            self.index_version += 1
+        return index
+
+    def _rebuild_index(self, index: AttributeValueIndex):
+        attribute = index.attribute
+        rows = self._rows.items()
+        if self._tier is not None:
+            rows = itertools.chain(
+                rows,
+                (
+                    (key, row)
+                    for key, row in self._tier.rows()
+                    if key not in self._rows
+                ),
+            )
+        index.rebuild(
+            (entity_type, entity_id, row[attribute].value)
+            for (entity_type, entity_id), row in rows
+            if attribute in row
+        )
+
+    def begin_bulk(self):
+        super().begin_bulk()
+        # Value indexes are rebuilt in one pass by ``end_bulk``.
+        self._deferred_indexes.update(self._indexes)
+        self._indexes = {}
+
+    def build_deferred_indexes(self):
+        for index in self._deferred_indexes.values():
+            self._rebuild_index(index)
+        self._indexes.update(self._deferred_indexes)
+        self._deferred_indexes = {}
+        self.index_version += 1
+
+    def attribute_index(
+        self, attribute: Attribute
+    ) -> Optional[AttributeValueIndex]:
+        return self._indexes.get(attribute)
+
+    def _add_entity(self, entity_type, entity_id):
+        key = (entity_type, entity_id)
+        if key not in self._codes:
+            # In this order, so that a snapshot that finds the entity also
+            # finds its code and version.
+            self._entity_versions.append(self._version + 1)
+            self._entity_keys.append(key)
+            self._codes[key] = len(self._entity_keys) - 1
+            self._entities[entity_type].append(entity_id)
+            self._statistics.observe_entity(entity_type)
 
     def _put_relationship_fact(self, relationship_fact: RelationshipFact):
         """
         Also won't be used.
         """
         self.relationships.append(relationship_fact)
+        self._memory.charge(relationship_fact)
+        source = (
+            relationship_fact.source_entity_type,
+            relationship_fact.source_entity_id,
+        )
+        target = (
+            relationship_fact.target_entity_type,
+            relationship_fact.target_entity_id,
+        )
+        self._add_entity(*source)
+        self._add_entity(*target)
+        edge_key = _edge_key(relationship_fact)
+        relationship = relationship_fact.relationship
+        outgoing = self._outgoing[relationship][source]
+        incoming = self._incoming[relationship][target]
+        if edge_key not in outgoing:
+            self._edge_versions[edge_key] = self._version + 1
+            self._statistics.observe_edge(
+                relationship,
+                source[0],
+                target[0],
+                new_source=not outgoing,
+                new_target=not incoming,
+            )
+            source_code = self._codes[source]
+            target_code = self._codes[target]
+            out_codes = self._adjacency["out"][relationship]
+            in_codes = self._adjacency["in"][relationship]
+            if source_code in out_codes:
+                out_codes[source_code].add(target_code)
+            else:
+                out_codes[source_code] = {target_code}
+            if target_code in in_codes:
+                in_codes[target_code].add(source_code)
+            else:
+                in_codes[target_code] = {source_code}
+        outgoing[edge_key] = relationship_fact
+        incoming[edge_key] = relationship_fact
+        if relationship.ttl is not None:
+            self._schedule(relationship_fact, relationship.ttl)
+
+    def _schedule(self, fact: Fact, ttl: float):
+        if self._wheel is None:
+            self._wheel = TimingWheel(TTL_TICK)
+        self._wheel.schedule(fact.created_at.timestamp() + ttl, fact)
+
+    def expire(self, now: float = None) -> int:
+        """
+        Removes the facts whose ``ttl`` ran out by ``now`` (default: the
+        current time) from every index, with the derived attributes
+        computed from them, as one version. Snapshots taken before still
+        see them. This runs whenever a transaction begins, so it only needs
+        calling on a store nothing is written to. Entities stay known after
+        their facts expire. Returns how many facts were removed.
+        """
+        if self._wheel is None:
+            return 0
+        due = self._wheel.advance(now)
+        if not due:
+            return 0
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        removed = 0
+        self._depth += 1
+        try:
+            for fact in due:
+                # Replaced facts expire too, from the fact lists.
+                self._expired[id(fact)] = fact
+                if isinstance(fact, AttributeFact):
+                    removed += self._remove_attribute(fact)
+                else:
+                    removed += self._remove_relationship(fact)
+        finally:
+            self.commit()
+        if 2 * len(self._expired) > len(self.attributes) + len(
+            self.relationships
+        ):
+            self._compact()
+        if timing:
+            METRICS.observe("stage.expire", time.perf_counter() - start)
+            METRICS.inc("fact_store.expired", removed)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Expired %d facts", removed)
+        return removed
+
+    def _compact(self):
+        # Once expired facts are half the lists, so each fact is copied
+        # O(1) times on average.
+        self.attributes = self._without_expired(self.attributes)
+        self.relationships = self._without_expired(self.relationships)
+        self._expired.clear()
+
+    def _without_expired(self, facts: List[Fact]) -> List[Fact]:
+        expired = self._expired
+        kept = []
+        for fact in facts:
+            if id(fact) in expired:
+                self._memory.credit(fact)
+            else:
+                kept.append(fact)
+        return kept
+
+    def _row(
+        self, key: Tuple[Any, Any], admit: bool = True
+    ) -> Optional[Dict[Any, AttributeFact]]:
+        # The row of ``key``, read back from the disk tier if it was
+        # spilled. Snapshots read without taking the row back in, as only
+        # the writer changes ``_rows``.
+        row = self._rows.get(key)
+        if row is None and self._tier is not None:
+            row = self._tier.get_row(key)
+            if row is None or not admit:
+                return row
+            self._rows[key] = row
+            self._spilled[key[0]] -= 1
+            for fact in row.values():
+                self._memory.charge(fact)
+                self._row_only.add(id(fact))
+            if METRICS.enabled:
+                METRICS.inc("fact_store.memory.read_back")
+        if admit and self._hot is not None:
+            self._hot.add(key)
+        return row
+
+    def spill(self, target: Optional[int] = None) -> int:
+        """
+        Moves facts to the disk tier until the estimated bytes held are at
+        most ``target`` (default: ``SPILL_TARGET`` of the budget). Old
+        versions in the fact lists go first, then the rows of entities not
+        used since the last spill, then of any entity, oldest first. Rows
+        are read back when their entity is used; edges stay in memory.
+        This runs by itself when a commit leaves the store over its budget.
+        Returns the bytes freed.
+        """
+        if target is None:
+            target = int((self.memory_budget or 0) * SPILL_TARGET)
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        if self._tier is None:
+            self._tier = DiskTier(self.spill_directory)
+            if self._hot is None:
+                self._hot = set()
+        before = self._memory.total
+        self._spill_versions()
+        if self._memory.total > target:
+            self._spill_rows(target)
+        self._hot.clear()
+        freed = before - self._memory.total
+        if self.memory_budget is not None:
+            self._spill_at = max(
+                self.memory_budget,
+                self._memory.total + self.memory_budget - target,
+            )
+        if timing:
+            METRICS.observe("stage.spill", time.perf_counter() - start)
+            METRICS.inc("fact_store.memory.spilled", freed)
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info(
+                "Spilled %d bytes to disk, %d held", freed, self._memory.total
+            )
+        return freed
+
+    def _spill_versions(self):
+        # The facts in the lists that are no longer current; expired ones
+        # are dropped on the way.
+        expired = self._expired
+        rows = self._rows
+        spilled = []
+        kept = []
+        for fact in self.attributes:
+            if id(fact) in expired:
+                self._memory.credit(fact)
+                continue
+            row = rows.get((fact.entity_type, fact.entity_id))
+            if row is not None and row.get(fact.attribute) is fact:
+                kept.append(fact)
+            else:
+                spilled.append(fact)
+        self.attributes = kept
+        kept = []
+        for fact in self.relationships:
+            if id(fact) in expired:
+                self._memory.credit(fact)
+                continue
+            outgoing = self._outgoing[fact.relationship].get(
+                (fact.source_entity_type, fact.source_entity_id)
+            )
+            if outgoing is not None and outgoing.get(_edge_key(fact)) is fact:
+                kept.append(fact)
+            else:
+                spilled.append(fact)
+        self.relationships = kept
+        expired.clear()
+        if spilled:
+            self._tier.append_facts(spilled)
+            for fact in spilled:
+                self._memory.credit(fact)
+
+    def _spill_rows(self, target: int):
+        # Rows not used since the last spill first, then any, in the order
+        # they were loaded. Their facts leave the fact lists for the tier.
+        memory = self._memory
+        row_only = self._row_only
+        chosen: Dict[Tuple[Any, Any], Dict[Any, AttributeFact]] = {}
+        moved = set()
+        for skip in (self._hot, ()):
+            for key, row in self._rows.items():
+                if memory.total <= target:
+                    break
+                if not row or key in skip or key in chosen:
+                    continue
+                chosen[key] = row
+                for fact in row.values():
+                    memory.credit(fact)
+                    if id(fact) in row_only:
+                        row_only.discard(id(fact))
+                    else:
+                        moved.add(id(fact))
+        # Written before they leave memory, so snapshots reading
+        # concurrently find each row in one place or the other.
+        self._tier.put_rows(chosen.items())
+        for key in chosen:
+            del self._rows[key]
+            self._spilled[key[0]] += 1
+        if moved:
+            self._tier.append_facts(
+                [fact for fact in self.attributes if id(fact) in moved]
+            )
+            self.attributes = [
+                fact for fact in self.attributes if id(fact) not in moved
+            ]
+
+    def close(self):
+        """
+        Deletes the disk tier, if there is one, and what was spilled to it,
+        and drops the store's gauges.
+        """
+        METRICS.unregister_gauges(self.metrics_label)
+        if self._tier is not None:
+            self._tier.close()
+
+    def _remove_attribute(self, fact: AttributeFact) -> int:
+        # Removes ``fact`` if it is still the current value, and then the
+        # derived attributes computed from it, which would be stale.
+        callback_dict = REGISTRY.callback_dict()
+        removed = 0
+        pending = [fact]
+        while pending:
+            fact = pending.pop()
+            key = (fact.entity_type, fact.entity_id)
+            attribute = fact.attribute
+            if self._hot is not None:
+                row = self._row(key)
+            else:
+                row = self._rows.get(key)
+            current = None if row is None else row.get(attribute)
+            # Rows read back from disk hold copies.
+            if current is None or (
+                current is not fact and current.uuid != fact.uuid
+            ):
+                continue
+            fact = current
+            if self._row_only and id(fact) in self._row_only:
+                self._row_only.discard(id(fact))
+                self._memory.credit(fact)
+            version = self._version + 1
+            cell = (key[0], key[1], attribute)
+            entries = self._history.get(cell)
+            if entries is None or entries[-1][0] != version:
+                self._remember(cell, (version, fact))
+            self._remember(key, (version, attribute))
+            index = self._indexes.get(attribute)
+            if index is not None:
+                index.update(key[0], key[1], fact.value, __MISSING__)
+            del row[attribute]
+            if not row:
+                if self._tier is not None:
+                    self._tier.discard_row(key)
+                del self._rows[key]
+            removed += 1
+            if self.standing_queries and not self.bulk:
+                self._retract(fact)
+            for callback in callback_dict.get((key[0], attribute), ()):
+                derived_type, derived = REGISTRY.entity_attribute(
+                    callback._function_name
+                )
+                derived_key = (derived_type, key[1])
+                if self._hot is not None:
+                    derived_row = self._row(derived_key)
+                else:
+                    derived_row = self._rows.get(derived_key)
+                derived_fact = derived_row and derived_row.get(derived)
+                if derived_fact is not None:
+                    pending.append(derived_fact)
+        return removed
+
+    def _remove_relationship(self, fact: RelationshipFact) -> int:
+        # Removes the edge if ``fact`` is still the one stored for it.
+        relationship = fact.relationship
+        source = (fact.source_entity_type, fact.source_entity_id)
+        target = (fact.target_entity_type, fact.target_entity_id)
+        edge_key = _edge_key(fact)
+        outgoing = self._outgoing[relationship].get(source)
+        if not outgoing or outgoing.get(edge_key) is not fact:
+            return 0
+        # Kept for snapshots before the edge goes.
+        entry = (self._version + 1, fact, self._edge_versions[edge_key])
+        self._remember((relationship, "out") + source, entry)
+        self._remember((relationship, "in") + target, entry)
+        del self._edge_versions[edge_key]
+        del outgoing[edge_key]
+        if not outgoing:
+            del self._outgoing[relationship][source]
+        incoming = self._incoming[relationship][target]
+        del incoming[edge_key]
+        if not incoming:
+            del self._incoming[relationship][target]
+        source_code = self._codes[source]
+        target_code = self._codes[target]
+        for direction, code, other in (
+            ("out", source_code, target_code),
+            ("in", target_code, source_code),
+        ):
+            codes = self._adjacency[direction][relationship]
+            codes[code].discard(other)
+            if not codes[code]:
+                del codes[code]
+        self._statistics.forget_edge(
+            relationship,
+            source[0],
+            target[0],
+            last_source=not outgoing,
+            last_target=not incoming,
+        )
+        if self.aggregates is not None:
+            self.aggregates.forget_edge(fact)
+        if self.standing_queries and not self.bulk:
+            self._retract(fact)
+        return 1
 
     def put(self, fact: Fact):
-        if "RelationshipFact" in fact.__class__.__name__:
+        if isinstance(fact, RelationshipFact):
             self._put_relationship_fact(fact)
-        elif "AttributeFact" in fact.__class__.__name__:
+        elif isinstance(fact, AttributeFact):
             self._put_attribute_fact(fact)
         else:
             raise TypeError("Tried to put a non-Fact into the store.")
@@ -157,18 +1381,260 @@ class MemoryFactStore(FactStore):
         attribute: Attribute = None,
         entity_id: str = None,
     ):
-        for fact in self.attributes:
-            if (
-                fact.entity_type is entity_type
-                and fact.entity_id == entity_id
-                and fact.attribute is attribute
-            ):
-                return fact
-        logging.debug("no fact found")
+        key = (entity_type, entity_id)
+        row = self._row(key) if self._hot is not None else self._rows.get(key)
+        fact = None if row is None else row.get(attribute)
+        if fact is not None:
+            return fact
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("no fact found")
         return __MISSING__
 
+    def _get_entity(
+        self, entity_type: EntityType, entity_id: Any
+    ) -> Dict[Attribute, AttributeFact]:
+        key = (entity_type, entity_id)
+        row = self._row(key) if self._hot is not None else self._rows.get(key)
+        return dict(row or ())
+
+    def statistics(self) -> CardinalityStatistics:
+        return self._statistics
+
+    def has_entity(self, entity_type: EntityType, entity_id: Any) -> bool:
+        return (entity_type, entity_id) in self._codes
+
+    def traverse(
+        self,
+        entity_type: EntityType,
+        entity_id: Any,
+        relationship: Relationship = None,
+        direction: str = "out",
+        min_hops: int = 1,
+        max_hops: Optional[int] = None,
+    ) -> Iterator[Tuple[Any, Any, int]]:
+        # Frontiers and the visited set are sets of entity codes, so each
+        # level is a few set unions and differences, not a Python loop per
+        # edge.
+        start = self._codes.get((entity_type, entity_id))
+        if start is None:
+            return
+        by_relationship = self._adjacency[direction]
+        adjacencies = [
+            adjacency
+            for relationship_cls, adjacency in list(by_relationship.items())
+            if relationship is None or relationship_cls is relationship
+        ]
+        entity_keys = self._entity_keys
+        if min_hops == 0:
+            yield entity_type, entity_id, 0
+        visited = {start}
+        frontier = {start}
+        hops = 0
+        while frontier and (max_hops is None or hops < max_hops):
+            hops += 1
+            next_frontier = set()
+            for adjacency in adjacencies:
+                for code in frontier:
+                    neighbours = adjacency.get(code)
+                    if neighbours:
+                        next_frontier |= neighbours
+            next_frontier -= visited
+            visited |= next_frontier
+            if hops >= min_hops:
+                for code in next_frontier:
+                    other_type, other_id = entity_keys[code]
+                    yield other_type, other_id, hops
+            frontier = next_frontier
+
+    def entity_ids(self, entity_type: EntityType = None) -> Iterator[Any]:
+        # Walk the append-only list by position: nothing is copied, and
+        # entities added while iterating are picked up at the end.
+        entity_ids = self._entities.get(entity_type)
+        if entity_ids is None:
+            return
+        position = 0
+        while position < len(entity_ids):
+            yield entity_ids[position]
+            position += 1
+
+    def edges(
+        self,
+        relationship: Relationship = None,
+        entity_type: EntityType = None,
+        entity_id: Any = None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        index = self._outgoing if direction == "out" else self._incoming
+        relationships = (
+            list(index) if relationship is None else (relationship,)
+        )
+        for relationship_cls in relationships:
+            by_entity = index.get(relationship_cls)
+            if by_entity is None:
+                continue
+            edge_dict = by_entity.get((entity_type, entity_id))
+            if edge_dict:
+                yield from list(edge_dict.values())
+
     def __iter__(self):
+        if self._tier is not None:
+            # Spilled facts first, but for those that expired since.
+            now = None if self._wheel is None else self._wheel.now
+            for fact in self._tier.facts():
+                ttl = (
+                    fact.attribute
+                    if isinstance(fact, AttributeFact)
+                    else fact.relationship
+                ).ttl
+                if (
+                    ttl is None
+                    or now is None
+                    or fact.created_at.timestamp() + ttl > now
+                ):
+                    yield fact
+        expired = self._expired
         for attribute in self.attributes:
-            yield attribute
+            if not expired or id(attribute) not in expired:
+                yield attribute
         for relationship in self.relationships:
-            yield relationship
+            if not expired or id(relationship) not in expired:
+                yield relationship
+
+
+class MemorySnapshot(FactStore):
+    """
+    Read-only view of a ``MemoryFactStore`` as of one committed version,
+    from ``MemoryFactStore.snapshot``. Reads do not block the writer: they
+    read the current rows and fall back to the store's history for values
+    overwritten since, and skip entities and edges added since. Value
+    indexes are not versioned, so queries against a snapshot filter with
+    ``get_attribute``.
+    """
+
+    entity_cache_size = None
+
+    def __init__(self, store: MemoryFactStore, version: int):
+        super().__init__()
+        self.store = store
+        self.version = version
+        self.released = False
+
+    def put(self, _):
+        raise TypeError("Snapshots are read-only.")
+
+    def release(self):
+        """
+        Unpins the version, so the history it needs can be reclaimed.
+        """
+        if not self.released:
+            self.released = True
+            self.store._unpin(self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def _visible(self, entity_type, entity_id, attribute, fact):
+        # ``fact`` must be read before the history: the writer records the
+        # replaced value before it overwrites the row.
+        entries = self.store._history.get((entity_type, entity_id, attribute))
+        if entries:
+            for version, replaced in tuple(entries):
+                if version > self.version:
+                    return replaced
+        return __MISSING__ if fact is None else fact
+
+    def _get_attribute(
+        self,
+        entity_type: EntityType = None,
+        attribute: Attribute = None,
+        entity_id: str = None,
+    ):
+        row = self.store._row((entity_type, entity_id), admit=False) or {}
+        return self._visible(
+            entity_type, entity_id, attribute, row.get(attribute)
+        )
+
+    def _get_entity(
+        self, entity_type: EntityType, entity_id: Any
+    ) -> Dict[Attribute, AttributeFact]:
+        row = self.store._row((entity_type, entity_id), admit=False)
+        row = dict(row or ())
+        out = {}
+        for attribute, fact in row.items():
+            fact = self._visible(entity_type, entity_id, attribute, fact)
+            if fact is not __MISSING__:
+                out[attribute] = fact
+        # Attributes that expired since.
+        removed = self.store._history.get((entity_type, entity_id))
+        if removed:
+            for version, attribute in tuple(removed):
+                if version > self.version and attribute not in out:
+                    fact = self._visible(
+                        entity_type, entity_id, attribute, None
+                    )
+                    if fact is not __MISSING__:
+                        out[attribute] = fact
+        return out
+
+    def has_entity(self, entity_type: EntityType, entity_id: Any) -> bool:
+        code = self.store._codes.get((entity_type, entity_id))
+        return (
+            code is not None
+            and self.store._entity_versions[code] <= self.version
+        )
+
+    def entity_ids(self, entity_type: EntityType = None) -> Iterator[Any]:
+        codes = self.store._codes
+        versions = self.store._entity_versions
+        for entity_id in self.store.entity_ids(entity_type):
+            # Entities are appended in version order.
+            if versions[codes[(entity_type, entity_id)]] > self.version:
+                return
+            yield entity_id
+
+    def edges(
+        self,
+        relationship: Relationship = None,
+        entity_type: EntityType = None,
+        entity_id: Any = None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        store = self.store
+        versions = store._edge_versions
+        # The current edges first: expiry records an edge in the history
+        # before it removes it.
+        facts = []
+        for fact in store.edges(
+            relationship=relationship,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            direction=direction,
+        ):
+            version = versions.get(_edge_key(fact))
+            if version is not None and version <= self.version:
+                facts.append(fact)
+        index = store._outgoing if direction == "out" else store._incoming
+        expired = []
+        for relationship_cls in (
+            list(index) if relationship is None else (relationship,)
+        ):
+            removed = store._history.get(
+                (relationship_cls, direction, entity_type, entity_id)
+            )
+            if removed:
+                expired.extend(
+                    fact
+                    for version, fact, created in tuple(removed)
+                    if created <= self.version < version
+                )
+        if expired:
+            # Seen in both if it expired while the edges were read.
+            current = {id(fact) for fact in facts}
+            facts.extend(fact for fact in expired if id(fact) not in current)
+        yield from facts
+
+    def statistics(self) -> CardinalityStatistics:
+        return self.store.statistics()
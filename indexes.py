@@ -0,0 +1,198 @@
+"""
+Secondary indexes on attribute values.
+
+An ``AttributeValueIndex`` maps, per entity type, each current value of one
+attribute class to the set of entity ids holding it. Distinct numeric and
+string values are also kept sorted, so range constraints are answered with
+``bisect`` instead of a scan. The fact store calls ``update`` with the old
+and new value on every put, so the index always reflects current values.
+"""
+from __future__ import annotations
+
+import bisect
+import collections
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+__MISSING__ = "__MISSING__"
+
+EQUALS = "EQUALS"
+RANGE_RELATIONS = ("LT", "GT", "LTE", "GTE")
+
+
+def _family(value: Any) -> Optional[str]:
+    """
+    Group of mutually comparable values a value is range-indexed under,
+    or ``None`` if it is not range-indexed.
+    """
+    if isinstance(value, (int, float)):
+        # NaN compares false with everything and would break the ordering.
+        return "number" if value == value else None
+    if isinstance(value, str):
+        return "str"
+    return None
+
+
+class AttributeValueIndex:
+    """
+    Value index over one attribute class.
+    """
+
+    def __init__(self, attribute: type):
+        self.attribute = attribute
+        # entity type -> value -> entity ids
+        self._by_value: Dict[Any, Dict[Any, Set[Any]]] = (
+            collections.defaultdict(dict)
+        )
+        # entity type -> family -> sorted distinct values
+        self._sorted: Dict[Any, Dict[str, List[Any]]] = (
+            collections.defaultdict(dict)
+        )
+        # entity type -> number of indexed entities
+        self._sizes: Dict[Any, int] = collections.Counter()
+
+    def _add(self, entity_type, entity_id, value, keep_sorted=True):
+        try:
+            by_value = self._by_value[entity_type]
+            entity_ids = by_value.get(value)
+        except TypeError:  # unhashable values are not indexed
+            return
+        if entity_ids is None:
+            entity_ids = by_value[value] = set()
+            family = _family(value)
+            if family is not None and keep_sorted:
+                bisect.insort(
+                    self._sorted[entity_type].setdefault(family, []), value
+                )
+        if entity_id not in entity_ids:
+            entity_ids.add(entity_id)
+            self._sizes[entity_type] += 1
+
+    def _remove(self, entity_type, entity_id, value):
+        try:
+            by_value = self._by_value[entity_type]
+            entity_ids = by_value.get(value)
+        except TypeError:
+            return
+        if not entity_ids or entity_id not in entity_ids:
+            return
+        entity_ids.discard(entity_id)
+        self._sizes[entity_type] -= 1
+        if not entity_ids:
+            del by_value[value]
+            family = _family(value)
+            if family is not None:
+                values = self._sorted[entity_type][family]
+                position = bisect.bisect_left(values, value)
+                if position < len(values) and values[position] == value:
+                    del values[position]
+
+    def update(
+        self, entity_type: Any, entity_id: Any, old_value: Any, new_value: Any
+    ):
+        """
+        ``entity_id``'s value changed from ``old_value`` to ``new_value``
+        (either may be ``__MISSING__``).
+        """
+        if old_value is not __MISSING__:
+            if old_value == new_value and type(old_value) is type(new_value):
+                return
+            self._remove(entity_type, entity_id, old_value)
+        if new_value is not __MISSING__:
+            self._add(entity_type, entity_id, new_value)
+
+    def _range(self, entity_type, relation, value) -> List[Any]:
+        family = _family(value)
+        if family is None:
+            return []
+        values = self._sorted.get(entity_type, {}).get(family, [])
+        if relation == "LT":
+            return values[: bisect.bisect_left(values, value)]
+        if relation == "LTE":
+            return values[: bisect.bisect_right(values, value)]
+        if relation == "GT":
+            return values[bisect.bisect_right(values, value) :]
+        if relation == "GTE":
+            return values[bisect.bisect_left(values, value) :]
+        raise ValueError(f"Unknown relation: {relation}")
+
+    def lookup(
+        self, entity_type: Any, relation: str, value: Any
+    ) -> Iterator[Any]:
+        """
+        Ids of ``entity_type`` entities whose value satisfies
+        ``value <relation> constant``.
+        """
+        by_value = self._by_value.get(entity_type, {})
+        if relation == EQUALS:
+            try:
+                return iter(list(by_value.get(value, ())))
+            except TypeError:
+                return iter(())
+        return itertools.chain.from_iterable(
+            list(by_value.get(matching, ()))
+            for matching in self._range(entity_type, relation, value)
+        )
+
+    def contains(
+        self, entity_type: Any, entity_id: Any, relation: str, value: Any
+    ) -> Optional[bool]:
+        """
+        Whether ``entity_id`` passes an ``EQUALS`` constraint, answered
+        from the index; ``None`` for relations the index cannot check
+        without the entity's value.
+        """
+        if relation != EQUALS:
+            return None
+        try:
+            entity_ids = self._by_value.get(entity_type, {}).get(value)
+        except TypeError:
+            return False
+        return entity_ids is not None and entity_id in entity_ids
+
+    def estimate(self, entity_type: Any, relation: str, value: Any) -> float:
+        """
+        Estimated number of entities a lookup returns: exact for
+        ``EQUALS``, otherwise the matching share of distinct values times
+        the number of indexed entities.
+        """
+        by_value = self._by_value.get(entity_type, {})
+        if relation == EQUALS:
+            try:
+                return float(len(by_value.get(value, ())))
+            except TypeError:
+                return 0.0
+        if not by_value:
+            return 0.0
+        matching = len(self._range(entity_type, relation, value))
+        return self._sizes[entity_type] * matching / len(by_value)
+
+    def size(self, entity_type: Any) -> int:
+        """
+        Number of indexed ``entity_type`` entities.
+        """
+        return self._sizes.get(entity_type, 0)
+
+    def rebuild(self, rows: Iterable[tuple]):
+        """
+        Replaces the contents with ``(entity_type, entity_id, value)``
+        rows.
+        """
+        self._by_value.clear()
+        self._sorted.clear()
+        self._sizes.clear()
+        for entity_type, entity_id, value in rows:
+            self._add(entity_type, entity_id, value, keep_sorted=False)
+        # Sorting once is cheaper than one ``insort`` per distinct value.
+        for entity_type, by_value in self._by_value.items():
+            families: Dict[str, List[Any]] = collections.defaultdict(list)
+            for value in by_value:
+                family = _family(value)
+                if family is not None:
+                    families[family].append(value)
+            self._sorted[entity_type] = {
+                family: sorted(values) for family, values in families.items()
+            }
+
+    def __repr__(self):
+        return f"AttributeValueIndex({self.attribute.__name__})"
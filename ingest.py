@@ -0,0 +1,350 @@
+'''
+Streaming ingestion of JSON-lines CDC dumps.
+
+Usage::
+
+    python ingest.py dump.jsonl --sqlite facts.db --checkpoint dump.offset
+    python ingest.py dump.jsonl --sqlite facts.db --checkpoint dump.offset \
+        --resume
+    python ingest.py dump.jsonl --workers 4 --publish /dev/shm/facts
+    cat dump.jsonl | python ingest.py -
+
+Facts go into the SQLite database at ``--sqlite``, or else into memory.
+``--publish`` then writes them as a replica generation in a directory
+(see ``replica``). With neither, the run is a dry run that only measures
+ingestion. A checkpoint only makes sense where the facts are kept, so
+``--checkpoint`` needs ``--sqlite``.
+
+Files are read through ``mmap`` and stdin in large buffered chunks. Lines are
+parsed in worker processes, which keep only the keypaths that routes,
+``argument_mapping`` and attribute-function id keypaths need, so little
+more than the extracted fields crosses the process boundary. Records keep
+their byte offsets; after each batch is committed to the ``Session`` the end
+offset is written to the checkpoint file, which is where ``--resume`` picks
+up.
+'''
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import sys
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Set, Tuple
+
+from attribute import _MESSAGE_TYPE_CLS_LIST_DICT, _MESSAGE_TYPE_FUNCTION_TO_DICT
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+LINES_PER_TASK = 1000
+
+
+class Record(NamedTuple):
+    """
+    One parsed line. ``end_offset`` is the offset just past its newline.
+    """
+
+    offset: int
+    end_offset: int
+    message: dict
+
+
+def needed_keypaths(message_roundabout) -> Set[tuple]:
+    """
+    Every keypath the routes and their message types read from a message.
+    """
+    keypaths = set()
+    for route in message_roundabout.routes:
+        keypaths.add(tuple(route.keypath))
+        message_type = route.message_type
+        for keypath in getattr(message_type, "argument_mapping", {}).values():
+            keypaths.add(tuple(keypath))
+        for attribute_function in _MESSAGE_TYPE_CLS_LIST_DICT[
+            message_type.__name__
+        ]:
+            keypaths.add(
+                tuple(
+                    _MESSAGE_TYPE_FUNCTION_TO_DICT[attribute_function][
+                        message_type.__name__
+                    ]["id_keypath"]
+                )
+            )
+    return keypaths
+
+
+def prune(message: dict, keypaths: Iterable[tuple]) -> dict:
+    """
+    Copy of ``message`` holding only the values at ``keypaths``.
+    """
+    out: dict = {}
+    for keypath in keypaths:
+        obj = message
+        for key in keypath:
+            if not isinstance(obj, dict) or key not in obj:
+                break
+            obj = obj[key]
+        else:
+            target = out
+            for key in keypath[:-1]:
+                target = target.setdefault(key, {})
+            target[keypath[-1]] = obj
+    return out
+
+
+def iter_file_lines(
+    path: str, start_offset: int = 0
+) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Yields ``(offset, end_offset, line)`` from a memory-mapped file.
+    """
+    with open(path, "rb") as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(
+            input_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            size = len(buffer)
+            position = start_offset
+            while position < size:
+                newline = buffer.find(b"\n", position)
+                end = size if newline == -1 else newline + 1
+                yield position, end, buffer[position:end]
+                position = end
+
+
+def iter_stream_lines(
+    stream: BinaryIO, start_offset: int = 0, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Yields ``(offset, end_offset, line)`` from a binary stream read in
+    ``chunk_size`` blocks. The first ``start_offset`` bytes are skipped.
+    """
+    to_skip = start_offset
+    while to_skip:
+        skipped = stream.read(min(chunk_size, to_skip))
+        if not skipped:
+            return
+        to_skip -= len(skipped)
+    position = start_offset
+    remainder = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            end = position + len(line) + 1
+            yield position, end, line
+            position = end
+    if remainder:
+        yield position, position + len(remainder), remainder
+
+
+_WORKER_KEYPATHS: List[tuple] = []
+
+
+def _init_worker(keypaths: List[tuple]):
+    global _WORKER_KEYPATHS  # pylint: disable=global-statement
+    _WORKER_KEYPATHS = keypaths
+
+
+def _parse_lines(
+    lines: List[Tuple[int, int, bytes]]
+) -> List[Tuple[int, int, dict]]:
+    out = []
+    for offset, end_offset, line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            out.append((offset, end_offset, None))
+            continue
+        out.append((offset, end_offset, prune(message, _WORKER_KEYPATHS)))
+    return out
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_records(
+    lines: Iterable[Tuple[int, int, bytes]],
+    keypaths: Iterable[tuple],
+    workers: int = 0,
+) -> Iterator[Record]:
+    """
+    Parses and prunes ``lines``, in order, using ``workers`` processes
+    (inline if ``workers`` is 0). Lines that are not valid JSON are logged
+    and skipped.
+    """
+    keypaths = sorted(keypaths)
+    tasks = _batched(lines, LINES_PER_TASK)
+    if workers:
+        pool = multiprocessing.Pool(
+            workers, initializer=_init_worker, initargs=(keypaths,)
+        )
+        parsed_batches = _bounded_imap(pool, tasks, workers * 2)
+    else:
+        pool = None
+        _init_worker(keypaths)
+        parsed_batches = map(_parse_lines, tasks)
+    try:
+        for parsed in parsed_batches:
+            for offset, end_offset, message in parsed:
+                if message is None:
+                    LOGGER.warning("Skipping invalid JSON at byte %d", offset)
+                    continue
+                yield Record(offset, end_offset, message)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _bounded_imap(pool, tasks: Iterator[list], window: int) -> Iterator:
+    # ``Pool.imap`` drains its input eagerly, which would read the whole
+    # file into memory; keep at most ``window`` tasks in flight instead.
+    pending: collections.deque = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_parse_lines, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def read_checkpoint(path: str) -> int:
+    """
+    Offset stored in a checkpoint file, or 0 if there is none.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            return int(checkpoint_file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path: str, offset: int):
+    """
+    Atomically records ``offset`` as the resume point.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as checkpoint_file:
+        checkpoint_file.write(str(offset))
+    os.replace(tmp_path, path)
+
+
+def ingest(
+    session,
+    source: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    start_offset: int = 0,
+    checkpoint_path: str = None,
+) -> int:
+    """
+    Feeds the JSON-lines ``source`` (a path, or ``"-"`` for stdin) into
+    ``session`` in batches of ``batch_size`` records. Returns the offset
+    just past the last committed record.
+    """
+    if source == "-":
+        lines = iter_stream_lines(sys.stdin.buffer, start_offset)
+    else:
+        lines = iter_file_lines(source, start_offset)
+    records = iter_records(
+        lines, needed_keypaths(session.message_roundabout), workers=workers
+    )
+    committed = start_offset
+    for batch in _batched(records, batch_size):
+        session.ingest(record.message for record in batch)
+        committed = batch[-1].end_offset
+        if checkpoint_path:
+            write_checkpoint(checkpoint_path, committed)
+    return committed
+
+
+def main(argv: List[str] = None):
+    """
+    Command-line entry point.
+    """
+    # Imported here so that importing ``ingest`` does not load ``session``.
+    from fact_store import MemoryFactStore  # pylint: disable=import-outside-toplevel
+    from message_loader import DEFAULT_LOADER  # pylint: disable=import-outside-toplevel
+    from route import MessageRoundabout  # pylint: disable=import-outside-toplevel
+    from session import Session  # pylint: disable=import-outside-toplevel
+    from sqlite_fact_store import SqliteFactStore  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("source", help="JSON-lines file, or - for stdin.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--sqlite", help="SQLite database to ingest into.")
+    parser.add_argument(
+        "--publish", help="Directory to publish a replica generation to."
+    )
+    parser.add_argument("--checkpoint", help="File holding the resume offset.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Start from the offset in --checkpoint.",
+    )
+    parser.add_argument("--start-offset", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.checkpoint and not args.sqlite:
+        parser.error("--checkpoint requires --sqlite")
+    start_offset = args.start_offset
+    if args.resume:
+        if not args.checkpoint:
+            parser.error("--resume requires --checkpoint")
+        start_offset = read_checkpoint(args.checkpoint)
+
+    message_roundabout = MessageRoundabout()
+    for route in DEFAULT_LOADER.routes():
+        message_roundabout.add_route(route)
+    if args.sqlite:
+        fact_store_cls = SqliteFactStore
+        fact_store_kwargs = {"path": args.sqlite}
+    else:
+        fact_store_cls = MemoryFactStore
+        fact_store_kwargs = {}
+        if not args.publish:
+            LOGGER.warning("No --sqlite or --publish: the facts are dropped")
+    with Session(
+        fact_store_cls=fact_store_cls,
+        fact_store_kwargs=fact_store_kwargs,
+        message_roundabout=message_roundabout,
+    ) as session:
+        end_offset = ingest(
+            session,
+            args.source,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            start_offset=start_offset,
+            checkpoint_path=args.checkpoint,
+        )
+        if args.publish:
+            generation = session.publish(args.publish)
+            LOGGER.info("Published generation %d", generation)
+    close = getattr(session.fact_store, "close", None)
+    if close is not None:
+        close()
+    LOGGER.info("Ingested up to byte %d", end_offset)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,102 @@
+"""
+Memory accounting for ``MemoryFactStore``.
+
+A ``MemoryAccount`` is charged when the store takes a fact into memory and
+credited when it lets one go, so its totals per entity type and per
+attribute or relationship class are current without walking the store. A
+fact's size is estimated from ``sys.getsizeof`` of the fact, its
+``__dict__``, its id and timestamp and its value, shallowly. The indexes
+over the facts are not counted, so compare the numbers with each other
+rather than with the process size, and leave headroom when setting a
+budget.
+"""
+from __future__ import annotations
+
+import collections
+import sys
+from typing import Any, Dict
+
+from fact import AttributeFact
+
+# Fact class -> bytes of a fact of that class, but for its value.
+_OVERHEAD: Dict[type, int] = {}
+
+
+def fact_size(fact: Any) -> int:
+    """
+    Estimated bytes ``fact`` takes up.
+    """
+    overhead = _OVERHEAD.get(type(fact))
+    if overhead is None:
+        fields = vars(fact)
+        overhead = _OVERHEAD[type(fact)] = (
+            sys.getsizeof(fact)
+            + sys.getsizeof(fields)
+            + sum(
+                sys.getsizeof(fields[name])
+                for name in ("uuid", "created_at")
+                if name in fields
+            )
+        )
+    if isinstance(fact, AttributeFact):
+        return overhead + sys.getsizeof(fact.value)
+    return overhead
+
+
+class MemoryAccount:
+    """
+    Estimated bytes held, in total, per entity type and per attribute and
+    relationship class. Attribute facts count towards their entity's type,
+    edges towards their source's.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.entity_types: Dict[type, int] = collections.Counter()
+        self.attributes: Dict[type, int] = collections.Counter()
+        self.relationships: Dict[type, int] = collections.Counter()
+
+    def charge(self, fact: Any) -> int:
+        """
+        ``fact`` was taken into memory. Returns its size.
+        """
+        size = fact_size(fact)
+        self.total += size
+        if isinstance(fact, AttributeFact):
+            self.entity_types[fact.entity_type] += size
+            self.attributes[fact.attribute] += size
+        else:
+            self.entity_types[fact.source_entity_type] += size
+            self.relationships[fact.relationship] += size
+        return size
+
+    def credit(self, fact: Any) -> int:
+        """
+        ``fact`` was let go. Returns its size.
+        """
+        size = fact_size(fact)
+        self.total -= size
+        if isinstance(fact, AttributeFact):
+            self.entity_types[fact.entity_type] -= size
+            self.attributes[fact.attribute] -= size
+        else:
+            self.entity_types[fact.source_entity_type] -= size
+            self.relationships[fact.relationship] -= size
+        return size
+
+    def as_dict(self) -> dict:
+        """
+        Plain-data view, by class name.
+        """
+
+        def by_name(counts):
+            return {
+                cls.__name__: size for cls, size in counts.items() if size
+            }
+
+        return {
+            "total": self.total,
+            "entity_types": by_name(self.entity_types),
+            "attributes": by_name(self.attributes),
+            "relationships": by_name(self.relationships),
+        }
@@ -2,7 +2,38 @@
 messages
 '''
 
-from dataclasses import dataclass
+from registry import REGISTRY
+
+
+def compile_keypath(keypath):
+    """
+    Returns a function equivalent to
+    ``DictAttributeMapping.lookup_keypath(dictionary, keypath)`` with the
+    keypath baked in. Short keypaths are unrolled.
+    """
+    keys = tuple(keypath)
+    if len(keys) == 1:
+        (first,) = keys
+        return lambda dictionary: dictionary.get(first, {})
+    if len(keys) == 2:
+        first, second = keys
+        return lambda dictionary: dictionary.get(first, {}).get(second, {})
+    if len(keys) == 3:
+        first, second, third = keys
+        return (
+            lambda dictionary: dictionary.get(first, {})
+            .get(second, {})
+            .get(third, {})
+        )
+
+    def extract(dictionary):
+        obj = dictionary
+        for key in keys:
+            obj = obj.get(key, {})
+        return obj
+
+    return extract
+
 
 class DictAttributeMapping:
     """
@@ -12,6 +43,10 @@ class DictAttributeMapping:
 
     def __init__(self, keypath_arg_dict: dict = None):
         self.keypath_arg_dict = keypath_arg_dict or {}
+        self.extractors = tuple(
+            (key, compile_keypath(keypath))
+            for key, keypath in self.keypath_arg_dict.items()
+        )
 
     @staticmethod
     def lookup_keypath(dictionary, keypath):
@@ -25,8 +60,7 @@ class DictAttributeMapping:
 
     def __call__(self, dictionary):
         key_values = {
-            key: DictAttributeMapping.lookup_keypath(dictionary, keypath)
-            for key, keypath in self.keypath_arg_dict.items()
+            key: extractor(dictionary) for key, extractor in self.extractors
         }
         return key_values
 
@@ -37,49 +71,59 @@ class Message:
     """
 
     argument_mapping: dict
+    relationship_mapping: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        REGISTRY.register_message_type(cls)
+        cls.compile()
+
+    @classmethod
+    def compile(cls):
+        """
+        Precompiles the argument and relationship mappings. Called when the
+        class is created and again whenever its mappings are replaced.
+        """
+        argument_mapping = getattr(cls, "argument_mapping", {})
+        cls._attribute_mapping = DictAttributeMapping(
+            keypath_arg_dict=argument_mapping
+        )
+        cls._relationship_extractors = tuple(
+            (
+                relationship_name,
+                relationship_config["source"]["entity_type"],
+                compile_keypath(
+                    argument_mapping[
+                        relationship_config["source"]["entity_id_keypath"]
+                    ]
+                ),
+                relationship_config["target"]["entity_type"],
+                compile_keypath(
+                    argument_mapping[
+                        relationship_config["target"]["entity_id_keypath"]
+                    ]
+                ),
+            )
+            for relationship_name, relationship_config in (
+                cls.relationship_mapping.items()
+            )
+        )
 
     def get_kwargs(self, message: dict):
         """
         Gets the kwargs
         """
-        arg_map = DictAttributeMapping(keypath_arg_dict=self.argument_mapping)
-        message_kwargs = arg_map(message)
-        return message_kwargs
+        return self._attribute_mapping(message)
 
 
-@dataclass
-class UserTableMessageType(Message):
-    """
-    One table
-    """
+def __getattr__(name):
+    # Message types such as ``UserTableMessageType`` are defined in
+    # ``message_configs``; load them on first access.
+    if name.startswith("_"):
+        raise AttributeError(f"module 'message' has no attribute '{name}'")
+    from message_loader import DEFAULT_LOADER  # pylint: disable=import-outside-toplevel
 
-    argument_mapping = {
-        "user_id": [
-            "cdc",
-            "columns",
-            "id",
-        ],
-        "user_name": [
-            "cdc",
-            "columns",
-            "name",
-        ],
-        "state": [
-            "cdc",
-            "columns",
-            "state",
-        ],
-    }
-
-    relationship_mapping = {
-        "LivesIn": {
-            "source": {
-                "entity_type": "Person",
-                "entity_id_keypath": "user_id",
-            },
-            "target": {
-                "entity_type": "State",
-                "entity_id_keypath": "state",
-            },
-        }
-    }
+    message_types = DEFAULT_LOADER.load()
+    if name in message_types:
+        return message_types[name]
+    raise AttributeError(f"module 'message' has no attribute '{name}'")
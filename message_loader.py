@@ -0,0 +1,144 @@
+'''
+Builds ``Message`` types from the YAML files in ``MESSAGE_CONFIG_DIRECTORY``.
+
+Each top-level key of a YAML file names a message type::
+
+    UserTableMessageType:
+      route:                      # optional
+        keypath: [metadata, table]
+        value_match: users
+      argument_mapping:
+        user_id: [cdc, columns, id]
+      relationship_mapping:
+        LivesIn:
+          source: {entity_type: Person, entity_id_keypath: user_id}
+          target: {entity_type: State, entity_id_keypath: state}
+'''
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from configs import MESSAGE_CONFIG_DIRECTORY
+from message import Message
+from registry import CONFIG_CACHE
+from route import Route
+
+LOGGER = logging.getLogger(__name__)
+
+_YAML_SUFFIXES = (".yaml", ".yml")
+
+
+def compile_message_type(name: str, config: dict, existing: type = None):
+    """
+    Returns a ``Message`` subclass for ``config``. If ``existing`` is given
+    its mappings are replaced in place, so routes and sessions holding the
+    class see the new definition.
+    """
+    attrs = {
+        "argument_mapping": dict(config.get("argument_mapping") or {}),
+        "relationship_mapping": dict(
+            config.get("relationship_mapping") or {}
+        ),
+        "route": config.get("route"),
+        "__doc__": config.get("description", f"{name} (from YAML)"),
+    }
+    if existing is not None:
+        for key, value in attrs.items():
+            setattr(existing, key, value)
+        existing.compile()
+        return existing
+    return type(name, (Message,), attrs)
+
+
+def message_route(message_type: type) -> Optional[Route]:
+    """
+    The ``Route`` declared by a loaded message type, if it declares one.
+    """
+    route = getattr(message_type, "route", None)
+    if not route:
+        return None
+    return Route(
+        message_type=message_type,
+        keypath=list(route["keypath"]),
+        value_match=route["value_match"],
+    )
+
+
+class MessageTypeLoader:
+    """
+    Loads every YAML file in ``directory``. Parsed files are cached by
+    modification time and size, so calling ``load`` again only re-reads
+    files that changed; that is how a running ``Session`` hot-reloads.
+    """
+
+    def __init__(self, directory: str = MESSAGE_CONFIG_DIRECTORY):
+        if not os.path.isabs(directory):
+            directory = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), directory
+            )
+        self.directory = directory
+        self.message_types: Dict[str, type] = {}
+        # path -> ((mtime_ns, size), message type names defined there)
+        self._file_state: Dict[str, Tuple[tuple, List[str]]] = {}
+
+    def _config_paths(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, file_name)
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(_YAML_SUFFIXES)
+        )
+
+    def _load_file(self, path: str) -> List[str]:
+        # Through the config cache, so a warm start never imports yaml.
+        with open(path) as config_file:
+            file_config = CONFIG_CACHE(config_file.read()) or {}
+        for name, config in file_config.items():
+            self.message_types[name] = compile_message_type(
+                name, config, existing=self.message_types.get(name)
+            )
+            LOGGER.info("Loaded message type %s from %s", name, path)
+        return list(file_config)
+
+    def load(self) -> Dict[str, type]:
+        """
+        Loads new and changed files and returns name -> message type.
+        Types whose file disappeared are dropped from the loader (but
+        classes already handed out keep working).
+        """
+        seen = set()
+        for path in self._config_paths():
+            seen.add(path)
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = self._file_state.get(path)
+            if cached is not None and cached[0] == signature:
+                continue
+            names = self._load_file(path)
+            if cached is not None:
+                for stale_name in set(cached[1]) - set(names):
+                    self.message_types.pop(stale_name, None)
+            self._file_state[path] = (signature, names)
+        for path in set(self._file_state) - seen:
+            _, names = self._file_state.pop(path)
+            for name in names:
+                self.message_types.pop(name, None)
+        return self.message_types
+
+    reload = load
+
+    def routes(self) -> List[Route]:
+        """
+        ``Route`` objects for every loaded type that declares a ``route``.
+        """
+        routes = (
+            message_route(message_type)
+            for message_type in self.load().values()
+        )
+        return [route for route in routes if route is not None]
+
+
+DEFAULT_LOADER = MessageTypeLoader()
@@ -0,0 +1,340 @@
+"""
+Counters, gauges and latency histograms for the hot path.
+
+Everything reports into the module-level ``METRICS`` registry. It is
+disabled by default; call sites check ``METRICS.enabled`` before reading the
+clock, so a disabled registry costs one attribute lookup per call site.
+"""
+from __future__ import annotations
+
+import bisect
+import itertools
+import json
+import math
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+# Latency bucket upper bounds in seconds: 1us doubling up to ~134s.
+_BUCKET_BOUNDS: List[float] = [1e-6 * 2 ** i for i in range(28)]
+
+
+class Counter:
+    """
+    A monotonically increasing count.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        """
+        Adds ``amount`` to the counter.
+        """
+        self.value += amount
+
+
+class Gauge:
+    """
+    A value that is set rather than accumulated. If ``callback`` is given,
+    the value is read from it when a snapshot is taken, so nothing is paid
+    on the hot path.
+    """
+
+    __slots__ = ("value", "callback")
+
+    def __init__(self, callback: Optional[Callable[[], Any]] = None):
+        self.value: Any = 0
+        self.callback = callback
+
+    def set(self, value: Any):
+        """
+        Sets the gauge.
+        """
+        self.value = value
+
+    def read(self) -> Any:
+        """
+        Current value of the gauge.
+        """
+        if self.callback is None:
+            return self.value
+        value = self.callback()
+        return self.value if value is None else value
+
+
+class Histogram:
+    """
+    Latency histogram with fixed exponential buckets. Quantiles are estimated
+    from the bucket upper bounds and clamped to the observed min and max.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        """
+        Records one observation.
+        """
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimated ``q``-quantile, e.g. ``0.99``.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                bound = (
+                    _BUCKET_BOUNDS[index]
+                    if index < len(_BUCKET_BOUNDS)
+                    else self.max
+                )
+                return max(self.min, min(bound, self.max))
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Plain-dict summary for export.
+        """
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Timer:
+    """
+    Context manager that records elapsed time into a histogram.
+    """
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    """
+    Stand-in for ``_Timer`` when metrics are disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Holds every named metric. Metrics are created on first use.
+
+    Updates are not locked; under the GIL a lost increment is possible when
+    several threads report into the same counter, which is acceptable for
+    observability data.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Gauge] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._labels = itertools.count(1)
+
+    def enable(self):
+        """
+        Turns reporting on.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Turns reporting off. Existing values are kept.
+        """
+        self.enabled = False
+
+    def counter(self, name: str) -> Counter:
+        """
+        Returns the counter called ``name``, creating it if necessary.
+        """
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter()
+        return counter
+
+    def gauge(self, name: str) -> Gauge:
+        """
+        Returns the gauge called ``name``, creating it if necessary.
+        """
+        gauge = self.gauges.get(name)
+        if gauge is None:
+            gauge = self.gauges[name] = Gauge()
+        return gauge
+
+    def histogram(self, name: str) -> Histogram:
+        """
+        Returns the histogram called ``name``, creating it if necessary.
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def inc(self, name: str, amount: int = 1):
+        """
+        Shortcut for ``counter(name).inc(amount)``.
+        """
+        self.counter(name).inc(amount)
+
+    def observe(self, name: str, value: float):
+        """
+        Shortcut for ``histogram(name).observe(value)``.
+        """
+        self.histogram(name).observe(value)
+
+    def timer(self, name: str):
+        """
+        Context manager timing its body into histogram ``name``. Returns a
+        shared no-op when disabled.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name))
+
+    def register_gauge(self, name: str, callback: Callable[[], Any]):
+        """
+        Registers a gauge whose value is computed at snapshot time. Bound
+        methods are held weakly so that registering does not keep their
+        owner alive, and the gauge is dropped when the owner is collected.
+        """
+        if _is_bound_method(callback):
+            ref = weakref.WeakMethod(callback)
+
+            def _read():
+                method = ref()
+                return None if method is None else method()
+
+            gauge = Gauge(callback=_read)
+            weakref.finalize(callback.__self__, self._drop_gauge, name, gauge)
+        else:
+            gauge = Gauge(callback=callback)
+        self.gauges[name] = gauge
+
+    def register_gauges(
+        self, owner: Any, gauges: Dict[str, Callable[[], Any]]
+    ) -> str:
+        """
+        Registers each of ``owner``'s gauges as ``name[label]``, with a
+        label such as ``MemoryFactStore-3`` that is unique to ``owner``, so
+        that several instances report side by side. Returns the label, for
+        ``unregister_gauges``.
+        """
+        label = f"{type(owner).__name__}-{next(self._labels)}"
+        for name, callback in gauges.items():
+            self.register_gauge(f"{name}[{label}]", callback)
+        return label
+
+    def unregister_gauges(self, label: str):
+        """
+        Drops the gauges registered by ``register_gauges`` under ``label``.
+        """
+        suffix = f"[{label}]"
+        for name in [name for name in self.gauges if name.endswith(suffix)]:
+            del self.gauges[name]
+
+    def _drop_gauge(self, name: str, gauge: Gauge):
+        # Only if it was not replaced since.
+        if self.gauges.get(name) is gauge:
+            del self.gauges[name]
+
+    def reset(self):
+        """
+        Drops every counter and histogram. Callback gauges are kept.
+        """
+        self.counters.clear()
+        self.histograms.clear()
+        self.gauges = {
+            name: gauge
+            for name, gauge in self.gauges.items()
+            if gauge.callback is not None
+        }
+
+    def snapshot(self) -> dict:
+        """
+        Returns a point-in-time copy of every metric as plain data.
+        """
+        return {
+            "enabled": self.enabled,
+            "counters": {
+                name: counter.value
+                for name, counter in sorted(self.counters.items())
+            },
+            "gauges": {
+                name: gauge.read()
+                for name, gauge in sorted(self.gauges.items())
+            },
+            "histograms": {
+                name: histogram.summary()
+                for name, histogram in sorted(self.histograms.items())
+            },
+        }
+
+    def export_json(self, path: str = None) -> str:
+        """
+        Serializes ``snapshot()`` as JSON, writing it to ``path`` if given.
+        """
+        out = json.dumps(self.snapshot(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, "w") as export_file:
+                export_file.write(out)
+        return out
+
+
+def _is_bound_method(obj) -> bool:
+    """
+    True if ``obj`` is a method bound to an instance.
+    """
+    return hasattr(obj, "__self__") and hasattr(obj, "__func__")
+
+
+METRICS = MetricsRegistry()
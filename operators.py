@@ -0,0 +1,681 @@
+"""
+Plan operators for ``MATCH`` queries.
+
+Each operator consumes a stream of bindings and yields extended bindings. A
+binding maps variable names to ``EntityRef`` (for nodes) or
+``RelationshipFact`` (for named relationships). Operators only use
+``FactStore.entity_ids``, ``FactStore.edges``, ``FactStore.get_attribute``
+and ``FactStore.attribute_index``, so a store with indexes behind those
+methods is never scanned fact by fact.
+"""
+from __future__ import annotations
+
+import collections
+import operator as _operator
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from decision import ConstraintList
+from registry import REGISTRY
+
+__MISSING__ = "__MISSING__"
+
+
+class QueryError(Exception):
+    """
+    The query cannot be planned, e.g. it names an unknown entity type.
+    """
+
+
+class QueryCancelled(QueryError):
+    """
+    The query was cancelled while it was producing rows.
+    """
+
+
+class CancellableStore:
+    """
+    Wraps a fact store for one execution so that its streaming reads
+    (``entity_ids``, ``edges``, ``traverse``) raise ``QueryCancelled`` at
+    the next item once ``cancelled()`` is true. Every operator pulls its
+    work from those iterators, so cancelling, even from another thread,
+    stops a scan or expansion mid-way instead of after its next row.
+    """
+
+    def __init__(self, store, cancelled: Callable[[], bool]):
+        self.store = store
+        self.cancelled = cancelled
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def _checked(self, iterator: Iterator) -> Iterator:
+        cancelled = self.cancelled
+        for item in iterator:
+            if cancelled():
+                raise QueryCancelled("Query cancelled")
+            yield item
+
+    def entity_ids(self, *args, **kwargs):
+        return self._checked(self.store.entity_ids(*args, **kwargs))
+
+    def edges(self, *args, **kwargs):
+        return self._checked(self.store.edges(*args, **kwargs))
+
+    def traverse(self, *args, **kwargs):
+        return self._checked(self.store.traverse(*args, **kwargs))
+
+
+class OperatorProfile:
+    """
+    What one operator did during a profiled execution. ``time`` includes
+    the operators feeding it; ``self_time`` does not. ``index_hits`` and
+    ``index_misses`` count value index probes that did and did not find a
+    matching entity.
+    """
+
+    def __init__(self, operator: Operator):
+        self.operator = operator
+        self.description = operator.describe()
+        self.estimated_rows = operator.estimated_rows
+        self.rows_in = 0
+        self.rows_out = 0
+        self.time = 0.0
+        self.self_time = 0.0
+        self.store_calls: Dict[str, int] = collections.Counter()
+        self.index_hits = 0
+        self.index_misses = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        The profile as plain data.
+        """
+        return {
+            "operator": self.description,
+            "estimated_rows": self.estimated_rows,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "time": self.time,
+            "self_time": self.self_time,
+            "store_calls": dict(self.store_calls),
+            "index_hits": self.index_hits,
+            "index_misses": self.index_misses,
+        }
+
+    def timed(self, rows: Iterator[dict]) -> Iterator[dict]:
+        """
+        Passes ``rows`` through, counting them and the time spent
+        producing them.
+        """
+        clock = time.perf_counter
+        try:
+            while True:
+                started = clock()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    self.time += clock() - started
+                self.rows_out += 1
+                yield row
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+
+
+class _ProfiledIndex:
+    """
+    Counts the probes of a value index into an ``OperatorProfile``.
+    """
+
+    def __init__(self, index, profile: OperatorProfile):
+        self.index = index
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def lookup(self, *args, **kwargs) -> Iterator[Any]:
+        found = False
+        try:
+            for entity_id in self.index.lookup(*args, **kwargs):
+                found = True
+                yield entity_id
+        finally:
+            if found:
+                self.profile.index_hits += 1
+            else:
+                self.profile.index_misses += 1
+
+    def contains(self, *args, **kwargs) -> Optional[bool]:
+        result = self.index.contains(*args, **kwargs)
+        if result:
+            self.profile.index_hits += 1
+        elif result is not None:
+            self.profile.index_misses += 1
+        return result
+
+
+class ProfilingStore:
+    """
+    Wraps a fact store for one operator of a profiled execution, counting
+    its reads into ``profile.store_calls`` and wrapping the value indexes it
+    hands out so their probes are counted too.
+    """
+
+    def __init__(self, store, profile: OperatorProfile):
+        self.store = store
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def _count(self, name: str):
+        self.profile.store_calls[name] += 1
+        return getattr(self.store, name)
+
+    def entity_ids(self, *args, **kwargs):
+        return self._count("entity_ids")(*args, **kwargs)
+
+    def edges(self, *args, **kwargs):
+        return self._count("edges")(*args, **kwargs)
+
+    def traverse(self, *args, **kwargs):
+        return self._count("traverse")(*args, **kwargs)
+
+    def has_entity(self, *args, **kwargs):
+        return self._count("has_entity")(*args, **kwargs)
+
+    def get_attribute(self, *args, **kwargs):
+        return self._count("get_attribute")(*args, **kwargs)
+
+    def attribute_index(self, attribute):
+        index = self._count("attribute_index")(attribute)
+        if index is None:
+            return None
+        return _ProfiledIndex(index, self.profile)
+
+
+class EntityRef(NamedTuple):
+    """
+    A node binding.
+    """
+
+    entity_type: type
+    entity_id: Any
+
+    def __repr__(self):
+        return f"{self.entity_type.__name__}({self.entity_id!r})"
+
+
+def resolve_entity_type(name: Optional[str]) -> Optional[type]:
+    """
+    Entity type called ``name``; ``None`` stays ``None``.
+    """
+    if name is None:
+        return None
+    try:
+        return REGISTRY.entity_types[name]
+    except KeyError:
+        raise QueryError(f"Unknown entity type: {name}") from None
+
+
+def resolve_relationship(name: Optional[str]) -> Optional[type]:
+    """
+    Relationship class called ``name``; ``None`` stays ``None``.
+    """
+    if name is None:
+        return None
+    try:
+        return REGISTRY.relationships[name]
+    except KeyError:
+        raise QueryError(f"Unknown relationship: {name}") from None
+
+
+# Relation token -> (comparison, symbol for ``describe``)
+RELATIONS = {
+    "EQUALS": (_operator.eq, "="),
+    "LT": (_operator.lt, "<"),
+    "GT": (_operator.gt, ">"),
+    "LTE": (_operator.le, "<="),
+    "GTE": (_operator.ge, ">="),
+}
+
+
+def _compare(relation: str, left: Any, right: Any) -> bool:
+    try:
+        return RELATIONS[relation][0](left, right)
+    except TypeError:  # e.g. "abc" < 3 simply does not match
+        return False
+
+
+def resolve_attribute(name: str) -> type:
+    """
+    Attribute class called ``name``.
+    """
+    try:
+        return REGISTRY.attributes[name]
+    except KeyError:
+        raise QueryError(f"Unknown attribute: {name}") from None
+
+
+class AttributeConstraint:
+    """
+    ``attribute <relation> value`` on a node, from a node constraint such
+    as ``(a:Person {LuckyNumber = 13})`` or a ``WHERE a.LuckyNumber > 10``
+    clause.
+    """
+
+    def __init__(self, attribute: type, relation: str, value: Any):
+        if relation not in RELATIONS:
+            raise QueryError(f"Unknown relation: {relation}")
+        self.attribute = attribute
+        self.relation = relation
+        self.value = value
+
+    @classmethod
+    def from_ast(cls, constraint_list: ConstraintList) -> List:
+        """
+        Converts a parsed ``ConstraintList`` (or ``None``).
+        """
+        if constraint_list is None:
+            return []
+        out = []
+        for constraint in constraint_list.constraint_list:
+            name = getattr(constraint.name, "name", constraint.name)
+            out.append(
+                cls(
+                    resolve_attribute(name),
+                    constraint.relation,
+                    constraint.value,
+                )
+            )
+        return out
+
+    def __call__(self, store, entity_type: type, entity_id: Any) -> bool:
+        fact = store.get_attribute(
+            entity_type=entity_type,
+            attribute=self.attribute,
+            entity_id=entity_id,
+        )
+        if fact is __MISSING__:
+            return False
+        return _compare(self.relation, fact.value, self.value)
+
+    def __repr__(self):
+        symbol = RELATIONS[self.relation][1]
+        return f"{self.attribute.__name__} {symbol} {self.value!r}"
+
+
+class EntityIdConstraint:
+    """
+    ``entity_id <relation> value``, from ``WHERE a = 1``.
+    """
+
+    def __init__(self, relation: str, value: Any):
+        if relation not in RELATIONS:
+            raise QueryError(f"Unknown relation: {relation}")
+        self.relation = relation
+        self.value = value
+
+    def __call__(self, store, entity_type: type, entity_id: Any) -> bool:
+        return _compare(self.relation, entity_id, self.value)
+
+    def __repr__(self):
+        return f"id {RELATIONS[self.relation][1]} {self.value!r}"
+
+
+def _indexed(store, constraints: List) -> List[tuple]:
+    """
+    ``(index, constraint)`` for each attribute constraint ``store`` has a
+    value index for.
+    """
+    out = []
+    for constraint in constraints:
+        if isinstance(constraint, AttributeConstraint):
+            index = store.attribute_index(constraint.attribute)
+            if index is not None:
+                out.append((index, constraint))
+    return out
+
+
+def _entity_types_for(entity_type: Optional[type]) -> List[type]:
+    if entity_type is not None:
+        return [entity_type]
+    return list(REGISTRY.entity_types.values())
+
+
+class Operator:
+    """
+    Superclass for plan operators. ``estimated_rows`` is filled in by the
+    planner when the store has statistics.
+    """
+
+    estimated_rows: Optional[float] = None
+
+    def __call__(self, store, bindings: Iterable[dict]) -> Iterator[dict]:
+        raise NotImplementedError("Operators must implement `__call__`.")
+
+    def describe(self) -> str:
+        """
+        One line for ``Plan.explain``.
+        """
+        return repr(self)
+
+
+class NodeScan(Operator):
+    """
+    Binds ``variable`` to every entity of ``entity_type`` (any type if
+    ``None``) that satisfies ``constraints``.
+    """
+
+    def __init__(
+        self,
+        variable: str,
+        entity_type: Optional[type] = None,
+        constraints: List[AttributeConstraint] = None,
+    ):
+        self.variable = variable
+        self.entity_type = entity_type
+        self.constraints = constraints or []
+
+    def __call__(self, store, bindings):
+        for binding in bindings:
+            for entity_type in _entity_types_for(self.entity_type):
+                for entity_id in store.entity_ids(entity_type):
+                    if all(
+                        constraint(store, entity_type, entity_id)
+                        for constraint in self.constraints
+                    ):
+                        yield {
+                            **binding,
+                            self.variable: EntityRef(entity_type, entity_id),
+                        }
+
+    def describe(self):
+        type_name = getattr(self.entity_type, "__name__", "*")
+        out = f"NodeScan({self.variable}:{type_name})"
+        if self.constraints:
+            out += f" filter {self.constraints}"
+        return out
+
+
+class NodeById(Operator):
+    """
+    Binds ``variable`` to the entity with id ``entity_id`` if it exists
+    and satisfies ``constraints``; from ``WHERE a = <id>``.
+    """
+
+    def __init__(
+        self,
+        variable: str,
+        entity_id: Any,
+        entity_type: Optional[type] = None,
+        constraints: List[AttributeConstraint] = None,
+    ):
+        self.variable = variable
+        self.entity_id = entity_id
+        self.entity_type = entity_type
+        self.constraints = constraints or []
+
+    def __call__(self, store, bindings):
+        for binding in bindings:
+            for entity_type in _entity_types_for(self.entity_type):
+                if not store.has_entity(entity_type, self.entity_id):
+                    continue
+                if all(
+                    constraint(store, entity_type, self.entity_id)
+                    for constraint in self.constraints
+                ):
+                    yield {
+                        **binding,
+                        self.variable: EntityRef(entity_type, self.entity_id),
+                    }
+
+    def describe(self):
+        type_name = getattr(self.entity_type, "__name__", "*")
+        out = f"NodeById({self.variable}:{type_name} = {self.entity_id!r})"
+        if self.constraints:
+            out += f" filter {self.constraints}"
+        return out
+
+
+class IndexSeek(Operator):
+    """
+    Binds ``variable`` to the entities the value index on
+    ``seek.attribute`` returns for ``seek``, then checks the remaining
+    ``constraints``. The index is looked up when the operator runs, so a
+    plan cached before the index was dropped falls back to scanning.
+    """
+
+    def __init__(
+        self,
+        variable: str,
+        seek: AttributeConstraint,
+        entity_type: Optional[type] = None,
+        constraints: List[AttributeConstraint] = None,
+    ):
+        self.variable = variable
+        self.seek = seek
+        self.entity_type = entity_type
+        self.constraints = constraints or []
+
+    def _candidates(self, store, entity_type):
+        index = store.attribute_index(self.seek.attribute)
+        if index is None:
+            return (
+                entity_id
+                for entity_id in store.entity_ids(entity_type)
+                if self.seek(store, entity_type, entity_id)
+            )
+        return index.lookup(entity_type, self.seek.relation, self.seek.value)
+
+    def __call__(self, store, bindings):
+        for binding in bindings:
+            for entity_type in _entity_types_for(self.entity_type):
+                for entity_id in self._candidates(store, entity_type):
+                    if all(
+                        constraint(store, entity_type, entity_id)
+                        for constraint in self.constraints
+                    ):
+                        yield {
+                            **binding,
+                            self.variable: EntityRef(entity_type, entity_id),
+                        }
+
+    def describe(self):
+        type_name = getattr(self.entity_type, "__name__", "*")
+        out = f"IndexSeek({self.variable}:{type_name} {self.seek!r})"
+        if self.constraints:
+            out += f" filter {self.constraints}"
+        return out
+
+
+class Expand(Operator):
+    """
+    Follows ``relationship`` edges from the already-bound ``from_variable``
+    and binds the other endpoint to ``to_variable``. ``direction`` is
+    ``"out"`` when ``from_variable`` is the source of the edge. If
+    ``to_variable`` is already bound, the edge must lead to it.
+    """
+
+    def __init__(
+        self,
+        from_variable: str,
+        to_variable: str,
+        relationship: Optional[type] = None,
+        direction: str = "out",
+        to_entity_type: Optional[type] = None,
+        to_constraints: List[AttributeConstraint] = None,
+        relationship_variable: str = None,
+        into: bool = False,
+    ):
+        self.from_variable = from_variable
+        self.to_variable = to_variable
+        self.relationship = relationship
+        self.direction = direction
+        self.to_entity_type = to_entity_type
+        self.to_constraints = to_constraints or []
+        self.relationship_variable = relationship_variable
+        self.into = into
+
+    def _index_checks(self, store):
+        # Equality constraints with an index become a set membership test
+        # instead of a ``get_attribute`` per candidate.
+        checks = []
+        filters = list(self.to_constraints)
+        for index, constraint in _indexed(store, self.to_constraints):
+            if constraint.relation == "EQUALS":
+                checks.append((index, constraint))
+                filters.remove(constraint)
+        return checks, filters
+
+    def __call__(self, store, bindings):
+        outgoing = self.direction == "out"
+        checks, filters = (
+            self._index_checks(store) if self.to_constraints else ((), ())
+        )
+        for binding in bindings:
+            source = binding[self.from_variable]
+            for fact in store.edges(
+                relationship=self.relationship,
+                entity_type=source.entity_type,
+                entity_id=source.entity_id,
+                direction=self.direction,
+            ):
+                if outgoing:
+                    other = EntityRef(
+                        fact.target_entity_type, fact.target_entity_id
+                    )
+                else:
+                    other = EntityRef(
+                        fact.source_entity_type, fact.source_entity_id
+                    )
+                if self.into:
+                    if binding[self.to_variable] != other:
+                        continue
+                else:
+                    if (
+                        self.to_entity_type is not None
+                        and other.entity_type is not self.to_entity_type
+                    ):
+                        continue
+                    if not all(
+                        index.contains(
+                            other.entity_type,
+                            other.entity_id,
+                            constraint.relation,
+                            constraint.value,
+                        )
+                        for index, constraint in checks
+                    ):
+                        continue
+                    if not all(
+                        constraint(store, other.entity_type, other.entity_id)
+                        for constraint in filters
+                    ):
+                        continue
+                extended = dict(binding)
+                extended[self.to_variable] = other
+                if self.relationship_variable is not None:
+                    extended[self.relationship_variable] = fact
+                yield extended
+
+    def describe(self):
+        arrow = "->" if self.direction == "out" else "<-"
+        relationship = getattr(self.relationship, "__name__", "*")
+        kind = "ExpandInto" if self.into else "Expand"
+        type_name = getattr(self.to_entity_type, "__name__", "*")
+        out = (
+            f"{kind}({self.from_variable}){arrow}[{relationship}]"
+            f"({self.to_variable}:{type_name})"
+        )
+        if self.to_constraints:
+            out += f" filter {self.to_constraints}"
+        return out
+
+
+class VarLengthExpand(Operator):
+    """
+    Binds ``to_variable`` to every entity reachable from ``from_variable``
+    in ``min_hops`` to ``max_hops`` (unbounded if ``None``)
+    ``relationship`` edges, via ``FactStore.traverse``. Each reachable
+    entity is bound once, at its shortest distance.
+    """
+
+    def __init__(
+        self,
+        from_variable: str,
+        to_variable: str,
+        relationship: Optional[type] = None,
+        direction: str = "out",
+        min_hops: int = 1,
+        max_hops: Optional[int] = None,
+        to_entity_type: Optional[type] = None,
+        to_constraints: List[AttributeConstraint] = None,
+        into: bool = False,
+    ):
+        self.from_variable = from_variable
+        self.to_variable = to_variable
+        self.relationship = relationship
+        self.direction = direction
+        self.min_hops = min_hops
+        self.max_hops = max_hops
+        self.to_entity_type = to_entity_type
+        self.to_constraints = to_constraints or []
+        self.into = into
+
+    def __call__(self, store, bindings):
+        for binding in bindings:
+            source = binding[self.from_variable]
+            for entity_type, entity_id, _ in store.traverse(
+                source.entity_type,
+                source.entity_id,
+                relationship=self.relationship,
+                direction=self.direction,
+                min_hops=self.min_hops,
+                max_hops=self.max_hops,
+            ):
+                other = EntityRef(entity_type, entity_id)
+                if self.into:
+                    if binding[self.to_variable] != other:
+                        continue
+                    yield binding
+                    break
+                if (
+                    self.to_entity_type is not None
+                    and entity_type is not self.to_entity_type
+                ):
+                    continue
+                if not all(
+                    constraint(store, entity_type, entity_id)
+                    for constraint in self.to_constraints
+                ):
+                    continue
+                yield {**binding, self.to_variable: other}
+
+    def describe(self):
+        arrow = "->" if self.direction == "out" else "<-"
+        relationship = getattr(self.relationship, "__name__", "*")
+        kind = "VarLengthExpandInto" if self.into else "VarLengthExpand"
+        type_name = getattr(self.to_entity_type, "__name__", "*")
+        max_hops = "" if self.max_hops is None else self.max_hops
+        hops = f"*{self.min_hops}..{max_hops}"
+        out = (
+            f"{kind}({self.from_variable}){arrow}[{relationship}{hops}]"
+            f"({self.to_variable}:{type_name})"
+        )
+        if self.to_constraints:
+            out += f" filter {self.to_constraints}"
+        return out
@@ -0,0 +1,759 @@
+"""
+Turns a parsed ``MATCH`` pattern into a ``Plan``.
+
+When the fact store keeps ``CardinalityStatistics`` the planner tries every
+pattern variable as the starting node, expands greedily along whichever
+adjacent edge produces the fewest estimated rows, and keeps the cheapest
+order (estimated entities examined plus edges traversed). Without
+statistics the pattern is expanded left to right.
+
+``WHERE`` constraints are pushed down onto the node they name. A node is
+bound by id (``WHERE a = 1``), through a value index when the store has one
+on a constrained attribute, or by scanning its entity type, in that order of
+preference; index counts replace the default selectivity when estimating.
+"""
+from __future__ import annotations
+
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from decision import (
+    Expression,
+    Limit,
+    Match,
+    MatchWhere,
+    Node,
+    RelationshipList,
+)
+from operators import (
+    AttributeConstraint,
+    CancellableStore,
+    EntityIdConstraint,
+    Expand,
+    IndexSeek,
+    NodeById,
+    NodeScan,
+    Operator,
+    OperatorProfile,
+    ProfilingStore,
+    QueryError,
+    resolve_attribute,
+    resolve_entity_type,
+    resolve_relationship,
+    VarLengthExpand,
+)
+
+# Fraction of rows assumed to pass one equality constraint.
+DEFAULT_SELECTIVITY = 0.1
+
+# Hops assumed when estimating an unbounded variable-length relationship.
+UNBOUNDED_HOPS_ESTIMATE = 8
+
+__MISSING__ = "__MISSING__"
+
+
+def _variable_name(node: Node) -> str:
+    return getattr(node.name, "name", node.name)
+
+
+class PatternNode:
+    """
+    Everything the planner knows about one variable.
+    """
+
+    def __init__(self, variable: str):
+        self.variable = variable
+        self.entity_type: Optional[type] = None
+        # AttributeConstraint and EntityIdConstraint
+        self.constraints: List = []
+
+    def merge(self, node: Node):
+        """
+        Folds the type and constraints of another occurrence of the
+        variable into this one.
+        """
+        entity_type = resolve_entity_type(node.node_type)
+        if entity_type is not None:
+            if (
+                self.entity_type is not None
+                and self.entity_type is not entity_type
+            ):
+                raise QueryError(
+                    f"Variable {self.variable} has two types: "
+                    f"{self.entity_type.__name__}, {entity_type.__name__}"
+                )
+            self.entity_type = entity_type
+        self.constraints.extend(AttributeConstraint.from_ast(node.constraint))
+
+    def entity_id(self):
+        """
+        The id an ``id = value`` constraint pins this node to, or
+        ``__MISSING__``.
+        """
+        for constraint in self.constraints:
+            if (
+                isinstance(constraint, EntityIdConstraint)
+                and constraint.relation == "EQUALS"
+            ):
+                return constraint.value
+        return __MISSING__
+
+
+class PatternEdge(NamedTuple):
+    """
+    One relationship in the pattern, always stored source -> target.
+    ``max_hops`` is ``None`` for an unbounded variable-length relationship.
+    """
+
+    source: str
+    target: str
+    relationship: Optional[type]
+    variable: Optional[str]
+    min_hops: int = 1
+    max_hops: Optional[int] = 1
+
+    @property
+    def variable_length(self) -> bool:
+        return (self.min_hops, self.max_hops) != (1, 1)
+
+
+def pattern(ast) -> Tuple[Dict[str, PatternNode], List[PatternEdge], str]:
+    """
+    Nodes, edges and leftmost variable of a parsed ``Match``,
+    ``MatchWhere``, ``RelationshipList`` or ``Node`` (or an ``Expression``
+    wrapping one).
+    """
+    if isinstance(ast, Expression):
+        ast = ast.ast
+    if isinstance(ast, Limit):
+        ast = ast.query
+    where = None
+    if isinstance(ast, MatchWhere):
+        ast, where = ast.pattern, ast.where
+    if isinstance(ast, Match):
+        ast = ast.relationship_list
+    nodes, edges, start = _pattern(ast)
+    if where is not None:
+        _push_down(nodes, where.constraint_list)
+    return nodes, edges, start
+
+
+def _push_down(nodes: Dict[str, PatternNode], constraint_list):
+    """
+    Attaches each ``WHERE`` constraint to the node it names.
+    """
+    for constraint in constraint_list.constraint_list:
+        variable = getattr(constraint.name, "name", constraint.name)
+        if variable not in nodes:
+            raise QueryError(f"Unknown variable in WHERE: {variable}")
+        if constraint.attribute is None:
+            nodes[variable].constraints.append(
+                EntityIdConstraint(constraint.relation, constraint.value)
+            )
+        else:
+            nodes[variable].constraints.append(
+                AttributeConstraint(
+                    resolve_attribute(constraint.attribute),
+                    constraint.relation,
+                    constraint.value,
+                )
+            )
+
+
+def _pattern(ast) -> Tuple[Dict[str, PatternNode], List[PatternEdge], str]:
+    nodes: Dict[str, PatternNode] = {}
+    edges: List[PatternEdge] = []
+    # The parser reuses one Node object for the shared node of two chained
+    # relationships; merge each object only once.
+    merged = set()
+
+    def add_node(node: Node) -> str:
+        variable = _variable_name(node)
+        if variable not in nodes:
+            nodes[variable] = PatternNode(variable)
+        if id(node) not in merged:
+            merged.add(id(node))
+            nodes[variable].merge(node)
+        return variable
+
+    if isinstance(ast, Node):
+        return nodes, edges, add_node(ast)
+    if not isinstance(ast, RelationshipList):
+        raise QueryError(f"Cannot execute {type(ast).__name__}")
+
+    for relationship in ast.relationship_list:
+        add_node(relationship.left_node)
+        add_node(relationship.right_node)
+        spec = relationship.relationship_spec
+        relationship_variable = None
+        relationship_type = None
+        min_hops = max_hops = 1
+        if spec is not None:
+            relationship_variable = getattr(
+                spec.relationship_name, "name", spec.relationship_name
+            )
+            relationship_type = resolve_relationship(spec.relationship_type)
+            min_hops, max_hops = spec.min_hops, spec.max_hops
+            if max_hops is not None and max_hops < min_hops:
+                raise QueryError(f"Empty hop range *{min_hops}..{max_hops}")
+            if (min_hops, max_hops) != (1, 1) and relationship_variable:
+                raise QueryError(
+                    "Variable-length relationships cannot be bound to a "
+                    f"variable ({relationship_variable})"
+                )
+        edges.append(
+            PatternEdge(
+                source=_variable_name(relationship.source),
+                target=_variable_name(relationship.target),
+                relationship=relationship_type,
+                variable=relationship_variable,
+                min_hops=min_hops,
+                max_hops=max_hops,
+            )
+        )
+    return nodes, edges, _variable_name(ast.relationship_list[0].left_node)
+
+
+class _CostModel:
+    """
+    Row estimates from ``CardinalityStatistics`` and, for indexed
+    attributes, the store's value indexes.
+    """
+
+    def __init__(self, statistics, store=None):
+        self.statistics = statistics
+        self.store = store
+
+    def _constraint_selectivity(self, node: PatternNode, constraint) -> float:
+        count = self.statistics.entity_count(node.entity_type)
+        if isinstance(constraint, EntityIdConstraint):
+            if constraint.relation == "EQUALS":
+                return 1.0 / count if count else 0.0
+            return DEFAULT_SELECTIVITY
+        index = (
+            self.store.attribute_index(constraint.attribute)
+            if self.store is not None and node.entity_type is not None
+            else None
+        )
+        if index is None:
+            return DEFAULT_SELECTIVITY
+        estimate = index.estimate(
+            node.entity_type, constraint.relation, constraint.value
+        )
+        return min(estimate / count, 1.0) if count else 0.0
+
+    def selectivity(self, node: PatternNode) -> float:
+        """
+        Fraction of ``node``'s entities that pass its constraints
+        (assumed independent).
+        """
+        out = 1.0
+        for constraint in node.constraints:
+            out *= self._constraint_selectivity(node, constraint)
+        return out
+
+    def scan(self, node: PatternNode) -> float:
+        """
+        Rows produced by binding ``node`` from scratch.
+        """
+        return self.statistics.entity_count(
+            node.entity_type
+        ) * self.selectivity(node)
+
+    def expand(
+        self,
+        rows: float,
+        edge: PatternEdge,
+        from_node: PatternNode,
+        to_node: PatternNode,
+        direction: str,
+        into: bool,
+    ) -> float:
+        """
+        Rows produced by expanding ``rows`` bindings along ``edge``.
+        """
+        if direction == "out":
+            source_node, target_node = from_node, to_node
+        else:
+            source_node, target_node = to_node, from_node
+        edges = self.statistics.edge_count(
+            edge.relationship,
+            source_node.entity_type,
+            target_node.entity_type,
+        )
+        from_count = self.statistics.entity_count(from_node.entity_type)
+        per_entity = edges / from_count if from_count else 0.0
+        if edge.variable_length:
+            per_entity = self._reachable(edge, per_entity)
+        if into:
+            to_count = self.statistics.entity_count(to_node.entity_type)
+            return rows * per_entity / to_count if to_count else 0.0
+        return rows * per_entity * self.selectivity(to_node)
+
+    def traversed(
+        self,
+        rows: float,
+        edge: PatternEdge,
+        from_node: PatternNode,
+        to_node: PatternNode,
+        direction: str,
+    ) -> float:
+        """
+        Edges read while expanding ``rows`` bindings along ``edge``.
+        """
+        if direction == "out":
+            source_node, target_node = from_node, to_node
+        else:
+            source_node, target_node = to_node, from_node
+        edges = self.statistics.edge_count(
+            edge.relationship,
+            source_node.entity_type,
+            target_node.entity_type,
+        )
+        from_count = self.statistics.entity_count(from_node.entity_type)
+        per_entity = edges / from_count if from_count else 0.0
+        if edge.variable_length:
+            # Every level up to ``max_hops`` is expanded, whatever
+            # ``min_hops`` is; visited entities are not re-read.
+            reached = self._reachable(edge._replace(min_hops=0), per_entity)
+            return rows * min(
+                reached * per_entity,
+                float(self.statistics.edge_count(edge.relationship)),
+            )
+        return rows * per_entity
+
+    def _reachable(self, edge: PatternEdge, degree: float) -> float:
+        """
+        Entities reached per start along a variable-length ``edge`` whose
+        hops each fan out ``degree`` ways, at most every entity.
+        """
+        max_hops = edge.max_hops
+        if max_hops is None:
+            max_hops = max(edge.min_hops, UNBOUNDED_HOPS_ESTIMATE)
+        reached = sum(
+            degree**hops for hops in range(edge.min_hops, max_hops + 1)
+        )
+        return min(reached, float(self.statistics.entity_count()))
+
+    def examined(self, node: PatternNode, operator: Operator) -> float:
+        """
+        Entities ``operator`` (from ``_scan``) reads to bind ``node``.
+        """
+        if isinstance(operator, NodeById):
+            return 1.0
+        if isinstance(operator, IndexSeek) and node.entity_type is not None:
+            return self._constraint_selectivity(
+                node, operator.seek
+            ) * self.statistics.entity_count(node.entity_type)
+        return float(self.statistics.entity_count(node.entity_type))
+
+
+def _scan(node: PatternNode, store=None) -> Operator:
+    """
+    The cheapest way to bind ``node`` from scratch: by id, through the
+    most selective value index, or by scanning.
+    """
+    constraints = list(node.constraints)
+    entity_id = node.entity_id()
+    if entity_id is not __MISSING__:
+        return NodeById(
+            node.variable,
+            entity_id,
+            entity_type=node.entity_type,
+            constraints=[
+                constraint
+                for constraint in constraints
+                if not isinstance(constraint, EntityIdConstraint)
+                or constraint.relation != "EQUALS"
+                or constraint.value != entity_id
+            ],
+        )
+    indexed = []
+    if store is not None:
+        for constraint in constraints:
+            if not isinstance(constraint, AttributeConstraint):
+                continue
+            index = store.attribute_index(constraint.attribute)
+            if index is None:
+                continue
+            if node.entity_type is None:
+                estimate = 0.0
+            else:
+                estimate = index.estimate(
+                    node.entity_type, constraint.relation, constraint.value
+                )
+            indexed.append((estimate, constraint))
+    if indexed:
+        # Equality first on ties; ``min`` keeps the earliest.
+        seek = min(indexed, key=lambda item: item[0])[1]
+        constraints.remove(seek)
+        return IndexSeek(
+            node.variable,
+            seek,
+            entity_type=node.entity_type,
+            constraints=constraints,
+        )
+    return NodeScan(
+        node.variable,
+        entity_type=node.entity_type,
+        constraints=constraints,
+    )
+
+
+def _expand(
+    nodes: Dict[str, PatternNode], edge: PatternEdge, bound: set
+) -> Tuple[Operator, str, str]:
+    if edge.source in bound:
+        from_variable, to_variable, direction = edge.source, edge.target, "out"
+    else:
+        from_variable, to_variable, direction = edge.target, edge.source, "in"
+    to_node = nodes[to_variable]
+    if edge.variable_length:
+        operator = VarLengthExpand(
+            from_variable,
+            to_variable,
+            relationship=edge.relationship,
+            direction=direction,
+            min_hops=edge.min_hops,
+            max_hops=edge.max_hops,
+            to_entity_type=to_node.entity_type,
+            to_constraints=to_node.constraints,
+            into=to_variable in bound,
+        )
+        return operator, from_variable, direction
+    operator = Expand(
+        from_variable,
+        to_variable,
+        relationship=edge.relationship,
+        direction=direction,
+        to_entity_type=to_node.entity_type,
+        to_constraints=to_node.constraints,
+        relationship_variable=edge.variable,
+        into=to_variable in bound,
+    )
+    return operator, from_variable, direction
+
+
+def order(
+    nodes: Dict[str, PatternNode],
+    edges: List[PatternEdge],
+    start: str,
+    cost_model: _CostModel = None,
+    store=None,
+) -> Tuple[List[Operator], float]:
+    """
+    Operators that bind ``start`` and then expand every edge, each from an
+    already-bound endpoint. With a cost model, the cheapest adjacent edge
+    is taken next; otherwise edges are taken in pattern order. Returns the
+    operators and the total estimated work (0 without a cost model).
+    """
+    operators: List[Operator] = [_scan(nodes[start], store)]
+    rows = cost_model.scan(nodes[start]) if cost_model else 0.0
+    operators[0].estimated_rows = rows if cost_model else None
+    total = (
+        cost_model.examined(nodes[start], operators[0]) if cost_model else 0.0
+    )
+    bound = {start}
+    remaining = list(edges)
+    while remaining:
+        candidates = [
+            (index, edge)
+            for index, edge in enumerate(remaining)
+            if edge.source in bound or edge.target in bound
+        ]
+        if not candidates:
+            # Disconnected component: scan it (cartesian product).
+            unbound = [
+                variable
+                for edge in remaining
+                for variable in (edge.source, edge.target)
+                if variable not in bound
+            ]
+            if cost_model:
+                variable = min(
+                    unbound, key=lambda name: cost_model.scan(nodes[name])
+                )
+            else:
+                variable = unbound[0]
+            scan = _scan(nodes[variable], store)
+            if cost_model:
+                total += rows * cost_model.examined(nodes[variable], scan)
+                rows = rows * cost_model.scan(nodes[variable])
+                scan.estimated_rows = rows
+            operators.append(scan)
+            bound.add(variable)
+            continue
+        best = None
+        for index, edge in candidates:
+            operator, from_variable, direction = _expand(nodes, edge, bound)
+            if cost_model is None:
+                best = (0.0, index, operator)
+                break
+            estimate = cost_model.expand(
+                rows,
+                edge,
+                nodes[from_variable],
+                nodes[operator.to_variable],
+                direction,
+                operator.into,
+            )
+            if best is None or estimate < best[0]:
+                best = (estimate, index, operator)
+        estimate, index, operator = best
+        edge = remaining.pop(index)
+        bound.add(operator.to_variable)
+        if cost_model:
+            total += cost_model.traversed(
+                rows,
+                edge,
+                nodes[operator.from_variable],
+                nodes[operator.to_variable],
+                operator.direction,
+            )
+            rows = estimate
+            operator.estimated_rows = rows
+        operators.append(operator)
+    return operators, total
+
+
+def _take(bindings: Iterator[dict], count: int) -> Iterator[dict]:
+    # Unlike ``islice``, close the pipeline as soon as the limit is hit so
+    # upstream generators release their state straight away.
+    try:
+        if count <= 0:
+            return
+        for produced, binding in enumerate(bindings, 1):
+            yield binding
+            if produced >= count:
+                return
+    finally:
+        close = getattr(bindings, "close", None)
+        if close is not None:
+            close()
+
+
+class Plan:
+    """
+    A compiled pattern. The operator order is chosen per store from its
+    statistics and indexes, and cached for that store until its
+    statistics change generation or an index is created. Calling
+    ``plan(store)`` streams bindings lazily, stopping after ``limit`` rows
+    if one is set.
+    """
+
+    def __init__(
+        self,
+        nodes: Dict[str, PatternNode],
+        edges: List[PatternEdge],
+        start: str,
+        limit: Optional[int] = None,
+    ):
+        self.nodes = nodes
+        self.edges = edges
+        self.start = start
+        self.limit = limit
+        # Keyed on the store itself, so an order never outlives its store
+        # or is handed to another store that reuses its ``id``.
+        self._orders: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._default_order: Optional[List[Operator]] = None
+
+    def operators(self, store=None) -> List[Operator]:
+        """
+        The operator pipeline to run against ``store``.
+        """
+        if store is None:
+            if self._default_order is None:
+                self._default_order = self._choose(None)
+            return self._default_order
+        statistics = store.statistics()
+        version = (
+            getattr(statistics, "generation", None),
+            getattr(store, "index_version", 0),
+        )
+        try:
+            cached = self._orders.get(store)
+        except TypeError:
+            # Not weakly referenceable: plan every time.
+            return self._choose(statistics, store)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        operators = self._choose(statistics, store)
+        self._orders[store] = (version, operators)
+        return operators
+
+    def _choose(self, statistics, store=None) -> List[Operator]:
+        if statistics is None:
+            return order(self.nodes, self.edges, self.start, store=store)[0]
+        cost_model = _CostModel(statistics, store)
+        best = None
+        # Pattern order first, so ties keep the leftmost start.
+        for start in sorted(self.nodes, key=lambda name: name != self.start):
+            operators, total = order(
+                self.nodes,
+                self.edges,
+                start,
+                cost_model=cost_model,
+                store=store,
+            )
+            if best is None or total < best[0]:
+                best = (total, operators)
+        return best[1]
+
+    def __call__(
+        self,
+        store,
+        limit: Optional[int] = None,
+        cancelled: Callable[[], bool] = None,
+    ):
+        """
+        Streams bindings against ``store``. ``limit`` (or the query's
+        ``LIMIT``, whichever is smaller) stops the pipeline once that many
+        rows have been produced. If ``cancelled`` is given, store reads
+        raise ``QueryCancelled`` as soon as it returns true.
+        """
+        operators = self.operators(store)
+        if cancelled is not None:
+            store = CancellableStore(store, cancelled)
+        bindings = iter(({},))
+        for operator in operators:
+            bindings = operator(store, bindings)
+        limits = [count for count in (limit, self.limit) if count is not None]
+        if limits:
+            bindings = _take(bindings, min(limits))
+        return bindings
+
+    def profile(self, store, limit: Optional[int] = None) -> QueryProfile:
+        """
+        Runs the plan against ``store`` to completion (or ``limit``) and
+        records, per operator, the rows in and out, wall time, fact store
+        calls and value index hits and misses.
+        """
+        operators = list(self.operators(store))
+        limits = [count for count in (limit, self.limit) if count is not None]
+        if limits:
+            operators.append(_LimitOperator(min(limits)))
+        profiles = []
+        bindings = iter(({},))
+        for operator in operators:
+            profile = OperatorProfile(operator)
+            bindings = profile.timed(
+                operator(ProfilingStore(store, profile), bindings)
+            )
+            profiles.append(profile)
+        try:
+            rows = list(bindings)
+        finally:
+            bindings.close()
+        upstream_rows, upstream_time = 1, 0.0
+        for profile in profiles:
+            profile.rows_in = upstream_rows
+            profile.self_time = max(profile.time - upstream_time, 0.0)
+            upstream_rows, upstream_time = profile.rows_out, profile.time
+        return QueryProfile(profiles, rows)
+
+    def explain(self, store=None) -> str:
+        """
+        The operators, one per line, in execution order, with estimated
+        row counts when the store has statistics.
+        """
+        lines = []
+        for index, operator in enumerate(self.operators(store)):
+            line = f"{index}: {operator.describe()}"
+            if operator.estimated_rows is not None:
+                line += f"  (estimated rows: {operator.estimated_rows:.1f})"
+            lines.append(line)
+        if self.limit is not None:
+            lines.append(f"{len(lines)}: Limit({self.limit})")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"Plan(\n{self.explain()}\n)"
+
+
+class QueryProfile:
+    """
+    The result of ``Plan.profile``: the rows produced and one
+    ``OperatorProfile`` per operator in execution order (plus a ``Limit``
+    entry when one applied).
+    """
+
+    def __init__(self, operators: List[OperatorProfile], rows: List[dict]):
+        self.operators = operators
+        self.rows = rows
+        self.time = operators[-1].time if operators else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        The profile as plain data, e.g. for logging as JSON.
+        """
+        return {
+            "rows": len(self.rows),
+            "time": self.time,
+            "operators": [profile.as_dict() for profile in self.operators],
+        }
+
+    def render(self) -> str:
+        """
+        The operators as a tree, the last one at the root and each
+        operator's input beneath it, with its counters.
+        """
+        lines = []
+        for depth, profile in enumerate(reversed(self.operators)):
+            prefix = "   " * (depth - 1) + "└─ " if depth else ""
+            lines.append(f"{prefix}{profile.description}")
+            detail = "   " * (depth + 1)
+            rows = f"rows in {profile.rows_in}, out {profile.rows_out}"
+            if profile.estimated_rows is not None:
+                rows += f" (estimated {profile.estimated_rows:.1f})"
+            lines.append(f"{detail}{rows}")
+            lines.append(
+                f"{detail}time {profile.time * 1000:.3f}ms"
+                f" (self {profile.self_time * 1000:.3f}ms)"
+            )
+            calls = sum(profile.store_calls.values())
+            if calls:
+                by_method = ", ".join(
+                    f"{name} {count}"
+                    for name, count in sorted(profile.store_calls.items())
+                )
+                lines.append(f"{detail}store calls {calls} ({by_method})")
+            if profile.index_hits or profile.index_misses:
+                lines.append(
+                    f"{detail}index hits {profile.index_hits},"
+                    f" misses {profile.index_misses}"
+                )
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.render()
+
+
+class _LimitOperator(Operator):
+    def __init__(self, count: int):
+        self.count = count
+
+    def __call__(self, store, bindings):
+        return _take(bindings, self.count)
+
+    def describe(self):
+        return f"Limit({self.count})"
+
+
+def plan(ast) -> Plan:
+    """
+    Compiles a parsed ``Match``, ``MatchWhere``, ``Limit``,
+    ``RelationshipList`` or ``Node`` (or an ``Expression`` wrapping one)
+    into a ``Plan``.
+    """
+    limited = ast.ast if isinstance(ast, Expression) else ast
+    limit = limited.count if isinstance(limited, Limit) else None
+    return Plan(*pattern(ast), limit=limit)
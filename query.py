@@ -0,0 +1,197 @@
+"""
+Executes ``MATCH`` patterns parsed by ``decision.py`` against a ``FactStore``.
+
+``compile_query`` parses and plans query text (see ``planner``), and
+``execute`` streams bindings from the resulting plan (see ``operators``).
+Prefixing a query with ``EXPLAIN`` returns the chosen plan instead of
+running it; prefixing it with ``PROFILE`` runs it and returns what each
+operator did (see ``profile``).
+
+Results are generated lazily from the store scans up: nothing is
+materialized, the first row is returned as soon as it is found, and
+``LIMIT`` (or ``execute(..., limit=n)``) stops the pipeline after ``n``
+rows. ``ResultStream.cancel`` stops a running query at its next store
+read, from any thread.
+"""
+from __future__ import annotations
+
+import functools
+import re
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from configs import QUERY_CACHE_SIZE
+import decision
+from operators import EntityRef, QueryCancelled, QueryError
+from planner import Plan, QueryProfile, plan
+
+EXPLAIN_PREFIX = "EXPLAIN"
+PROFILE_PREFIX = "PROFILE"
+
+
+def parse(text: str):
+    """
+    Parses query text with the ``decision.py`` grammar.
+    """
+    try:
+        result = decision.parse(text)
+    except decision.QuerySyntaxError as error:
+        raise QueryError(str(error)) from None
+    if result is None:
+        raise QueryError(f"Could not parse query: {text}")
+    return result
+
+
+# String literals, as the lexer reads them; captured, so that ``split``
+# keeps them at the odd positions.
+_STRING_LITERAL = re.compile(f"({decision.t_STRING.__doc__})")
+
+
+def normalize(text: str) -> str:
+    """
+    ``text`` with every run of whitespace outside string literals made one
+    space, and none at the ends. Literals are kept as they are.
+    """
+    parts = _STRING_LITERAL.split(text)
+    parts[::2] = (" ".join(part.split()) for part in parts[::2])
+    return " ".join(part for part in parts if part)
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _compile_normalized(text: str) -> Plan:
+    return plan(parse(text))
+
+
+def compile_query(text: str) -> Plan:
+    """
+    Parses and plans ``text``. Plans hold no per-execution state, so they
+    are cached (LRU, keyed on the ``normalize``d text) and repeated
+    queries skip lexing, parsing and planning.
+    """
+    return _compile_normalized(normalize(text))
+
+
+compile_query.cache_info = _compile_normalized.cache_info
+compile_query.cache_clear = _compile_normalized.cache_clear
+
+
+def _strip_prefix(text: str, prefix: str):
+    stripped = text.lstrip()
+    if stripped[: len(prefix)].upper() == prefix and (
+        len(stripped) == len(prefix) or stripped[len(prefix)].isspace()
+    ):
+        return True, stripped[len(prefix) :]
+    return False, text
+
+
+def _as_plan(query) -> Plan:
+    if isinstance(query, str):
+        return compile_query(query)
+    if isinstance(query, Plan):
+        return query
+    return plan(query)
+
+
+def explain(store, query) -> str:
+    """
+    The plan ``query`` would run against ``store``, with estimated rows.
+    """
+    if isinstance(query, str):
+        query = _strip_prefix(query, EXPLAIN_PREFIX)[1]
+    return _as_plan(query).explain(store)
+
+
+def profile(store, query, limit: Optional[int] = None) -> QueryProfile:
+    """
+    Runs ``query`` against ``store`` and returns a ``QueryProfile`` with
+    the rows and, per plan operator, the rows in and out, wall time, fact
+    store calls and index hits and misses. ``QueryProfile.render`` draws
+    it as a tree; ``QueryProfile.as_dict`` returns plain data.
+    """
+    if isinstance(query, str):
+        query = _strip_prefix(query, PROFILE_PREFIX)[1]
+    return _as_plan(query).profile(store, limit=limit)
+
+
+class ResultStream:
+    """
+    Iterator over the rows of one execution. Iterating pulls rows through
+    the plan one at a time. ``cancel`` (safe to call from another thread)
+    makes the pipeline raise ``QueryCancelled`` at its next store read;
+    ``close`` (or leaving a ``with`` block) abandons the rest of the
+    results.
+    """
+
+    def __init__(self, start: Callable[[Callable[[], bool]], Iterator]):
+        self.cancelled = False
+        self._rows = start(self._is_cancelled)
+
+    def _is_cancelled(self) -> bool:
+        return self.cancelled
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self.cancelled:
+            raise QueryCancelled("Query cancelled")
+        return next(self._rows)
+
+    def cancel(self):
+        """
+        Stops the query.
+        """
+        self.cancelled = True
+        try:
+            self.close()
+        except ValueError:
+            # Running in another thread; it stops at its next store read.
+            pass
+
+    def close(self):
+        """
+        Releases the pipeline without reading the remaining rows.
+        """
+        close = getattr(self._rows, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def execute(
+    store, query, limit: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the bindings of ``query`` (text, parsed AST or ``Plan``)
+    against ``store`` as a ``ResultStream``, at most ``limit`` of them.
+    ``EXPLAIN <query>`` yields a single row whose ``plan`` key holds the
+    ``explain`` output; ``PROFILE <query>`` runs the query and yields a
+    single row with the ``QueryProfile`` under ``profile`` and its
+    rendered tree under ``plan``.
+    """
+    if isinstance(query, str):
+        is_explain, query = _strip_prefix(query, EXPLAIN_PREFIX)
+        if is_explain:
+            plan_text = explain(store, query)
+            return ResultStream(lambda _: iter(({"plan": plan_text},)))
+        is_profile, query = _strip_prefix(query, PROFILE_PREFIX)
+        if is_profile:
+            result = profile(store, query, limit=limit)
+            row = {"profile": result, "plan": result.render()}
+            return ResultStream(lambda _: iter((row,)))
+    compiled = _as_plan(query)
+    run_plan = getattr(store, "run_plan", None)
+    if run_plan is not None:
+        # Stores that execute plans themselves, e.g. ``ShardedFactStore``.
+        return ResultStream(
+            lambda cancelled: run_plan(
+                compiled, limit=limit, cancelled=cancelled
+            )
+        )
+    return ResultStream(
+        lambda cancelled: compiled(store, limit=limit, cancelled=cancelled)
+    )
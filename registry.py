@@ -0,0 +1,243 @@
+"""
+Explicit registry of entity types, attribute classes, relationships,
+message types and attribute functions.
+
+The base classes register their subclasses as they are defined, and the
+``@attribute`` / ``@inductive_attribute`` decorators register functions, so
+nothing needs to scan a module namespace to find them.
+"""
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+from configs import CONFIG_CACHE_PATH
+
+
+class Registry:
+    """
+    Name -> object lookups, plus the derived tables ``Session`` and
+    ``FactStore`` need. Derived tables are cached and rebuilt only when
+    something new is registered.
+    """
+
+    def __init__(self):
+        self.entity_types: Dict[str, type] = {}
+        self.attributes: Dict[str, type] = {}
+        self.relationships: Dict[str, type] = {}
+        self.message_types: Dict[str, type] = {}
+        self.attribute_functions: Dict[str, Callable] = {}
+        # Functions tagged by ``@aggregate_attribute``; not callbacks.
+        self.aggregate_functions: Dict[str, Callable] = {}
+        # Message type name -> attribute functions fed by that message type.
+        self.message_type_functions: Dict[str, List[Callable]] = (
+            collections.defaultdict(list)
+        )
+        # Attribute function -> message type name -> id keypath and entity.
+        self.function_message_configs: Dict[Callable, Dict[str, dict]] = (
+            collections.defaultdict(dict)
+        )
+        self._callback_dict = None
+        self._derived_levels = None
+        self._parameters: Dict[Callable, Dict[str, Tuple[type, type]]] = {}
+
+    def register_entity_type(self, cls: type) -> type:
+        """
+        Registers an ``EntityType`` subclass.
+        """
+        self.entity_types[cls.__name__] = cls
+        return cls
+
+    def register_attribute(self, cls: type) -> type:
+        """
+        Registers an ``Attribute`` subclass.
+        """
+        self.attributes[cls.__name__] = cls
+        return cls
+
+    def register_relationship(self, cls: type) -> type:
+        """
+        Registers a ``Relationship`` subclass.
+        """
+        self.relationships[cls.__name__] = cls
+        return cls
+
+    def register_message_type(self, cls: type) -> type:
+        """
+        Registers a ``Message`` subclass. A later class with the same name
+        replaces the earlier one.
+        """
+        self.message_types[cls.__name__] = cls
+        return cls
+
+    def register_attribute_function(self, func: Callable) -> Callable:
+        """
+        Registers a function tagged by ``@attribute`` or
+        ``@inductive_attribute``.
+        """
+        self.attribute_functions[func._function_name] = func
+        self._callback_dict = None
+        self._derived_levels = None
+        return func
+
+    def register_aggregate_function(self, func: Callable) -> Callable:
+        """
+        Registers a function tagged by ``@aggregate_attribute``.
+        """
+        self.aggregate_functions[func._function_name] = func
+        return func
+
+    def entity_attribute(self, name: str) -> Tuple[type, type]:
+        """
+        Resolves ``"Person__FirstName"`` to ``(Person, FirstName)``.
+        """
+        entity_type_name, attribute_cls_name = name.split("__")
+        return (
+            self.entity_types[entity_type_name],
+            self.attributes[attribute_cls_name],
+        )
+
+    def parameters(self, func: Callable) -> Dict[str, Tuple[type, type]]:
+        """
+        Parameter name -> ``(entity type, attribute class)`` for an attribute
+        function whose parameters name other attributes.
+        """
+        out = self._parameters.get(func)
+        if out is None:
+            out = {
+                parameter: self.entity_attribute(parameter)
+                for parameter in func._function_signature.parameters
+            }
+            self._parameters[func] = out
+        return out
+
+    def callback_dict(self) -> Dict[Tuple[type, type], List[Callable]]:
+        """
+        ``(entity type, attribute class)`` -> attribute functions that take
+        that attribute as a parameter and must be re-run when it changes.
+        """
+        if self._callback_dict is None:
+            callback_dict = collections.defaultdict(list)
+            for func in self.attribute_functions.values():
+                for parameter_name in func._function_signature.parameters:
+                    if parameter_name in self.attribute_functions:
+                        callback_dict[
+                            self.entity_attribute(parameter_name)
+                        ].append(func)
+            self._callback_dict = callback_dict
+        return self._callback_dict
+
+    def derived_levels(self) -> List[List[Callable]]:
+        """
+        Derived attribute functions (those run as callbacks) grouped by
+        dependency level: the first level only reads attributes that are
+        not derived, and each later level reads attributes derived by the
+        levels before it.
+        """
+        if self._derived_levels is None:
+            derived = {
+                func._function_name: func
+                for funcs in self.callback_dict().values()
+                for func in funcs
+            }
+            levels: Dict[str, int] = {}
+
+            def level(name, visiting=()):
+                if name not in levels:
+                    if name in visiting:
+                        raise ValueError(
+                            f"Derived attributes depend on each other: "
+                            f"{' -> '.join(visiting + (name,))}"
+                        )
+                    levels[name] = 1 + max(
+                        (
+                            level(parameter, visiting + (name,))
+                            for parameter in derived[
+                                name
+                            ]._function_signature.parameters
+                            if parameter in derived
+                        ),
+                        default=-1,
+                    )
+                return levels[name]
+
+            grouped: List[List[Callable]] = []
+            for name, func in derived.items():
+                depth = level(name)
+                while len(grouped) <= depth:
+                    grouped.append([])
+                grouped[depth].append(func)
+            self._derived_levels = grouped
+        return self._derived_levels
+
+
+REGISTRY = Registry()
+
+
+class _ConfigCache:
+    """
+    Parsed YAML configs (attribute function docstrings and message type
+    files) keyed by a digest of their text, persisted as JSON so that later
+    processes skip YAML parsing entirely. Values that JSON would change,
+    such as dates or non-string keys, are parsed every time instead.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._entries: Dict[str, Any] = None
+        self._dirty = False
+
+    def _load(self):
+        self._entries = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def __call__(self, config_text: str) -> Any:
+        if self._entries is None:
+            self._load()
+        key = hashlib.sha1(config_text.encode("utf8")).hexdigest()
+        try:
+            return self._entries[key]
+        except KeyError:
+            pass
+        # Imported here so that a warm cache never pays for importing yaml.
+        import yaml  # pylint: disable=import-outside-toplevel
+
+        value = yaml.load(
+            config_text, getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        )
+        try:
+            cacheable = json.loads(json.dumps(value)) == value
+        except (TypeError, ValueError):
+            cacheable = False
+        if cacheable:
+            self._entries[key] = value
+            self._dirty = True
+        return value
+
+    def save(self):
+        """
+        Writes new entries back to disk. Failures are ignored; the cache is
+        only an optimization.
+        """
+        if not (self._dirty and self.path):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError:
+            pass
+
+
+CONFIG_CACHE = _ConfigCache(CONFIG_CACHE_PATH)
@@ -0,0 +1,879 @@
+"""
+Read-only replicas of a fact store in memory-mapped files.
+
+``publish`` (or ``Session.publish``) writes the facts visible in a store
+into a new file per generation and then points ``<name>.current`` at it
+with an atomic rename. A store that supports snapshots is read through
+one, so ingest can continue while the replica is written.
+``ReplicaFactStore`` maps the current generation read-only. Attaching
+copies nothing, and reads decode only the records they touch, so any
+number of worker processes share one copy in the page cache. Value index
+lookups are binary searches over sorted arrays in the file. Put the
+directory on a tmpfs such as ``/dev/shm`` to keep the replica in memory.
+
+A mapping is never modified after it is published. ``refresh`` moves a
+reader to the newest generation, so a reader sees exactly one consistent
+generation between refreshes. Superseded files are unlinked by the
+publisher; readers still mapping them keep working until they refresh.
+
+File layout: an 8-byte magic number and the length of a JSON header, the
+header itself (type names, section offsets, statistics), then the
+sections. Entity ids and attribute values are kept in a blob as tagged
+encodings. Entities are found through an open-addressing hash table of
+entity codes. Each entity's attributes and edges are contiguous runs
+located through offset arrays (compressed sparse rows).
+"""
+from __future__ import annotations
+
+import bisect
+import datetime
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from cardinality import CardinalityStatistics
+from fact import AttributeFact, RelationshipFact
+from fact_store import FactStore
+from indexes import EQUALS, _family
+from registry import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+__MISSING__ = "__MISSING__"
+
+MAGIC = b"FACTREP1"
+_PREAMBLE = struct.Struct("=8sQ")
+# entity type, id offset, id length
+_ENTITY = struct.Struct("=HII")
+# attribute, value offset, value length, fact uuid, created_at timestamp
+_ATTRIBUTE = struct.Struct("=HII16sd")
+# relationship, other endpoint's entity code, created_at timestamp
+_EDGE = struct.Struct("=HId")
+# entity code, value offset, value length
+_INDEX_ENTRY = struct.Struct("=III")
+
+_U32 = "I" if array("I").itemsize == 4 else "L"
+
+# Value encoding tags.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _PICKLE = range(8)
+_INT64 = struct.Struct("=q")
+_FLOAT64 = struct.Struct("=d")
+
+
+def _encode(value: Any) -> bytes:
+    if value is None:
+        return bytes((_NONE,))
+    if value is True or value is False:
+        return bytes((_TRUE if value else _FALSE,))
+    if type(value) is int and -(2**63) <= value < 2**63:
+        return bytes((_INT,)) + _INT64.pack(value)
+    if type(value) is float:
+        return bytes((_FLOAT,)) + _FLOAT64.pack(value)
+    if type(value) is str:
+        return bytes((_STR,)) + value.encode("utf-8")
+    if type(value) is bytes:
+        return bytes((_BYTES,)) + value
+    return bytes((_PICKLE,)) + pickle.dumps(value)
+
+
+def _decode(buffer, offset: int, length: int) -> Any:
+    tag = buffer[offset]
+    if tag == _STR:
+        return str(buffer[offset + 1 : offset + length], "utf-8")
+    if tag == _INT:
+        return _INT64.unpack_from(buffer, offset + 1)[0]
+    if tag == _FLOAT:
+        return _FLOAT64.unpack_from(buffer, offset + 1)[0]
+    if tag == _NONE:
+        return None
+    if tag == _TRUE:
+        return True
+    if tag == _FALSE:
+        return False
+    if tag == _BYTES:
+        return bytes(buffer[offset + 1 : offset + length])
+    return pickle.loads(buffer[offset + 1 : offset + length])
+
+
+def _slot_hash(type_index: int, key: bytes) -> int:
+    return zlib.crc32(key, type_index)
+
+
+def _timestamp(fact) -> float:
+    created_at = getattr(fact, "created_at", None)
+    return created_at.timestamp() if created_at is not None else 0.0
+
+
+def _pointer_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.current")
+
+
+def _generation_path(directory: str, name: str, generation: int) -> str:
+    return os.path.join(directory, f"{name}.{generation}.replica")
+
+
+def current_generation(directory: str, name: str = "facts") -> int:
+    """
+    Generation ``<name>.current`` points at, or 0 if nothing is published.
+    """
+    try:
+        with open(_pointer_path(directory, name), encoding="utf-8") as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+class _Builder:
+    """
+    Collects the contents of one generation.
+    """
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.entity_types: Dict[type, int] = {}
+        self.attributes: Dict[type, int] = {}
+        self.relationships: Dict[type, int] = {}
+
+    @staticmethod
+    def _intern(names: Dict[type, int], cls: type) -> int:
+        index = names.get(cls)
+        if index is None:
+            index = names[cls] = len(names)
+        return index
+
+    def add(self, value: Any) -> Tuple[int, int]:
+        encoded = _encode(value)
+        offset = len(self.blob)
+        self.blob += encoded
+        return offset, len(encoded)
+
+    def build(self, store, indexed: Iterable[type], generation: int) -> bytes:
+        indexed = list(indexed)
+        keys: List[Tuple[Any, Any]] = []
+        codes: Dict[Tuple[Any, Any], int] = {}
+        entities = bytearray()
+        type_codes: Dict[int, array] = {}
+        for entity_type in REGISTRY.entity_types.values():
+            type_index = None
+            for entity_id in store.entity_ids(entity_type):
+                if type_index is None:
+                    type_index = self._intern(self.entity_types, entity_type)
+                    type_codes[type_index] = array(_U32)
+                codes[(entity_type, entity_id)] = len(keys)
+                type_codes[type_index].append(len(keys))
+                keys.append((entity_type, entity_id))
+                entities += _ENTITY.pack(type_index, *self.add(entity_id))
+
+        attribute_start = array(_U32, [0])
+        attribute_records = bytearray()
+        # attribute -> entity type -> family -> [(sort key, entry)]
+        index_entries: Dict[type, Dict[type, Dict[str, list]]] = {
+            attribute: {} for attribute in indexed
+        }
+        out_edges: List[List[bytes]] = [[] for _ in keys]
+        in_edges: List[List[bytes]] = [[] for _ in keys]
+        for code, (entity_type, entity_id) in enumerate(keys):
+            for attribute, fact in store.get_entity(
+                entity_type, entity_id
+            ).items():
+                offset, length = self.add(fact.value)
+                fact_uuid = getattr(fact, "uuid", None)
+                attribute_records += _ATTRIBUTE.pack(
+                    self._intern(self.attributes, attribute),
+                    offset,
+                    length,
+                    fact_uuid.bytes if fact_uuid is not None else bytes(16),
+                    _timestamp(fact),
+                )
+                by_type = index_entries.get(attribute)
+                if by_type is not None:
+                    family = _family(fact.value) or "other"
+                    try:
+                        hash(fact.value)
+                    except TypeError:  # unhashable values are not indexed
+                        continue
+                    sort_key = (
+                        _encode(fact.value)
+                        if family == "other"
+                        else fact.value
+                    )
+                    by_type.setdefault(entity_type, {}).setdefault(
+                        family, []
+                    ).append(
+                        (sort_key, _INDEX_ENTRY.pack(code, offset, length))
+                    )
+            attribute_start.append(len(attribute_records) // _ATTRIBUTE.size)
+            for fact in store.edges(
+                entity_type=entity_type, entity_id=entity_id, direction="out"
+            ):
+                target = codes.get(
+                    (fact.target_entity_type, fact.target_entity_id)
+                )
+                if target is None:
+                    continue
+                relationship = self._intern(
+                    self.relationships, fact.relationship
+                )
+                created_at = _timestamp(fact)
+                out_edges[code].append(
+                    _EDGE.pack(relationship, target, created_at)
+                )
+                in_edges[target].append(
+                    _EDGE.pack(relationship, code, created_at)
+                )
+
+        table_size = 8
+        while table_size < 2 * len(keys):
+            table_size *= 2
+        slots = array(_U32, bytes(4 * table_size))
+        for code, (entity_type, entity_id) in enumerate(keys):
+            slot = _slot_hash(
+                self.entity_types[entity_type], _encode(entity_id)
+            ) & (table_size - 1)
+            while slots[slot]:
+                slot = (slot + 1) & (table_size - 1)
+            slots[slot] = code + 1
+
+        sections: Dict[str, bytes] = {
+            "blob": bytes(self.blob),
+            "entities": bytes(entities),
+            "slots": slots.tobytes(),
+            "attribute_start": attribute_start.tobytes(),
+            "attributes": bytes(attribute_records),
+        }
+        for direction, edges in (("out", out_edges), ("in", in_edges)):
+            start = array(_U32, [0])
+            records = bytearray()
+            for entity_edges in edges:
+                for record in entity_edges:
+                    records += record
+                start.append(len(records) // _EDGE.size)
+            sections[f"{direction}_start"] = start.tobytes()
+            sections[direction] = bytes(records)
+
+        type_ranges = {}
+        all_type_codes = array(_U32)
+        for type_index, type_code_list in type_codes.items():
+            type_ranges[type_index] = [
+                len(all_type_codes),
+                len(type_code_list),
+            ]
+            all_type_codes.extend(type_code_list)
+        sections["type_codes"] = all_type_codes.tobytes()
+
+        index_ranges: Dict[str, Dict[str, Dict[str, list]]] = {}
+        index_records = bytearray()
+        for attribute, by_type in index_entries.items():
+            ranges = index_ranges[attribute.__name__] = {}
+            for entity_type, families in by_type.items():
+                type_ranges_for = ranges[entity_type.__name__] = {}
+                for family, entries in families.items():
+                    entries.sort(key=lambda entry: entry[0])
+                    type_ranges_for[family] = [
+                        len(index_records) // _INDEX_ENTRY.size,
+                        len(entries),
+                    ]
+                    for _, record in entries:
+                        index_records += record
+        sections["index"] = bytes(index_records)
+
+        statistics = store.statistics()
+        header: Dict[str, Any] = {
+            "generation": generation,
+            "entity_count": len(keys),
+            "entity_types": [cls.__name__ for cls in self.entity_types],
+            "attributes": [cls.__name__ for cls in self.attributes],
+            "relationships": [cls.__name__ for cls in self.relationships],
+            "type_ranges": type_ranges,
+            "indexes": index_ranges,
+            "statistics": _statistics_header(statistics),
+            "sections": {},
+        }
+        # Section offsets are relative to the end of the header; each
+        # section starts 8-byte aligned so it can be cast in place.
+        body = bytearray()
+        for section, data in sections.items():
+            body += bytes(-len(body) % 8)
+            header["sections"][section] = [len(body), len(data)]
+            body += data
+        encoded_header = json.dumps(header).encode("utf-8")
+        encoded_header += b" " * (-len(encoded_header) % 8)
+        return (
+            _PREAMBLE.pack(MAGIC, len(encoded_header))
+            + encoded_header
+            + bytes(body)
+        )
+
+
+def _statistics_header(statistics) -> Optional[dict]:
+    if statistics is None:
+        return None
+    return {
+        "entity_counts": {
+            entity_type.__name__: count
+            for entity_type, count in statistics.entity_counts.items()
+        },
+        "edges": [
+            [cls.__name__ for cls in key]
+            + [
+                count,
+                statistics.source_counts.get(key, 0),
+                statistics.target_counts.get(key, 0),
+            ]
+            for key, count in statistics.edge_counts.items()
+        ],
+    }
+
+
+def publish(store, directory: str, name: str = "facts", keep: int = 2) -> int:
+    """
+    Writes the facts in ``store`` as the next generation of replica
+    ``name`` in ``directory`` and makes it current. Generations older
+    than the last ``keep`` are removed. Returns the new generation.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = current_generation(directory, name) + 1
+    indexed = [
+        attribute
+        for attribute in REGISTRY.attributes.values()
+        if store.attribute_index(attribute) is not None
+    ]
+    try:
+        view = store.snapshot()
+    except NotImplementedError:
+        view = store
+    try:
+        data = _Builder().build(view, indexed, generation)
+    finally:
+        if view is not store:
+            view.release()
+    path = _generation_path(directory, name, generation)
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+    pointer = _pointer_path(directory, name)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as file:
+        file.write(str(generation))
+    os.replace(pointer + ".tmp", pointer)
+    for old in range(generation - keep, 0, -1):
+        try:
+            os.unlink(_generation_path(directory, name, old))
+        except FileNotFoundError:
+            break
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info(
+            "Published replica %s generation %d (%d bytes)",
+            name,
+            generation,
+            len(data),
+        )
+    return generation
+
+
+class ReplicaAttributeFact(AttributeFact):
+    """
+    An ``AttributeFact`` read back from a replica. ``uuid`` and
+    ``created_at`` are decoded when first read, which keeps lookups cheap.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(
+        self, entity_type, entity_id, attribute, value, raw_uuid, timestamp
+    ):
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+        self.attribute = attribute
+        self.value = value
+        self._raw_uuid = raw_uuid
+        self._timestamp = timestamp
+
+    @property
+    def uuid(self) -> UUID:
+        return UUID(bytes=self._raw_uuid)
+
+    @property
+    def created_at(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self._timestamp)
+
+
+class _SortedValues:
+    """
+    One family of a replica index as a sequence of decoded values, for
+    ``bisect``.
+    """
+
+    def __init__(
+        self, replica: "ReplicaFactStore", start: int, count: int, other: bool
+    ):
+        self.replica = replica
+        self.start = start
+        self.count = count
+        # "other" values are compared by their encoding.
+        self.other = other
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position: int):
+        _, offset, length = self.replica._index_entry(self.start + position)
+        if self.other:
+            return bytes(self.replica._blob[offset : offset + length])
+        return _decode(self.replica._blob, offset, length)
+
+
+class ReplicaIndex:
+    """
+    Value index on one attribute class, answered from a replica's sorted
+    index arrays. Same interface as ``AttributeValueIndex``.
+    """
+
+    def __init__(self, replica: "ReplicaFactStore", attribute: type, ranges):
+        self.replica = replica
+        self.attribute = attribute
+        self._ranges: Dict[type, Dict[str, list]] = ranges
+
+    def _bounds(self, entity_type, relation, value):
+        family = _family(value)
+        if family is None:
+            if relation != EQUALS:
+                return None
+            try:
+                hash(value)
+            except TypeError:
+                return None
+            family = "other"
+        span = self._ranges.get(entity_type, {}).get(family)
+        if span is None:
+            return None
+        values = _SortedValues(self.replica, *span, family == "other")
+        if family == "other":
+            value = _encode(value)
+        if relation == EQUALS:
+            bounds = (
+                bisect.bisect_left(values, value),
+                bisect.bisect_right(values, value),
+            )
+        elif relation == "LT":
+            bounds = (0, bisect.bisect_left(values, value))
+        elif relation == "LTE":
+            bounds = (0, bisect.bisect_right(values, value))
+        elif relation == "GT":
+            bounds = (bisect.bisect_right(values, value), len(values))
+        elif relation == "GTE":
+            bounds = (bisect.bisect_left(values, value), len(values))
+        else:
+            raise ValueError(f"Unknown relation: {relation}")
+        return span[0] + bounds[0], span[0] + bounds[1]
+
+    def lookup(
+        self, entity_type: Any, relation: str, value: Any
+    ) -> Iterator[Any]:
+        """
+        Ids of ``entity_type`` entities whose value satisfies
+        ``value <relation> constant``.
+        """
+        bounds = self._bounds(entity_type, relation, value)
+        if bounds is None:
+            return iter(())
+        replica = self.replica
+        return (
+            replica._entity(replica._index_entry(position)[0])[1]
+            for position in range(*bounds)
+        )
+
+    def contains(
+        self, entity_type: Any, entity_id: Any, relation: str, value: Any
+    ) -> Optional[bool]:
+        """
+        Whether ``entity_id`` passes an ``EQUALS`` constraint; ``None`` for
+        other relations.
+        """
+        if relation != EQUALS:
+            return None
+        found = self.replica._get_attribute(
+            entity_type=entity_type,
+            attribute=self.attribute,
+            entity_id=entity_id,
+        )
+        return found is not __MISSING__ and found.value == value
+
+    def estimate(self, entity_type: Any, relation: str, value: Any) -> float:
+        """
+        Number of entities a lookup returns (exact).
+        """
+        bounds = self._bounds(entity_type, relation, value)
+        return 0.0 if bounds is None else float(bounds[1] - bounds[0])
+
+    def size(self, entity_type: Any) -> int:
+        """
+        Number of indexed ``entity_type`` entities.
+        """
+        return sum(
+            count for _, count in self._ranges.get(entity_type, {}).values()
+        )
+
+    def __repr__(self):
+        return f"ReplicaIndex({self.attribute.__name__})"
+
+
+class ReplicaFactStore(FactStore):
+    """
+    Read-only fact store over the current generation of replica ``name``
+    in ``directory``, as written by ``publish``.
+    """
+
+    entity_cache_size = None
+
+    def __init__(self, directory: str, name: str = "facts"):
+        super().__init__()
+        self.directory = directory
+        self.name = name
+        self.generation = 0
+        self._map = None
+        self._views: List[memoryview] = []
+        self._attach(current_generation(directory, name))
+
+    def _attach(self, generation: int):
+        if generation == 0:
+            raise FileNotFoundError(
+                f"No replica {self.name!r} published in {self.directory}"
+            )
+        path = _generation_path(self.directory, self.name, generation)
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREAMBLE.unpack_from(mapping, 0)
+        if magic != MAGIC:
+            mapping.close()
+            raise ValueError(f"{path} is not a fact store replica")
+        body = _PREAMBLE.size + header_length
+        header = json.loads(bytes(mapping[_PREAMBLE.size : body]))
+        self._detach()
+        self._map = mapping
+        whole = memoryview(mapping)
+        self._views = [whole]
+
+        def section(name: str, cast: str = None) -> memoryview:
+            offset, length = header["sections"][name]
+            view = whole[body + offset : body + offset + length]
+            self._views.append(view)
+            if cast is not None:
+                view = view.cast(cast)
+                self._views.append(view)
+            return view
+
+        self._blob = section("blob")
+        self._entities = section("entities")
+        self._slots = section("slots", _U32)
+        self._attribute_start = section("attribute_start", _U32)
+        self._attributes = section("attributes")
+        self._edge_start = {
+            "out": section("out_start", _U32),
+            "in": section("in_start", _U32),
+        }
+        self._edges = {"out": section("out"), "in": section("in")}
+        self._type_codes = section("type_codes", _U32)
+        self._index = section("index")
+        self._entity_type_list = [
+            REGISTRY.entity_types[name] for name in header["entity_types"]
+        ]
+        self._entity_type_index = {
+            cls: index for index, cls in enumerate(self._entity_type_list)
+        }
+        self._attribute_list = [
+            REGISTRY.attributes[name] for name in header["attributes"]
+        ]
+        self._attribute_index = {
+            cls: index for index, cls in enumerate(self._attribute_list)
+        }
+        self._relationship_list = [
+            REGISTRY.relationships[name] for name in header["relationships"]
+        ]
+        self._relationship_index = {
+            cls: index for index, cls in enumerate(self._relationship_list)
+        }
+        self._type_ranges = {
+            self._entity_type_list[int(index)]: span
+            for index, span in header["type_ranges"].items()
+        }
+        self._indexes = {
+            REGISTRY.attributes[attribute]: ReplicaIndex(
+                self,
+                REGISTRY.attributes[attribute],
+                {
+                    REGISTRY.entity_types[type_name]: families
+                    for type_name, families in by_type.items()
+                },
+            )
+            for attribute, by_type in header["indexes"].items()
+        }
+        self._statistics = self._load_statistics(
+            header["statistics"], generation
+        )
+        self.generation = generation
+        # Plans cached for the previous generation are chosen again.
+        self.index_version += 1
+
+    @staticmethod
+    def _load_statistics(header, generation):
+        if header is None:
+            return None
+        statistics = CardinalityStatistics()
+        for type_name, count in header["entity_counts"].items():
+            statistics.entity_counts[REGISTRY.entity_types[type_name]] = count
+        for (
+            relationship,
+            source_type,
+            target_type,
+            edges,
+            sources,
+            targets,
+        ) in header["edges"]:
+            key = (
+                REGISTRY.relationships[relationship],
+                REGISTRY.entity_types[source_type],
+                REGISTRY.entity_types[target_type],
+            )
+            statistics.edge_counts[key] = edges
+            statistics.source_counts[key] = sources
+            statistics.target_counts[key] = targets
+        statistics.generation = generation
+        return statistics
+
+    def _detach(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def refresh(self) -> bool:
+        """
+        Switches to the newest published generation. Returns whether it
+        changed.
+        """
+        generation = current_generation(self.directory, self.name)
+        if generation == self.generation:
+            return False
+        self._attach(generation)
+        return True
+
+    def close(self):
+        """
+        Unmaps the replica.
+        """
+        self._detach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def put(self, _):
+        raise TypeError("Replicas are read-only; publish a new generation.")
+
+    # Decoding
+
+    def _entity(self, code: int) -> Tuple[type, Any]:
+        type_index, offset, length = _ENTITY.unpack_from(
+            self._entities, code * _ENTITY.size
+        )
+        return (
+            self._entity_type_list[type_index],
+            _decode(self._blob, offset, length),
+        )
+
+    def _code(self, entity_type, entity_id) -> Optional[int]:
+        type_index = self._entity_type_index.get(entity_type)
+        if type_index is None:
+            return None
+        key = _encode(entity_id)
+        slots = self._slots
+        mask = len(slots) - 1
+        slot = _slot_hash(type_index, key) & mask
+        blob = self._blob
+        while True:
+            code = slots[slot]
+            if not code:
+                return None
+            found_type, offset, length = _ENTITY.unpack_from(
+                self._entities, (code - 1) * _ENTITY.size
+            )
+            if (
+                found_type == type_index
+                and blob[offset : offset + length] == key
+            ):
+                return code - 1
+            slot = (slot + 1) & mask
+
+    def _index_entry(self, position: int) -> Tuple[int, int, int]:
+        return _INDEX_ENTRY.unpack_from(
+            self._index, position * _INDEX_ENTRY.size
+        )
+
+    def _row(self, code: int) -> Iterator[tuple]:
+        start = self._attribute_start
+        return _ATTRIBUTE.iter_unpack(
+            self._attributes[
+                start[code] * _ATTRIBUTE.size : start[code + 1]
+                * _ATTRIBUTE.size
+            ]
+        )
+
+    def _attribute_fact(self, entity_type, entity_id, record: tuple):
+        attribute_index, offset, length, raw_uuid, timestamp = record
+        return ReplicaAttributeFact(
+            entity_type,
+            entity_id,
+            self._attribute_list[attribute_index],
+            _decode(self._blob, offset, length),
+            raw_uuid,
+            timestamp,
+        )
+
+    # FactStore reads
+
+    def _get_attribute(self, entity_type=None, attribute=None, entity_id=None):
+        code = self._code(entity_type, entity_id)
+        attribute_index = self._attribute_index.get(attribute)
+        if code is None or attribute_index is None:
+            return __MISSING__
+        for record in self._row(code):
+            if record[0] == attribute_index:
+                return self._attribute_fact(entity_type, entity_id, record)
+        return __MISSING__
+
+    def _get_entity(self, entity_type, entity_id):
+        code = self._code(entity_type, entity_id)
+        if code is None:
+            return {}
+        out = {}
+        for record in self._row(code):
+            fact = self._attribute_fact(entity_type, entity_id, record)
+            out[fact.attribute] = fact
+        return out
+
+    def has_entity(self, entity_type, entity_id) -> bool:
+        return self._code(entity_type, entity_id) is not None
+
+    def entity_ids(self, entity_type=None) -> Iterator[Any]:
+        span = self._type_ranges.get(entity_type)
+        if span is None:
+            return
+        start, count = span
+        for position in range(start, start + count):
+            yield self._entity(self._type_codes[position])[1]
+
+    def _edge_records(self, code: int, direction: str):
+        records = self._edges[direction]
+        start = self._edge_start[direction]
+        for position in range(start[code], start[code + 1]):
+            yield _EDGE.unpack_from(records, position * _EDGE.size)
+
+    def edges(
+        self,
+        relationship=None,
+        entity_type=None,
+        entity_id=None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        code = self._code(entity_type, entity_id)
+        if code is None:
+            return
+        wanted = None
+        if relationship is not None:
+            wanted = self._relationship_index.get(relationship)
+            if wanted is None:
+                return
+        for relationship_index, other, created_at in self._edge_records(
+            code, direction
+        ):
+            if wanted is not None and relationship_index != wanted:
+                continue
+            other_type, other_id = self._entity(other)
+            fact = RelationshipFact.__new__(RelationshipFact)
+            fact.relationship = self._relationship_list[relationship_index]
+            if direction == "out":
+                fact.source_entity_type = entity_type
+                fact.source_entity_id = entity_id
+                fact.target_entity_type = other_type
+                fact.target_entity_id = other_id
+            else:
+                fact.source_entity_type = other_type
+                fact.source_entity_id = other_id
+                fact.target_entity_type = entity_type
+                fact.target_entity_id = entity_id
+            fact.created_at = datetime.datetime.fromtimestamp(created_at)
+            yield fact
+
+    def traverse(
+        self,
+        entity_type,
+        entity_id,
+        relationship=None,
+        direction: str = "out",
+        min_hops: int = 1,
+        max_hops: Optional[int] = None,
+    ) -> Iterator[Tuple[Any, Any, int]]:
+        # Breadth-first over entity codes straight from the edge arrays.
+        start = self._code(entity_type, entity_id)
+        if start is None:
+            return
+        wanted = None
+        if relationship is not None:
+            wanted = self._relationship_index.get(relationship)
+            if wanted is None:
+                return
+        if min_hops == 0:
+            yield entity_type, entity_id, 0
+        visited = {start}
+        frontier = [start]
+        hops = 0
+        while frontier and (max_hops is None or hops < max_hops):
+            hops += 1
+            next_frontier = []
+            for code in frontier:
+                for relationship_index, other, _ in self._edge_records(
+                    code, direction
+                ):
+                    if wanted is not None and relationship_index != wanted:
+                        continue
+                    if other not in visited:
+                        visited.add(other)
+                        next_frontier.append(other)
+            if hops >= min_hops:
+                for code in next_frontier:
+                    other_type, other_id = self._entity(code)
+                    yield other_type, other_id, hops
+            frontier = next_frontier
+
+    def attribute_index(self, attribute) -> Optional[ReplicaIndex]:
+        return self._indexes.get(attribute)
+
+    def statistics(self) -> CardinalityStatistics:
+        return self._statistics
+
+    def __iter__(self):
+        for entity_type, span in self._type_ranges.items():
+            start, count = span
+            for position in range(start, start + count):
+                _, entity_id = self._entity(self._type_codes[position])
+                yield from self._get_entity(entity_type, entity_id).values()
+        for entity_type, span in self._type_ranges.items():
+            start, count = span
+            for position in range(start, start + count):
+                _, entity_id = self._entity(self._type_codes[position])
+                yield from self.edges(
+                    entity_type=entity_type, entity_id=entity_id
+                )
+
@@ -2,8 +2,10 @@
 Classes for routing messages
 '''
 from dataclasses import dataclass
-from message import DictAttributeMapping
-from typing import Any, Type, List
+import time
+from message import DictAttributeMapping, compile_keypath
+from metrics import METRICS
+from typing import Any, Callable, Dict, Type, List, Tuple
 
 
 @dataclass
@@ -28,26 +30,75 @@ class Route:
 class MessageRoundabout:
     """
     Takes a message and assigns a type to it.
+
+    Routes are grouped by keypath and indexed by ``value_match``, so a
+    message is routed with one dictionary lookup per distinct keypath
+    rather than one comparison per route.
     """
 
     def __init__(self):
         self.routes: List = []
+        # keypath -> (compiled keypath, value_match -> message types)
+        self._index: Dict[tuple, Tuple[Callable, Dict[Any, list]]] = {}
+        # Routes whose value_match is unhashable; checked one by one.
+        self._unindexed: List[Route] = []
 
     def add_route(self, route: Route = None):
         """
         Appends a route.
         """
         self.routes.append(route)
+        keypath = tuple(route.keypath)
+        try:
+            hash(route.value_match)
+        except TypeError:
+            self._unindexed.append(route)
+            return
+        if keypath not in self._index:
+            self._index[keypath] = (compile_keypath(keypath), {})
+        self._index[keypath][1].setdefault(route.value_match, []).append(
+            route.message_type
+        )
 
-    def __call__(self, message):
+    def remove_routes(self, message_types):
         """
-        Returns the message type based on matching route.
+        Removes the routes to any of ``message_types`` and rebuilds the
+        index from the routes that are left.
         """
-        message_type_list = [
-            route(message)
+        message_types = set(message_types)
+        routes = [
+            route
             for route in self.routes
-            if route(message) is not None
+            if route.message_type not in message_types
         ]
+        self.routes = []
+        self._index = {}
+        self._unindexed = []
+        for route in routes:
+            self.add_route(route)
+
+    def __call__(self, message):
+        """
+        Returns the message type based on matching route.
+        """
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        message_type_list = []
+        for extractor, value_dict in self._index.values():
+            try:
+                message_type_list.extend(value_dict.get(extractor(message), ()))
+            except TypeError:  # unhashable value at the keypath
+                continue
+        for route in self._unindexed:
+            message_type = route(message)
+            if message_type is not None:
+                message_type_list.append(message_type)
+        if timing:
+            METRICS.observe("stage.route", time.perf_counter() - start)
+            METRICS.inc(
+                "route.matched" if message_type_list else "route.unmatched"
+            )
         assert (
             len(message_type_list) < 2
         ), "Message matched more than one route."
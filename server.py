@@ -0,0 +1,628 @@
+"""
+Long-lived ingestion server for a ``Session``, on a Unix-domain socket.
+
+Usage::
+
+    python server.py /tmp/facts.sock --batch-size 1000
+
+Every frame, both ways, is a 4-byte big-endian length followed by that many
+bytes of UTF-8 JSON. Requests carry an ``id`` that their response repeats,
+so a client can pipeline them on one connection:
+
+- ``{"id": 1, "op": "put", "message": {...}}`` queues a CDC message. Puts
+  from every connection are processed in batches, each committed to the
+  fact store as one version, and are answered ``{"id": 1, "ok": true}``
+  once their batch has committed.
+- ``{"id": 2, "op": "get_attribute", "entity_type": "Person",
+  "attribute": "FirstName", "entity_id": 7}`` is answered ``{"id": 2,
+  "ok": true, "value": "Bob"}``, with ``null`` if there is no value.
+- ``{"id": 3, "op": "get_entity", "entity_type": "Person", "entity_id":
+  7}`` is answered ``{"id": 3, "ok": true, "attributes": {"FirstName":
+  "Bob", ...}}``.
+
+A request that fails is answered ``{"id": ..., "ok": false, "error":
+"..."}``; a failed put does not hold back the rest of its batch.
+
+Messages are processed on one thread, so the event loop keeps reading
+frames while a batch commits and the next batch is whatever queued up
+meanwhile: batches grow with the load. Reads see the last commit, so a read
+sent after a put was acknowledged sees it. They are answered from a
+snapshot (see ``FactStore.snapshot``) without waiting for the batch in
+progress, or between batches for fact stores without snapshots.
+
+``Client`` speaks the protocol over one connection and ``ClientPool``
+spreads requests over a few; ``benchmarks/socket_load.py`` drives a server
+with them.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import signal
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from configs import SERVER_BATCH_SIZE, SERVER_MAX_FRAME, SERVER_QUEUE_SIZE
+from fact import AttributeFact
+from metrics import METRICS
+from registry import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("!I")
+
+
+class ServerError(Exception):
+    """
+    The server could not carry out a request.
+    """
+
+
+def encode_frame(payload: Any) -> bytes:
+    """
+    ``payload`` as one frame. Values JSON has no type for are sent as
+    strings.
+    """
+    data = json.dumps(payload, default=str).encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Any]:
+    """
+    The next frame's payload, or ``None`` if the peer closed the connection
+    between frames.
+    """
+    try:
+        header = await reader.readexactly(_LENGTH.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise
+        return None
+    (length,) = _LENGTH.unpack(header)
+    if length > SERVER_MAX_FRAME:
+        raise ServerError(f"Frame of {length} bytes is too large")
+    return json.loads(await reader.readexactly(length))
+
+
+def _lookup(table: Dict[str, type], kind: str, name: Any) -> type:
+    found = table.get(name)
+    if found is None:
+        raise ServerError(f"Unknown {kind}: {name!r}")
+    return found
+
+
+def _entity_type(request: dict) -> type:
+    return _lookup(
+        REGISTRY.entity_types, "entity type", request.get("entity_type")
+    )
+
+
+def _get_attribute(store, request: dict) -> dict:
+    fact = store.get_attribute(
+        _entity_type(request),
+        _lookup(REGISTRY.attributes, "attribute", request.get("attribute")),
+        request.get("entity_id"),
+    )
+    # Missing values come back as a sentinel.
+    return {"value": fact.value if isinstance(fact, AttributeFact) else None}
+
+
+def _get_entity(store, request: dict) -> dict:
+    row = store.get_entity(_entity_type(request), request.get("entity_id"))
+    return {
+        "attributes": {
+            attribute.__name__: fact.value for attribute, fact in row.items()
+        }
+    }
+
+
+_CLOSING = ServerError("Server is closing")
+
+# Request op -> function of the fact store (or snapshot) and the request.
+_READS = {"get_attribute": _get_attribute, "get_entity": _get_entity}
+
+
+class IngestServer:
+    """
+    Serves ``session`` on a Unix-domain socket at ``path``. At most
+    ``batch_size`` messages are committed together, and at most
+    ``queue_size`` wait for a batch; past that, connections are not read
+    until there is room.
+    """
+
+    def __init__(
+        self,
+        session,
+        path: str,
+        batch_size: int = SERVER_BATCH_SIZE,
+        queue_size: int = SERVER_QUEUE_SIZE,
+    ):
+        self.session = session
+        self.path = path
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._writers: set = set()
+        self._closing = False
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        # Messages are processed, and reads without snapshots answered, on
+        # this one thread.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="ingest"
+        )
+        # The snapshot reads are answered from, replaced after each batch;
+        # ``None`` if the fact store has none.
+        self._snapshot = None
+        self.metrics_label = METRICS.register_gauges(
+            self,
+            {
+                "server.connections": self.connection_count,
+                "server.queued": self.queued,
+            },
+        )
+
+    def connection_count(self) -> int:
+        """
+        Number of open client connections.
+        """
+        return len(self._writers)
+
+    def queued(self) -> int:
+        """
+        Number of messages waiting for a batch.
+        """
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def start(self):
+        """
+        Starts listening. A stale socket file at ``path`` is replaced.
+        """
+        try:
+            self._snapshot = self.session.fact_store.snapshot()
+        except NotImplementedError:
+            self._snapshot = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._queue = asyncio.Queue(self.queue_size)
+        self._batcher = asyncio.ensure_future(self._batches())
+        self._server = await asyncio.start_unix_server(
+            self._serve, path=self.path
+        )
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info("Listening on %s", self.path)
+
+    async def serve_forever(self):
+        """
+        Starts listening if need be, and serves until cancelled.
+        """
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, acknowledges the messages already queued once they
+        are committed, closes the connections, flushes the fact store and
+        drops the server's gauges. Puts that arrive meanwhile are refused.
+        """
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        if self._batcher is not None:
+            await self._queue.join()
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+            # Puts that were waiting for room in the queue.
+            while not self._queue.empty():
+                _, request_id, writer = self._queue.get_nowait()
+                _respond(writer, request_id, error=_CLOSING)
+        for writer in list(self._writers):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+        if self._snapshot is not None:
+            self._snapshot.release()
+            self._snapshot = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, self.session.fact_store.flush
+        )
+        self._executor.shutdown()
+        METRICS.unregister_gauges(self.metrics_label)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def _serve(self, reader, writer):
+        if self._closing:
+            writer.close()
+            return
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except (ServerError, ValueError) as error:
+                    # The stream can not be resynchronised after a bad frame.
+                    LOGGER.warning("Closing connection: %s", error)
+                    _respond(writer, None, error=error)
+                    break
+                if request is None:
+                    break
+                await self._handle(request, writer)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle(self, request: Any, writer):
+        if not isinstance(request, dict):
+            _respond(writer, None, error=ServerError("Expected an object"))
+            return
+        request_id = request.get("id")
+        op = request.get("op")
+        if op == "put":
+            if self._closing:
+                _respond(writer, request_id, error=_CLOSING)
+                return
+            await self._queue.put(
+                (request.get("message"), request_id, writer)
+            )
+            return
+        read = _READS.get(op)
+        if read is None:
+            _respond(
+                writer, request_id, error=ServerError(f"Unknown op: {op!r}")
+            )
+            return
+        try:
+            if self._snapshot is not None:
+                result = read(self._snapshot, request)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._executor, read, self.session.fact_store, request
+                )
+        except Exception as error:  # pylint: disable=broad-except
+            _respond(writer, request_id, error=error)
+        else:
+            _respond(writer, request_id, result)
+
+    async def _batches(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                errors, snapshot = await loop.run_in_executor(
+                    self._executor,
+                    self._commit,
+                    [message for message, _, _ in batch],
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                # The commit itself failed; what was written stays written.
+                LOGGER.exception("Batch of %d messages failed", len(batch))
+                errors, snapshot = [error] * len(batch), None
+            if snapshot is not None:
+                # Swapped here rather than on the ingest thread, so that no
+                # read is using the old one when it is released.
+                self._snapshot, old = snapshot, self._snapshot
+                old.release()
+            for (_, request_id, writer), error in zip(batch, errors):
+                _respond(writer, request_id, error=error)
+                queue.task_done()
+
+    def _commit(self, messages: List[Any]) -> Tuple[List, Any]:
+        # Runs on the ingest thread. Returns the error of each message (or
+        # ``None``) and, if reads use them, a snapshot of the commit.
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        session = self.session
+        errors: List[Optional[Exception]] = []
+        with session.fact_store.transaction():
+            for message in messages:
+                try:
+                    session(message)
+                except Exception as error:  # pylint: disable=broad-except
+                    if LOGGER.isEnabledFor(logging.WARNING):
+                        LOGGER.warning("Message failed: %r", error)
+                    errors.append(error)
+                else:
+                    errors.append(None)
+        snapshot = (
+            None
+            if self._snapshot is None
+            else session.fact_store.snapshot()
+        )
+        if timing:
+            METRICS.observe("stage.server.batch", time.perf_counter() - start)
+            METRICS.inc("server.batches")
+            METRICS.inc("server.messages", len(messages))
+        return errors, snapshot
+
+
+def _respond(
+    writer,
+    request_id: Any,
+    result: Optional[dict] = None,
+    error: Optional[Exception] = None,
+):
+    # Responses to a closed connection are dropped.
+    if writer.is_closing():
+        return
+    if error is not None:
+        response = {"id": request_id, "ok": False, "error": str(error)}
+    else:
+        response = {"id": request_id, "ok": True}
+        if result:
+            response.update(result)
+    writer.write(encode_frame(response))
+
+
+class Client:
+    """
+    One connection to an ``IngestServer``. Any number of tasks can have
+    requests in flight on it at once; responses are matched to requests by
+    ``id``. Use ``connect`` to open one.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reading = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, path: str) -> "Client":
+        """
+        Opens a connection to the server at ``path``.
+        """
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    @property
+    def closed(self) -> bool:
+        """
+        Whether the connection is closed, by either side.
+        """
+        return self._reading.done()
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of requests waiting for their response.
+        """
+        return len(self._pending)
+
+    async def request(self, request: dict) -> dict:
+        """
+        Sends ``request`` (without an ``id``; one is added) and returns the
+        response. Raises ``ServerError`` if it failed.
+        """
+        if self.closed:
+            raise ConnectionError("Connection is closed")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(encode_frame(dict(request, id=request_id)))
+        await self._writer.drain()
+        response = await future
+        if not response.get("ok"):
+            raise ServerError(response.get("error"))
+        return response
+
+    async def put(self, message: dict):
+        """
+        Sends a CDC message; returns once it is committed.
+        """
+        await self.request({"op": "put", "message": message})
+
+    async def get_attribute(
+        self, entity_type: str, attribute: str, entity_id: Any
+    ) -> Any:
+        """
+        The current value of ``attribute``, or ``None``. Classes are given
+        by name.
+        """
+        response = await self.request(
+            {
+                "op": "get_attribute",
+                "entity_type": entity_type,
+                "attribute": attribute,
+                "entity_id": entity_id,
+            }
+        )
+        return response["value"]
+
+    async def get_entity(self, entity_type: str, entity_id: Any) -> dict:
+        """
+        Every current attribute of the entity, as attribute name -> value.
+        """
+        response = await self.request(
+            {
+                "op": "get_entity",
+                "entity_type": entity_type,
+                "entity_id": entity_id,
+            }
+        )
+        return response["attributes"]
+
+    async def _read(self):
+        error: Exception = ConnectionError("Connection closed by the server")
+        try:
+            while True:
+                response = await read_frame(self._reader)
+                if response is None:
+                    break
+                future = self._pending.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, asyncio.IncompleteReadError) as failure:
+            error = ConnectionError(str(failure))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def close(self):
+        """
+        Closes the connection; requests in flight fail.
+        """
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._reading.cancel()
+        try:
+            await self._reading
+        except asyncio.CancelledError:
+            pass
+
+
+def _in_flight(client: Client) -> int:
+    return client.in_flight
+
+
+class ClientPool:
+    """
+    Up to ``size`` connections to the server at ``path``, shared by any
+    number of tasks. Connections are opened as they are needed, and each
+    request goes to the one with the fewest requests in flight; ones that
+    failed are replaced.
+    """
+
+    def __init__(self, path: str, size: int = 4):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.path = path
+        self.size = size
+        self._clients: List[Client] = []
+        self._lock = asyncio.Lock()
+
+    async def _client(self) -> Client:
+        # An idle connection if there is one, else a new one if there is
+        # room, else the least busy.
+        clients = self._clients
+        clients[:] = [client for client in clients if not client.closed]
+        best = min(clients, key=_in_flight, default=None)
+        if best is not None and (
+            not best.in_flight or len(clients) >= self.size
+        ):
+            return best
+        async with self._lock:
+            if len(clients) < self.size:
+                clients.append(await Client.connect(self.path))
+                return clients[-1]
+        return min(clients, key=_in_flight)
+
+    async def request(self, request: dict) -> dict:
+        """
+        See ``Client.request``.
+        """
+        return await (await self._client()).request(request)
+
+    async def put(self, message: dict):
+        """
+        See ``Client.put``.
+        """
+        await (await self._client()).put(message)
+
+    async def get_attribute(
+        self, entity_type: str, attribute: str, entity_id: Any
+    ) -> Any:
+        """
+        See ``Client.get_attribute``.
+        """
+        client = await self._client()
+        return await client.get_attribute(entity_type, attribute, entity_id)
+
+    async def get_entity(self, entity_type: str, entity_id: Any) -> dict:
+        """
+        See ``Client.get_entity``.
+        """
+        client = await self._client()
+        return await client.get_entity(entity_type, entity_id)
+
+    async def close(self):
+        """
+        Closes every connection.
+        """
+        clients, self._clients = self._clients, []
+        for client in clients:
+            await client.close()
+
+
+def main(argv: List[str] = None):
+    """
+    Command-line entry point.
+    """
+    # Imported here so that clients importing ``server`` do not load
+    # ``session``.
+    from fact_store import MemoryFactStore  # pylint: disable=import-outside-toplevel
+    from message_loader import DEFAULT_LOADER  # pylint: disable=import-outside-toplevel
+    from route import MessageRoundabout  # pylint: disable=import-outside-toplevel
+    from session import Session  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("path", help="Path of the Unix-domain socket.")
+    parser.add_argument("--batch-size", type=int, default=SERVER_BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE)
+    args = parser.parse_args(argv)
+
+    message_roundabout = MessageRoundabout()
+    for route in DEFAULT_LOADER.routes():
+        message_roundabout.add_route(route)
+    with Session(
+        fact_store_cls=MemoryFactStore, message_roundabout=message_roundabout
+    ) as session:
+        run(session, args.path, args.batch_size, args.queue_size)
+
+
+def run(
+    session,
+    path: str,
+    batch_size: int = SERVER_BATCH_SIZE,
+    queue_size: int = SERVER_QUEUE_SIZE,
+):
+    """
+    Serves ``session`` at ``path`` until ``SIGINT`` or ``SIGTERM``, then
+    closes the server cleanly.
+    """
+
+    async def serve():
+        server = IngestServer(session, path, batch_size, queue_size)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, asyncio.current_task().cancel)
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await server.close()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -6,19 +6,25 @@ from __future__ import annotations
 import collections
 from dataclasses import dataclass
 import inspect
+import itertools
 import logging
-from typing import Any, List, Type
+import time
+from typing import Any, Iterable, List, Type
 from uuid import UUID
 
+from configs import BACKFILL_BATCH_SIZE
 from fact import AttributeFact, RelationshipFact
 from fact_store import FactStore, MemoryFactStore
 from entities import *
 from attribute import *
 from attribute import _MESSAGE_TYPE_CLS_LIST_DICT, _MESSAGE_TYPE_FUNCTION_TO_DICT
-from message import UserTableMessageType, DictAttributeMapping
+from message import DictAttributeMapping
+from message_loader import DEFAULT_LOADER, MessageTypeLoader, message_route
 from route import Route, MessageRoundabout
+from metrics import METRICS
+from registry import CONFIG_CACHE, REGISTRY
 
-logging.basicConfig(level=logging.DEBUG)
+LOGGER = logging.getLogger(__name__)
 
 #_MESSAGE_TYPE_CLS_LIST_DICT: dict = collections.defaultdict(list)
 #_MESSAGE_TYPE_FUNCTION_TO_DICT: dict = collections.defaultdict(dict)
@@ -28,21 +34,9 @@ __MISSING__ = "__MISSING__"
 
 def get_entity_parameters(func):
     """
-    Inspect the signature etc.
+    Inspect the signature etc. Resolved once per function by the registry.
     """
-    sig = dict(func._function_signature.parameters.items())
-    out = {}
-    for parameter in sig.keys():
-        entity_name, attribute_name = parameter.split("__")
-        entity_obj = globals()[entity_name]
-        attribute_obj = globals()[attribute_name]
-        logging.debug(entity_obj)
-        logging.debug(attribute_obj)
-        out[parameter] = (
-            entity_obj,
-            attribute_obj,
-        )
-    return out
+    return REGISTRY.parameters(func)
 
 
 
@@ -57,114 +51,187 @@ class Session:
         fact_store_cls: Type = None,
         fact_store_kwargs: dict = None,
         message_roundabout: MessageRoundabout = None,
+        message_loader: MessageTypeLoader = DEFAULT_LOADER,
+        message_reload_interval: float = None,
     ):
         self.fact_store = fact_store_cls(**(fact_store_kwargs or {}))
         self.message_roundabout = message_roundabout
         self.fact_store.session = self
+        self.message_loader = message_loader
+        # Seconds between checks for changed message configs; ``None`` means
+        # only reload when ``reload_message_types`` is called.
+        self.message_reload_interval = message_reload_interval
+        self._last_reload = time.monotonic()
+        if self.message_loader is not None:
+            self.message_loader.load()
 
-        def _callback_dict():
-            function_update_callback_dict = collections.defaultdict(list)
-
-            attribute_function_dict = {}
-            obj_names = globals().keys()
-            all_obj_dict = {
-                obj_name: globals()[obj_name] for obj_name in obj_names
-            }
-            for obj_name, obj in all_obj_dict.items():
-                if (
-                    hasattr(obj, "_attribute_function")
-                    and obj._attribute_function
-                ):
-                    attribute_function_dict[obj_name] = obj
-                    logging.info(f"Found attribute function: {obj_name}")
-                    logging.debug(f"Signature: {inspect.signature(obj)}")
-                    logging.debug(f"function name: {obj._function_name}")
-                    logging.debug(f"signature: {obj._function_signature}")
-
-            for func in attribute_function_dict.values():
-                for (
-                    parameter_name,
-                    _,
-                ) in func._function_signature.parameters.items():
-                    if parameter_name in attribute_function_dict.keys():
-                        logging.debug(parameter_name)
-                        # Set callback
-                        entity_name, attribute_name = parameter_name.split(
-                            "__"
-                        )
-                        entity_cls = globals()[entity_name]
-                        attribute_cls = globals()[attribute_name]
-                        function_update_callback_dict[
-                            (
-                                entity_cls,
-                                attribute_cls,
-                            )
-                        ].append(func)
-            return function_update_callback_dict
-
-        self.callback_dict = _callback_dict()
+        if LOGGER.isEnabledFor(logging.INFO):
+            for function_name in REGISTRY.attribute_functions:
+                LOGGER.info("Found attribute function: %s", function_name)
+        self.callback_dict = REGISTRY.callback_dict()
+        CONFIG_CACHE.save()
 
     def __enter__(self, *args, **kwargs):
         return self
 
     def __exit__(self, *args, **kwargs):
-        pass
+        # Buffered facts, e.g. in a ``CachingFactStore``, reach the backend.
+        self.fact_store.flush()
+
+    def ingest(self, messages: Iterable[dict]) -> int:
+        """
+        Processes a batch of messages in order, committed to the fact
+        store as one version. Returns how many there were.
+        """
+        count = 0
+        with self.fact_store.transaction():
+            for message in messages:
+                self(message)
+                count += 1
+        return count
+
+    def backfill(
+        self,
+        messages: Iterable[dict],
+        batch_size: int = BACKFILL_BATCH_SIZE,
+    ) -> int:
+        """
+        Loads a history of messages in bulk, for when only the final state
+        matters. The facts are stored without running callbacks, in
+        transactions of ``batch_size`` messages; then every derived
+        attribute is computed once from the final values, indexes are
+        built and standing queries reloaded (see
+        ``FactStore.begin_bulk``). Returns how many messages there were.
+        """
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        count = 0
+        messages = iter(messages)
+        with self.fact_store.bulk_load():
+            while True:
+                loaded = self.ingest(itertools.islice(messages, batch_size))
+                count += loaded
+                if loaded < batch_size:
+                    break
+        if timing:
+            METRICS.observe("stage.backfill", time.perf_counter() - start)
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info("Backfilled %d messages", count)
+        return count
+
+    def publish(self, directory: str, name: str = "facts") -> int:
+        """
+        Publishes the fact store as the next generation of a shared,
+        memory-mapped replica that ``replica.ReplicaFactStore`` attaches
+        to. Returns the generation.
+        """
+        # Imported here so that sessions that never publish skip it.
+        from replica import publish  # pylint: disable=import-outside-toplevel
+
+        return publish(self.fact_store, directory, name=name)
+
+    def reload_message_types(self) -> dict:
+        """
+        Re-reads changed message config files. Existing message types are
+        updated in place. Routes to types whose ``route`` changed, and to
+        types that were added or dropped, are replaced in the session's
+        ``MessageRoundabout``; routes to other types are left alone.
+        """
+        self._last_reload = time.monotonic()
+        before = {
+            message_type: getattr(message_type, "route", None)
+            for message_type in self.message_loader.message_types.values()
+        }
+        message_types = self.message_loader.load()
+        current = set(message_types.values())
+        changed = {
+            message_type
+            for message_type, route in before.items()
+            if message_type not in current
+            or getattr(message_type, "route", None) != route
+        }
+        changed.update(
+            message_type
+            for message_type in current.difference(before)
+            if getattr(message_type, "route", None)
+        )
+        if changed and self.message_roundabout is not None:
+            self.message_roundabout.remove_routes(changed)
+            for message_type in changed & current:
+                route = message_route(message_type)
+                if route is not None:
+                    self.message_roundabout.add_route(route)
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info("Re-routed %d message types", len(changed))
+        return message_types
 
     def __call__(self, message):
+        """
+        Processes one message. Its facts, and the facts derived from them,
+        commit to the fact store as one version.
+        """
+        self.fact_store.begin()
+        try:
+            self._process(message)
+        finally:
+            self.fact_store.commit()
+
+    def _process(self, message):
+        if (
+            self.message_reload_interval is not None
+            and time.monotonic() - self._last_reload
+            > self.message_reload_interval
+        ):
+            self.reload_message_types()
+        timing = METRICS.enabled
+        if timing:
+            start = time.perf_counter()
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
         # Route sample message to identify its type.
         message_type = self.message_roundabout(message)
-        logging.debug(message_type)
-        logging.debug(_MESSAGE_TYPE_CLS_LIST_DICT[message_type])
         kwargs = message_type().get_kwargs(message)
-        logging.debug(f"message_type kwargs: {kwargs}")
-        for attribute_function in _MESSAGE_TYPE_CLS_LIST_DICT[message_type]:
+        if timing:
+            extracted = time.perf_counter()
+            METRICS.observe("stage.extract", extracted - start)
+        if debug:
+            LOGGER.debug("message_type: %s", message_type)
+            LOGGER.debug("message_type kwargs: %s", kwargs)
+        message_type_name = message_type.__name__
+        for attribute_function in _MESSAGE_TYPE_CLS_LIST_DICT[
+            message_type_name
+        ]:
             value, attribute_cls = attribute_function(**kwargs)
-            logging.debug(value)
-            id_keypath = _MESSAGE_TYPE_FUNCTION_TO_DICT[attribute_function][
-                message_type
-            ]["id_keypath"]
-            entity_type = _MESSAGE_TYPE_FUNCTION_TO_DICT[attribute_function][
-                message_type
-            ]["entity_type"]
-            id_value = DictAttributeMapping.lookup_keypath(message, id_keypath)
-            logging.debug(id_value)
-            logging.debug(entity_type)
+            function_config = _MESSAGE_TYPE_FUNCTION_TO_DICT[
+                attribute_function
+            ][message_type_name]
+            entity_type = function_config["entity_type"]
+            id_value = function_config["id_extractor"](message)
             _attribute = AttributeFact(
                 entity_type=entity_type,
                 entity_id=id_value,
                 attribute=attribute_cls,
                 value=value,
             )
-            logging.debug(_attribute)
-            session.fact_store(_attribute)
+            if debug:
+                LOGGER.debug("%s", _attribute)
+            self.fact_store(_attribute)
+        if timing:
+            attributes_done = time.perf_counter()
+            METRICS.observe("stage.attributes", attributes_done - extracted)
 
         for (
             relationship_name,
-            relationship_config,
-        ) in message_type.relationship_mapping.items():
-            source_entity_type = globals()[
-                relationship_config["source"]["entity_type"]
-            ]
-            target_entity_type = globals()[
-                relationship_config["target"]["entity_type"]
-            ]
-            relationship_cls = globals()[relationship_name]
-            source_entity_id = DictAttributeMapping.lookup_keypath(
-                message,
-                message_type.argument_mapping[
-                    message_type.relationship_mapping[relationship_name][
-                        "source"
-                    ]["entity_id_keypath"]
-                ],
-            )
-            target_entity_id = DictAttributeMapping.lookup_keypath(
-                message,
-                message_type.argument_mapping[
-                    message_type.relationship_mapping[relationship_name][
-                        "target"
-                    ]["entity_id_keypath"]
-                ],
-            )
+            source_entity_type_name,
+            source_extractor,
+            target_entity_type_name,
+            target_extractor,
+        ) in message_type._relationship_extractors:
+            source_entity_type = REGISTRY.entity_types[source_entity_type_name]
+            target_entity_type = REGISTRY.entity_types[target_entity_type_name]
+            relationship_cls = REGISTRY.relationships[relationship_name]
+            source_entity_id = source_extractor(message)
+            target_entity_id = target_extractor(message)
             relationship_fact = RelationshipFact(
                 source_entity_type=source_entity_type,
                 target_entity_type=target_entity_type,
@@ -173,20 +240,20 @@ class Session:
                 relationship=relationship_cls,
             )
             self.fact_store(relationship_fact)
+        if timing:
+            end = time.perf_counter()
+            METRICS.observe("stage.relationships", end - attributes_done)
+            METRICS.observe("stage.message", end - start)
+            METRICS.inc("session.messages")
+            METRICS.inc(f"session.messages.{message_type_name}")
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    METRICS.enable()
     _message_roundabout = MessageRoundabout()
-
-    ROUTE = Route(
-        message_type=UserTableMessageType,
-        keypath=[
-            "metadata",
-            "table",
-        ],
-        value_match="users",
-    )
-    _message_roundabout.add_route(ROUTE)
+    for ROUTE in DEFAULT_LOADER.routes():
+        _message_roundabout.add_route(ROUTE)
 
     SAMPLE_MESSAGE = {
         "cdc": {
@@ -206,3 +273,4 @@ if __name__ == "__main__":
         session(SAMPLE_MESSAGE)
         for i in session.fact_store:
             print(i)
+    print(METRICS.export_json())
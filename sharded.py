@@ -0,0 +1,889 @@
+"""
+Fact stores partitioned across worker processes, with scatter-gather query
+execution.
+
+``ShardedFactStore`` starts one worker process per shard, each holding an
+ordinary fact store. Entities are assigned to shards by a stable hash of
+their type and id. Attribute facts go to the entity's shard, where the
+attribute callbacks run (derived attributes only read their own entity).
+Relationship facts are stored on the shards of both endpoints, so every
+edge incident to an entity is local to its shard. An aggregate grouped by
+a relationship is kept on the shard that owns the target entity; other
+shards pass their values for it on as they are written.
+
+Queries are planned on the coordinator and run stage by stage over batches
+of bindings:
+
+* the first (scan) operator runs on every shard at once, each shard binding
+  only the entities it owns, and its results are streamed back in batches;
+* an ``Expand`` is sent to the shard that owns the bound ``from`` entity.
+  Constraints on the other endpoint need its attributes, so bindings whose
+  new entity lives elsewhere are exchanged to the owning shard and
+  filtered there;
+* a variable-length expansion walks frontiers level by level, asking each
+  shard for the neighbours of the frontier entities it owns.
+
+Batches for different shards are processed concurrently, so scans, filters
+and expansions scale with the number of shards. ``count`` aggregates on the
+shards and only merges the partial counts.
+
+Usage::
+
+    session = Session(
+        fact_store_cls=ShardedFactStore,
+        fact_store_kwargs={"shard_count": 4},
+        message_roundabout=message_roundabout,
+    )
+    session.ingest(messages)
+    store = session.fact_store
+    rows = query.execute(store, "MATCH (a:Person)-->(b:State) LIMIT 10")
+    by_state = store.count("MATCH (a:Person)-->(b:State)", group_by="b")
+    store.close()
+"""
+from __future__ import annotations
+
+import collections
+import copy
+import itertools
+import logging
+import multiprocessing
+from operator import itemgetter
+import os
+import types
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from aggregates import AggregateMaintainer
+from cardinality import CardinalityStatistics
+from fact import AttributeFact, Fact, RelationshipFact
+from fact_store import FactStore, MemoryFactStore, _edge_key
+from operators import (
+    AttributeConstraint,
+    EntityRef,
+    Expand,
+    IndexSeek,
+    NodeById,
+    NodeScan,
+    QueryCancelled,
+    VarLengthExpand,
+)
+from query import compile_query
+from registry import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+# Facts buffered per shard before they are sent.
+PUT_BATCH_SIZE = 1000
+# Bindings per batch streamed between stages.
+FETCH_SIZE = 1000
+
+_SCANS = (NodeScan, IndexSeek, NodeById)
+
+
+def shard_of(entity_type: type, entity_id: Any, shard_count: int) -> int:
+    """
+    Shard owning an entity. Stable across processes and runs, unlike
+    ``hash`` of a string.
+    """
+    key = f"{entity_type.__name__}\x00{entity_id!r}".encode("utf8")
+    return zlib.crc32(key) % shard_count
+
+
+def _finish(bindings, aggregate):
+    """
+    ``bindings`` as a list, or as partial counts if ``aggregate`` is
+    ``("count", group_by)``.
+    """
+    if aggregate is None:
+        return list(bindings)
+    _, group_by = aggregate
+    if group_by is None:
+        return collections.Counter({None: sum(1 for _ in bindings)})
+    return collections.Counter(binding[group_by] for binding in bindings)
+
+
+def _rows(batches: Iterator[list], limit: Optional[int]) -> Iterator[dict]:
+    # Like ``planner._take``: closing the rows, or reaching the limit,
+    # closes ``batches`` straight away, which closes the query on the
+    # shards.
+    try:
+        if limit is not None and limit <= 0:
+            return
+        produced = 0
+        for batch in batches:
+            for row in batch:
+                yield row
+                produced += 1
+                if produced == limit:
+                    return
+    finally:
+        batches.close()
+
+
+class _Filter:
+    """
+    Plan step that checks ``constraints`` on the entity bound to
+    ``variable``, on the shard that owns it.
+    """
+
+    def __init__(self, variable: str, constraints: list):
+        self.variable = variable
+        self.constraints = constraints
+
+    def __call__(self, store, bindings):
+        for binding in bindings:
+            entity = binding[self.variable]
+            if all(
+                constraint(store, *entity) for constraint in self.constraints
+            ):
+                yield binding
+
+
+# Anchors that are not an entity: run on every shard, or on the
+# coordinator.
+_BROADCAST = "broadcast"
+_COORDINATOR = "coordinator"
+
+
+def _steps(operators) -> list:
+    """
+    Splits the planned operators into steps that each need data from one
+    entity only: an expansion is followed by a ``_Filter`` for its target
+    constraints, which may live on another shard.
+    """
+    steps = []
+    for operator in operators:
+        if (
+            isinstance(operator, (Expand, VarLengthExpand))
+            and operator.to_constraints
+            and not operator.into
+        ):
+            stripped = copy.copy(operator)
+            stripped.to_constraints = []
+            steps.append(stripped)
+            steps.append(
+                _Filter(operator.to_variable, operator.to_constraints)
+            )
+        else:
+            steps.append(operator)
+    return steps
+
+
+def _anchor(step):
+    """
+    Function from a binding to the entity whose shard runs ``step``, or
+    ``_BROADCAST`` / ``_COORDINATOR``.
+    """
+    if isinstance(step, VarLengthExpand):
+        return _COORDINATOR
+    if isinstance(step, Expand):
+        return itemgetter(step.from_variable)
+    if isinstance(step, _Filter):
+        return itemgetter(step.variable)
+    if isinstance(step, NodeById) and step.entity_type is not None:
+        entity = EntityRef(step.entity_type, step.entity_id)
+        return lambda _: entity
+    return _BROADCAST
+
+
+class _Shard:
+    """
+    State of one worker process. ``do_<command>`` methods answer the
+    coordinator's requests.
+    """
+
+    def __init__(self, index, shard_count, fact_store_cls, fact_store_kwargs):
+        self.index = index
+        self.shard_count = shard_count
+        self.store = fact_store_cls(**(fact_store_kwargs or {}))
+        self.store.session = types.SimpleNamespace(
+            callback_dict=REGISTRY.callback_dict()
+        )
+        # Aggregates grouped by a relationship are kept on the shard that
+        # owns the group's entity.
+        self.store.aggregates = AggregateMaintainer(self.store)
+        self.store.aggregates.owns = lambda entity_type, entity_id: (
+            shard_of(entity_type, entity_id, shard_count) == index
+        )
+        # Entities owned here and edges whose source is owned here, so
+        # summing the shards counts everything once.
+        self.statistics = CardinalityStatistics()
+        # query id -> (steps, aggregate), and the open scans
+        self.queries: Dict[int, Tuple[list, Any]] = {}
+        self.cursors: Dict[int, Iterator] = {}
+
+    def owns(self, entity: EntityRef) -> bool:
+        return (
+            shard_of(entity.entity_type, entity.entity_id, self.shard_count)
+            == self.index
+        )
+
+    def _observe_entity(self, entity: EntityRef):
+        if self.owns(entity) and not self.store.has_entity(*entity):
+            self.statistics.observe_entity(entity.entity_type)
+
+    def do_put(self, facts: List[Fact]):
+        for fact in facts:
+            if isinstance(fact, AttributeFact):
+                self._observe_entity(
+                    EntityRef(fact.entity_type, fact.entity_id)
+                )
+            else:
+                source = EntityRef(
+                    fact.source_entity_type, fact.source_entity_id
+                )
+                target = EntityRef(
+                    fact.target_entity_type, fact.target_entity_id
+                )
+                self._observe_entity(source)
+                self._observe_entity(target)
+                if self.owns(source):
+                    key = _edge_key(fact)
+                    outgoing = [
+                        _edge_key(edge)
+                        for edge in self.store.edges(
+                            fact.relationship, *source, direction="out"
+                        )
+                    ]
+                    if key not in outgoing:
+                        incoming = self.store.edges(
+                            fact.relationship, *target, direction="in"
+                        )
+                        self.statistics.observe_edge(
+                            fact.relationship,
+                            source.entity_type,
+                            target.entity_type,
+                            new_source=not outgoing,
+                            new_target=next(incoming, None) is None,
+                        )
+            self.store(fact)
+        return self._outbox()
+
+    def _outbox(self) -> List[tuple]:
+        aggregates = self.store.aggregates
+        outbox, aggregates.outbox = aggregates.outbox, []
+        return outbox
+
+    def do_merge_aggregates(self, updates):
+        self.store.aggregates.merge(updates)
+        return self._outbox()
+
+    def do_advance_aggregates(self, now):
+        return self.store.advance_aggregates(now)
+
+    def _owned(self, bindings, variable):
+        return (
+            binding for binding in bindings if self.owns(binding[variable])
+        )
+
+    def _local(self, operator):
+        # Use a local value index for a scan the coordinator could not see.
+        if isinstance(operator, NodeScan) and operator.entity_type:
+            for constraint in operator.constraints:
+                if (
+                    isinstance(constraint, AttributeConstraint)
+                    and self.store.attribute_index(constraint.attribute)
+                    is not None
+                ):
+                    return IndexSeek(
+                        operator.variable,
+                        constraint,
+                        entity_type=operator.entity_type,
+                        constraints=[
+                            other
+                            for other in operator.constraints
+                            if other is not constraint
+                        ],
+                    )
+        return operator
+
+    def _advance(self, steps, stage, bindings):
+        """
+        Runs ``bindings`` through ``steps[stage:]`` for as long as this
+        shard owns each step's anchor entity. Returns the finished
+        bindings and ``(stage, binding)`` pairs to be exchanged. A
+        broadcast step (a scan binding a new component) runs here only
+        if the bindings were sent to every shard for it.
+        """
+        exported = []
+        entry = stage
+        while stage < len(steps) and bindings:
+            step = steps[stage]
+            anchor = _anchor(step)
+            if anchor is _COORDINATOR or (
+                anchor is _BROADCAST and stage != entry
+            ):
+                exported.extend((stage, binding) for binding in bindings)
+                return [], exported
+            if anchor is not _BROADCAST:
+                local = []
+                for binding in bindings:
+                    if self.owns(anchor(binding)):
+                        local.append(binding)
+                    else:
+                        exported.append((stage, binding))
+                bindings = local
+            rows = self._local(step)(self.store, iter(bindings))
+            if isinstance(step, _SCANS):
+                rows = self._owned(rows, step.variable)
+            bindings = list(rows)
+            stage += 1
+        if stage < len(steps):
+            return [], exported
+        return bindings, exported
+
+    def do_open(self, query_id, steps, aggregate, scan):
+        self.queries[query_id] = (steps, aggregate)
+        if scan:
+            self.cursors[query_id] = self._owned(
+                self._local(steps[0])(self.store, iter(({},))),
+                steps[0].variable,
+            )
+
+    def do_fetch(self, query_id, count):
+        """
+        The next ``count`` scan results, advanced through the fragment.
+        """
+        steps, aggregate = self.queries[query_id]
+        batch = list(itertools.islice(self.cursors[query_id], count))
+        done = len(batch) < count
+        if done:
+            del self.cursors[query_id]
+        finished, exported = self._advance(steps, 1, batch)
+        return _finish(finished, aggregate), exported, done
+
+    def do_advance(self, query_id, groups):
+        """
+        Continues exchanged bindings; ``groups`` maps stage -> bindings.
+        """
+        steps, aggregate = self.queries[query_id]
+        finished, exported = [], []
+        for stage, bindings in groups.items():
+            done, more = self._advance(steps, stage, bindings)
+            finished.extend(done)
+            exported.extend(more)
+        return _finish(finished, aggregate), exported
+
+    def do_close(self, query_id):
+        self.queries.pop(query_id, None)
+        self.cursors.pop(query_id, None)
+
+    def do_neighbours(self, relationship, direction, entities):
+        out = set()
+        for entity_type, entity_id in entities:
+            for fact in self.store.edges(
+                relationship, entity_type, entity_id, direction=direction
+            ):
+                if direction == "out":
+                    out.add(
+                        (fact.target_entity_type, fact.target_entity_id)
+                    )
+                else:
+                    out.add(
+                        (fact.source_entity_type, fact.source_entity_id)
+                    )
+        return out
+
+    def do_get_attribute(self, entity_type, attribute, entity_id):
+        return self.store.get_attribute(
+            entity_type=entity_type, attribute=attribute, entity_id=entity_id
+        )
+
+    def do_get_entity(self, entity_type, entity_id):
+        return self.store.get_entity(entity_type, entity_id)
+
+    def do_entity_ids(self, entity_type):
+        return [
+            entity_id
+            for entity_id in self.store.entity_ids(entity_type)
+            if self.owns(EntityRef(entity_type, entity_id))
+        ]
+
+    def do_edges(self, relationship, entity_type, entity_id, direction):
+        return list(
+            self.store.edges(relationship, entity_type, entity_id, direction)
+        )
+
+    def do_has_entity(self, entity_type, entity_id):
+        return self.store.has_entity(entity_type, entity_id)
+
+    def do_facts(self):
+        out = []
+        for fact in self.store:
+            if isinstance(fact, AttributeFact):
+                owner = EntityRef(fact.entity_type, fact.entity_id)
+            else:
+                owner = EntityRef(
+                    fact.source_entity_type, fact.source_entity_id
+                )
+            if self.owns(owner):
+                out.append(fact)
+        return out
+
+    def do_begin_bulk(self):
+        self.store.begin_bulk()
+
+    def do_end_bulk(self):
+        self.store.end_bulk()
+
+    def do_expire(self, now):
+        return self.store.expire(now)
+
+    def do_create_index(self, attribute):
+        self.store.create_index(attribute)
+
+    def do_memory_usage(self):
+        return self.store.memory_usage()
+
+    def do_statistics(self):
+        return self.statistics
+
+
+def _serve(connection, index, shard_count, fact_store_cls, fact_store_kwargs):
+    shard = _Shard(index, shard_count, fact_store_cls, fact_store_kwargs)
+    while True:
+        command, args = connection.recv()
+        if command == "stop":
+            # Workers exit without running finalizers, so stores that keep
+            # files (e.g. a spill tier) are closed here.
+            close = getattr(shard.store, "close", None)
+            if close is not None:
+                close()
+            connection.close()
+            return
+        try:
+            result = (True, getattr(shard, f"do_{command}")(*args))
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.exception("Shard %d failed on %s", index, command)
+            result = (False, error)
+        connection.send(result)
+
+
+class ShardedFactStore(FactStore):
+    """
+    Facts partitioned over ``shard_count`` worker processes, each running a
+    ``fact_store_cls``. Writes are buffered per shard and sent in batches;
+    every read flushes first.
+    """
+
+    # Derived attributes are computed on the shards, so rows cached here
+    # would go stale; each shard serves ``get_entity`` from its own store.
+    entity_cache_size = None
+
+    def __init__(
+        self,
+        shard_count: int = None,
+        fact_store_cls: type = MemoryFactStore,
+        fact_store_kwargs: dict = None,
+    ):
+        super().__init__()
+        self.shard_count = shard_count or os.cpu_count() or 1
+        context = multiprocessing.get_context()
+        self._connections = []
+        self._processes = []
+        for index in range(self.shard_count):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_serve,
+                args=(
+                    child,
+                    index,
+                    self.shard_count,
+                    fact_store_cls,
+                    fact_store_kwargs,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        self._pending: List[List[Fact]] = [[] for _ in range(self.shard_count)]
+        self._statistics = CardinalityStatistics()
+        self._cursor_ids = itertools.count()
+
+    # Worker protocol
+
+    def _gather(self, requests: Dict[int, tuple]) -> Dict[int, Any]:
+        """
+        Sends ``{shard: (command, *args)}`` to all shards, then collects
+        the answers, so the shards work concurrently.
+        """
+        for shard, (command, *args) in requests.items():
+            self._connections[shard].send((command, args))
+        results = {}
+        failure = None
+        for shard in requests:
+            ok, result = self._connections[shard].recv()
+            if ok:
+                results[shard] = result
+            elif failure is None:
+                failure = result
+        if failure is not None:
+            raise failure
+        return results
+
+    def _call(self, shard: int, command: str, *args):
+        return self._gather({shard: (command, *args)})[shard]
+
+    def _broadcast(self, command: str, *args) -> List[Any]:
+        results = self._gather(
+            {shard: (command, *args) for shard in range(self.shard_count)}
+        )
+        return [results[shard] for shard in range(self.shard_count)]
+
+    def shard(self, entity: Tuple[type, Any]) -> int:
+        """
+        Shard owning ``(entity_type, entity_id)``.
+        """
+        return shard_of(entity[0], entity[1], self.shard_count)
+
+    def close(self):
+        """
+        Flushes pending writes and stops the workers.
+        """
+        if not self._processes:
+            return
+        self.flush()
+        for connection in self._connections:
+            connection.send(("stop", ()))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # Writes
+
+    def put(self, fact: Fact):
+        if isinstance(fact, AttributeFact):
+            shards = {self.shard((fact.entity_type, fact.entity_id))}
+        elif isinstance(fact, RelationshipFact):
+            shards = {
+                self.shard((fact.source_entity_type, fact.source_entity_id)),
+                self.shard((fact.target_entity_type, fact.target_entity_id)),
+            }
+        else:
+            raise TypeError("Tried to put a non-Fact into the store.")
+        for shard in shards:
+            pending = self._pending[shard]
+            pending.append(fact)
+            if len(pending) >= PUT_BATCH_SIZE:
+                self.flush()
+
+    def __call__(self, fact: Fact):
+        # Callbacks run on the shard that owns the entity.
+        self.put(fact)
+        if self.standing_queries and not self.bulk:
+            self.flush()
+            self._notify(fact)
+
+    def flush(self):
+        """
+        Sends every buffered fact to its shards, then the aggregate values
+        the shards queued for groups owned by other shards.
+        """
+        requests = {
+            shard: ("put", pending)
+            for shard, pending in enumerate(self._pending)
+            if pending
+        }
+        if requests:
+            self._pending = [[] for _ in range(self.shard_count)]
+        functions = REGISTRY.aggregate_functions
+        while requests:
+            queued = collections.defaultdict(list)
+            for updates in self._gather(requests).values():
+                for update in updates:
+                    aggregate = functions[update[0]]._aggregate
+                    queued[
+                        self.shard((aggregate.entity_type, update[1]))
+                    ].append(update)
+            requests = {
+                shard: ("merge_aggregates", updates)
+                for shard, updates in queued.items()
+            }
+
+    def begin_bulk(self):
+        self.flush()
+        self._broadcast("begin_bulk")
+        super().begin_bulk()
+
+    def end_bulk(self):
+        # Derived attributes only read their own entity, so every shard
+        # recomputes its own.
+        self.flush()
+        try:
+            self._broadcast("end_bulk")
+        finally:
+            self.bulk = False
+        for standing_query in self.standing_queries:
+            standing_query.reload()
+
+    def expire(self, now: float = None) -> int:
+        """
+        Expires facts on every shard; shards also do so by themselves as
+        they are written to. An edge whose endpoints are on two shards is
+        counted by both.
+        """
+        self.flush()
+        return sum(self._broadcast("expire", now))
+
+    def advance_aggregates(self, now: float = None) -> int:
+        """
+        Moves the aggregate windows on every shard up to ``now``.
+        """
+        self.flush()
+        return sum(self._broadcast("advance_aggregates", now))
+
+    def memory_usage(self) -> List[dict]:
+        """
+        The ``memory_usage`` of each shard, in shard order. A
+        ``memory_budget`` in ``fact_store_kwargs`` applies to each shard.
+        """
+        self.flush()
+        return self._broadcast("memory_usage")
+
+    def create_index(self, attribute):
+        """
+        Builds a value index on ``attribute`` on every shard; scans use it
+        shard-locally.
+        """
+        self.flush()
+        self._broadcast("create_index", attribute)
+
+    # FactStore reads, mostly for compatibility; queries use ``run_plan``.
+
+    def _get_attribute(self, entity_type=None, attribute=None, entity_id=None):
+        self.flush()
+        return self._call(
+            self.shard((entity_type, entity_id)),
+            "get_attribute",
+            entity_type,
+            attribute,
+            entity_id,
+        )
+
+    def _get_entity(self, entity_type, entity_id):
+        self.flush()
+        return self._call(
+            self.shard((entity_type, entity_id)),
+            "get_entity",
+            entity_type,
+            entity_id,
+        )
+
+    def entity_ids(self, entity_type=None) -> Iterator[Any]:
+        self.flush()
+        return itertools.chain.from_iterable(
+            self._broadcast("entity_ids", entity_type)
+        )
+
+    def edges(
+        self,
+        relationship=None,
+        entity_type=None,
+        entity_id=None,
+        direction="out",
+    ) -> Iterator[RelationshipFact]:
+        self.flush()
+        return iter(
+            self._call(
+                self.shard((entity_type, entity_id)),
+                "edges",
+                relationship,
+                entity_type,
+                entity_id,
+                direction,
+            )
+        )
+
+    def has_entity(self, entity_type, entity_id) -> bool:
+        self.flush()
+        return self._call(
+            self.shard((entity_type, entity_id)),
+            "has_entity",
+            entity_type,
+            entity_id,
+        )
+
+    def traverse(
+        self,
+        entity_type,
+        entity_id,
+        relationship=None,
+        direction="out",
+        min_hops=1,
+        max_hops=None,
+    ):
+        self.flush()
+        start = (entity_type, entity_id)
+        if min_hops == 0:
+            yield entity_type, entity_id, 0
+        visited = {start}
+        frontier = {start}
+        hops = 0
+        while frontier and (max_hops is None or hops < max_hops):
+            hops += 1
+            by_shard = collections.defaultdict(list)
+            for entity in frontier:
+                by_shard[self.shard(entity)].append(entity)
+            next_frontier = set()
+            for neighbours in self._gather(
+                {
+                    shard: ("neighbours", relationship, direction, entities)
+                    for shard, entities in by_shard.items()
+                }
+            ).values():
+                next_frontier |= neighbours
+            next_frontier -= visited
+            visited |= next_frontier
+            if hops >= min_hops:
+                for other_type, other_id in next_frontier:
+                    yield other_type, other_id, hops
+            frontier = next_frontier
+
+    def statistics(self) -> CardinalityStatistics:
+        # Merged in place so the planner's cache key (the object) is stable.
+        self.flush()
+        merged = self._statistics
+        counters = (
+            "entity_counts",
+            "edge_counts",
+            "source_counts",
+            "target_counts",
+        )
+        for name in counters:
+            getattr(merged, name).clear()
+        generation = 0
+        for statistics in self._broadcast("statistics"):
+            for name in counters:
+                getattr(merged, name).update(getattr(statistics, name))
+            generation += statistics.generation
+        merged.generation = generation
+        return merged
+
+    def __iter__(self):
+        self.flush()
+        for facts in self._broadcast("facts"):
+            yield from facts
+
+    # Scatter-gather execution
+
+    def _route(self, steps, exported, cursor_id, aggregate) -> Iterator:
+        """
+        Exchanges ``(stage, binding)`` pairs to the shards that own the
+        next step's anchor until every binding is finished or dropped.
+        """
+        while exported:
+            requests = collections.defaultdict(
+                lambda: collections.defaultdict(list)
+            )
+            coordinator = collections.defaultdict(list)
+            for stage, binding in exported:
+                anchor = _anchor(steps[stage])
+                if anchor is _COORDINATOR:
+                    coordinator[stage].append(binding)
+                elif anchor is _BROADCAST:
+                    for shard in range(self.shard_count):
+                        requests[shard][stage].append(binding)
+                else:
+                    requests[self.shard(anchor(binding))][stage].append(
+                        binding
+                    )
+            exported = []
+            for stage, bindings in coordinator.items():
+                # Variable-length steps walk the shards level by level.
+                rows = list(steps[stage](self, iter(bindings)))
+                if stage + 1 == len(steps):
+                    if rows:
+                        yield _finish(rows, aggregate)
+                else:
+                    exported.extend((stage + 1, row) for row in rows)
+            if not requests:
+                continue
+            results = self._gather(
+                {
+                    shard: ("advance", cursor_id, dict(groups))
+                    for shard, groups in requests.items()
+                }
+            )
+            for finished, more in results.values():
+                if finished:
+                    yield finished
+                exported.extend(more)
+
+    def _batches(self, plan, aggregate=None, cancelled=None) -> Iterator:
+        self.flush()
+        steps = _steps(plan.operators(self))
+        first = steps[0]
+        if isinstance(first, NodeById) and first.entity_type is not None:
+            scanning = [self.shard((first.entity_type, first.entity_id))]
+        else:
+            scanning = list(range(self.shard_count))
+        query_id = next(self._cursor_ids)
+        self._gather(
+            {
+                shard: ("open", query_id, steps, aggregate, shard in scanning)
+                for shard in range(self.shard_count)
+            }
+        )
+        try:
+            active = scanning
+            while active:
+                results = self._gather(
+                    {
+                        shard: ("fetch", query_id, FETCH_SIZE)
+                        for shard in active
+                    }
+                )
+                active = []
+                exported = []
+                for shard, (finished, more, done) in results.items():
+                    if finished:
+                        yield finished
+                    exported.extend(more)
+                    if not done:
+                        active.append(shard)
+                for batch in self._route(steps, exported, query_id, aggregate):
+                    if cancelled is not None and cancelled():
+                        raise QueryCancelled("Query cancelled")
+                    yield batch
+                if cancelled is not None and cancelled():
+                    raise QueryCancelled("Query cancelled")
+        finally:
+            # Not when the store was closed first.
+            if self._connections:
+                self._broadcast("close", query_id)
+
+    def run_plan(self, plan, limit: Optional[int] = None, cancelled=None):
+        """
+        Streams the rows of ``plan``; ``query.execute`` calls this for
+        stores that provide it.
+        """
+        limits = [count for count in (limit, plan.limit) if count is not None]
+        return _rows(
+            self._batches(plan, cancelled=cancelled),
+            min(limits) if limits else None,
+        )
+
+    def count(self, query, group_by: str = None):
+        """
+        Number of rows of ``query``, or a ``Counter`` of rows per entity
+        bound to ``group_by``. Counting happens on the shards.
+        """
+        plan = compile_query(query) if isinstance(query, str) else query
+        if group_by is not None and group_by not in plan.nodes:
+            raise ValueError(f"Unknown variable: {group_by}")
+        total = collections.Counter()
+        for counts in self._batches(plan, aggregate=("count", group_by)):
+            total.update(counts)
+        if group_by is None:
+            return total[None]
+        return total
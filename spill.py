@@ -0,0 +1,196 @@
+"""
+Local disk tier for a ``MemoryFactStore`` over its memory budget.
+
+A ``DiskTier`` is a SQLite database in a temporary file. It holds the rows
+of the entities the store spilled, pickled whole under their (entity type,
+entity id), and the facts the store spilled from its fact lists, in the
+order they were spilled. A ``bloom.BloomFilter`` of the row keys answers
+most lookups of entities that were never spilled without a query. The file
+is only scratch space: it is not synced, and it is deleted when the tier is
+closed or collected.
+
+Snapshots read the tier from other threads, so every query holds a lock.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bloom import BloomFilter
+from configs import BLOOM_ERROR_RATE, BLOOM_MIN_CAPACITY
+
+LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = (
+    """
+    CREATE TABLE rows (
+        key BLOB PRIMARY KEY,
+        row BLOB NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE TABLE facts (fact BLOB NOT NULL)",
+)
+
+# Rows and facts read per query when streaming them back.
+_BATCH_SIZE = 1000
+
+
+def _dumps(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _close(connection: sqlite3.Connection, path: str):
+    connection.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class DiskTier:
+    """
+    Spilled entity rows and facts, in a temporary file in ``directory``
+    (the system default if ``None``).
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        handle, self.path = tempfile.mkstemp(
+            prefix="facts-", suffix=".spill", dir=directory
+        )
+        os.close(handle)
+        self._connection = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=OFF")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(BLOOM_MIN_CAPACITY, BLOOM_ERROR_RATE)
+        self.fact_count = 0
+        self._finalizer = weakref.finalize(
+            self, _close, self._connection, self.path
+        )
+
+    def __contains__(self, key: Tuple[Any, Any]) -> bool:
+        """
+        Whether the row of ``key`` may have been spilled; ``False`` is
+        certain.
+        """
+        return key in self._bloom
+
+    def put_rows(self, rows: Iterable[Tuple[Tuple[Any, Any], Dict]]):
+        """
+        Writes ``(key, row)`` pairs, replacing earlier copies.
+        """
+        rows = [(key, row) for key, row in rows]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?)",
+                ((_dumps(key), _dumps(row)) for key, row in rows),
+            )
+            self._connection.execute("COMMIT")
+        for key, _ in rows:
+            self._bloom.add(key)
+        if self._bloom.saturated:
+            self._rebuild_filter()
+
+    def _rebuild_filter(self):
+        with self._lock:
+            keys = [
+                pickle.loads(key)
+                for key, in self._connection.execute("SELECT key FROM rows")
+            ]
+        self._bloom = BloomFilter.from_keys(
+            keys, max(2 * len(keys), BLOOM_MIN_CAPACITY), BLOOM_ERROR_RATE
+        )
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Rebuilt spill filter for %d rows", len(keys))
+
+    def get_row(self, key: Tuple[Any, Any]) -> Optional[Dict]:
+        """
+        The spilled row of ``key``, or ``None``.
+        """
+        if key not in self._bloom:
+            return None
+        with self._lock:
+            found = self._connection.execute(
+                "SELECT row FROM rows WHERE key = ?", (_dumps(key),)
+            ).fetchone()
+        return None if found is None else pickle.loads(found[0])
+
+    def discard_row(self, key: Tuple[Any, Any]):
+        """
+        Forgets the spilled copy of ``key``'s row.
+        """
+        if key not in self._bloom:
+            return
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM rows WHERE key = ?", (_dumps(key),)
+            )
+
+    def rows(self) -> Iterator[Tuple[Tuple[Any, Any], Dict]]:
+        """
+        Every spilled ``(key, row)``.
+        """
+        last = b""
+        while True:
+            with self._lock:
+                batch = self._connection.execute(
+                    "SELECT key, row FROM rows WHERE key > ? ORDER BY key "
+                    "LIMIT ?",
+                    (last, _BATCH_SIZE),
+                ).fetchall()
+            if not batch:
+                return
+            for key, row in batch:
+                yield pickle.loads(key), pickle.loads(row)
+            last = batch[-1][0]
+
+    def append_facts(self, facts: List[Any]):
+        """
+        Writes ``facts`` after those already spilled.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT INTO facts VALUES (?)",
+                ((_dumps(fact),) for fact in facts),
+            )
+            self._connection.execute("COMMIT")
+        self.fact_count += len(facts)
+
+    def facts(self) -> Iterator[Any]:
+        """
+        Every spilled fact, in the order it was spilled.
+        """
+        last = 0
+        while True:
+            with self._lock:
+                batch = self._connection.execute(
+                    "SELECT rowid, fact FROM facts WHERE rowid > ? "
+                    "ORDER BY rowid LIMIT ?",
+                    (last, _BATCH_SIZE),
+                ).fetchall()
+            if not batch:
+                return
+            for _, fact in batch:
+                yield pickle.loads(fact)
+            last = batch[-1][0]
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    def close(self):
+        """
+        Closes and deletes the file.
+        """
+        self._finalizer()
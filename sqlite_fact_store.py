@@ -0,0 +1,497 @@
+"""
+Fact store persisted in a SQLite database.
+
+Current attribute values, entities and edges are kept in three tables keyed
+so that every ``FactStore`` read is one indexed lookup. Entity ids and
+attribute values are stored pickled; entity types, attributes and
+relationships by class name, resolved through the ``REGISTRY`` when read
+back. Transactions (``begin``/``commit``, so one per message under a
+``Session``) map onto SQLite transactions, and ``synchronous`` sets how
+hard each commit is pushed to disk.
+
+Callbacks ask for many attributes that do not exist yet, so the store
+keeps a ``bloom.BloomFilter`` of the (entity type, entity id, attribute)
+keys and entity keys it holds: lookups of keys the filter rules out return
+without a query. The filter is rebuilt from the database by ``compact``,
+and whenever it fills past the capacity it was sized for.
+
+Every commit waits for the disk, so wrap the store in a
+``caching.CachingFactStore`` to batch writes::
+
+    Session(
+        fact_store_cls=CachingFactStore,
+        fact_store_kwargs={
+            "fact_store_cls": SqliteFactStore,
+            "fact_store_kwargs": {"path": "facts.db"},
+        },
+    )
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import pickle
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, Optional
+from uuid import UUID
+
+from bloom import BloomFilter
+from cardinality import CardinalityStatistics
+from configs import BLOOM_ERROR_RATE, BLOOM_MIN_CAPACITY
+from fact import AttributeFact, Fact, RelationshipFact
+from fact_store import FactStore
+from metrics import METRICS
+from registry import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+__MISSING__ = "__MISSING__"
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+_EDGES_IN = """
+    CREATE INDEX IF NOT EXISTS edges_in
+    ON edges (target_type, target_id, relationship)
+"""
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS entities (
+        entity_type TEXT NOT NULL,
+        entity_id BLOB NOT NULL,
+        UNIQUE (entity_type, entity_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS attributes (
+        entity_type TEXT NOT NULL,
+        entity_id BLOB NOT NULL,
+        attribute TEXT NOT NULL,
+        value BLOB,
+        uuid BLOB,
+        created_at REAL,
+        PRIMARY KEY (entity_type, entity_id, attribute)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS edges (
+        source_type TEXT NOT NULL,
+        source_id BLOB NOT NULL,
+        relationship TEXT NOT NULL,
+        target_type TEXT NOT NULL,
+        target_id BLOB NOT NULL,
+        created_at REAL,
+        PRIMARY KEY (
+            source_type, source_id, relationship, target_type, target_id
+        )
+    ) WITHOUT ROWID
+    """,
+    _EDGES_IN,
+)
+
+
+def _key(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _timestamp(fact: Fact) -> Optional[float]:
+    created_at = getattr(fact, "created_at", None)
+    return None if created_at is None else created_at.timestamp()
+
+
+def _datetime(timestamp: Optional[float]):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+class SqliteFactStore(FactStore):
+    """
+    Fact store in the SQLite database at ``path`` (in memory if
+    ``":memory:"``). An existing database is reopened with its facts.
+    ``synchronous`` is SQLite's ``PRAGMA synchronous`` level: ``"FULL"``
+    makes every commit durable, ``"NORMAL"`` (in WAL mode) may lose the
+    last commits on power loss but not corrupt the database, ``"OFF"``
+    leaves flushing to the operating system. ``bloom_error_rate`` is the
+    target false-positive rate of the negative-lookup filter, ``None`` to
+    query for every lookup.
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        synchronous: str = "NORMAL",
+        bloom_error_rate: Optional[float] = BLOOM_ERROR_RATE,
+    ):
+        super().__init__()
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(
+                f"synchronous must be one of {SYNCHRONOUS_LEVELS}, "
+                f"not {synchronous!r}"
+            )
+        self.path = path
+        # Autocommit mode: transactions are opened by ``begin`` only. The
+        # store may be handed to another thread, as long as one thread uses
+        # it at a time (e.g. ``server.IngestServer``'s ingest thread).
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA synchronous={synchronous}")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._depth = 0
+        self._statistics = CardinalityStatistics()
+        self._load_statistics()
+        self.bloom_error_rate = bloom_error_rate
+        self._bloom: Optional[BloomFilter] = None
+        self.rebuild_filter()
+
+    def _load_statistics(self):
+        execute = self._connection.execute
+        entity_counts = {}
+        for type_name, count in execute(
+            "SELECT entity_type, COUNT(*) FROM entities GROUP BY entity_type"
+        ):
+            entity_counts[REGISTRY.entity_types[type_name]] = count
+        edge_counts = {}
+        for (
+            relationship,
+            source_type,
+            target_type,
+            edges,
+            sources,
+            targets,
+        ) in execute(
+            "SELECT relationship, source_type, target_type, COUNT(*), "
+            "COUNT(DISTINCT source_id), COUNT(DISTINCT target_id) "
+            "FROM edges GROUP BY relationship, source_type, target_type"
+        ):
+            edge_counts[
+                (
+                    REGISTRY.relationships[relationship],
+                    REGISTRY.entity_types[source_type],
+                    REGISTRY.entity_types[target_type],
+                )
+            ] = (edges, sources, targets)
+        self._statistics.add_counts(entity_counts, edge_counts)
+
+    def rebuild_filter(self):
+        """
+        Rebuilds the negative-lookup filter from the database, sized for
+        twice the keys it holds now.
+        """
+        if self.bloom_error_rate is None:
+            return
+        start = time.perf_counter()
+        execute = self._connection.execute
+        count = (
+            execute("SELECT COUNT(*) FROM attributes").fetchone()[0]
+            + execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+        )
+        bloom = BloomFilter(
+            max(count * 2, BLOOM_MIN_CAPACITY), self.bloom_error_rate
+        )
+        for key in execute(
+            "SELECT entity_type, entity_id, attribute FROM attributes"
+        ):
+            bloom.add(key)
+        for key in execute("SELECT entity_type, entity_id FROM entities"):
+            bloom.add(key)
+        self._bloom = bloom
+        if METRICS.enabled:
+            METRICS.observe("stage.bloom_rebuild", time.perf_counter() - start)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(
+                "Rebuilt negative-lookup filter: %d keys, %d bytes",
+                len(bloom),
+                bloom.size_bytes(),
+            )
+
+    def compact(self):
+        """
+        Rewrites the database without free pages, checkpoints the
+        write-ahead log and rebuilds the negative-lookup filter.
+        """
+        if self._depth:
+            raise RuntimeError("Can not compact inside a transaction")
+        self._connection.execute("VACUUM")
+        if self.path != ":memory:":
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.rebuild_filter()
+
+    def begin_bulk(self):
+        super().begin_bulk()
+        # Rebuilt in one pass each by ``build_deferred_indexes``, along
+        # with the edge statistics, which need ``edges_in`` to maintain.
+        self._connection.execute("DROP INDEX IF EXISTS edges_in")
+        self._bloom = None
+
+    def build_deferred_indexes(self):
+        self._connection.execute(_EDGES_IN)
+        self._statistics = CardinalityStatistics()
+        self._load_statistics()
+        self.rebuild_filter()
+        # Cached plans were costed with the old statistics.
+        self.index_version += 1
+
+    def _maybe_absent(self, key) -> bool:
+        """
+        Whether the filter rules ``key`` out, so it is not in the store.
+        """
+        if self._bloom is None or key in self._bloom:
+            return False
+        if METRICS.enabled:
+            METRICS.inc("fact_store.bloom.skipped")
+        return True
+
+    def close(self):
+        """
+        Commits any open transaction and closes the database.
+        """
+        if self._depth:
+            self._connection.execute("COMMIT")
+            self._depth = 0
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def begin(self):
+        self._depth += 1
+        if self._depth == 1:
+            self._connection.execute("BEGIN")
+
+    def commit(self):
+        self._depth -= 1
+        if not self._depth:
+            self._connection.execute("COMMIT")
+
+    # Writes
+
+    def _add_entity(self, type_name: str, entity_id: bytes, entity_type):
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO entities VALUES (?, ?)",
+            (type_name, entity_id),
+        )
+        if cursor.rowcount == 1:
+            self._statistics.observe_entity(entity_type)
+            if self._bloom is not None:
+                self._bloom.add((type_name, entity_id))
+
+    def _has_edge(self, direction: str, type_name, entity_id, relationship):
+        if direction == "out":
+            query = (
+                "SELECT COUNT(*) FROM (SELECT 1 FROM edges "
+                "WHERE source_type = ? AND source_id = ? "
+                "AND relationship = ? LIMIT 2)"
+            )
+        else:
+            query = (
+                "SELECT COUNT(*) FROM (SELECT 1 FROM edges "
+                "WHERE target_type = ? AND target_id = ? "
+                "AND relationship = ? LIMIT 2)"
+            )
+        return self._connection.execute(
+            query, (type_name, entity_id, relationship)
+        ).fetchone()[0]
+
+    def put(self, fact: Fact):
+        if isinstance(fact, AttributeFact):
+            type_name = fact.entity_type.__name__
+            entity_id = _key(fact.entity_id)
+            attribute_name = fact.attribute.__name__
+            self._add_entity(type_name, entity_id, fact.entity_type)
+            fact_uuid = getattr(fact, "uuid", None)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO attributes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    type_name,
+                    entity_id,
+                    attribute_name,
+                    _key(fact.value),
+                    None if fact_uuid is None else fact_uuid.bytes,
+                    _timestamp(fact),
+                ),
+            )
+            if self._bloom is not None:
+                self._bloom.add((type_name, entity_id, attribute_name))
+                if self._bloom.saturated:
+                    self.rebuild_filter()
+        elif isinstance(fact, RelationshipFact):
+            source_type = fact.source_entity_type.__name__
+            source_id = _key(fact.source_entity_id)
+            target_type = fact.target_entity_type.__name__
+            target_id = _key(fact.target_entity_id)
+            relationship = fact.relationship.__name__
+            self._add_entity(source_type, source_id, fact.source_entity_type)
+            self._add_entity(target_type, target_id, fact.target_entity_type)
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO edges VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    source_type,
+                    source_id,
+                    relationship,
+                    target_type,
+                    target_id,
+                    _timestamp(fact),
+                ),
+            )
+            if cursor.rowcount == 1 and not self.bulk:
+                self._statistics.observe_edge(
+                    fact.relationship,
+                    fact.source_entity_type,
+                    fact.target_entity_type,
+                    new_source=self._has_edge(
+                        "out", source_type, source_id, relationship
+                    )
+                    == 1,
+                    new_target=self._has_edge(
+                        "in", target_type, target_id, relationship
+                    )
+                    == 1,
+                )
+        else:
+            raise TypeError("Tried to put a non-Fact into the store.")
+
+    # Reads
+
+    @staticmethod
+    def _attribute_fact(
+        entity_type, entity_id, attribute, value, raw_uuid, created_at
+    ) -> AttributeFact:
+        # Built without ``__init__``, which would mint a new uuid.
+        fact = AttributeFact.__new__(AttributeFact)
+        fact.entity_type = entity_type
+        fact.entity_id = entity_id
+        fact.attribute = attribute
+        fact.value = pickle.loads(value)
+        fact.uuid = None if raw_uuid is None else UUID(bytes=raw_uuid)
+        fact.created_at = _datetime(created_at)
+        return fact
+
+    def _get_attribute(self, entity_type=None, attribute=None, entity_id=None):
+        key = (entity_type.__name__, _key(entity_id), attribute.__name__)
+        if self._maybe_absent(key):
+            return __MISSING__
+        found = self._connection.execute(
+            "SELECT value, uuid, created_at FROM attributes "
+            "WHERE entity_type = ? AND entity_id = ? AND attribute = ?",
+            key,
+        ).fetchone()
+        if found is None:
+            return __MISSING__
+        return self._attribute_fact(entity_type, entity_id, attribute, *found)
+
+    def _get_entity(self, entity_type, entity_id) -> Dict[Any, AttributeFact]:
+        out = {}
+        key = (entity_type.__name__, _key(entity_id))
+        if self._maybe_absent(key):
+            return out
+        for attribute_name, *found in self._connection.execute(
+            "SELECT attribute, value, uuid, created_at FROM attributes "
+            "WHERE entity_type = ? AND entity_id = ?",
+            key,
+        ):
+            attribute = REGISTRY.attributes[attribute_name]
+            out[attribute] = self._attribute_fact(
+                entity_type, entity_id, attribute, *found
+            )
+        return out
+
+    def has_entity(self, entity_type, entity_id) -> bool:
+        key = (entity_type.__name__, _key(entity_id))
+        if self._maybe_absent(key):
+            return False
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM entities "
+                "WHERE entity_type = ? AND entity_id = ?",
+                key,
+            ).fetchone()
+            is not None
+        )
+
+    def entity_ids(self, entity_type=None) -> Iterator[Any]:
+        if entity_type is None:
+            return
+        for (entity_id,) in self._connection.execute(
+            "SELECT entity_id FROM entities WHERE entity_type = ? "
+            "ORDER BY rowid",
+            (entity_type.__name__,),
+        ).fetchall():
+            yield pickle.loads(entity_id)
+
+    def edges(
+        self,
+        relationship=None,
+        entity_type=None,
+        entity_id=None,
+        direction: str = "out",
+    ) -> Iterator[RelationshipFact]:
+        if direction == "out":
+            query = (
+                "SELECT relationship, target_type, target_id, created_at "
+                "FROM edges WHERE source_type = ? AND source_id = ?"
+            )
+        else:
+            query = (
+                "SELECT relationship, source_type, source_id, created_at "
+                "FROM edges WHERE target_type = ? AND target_id = ?"
+            )
+        parameters = [entity_type.__name__, _key(entity_id)]
+        if relationship is not None:
+            query += " AND relationship = ?"
+            parameters.append(relationship.__name__)
+        for relationship_name, other_type, other_id, created_at in (
+            self._connection.execute(query, parameters).fetchall()
+        ):
+            fact = RelationshipFact.__new__(RelationshipFact)
+            fact.relationship = REGISTRY.relationships[relationship_name]
+            other_type = REGISTRY.entity_types[other_type]
+            other_id = pickle.loads(other_id)
+            if direction == "out":
+                fact.source_entity_type = entity_type
+                fact.source_entity_id = entity_id
+                fact.target_entity_type = other_type
+                fact.target_entity_id = other_id
+            else:
+                fact.source_entity_type = other_type
+                fact.source_entity_id = other_id
+                fact.target_entity_type = entity_type
+                fact.target_entity_id = entity_id
+            fact.created_at = _datetime(created_at)
+            yield fact
+
+    def statistics(self) -> CardinalityStatistics:
+        return self._statistics
+
+    def __iter__(self):
+        for (
+            type_name,
+            entity_id,
+            attribute_name,
+            *found,
+        ) in self._connection.execute(
+            "SELECT entity_type, entity_id, attribute, value, uuid, "
+            "created_at FROM attributes"
+        ).fetchall():
+            yield self._attribute_fact(
+                REGISTRY.entity_types[type_name],
+                pickle.loads(entity_id),
+                REGISTRY.attributes[attribute_name],
+                *found,
+            )
+        for type_name, entity_id in self._connection.execute(
+            "SELECT DISTINCT source_type, source_id FROM edges"
+        ).fetchall():
+            yield from self.edges(
+                entity_type=REGISTRY.entity_types[type_name],
+                entity_id=pickle.loads(entity_id),
+            )
@@ -0,0 +1,424 @@
+"""
+Standing ``MATCH`` queries, maintained incrementally as facts arrive.
+
+A ``StandingQuery`` keeps, per pattern variable, the entities that pass the
+node's type and constraints (its alpha memory) and, per pattern edge, the
+stored edges whose endpoints are both in the alpha memories of its
+variables, indexed by source and by target. A new fact only touches the
+memories of the entities it mentions; result rows are then found by joining
+outward from the changed binding through the edge memories, so the work per
+fact is proportional to the partial matches it affects rather than to the
+size of the store. The current rows are kept by key, and subscribers are
+called with only the rows that were added and removed.
+
+Register one with ``FactStore.subscribe``::
+
+    standing = store.subscribe(
+        "MATCH (a:Person)-[r:LivesIn]->(b:State) WHERE b = 'FL'",
+        lambda added, removed: print(added, removed),
+    )
+"""
+from __future__ import annotations
+
+import collections
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from fact import AttributeFact, RelationshipFact
+from fact_store import _edge_key
+from operators import (
+    AttributeConstraint,
+    EntityRef,
+    QueryError,
+    _entity_types_for,
+)
+from planner import Plan, PatternEdge, PatternNode, plan
+from query import compile_query
+
+LOGGER = logging.getLogger(__name__)
+
+Subscriber = Callable[[List[dict], List[dict]], None]
+
+
+class _EdgeMemory:
+    """
+    Stored edges matching one pattern edge, by source and by target.
+    """
+
+    def __init__(self):
+        # EntityRef -> edge key -> fact
+        self.outgoing: Dict[EntityRef, Dict[tuple, RelationshipFact]] = (
+            collections.defaultdict(dict)
+        )
+        self.incoming: Dict[EntityRef, Dict[tuple, RelationshipFact]] = (
+            collections.defaultdict(dict)
+        )
+
+    def add(self, source: EntityRef, target: EntityRef, fact) -> bool:
+        key = _edge_key(fact)
+        outgoing = self.outgoing[source]
+        new = key not in outgoing
+        outgoing[key] = fact
+        self.incoming[target][key] = fact
+        return new
+
+    def discard(self, source: EntityRef, target: EntityRef, fact) -> bool:
+        key = _edge_key(fact)
+        outgoing = self.outgoing.get(source)
+        if not outgoing or outgoing.pop(key, None) is None:
+            return False
+        if not outgoing:
+            del self.outgoing[source]
+        incoming = self.incoming.get(target)
+        if incoming is not None:
+            incoming.pop(key, None)
+            if not incoming:
+                del self.incoming[target]
+        return True
+
+    def discard_entity(self, entity: EntityRef, as_source: bool):
+        by_entity, other_side = (
+            (self.outgoing, self.incoming)
+            if as_source
+            else (self.incoming, self.outgoing)
+        )
+        for key, fact in by_entity.pop(entity, {}).items():
+            if as_source:
+                other = EntityRef(
+                    fact.target_entity_type, fact.target_entity_id
+                )
+            else:
+                other = EntityRef(
+                    fact.source_entity_type, fact.source_entity_id
+                )
+            other_edges = other_side.get(other)
+            if other_edges is not None:
+                other_edges.pop(key, None)
+                if not other_edges:
+                    del other_side[other]
+
+
+class StandingQuery:
+    """
+    A pattern whose result rows are kept current against ``store``.
+    ``query`` is query text, a parsed AST or a ``Plan``.
+    """
+
+    def __init__(self, store, query):
+        if isinstance(query, str):
+            query = compile_query(query)
+        elif not isinstance(query, Plan):
+            query = plan(query)
+        if query.limit is not None:
+            raise QueryError("Standing queries do not support LIMIT")
+        nodes, edges = query.nodes, query.edges
+        if any(edge.variable_length for edge in edges):
+            raise QueryError(
+                "Standing queries do not support variable-length "
+                "relationships"
+            )
+        self.store = store
+        self.nodes: Dict[str, PatternNode] = nodes
+        self.edges: List[PatternEdge] = edges
+        self.subscribers: List[Subscriber] = []
+        self._alpha: Dict[str, set] = {variable: set() for variable in nodes}
+        self._memories = [_EdgeMemory() for _ in edges]
+        # variable -> indices of the pattern edges it is an endpoint of
+        self._incident: Dict[str, List[int]] = collections.defaultdict(list)
+        for index, edge in enumerate(edges):
+            self._incident[edge.source].append(index)
+            if edge.target != edge.source:
+                self._incident[edge.target].append(index)
+        # attribute class -> variables constrained on it
+        self._watched: Dict[Any, List[str]] = collections.defaultdict(list)
+        # Variables with no attribute constraints, which an entity can
+        # start matching just by appearing in the store.
+        self._entity_only: List[str] = []
+        for variable, node in nodes.items():
+            for constraint in node.constraints:
+                if isinstance(constraint, AttributeConstraint):
+                    self._watched[constraint.attribute].append(variable)
+            if not any(
+                isinstance(constraint, AttributeConstraint)
+                for constraint in node.constraints
+            ):
+                self._entity_only.append(variable)
+        self._rows: Dict[tuple, dict] = {}
+        self._load()
+
+    def subscribe(self, subscriber: Subscriber) -> Subscriber:
+        """
+        Calls ``subscriber(added, removed)`` whenever the rows change.
+        """
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """
+        Stops calling ``subscriber``.
+        """
+        self.subscribers.remove(subscriber)
+
+    def rows(self) -> List[dict]:
+        """
+        The current result rows.
+        """
+        return list(self._rows.values())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def reload(self) -> Tuple[List[dict], List[dict]]:
+        """
+        Re-evaluates the query against the whole store, for writes it did
+        not observe (a bulk load), and notifies subscribers of the rows
+        that changed. Returns ``(added, removed)`` rows.
+        """
+        old_rows = self._rows
+        self._alpha = {variable: set() for variable in self.nodes}
+        self._memories = [_EdgeMemory() for _ in self.edges]
+        self._rows = {}
+        self._load()
+        added = [row for key, row in self._rows.items() if key not in old_rows]
+        removed = [
+            row for key, row in old_rows.items() if key not in self._rows
+        ]
+        if added or removed:
+            for subscriber in list(self.subscribers):
+                subscriber(added, removed)
+        return added, removed
+
+    def _passes(self, variable: str, entity: EntityRef) -> bool:
+        node = self.nodes[variable]
+        if (
+            node.entity_type is not None
+            and entity.entity_type is not node.entity_type
+        ):
+            return False
+        if not self.store.has_entity(entity.entity_type, entity.entity_id):
+            return False
+        return all(
+            constraint(self.store, entity.entity_type, entity.entity_id)
+            for constraint in node.constraints
+        )
+
+    def _edge_matches(self, index: int, fact: RelationshipFact) -> bool:
+        relationship = self.edges[index].relationship
+        return relationship is None or fact.relationship is relationship
+
+    def _load(self):
+        for variable, node in self.nodes.items():
+            alpha = self._alpha[variable]
+            for entity_type in _entity_types_for(node.entity_type):
+                for entity_id in self.store.entity_ids(entity_type):
+                    entity = EntityRef(entity_type, entity_id)
+                    if self._passes(variable, entity):
+                        alpha.add(entity)
+        for index, edge in enumerate(self.edges):
+            targets = self._alpha[edge.target]
+            for source in self._alpha[edge.source]:
+                for fact in self.store.edges(
+                    relationship=edge.relationship,
+                    entity_type=source.entity_type,
+                    entity_id=source.entity_id,
+                    direction="out",
+                ):
+                    target = EntityRef(
+                        fact.target_entity_type, fact.target_entity_id
+                    )
+                    if target in targets:
+                        self._memories[index].add(source, target, fact)
+        for key, row in self._join({}, {}):
+            self._rows[key] = row
+
+    def _join(
+        self, binding: Dict[str, EntityRef], chosen: Dict[int, Any]
+    ) -> Iterator[Tuple[tuple, dict]]:
+        """
+        Every complete ``(key, row)`` extending ``binding`` (variable ->
+        entity) and ``chosen`` (pattern edge index -> fact).
+        """
+        remaining = [
+            index for index in range(len(self.edges)) if index not in chosen
+        ]
+        if not remaining:
+            unbound = [name for name in self.nodes if name not in binding]
+            if unbound:
+                variable = unbound[0]
+                for entity in list(self._alpha[variable]):
+                    yield from self._join(
+                        {**binding, variable: entity}, chosen
+                    )
+                return
+            yield self._row(binding, chosen)
+            return
+        for index in remaining:
+            edge = self.edges[index]
+            if edge.source in binding or edge.target in binding:
+                break
+        else:
+            # Nothing bound touches the remaining edges: seed from an alpha
+            # memory (the first call, or a disconnected pattern).
+            variable = self.edges[remaining[0]].source
+            for entity in list(self._alpha[variable]):
+                yield from self._join({**binding, variable: entity}, chosen)
+            return
+        memory = self._memories[index]
+        outgoing = edge.source in binding
+        if outgoing:
+            facts = memory.outgoing.get(binding[edge.source], {})
+        else:
+            facts = memory.incoming.get(binding[edge.target], {})
+        for fact in list(facts.values()):
+            source = EntityRef(fact.source_entity_type, fact.source_entity_id)
+            target = EntityRef(fact.target_entity_type, fact.target_entity_id)
+            if binding.get(edge.source, source) != source:
+                continue
+            if binding.get(edge.target, target) != target:
+                continue
+            yield from self._join(
+                {**binding, edge.source: source, edge.target: target},
+                {**chosen, index: fact},
+            )
+
+    def _row(self, binding, chosen) -> Tuple[tuple, dict]:
+        key = tuple(binding[variable] for variable in self.nodes) + tuple(
+            _edge_key(chosen[index]) for index in range(len(self.edges))
+        )
+        row = dict(binding)
+        for index, edge in enumerate(self.edges):
+            if edge.variable is not None:
+                row[edge.variable] = chosen[index]
+        return key, row
+
+    def _enter(self, variable: str, entity: EntityRef, added: list):
+        self._alpha[variable].add(entity)
+        for index in self._incident[variable]:
+            edge = self.edges[index]
+            for direction, endpoint in (
+                ("out", edge.source),
+                ("in", edge.target),
+            ):
+                if endpoint != variable:
+                    continue
+                for fact in self.store.edges(
+                    relationship=edge.relationship,
+                    entity_type=entity.entity_type,
+                    entity_id=entity.entity_id,
+                    direction=direction,
+                ):
+                    source = EntityRef(
+                        fact.source_entity_type, fact.source_entity_id
+                    )
+                    target = EntityRef(
+                        fact.target_entity_type, fact.target_entity_id
+                    )
+                    if (
+                        source in self._alpha[edge.source]
+                        and target in self._alpha[edge.target]
+                    ):
+                        self._memories[index].add(source, target, fact)
+        for key, row in self._join({variable: entity}, {}):
+            if key not in self._rows:
+                self._rows[key] = row
+                added.append(row)
+
+    def _leave(self, variable: str, entity: EntityRef, removed: list):
+        for key, row in self._join({variable: entity}, {}):
+            if self._rows.pop(key, None) is not None:
+                removed.append(row)
+        for index in self._incident[variable]:
+            edge = self.edges[index]
+            if edge.source == variable:
+                self._memories[index].discard_entity(entity, as_source=True)
+            if edge.target == variable:
+                self._memories[index].discard_entity(entity, as_source=False)
+        self._alpha[variable].discard(entity)
+
+    def _check(self, variable: str, entity: EntityRef, added, removed):
+        member = entity in self._alpha[variable]
+        passes = self._passes(variable, entity)
+        if passes and not member:
+            self._enter(variable, entity, added)
+        elif member and not passes:
+            self._leave(variable, entity, removed)
+
+    def observe(self, fact) -> Tuple[List[dict], List[dict]]:
+        """
+        Updates the memories for a fact just written to the store and
+        notifies subscribers. Returns ``(added, removed)`` rows.
+        """
+        added: List[dict] = []
+        removed: List[dict] = []
+        if isinstance(fact, AttributeFact):
+            entity = EntityRef(fact.entity_type, fact.entity_id)
+            for variable in self._watched.get(fact.attribute, ()):
+                self._check(variable, entity, added, removed)
+            for variable in self._entity_only:
+                if entity not in self._alpha[variable]:
+                    self._check(variable, entity, added, removed)
+        elif isinstance(fact, RelationshipFact):
+            source = EntityRef(fact.source_entity_type, fact.source_entity_id)
+            target = EntityRef(fact.target_entity_type, fact.target_entity_id)
+            for variable in self._entity_only:
+                for entity in (source, target):
+                    if entity not in self._alpha[variable]:
+                        self._check(variable, entity, added, removed)
+            for index, edge in enumerate(self.edges):
+                if not self._edge_matches(index, fact):
+                    continue
+                if (
+                    source not in self._alpha[edge.source]
+                    or target not in self._alpha[edge.target]
+                ):
+                    continue
+                if not self._memories[index].add(source, target, fact):
+                    continue
+                for key, row in self._join(
+                    {edge.source: source, edge.target: target}, {index: fact}
+                ):
+                    if key not in self._rows:
+                        self._rows[key] = row
+                        added.append(row)
+        self._publish(added, removed)
+        return added, removed
+
+    def retract(self, fact) -> Tuple[List[dict], List[dict]]:
+        """
+        Updates the memories for a fact just removed from the store (it
+        expired) and notifies subscribers. Returns ``(added, removed)``
+        rows.
+        """
+        if isinstance(fact, AttributeFact):
+            # Constraints are checked against the store, which no longer
+            # has the value.
+            return self.observe(fact)
+        removed: List[dict] = []
+        source = EntityRef(fact.source_entity_type, fact.source_entity_id)
+        target = EntityRef(fact.target_entity_type, fact.target_entity_id)
+        key = _edge_key(fact)
+        for index, edge in enumerate(self.edges):
+            if not self._edge_matches(index, fact):
+                continue
+            memory = self._memories[index]
+            if key not in memory.outgoing.get(source, ()):
+                continue
+            for row_key, row in self._join(
+                {edge.source: source, edge.target: target}, {index: fact}
+            ):
+                if self._rows.pop(row_key, None) is not None:
+                    removed.append(row)
+            memory.discard(source, target, fact)
+        self._publish([], removed)
+        return [], removed
+
+    def _publish(self, added: List[dict], removed: List[dict]):
+        if added or removed:
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug(
+                    "Standing query: %d added, %d removed",
+                    len(added),
+                    len(removed),
+                )
+            for subscriber in list(self.subscribers):
+                subscriber(added, removed)
@@ -0,0 +1,148 @@
+"""
+Shared fixtures: generated CDC messages, sessions over each fact store
+backend, and a plain-data view of a store to compare stores with.
+"""
+from __future__ import annotations
+
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, beside ``tests``.
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+# pylint: disable=wrong-import-position
+from benchmarks.generator import CDCGenerator, build_roundabout
+from caching import CachingFactStore
+from entities import Person, State
+from fact_store import MemoryFactStore
+from query import execute
+from session import Session
+from sqlite_fact_store import SqliteFactStore
+
+TABLES = 2
+
+
+def _backends(tmp_path) -> dict:
+    def sqlite_kwargs(name="facts.db"):
+        return {"path": str(tmp_path / name)}
+
+    return {
+        "memory": (MemoryFactStore, {}),
+        # Small enough to spill many times over.
+        "memory+spill": (
+            MemoryFactStore,
+            {"memory_budget": 50_000, "spill_directory": str(tmp_path)},
+        ),
+        "sqlite": (SqliteFactStore, sqlite_kwargs()),
+        # Small enough that rows are evicted and batches flushed often.
+        "sqlite+cache": (
+            CachingFactStore,
+            {
+                "fact_store_cls": SqliteFactStore,
+                "fact_store_kwargs": sqlite_kwargs(),
+                "cache_size": 4,
+                "max_pending": 16,
+            },
+        ),
+    }
+
+
+BACKENDS = ["memory", "memory+spill", "sqlite", "sqlite+cache"]
+
+
+@pytest.fixture(scope="session")
+def messages():
+    return list(
+        CDCGenerator(
+            seed=7,
+            entity_cardinality=100,
+            update_ratio=0.6,
+            table_count=TABLES,
+        )(700)
+    )
+
+
+# Patterns that every store should answer the way the memory store does.
+QUERIES = [
+    "MATCH (a:Person)-->(b:State)",
+    "MATCH (a:Person)-->(b:State) WHERE b = 'FL'",
+    "MATCH (a:Person)-[r:LivesIn]->(b:State) WHERE a = 3",
+]
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    """
+    Builds a ``Session`` over a backend named in ``BACKENDS``, or over a
+    fact store class and its keyword arguments.
+    """
+    sessions = []
+
+    def make(backend, fact_store_kwargs=None):
+        if isinstance(backend, str):
+            fact_store_cls, fact_store_kwargs = _backends(tmp_path)[backend]
+        else:
+            fact_store_cls = backend
+        session = Session(
+            fact_store_cls=fact_store_cls,
+            fact_store_kwargs=fact_store_kwargs,
+            message_roundabout=build_roundabout(TABLES),
+            message_loader=None,
+        )
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        close = getattr(session.fact_store, "close", None)
+        if close is not None:
+            close()
+
+
+@pytest.fixture
+def memory_store(make_session, messages):
+    """
+    A ``MemoryFactStore`` holding ``messages``, to compare other stores
+    with.
+    """
+    session = make_session("memory")
+    session.ingest(messages)
+    return session.fact_store
+
+
+def entity_state(store, entity_types=(Person, State)) -> dict:
+    """
+    (entity type name, entity id) -> attribute name -> value, for every
+    entity with attributes.
+    """
+    state = {}
+    for entity_type in entity_types:
+        for entity_id in set(store.entity_ids(entity_type)):
+            row = store.get_entity(entity_type, entity_id)
+            if row:
+                state[(entity_type.__name__, entity_id)] = {
+                    attribute.__name__: fact.value
+                    for attribute, fact in row.items()
+                }
+    return state
+
+
+def comparable_rows(rows) -> list:
+    """
+    ``rows`` as sorted, comparable tuples.
+    """
+    return sorted(
+        tuple(sorted((name, repr(value)) for name, value in row.items()))
+        for row in rows
+    )
+
+
+def query_rows(store, query) -> list:
+    """
+    The rows of ``query`` as sorted, comparable tuples.
+    """
+    return comparable_rows(execute(store, query))
@@ -0,0 +1,94 @@
+"""
+Aggregate attributes: the example aggregates in ``benchmarks.aggregates``
+agree between backends, sharded stores included, and windows decay.
+"""
+import importlib
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import BACKENDS, entity_state
+from entities import Person
+from fact import AttributeFact
+from registry import REGISTRY
+from sharded import ShardedFactStore
+
+
+@pytest.fixture
+def example_aggregates():
+    """
+    Declares the example aggregates for one test.
+    """
+    module = importlib.import_module("benchmarks.aggregates")
+    functions = (module.Person__NameUpdates, module.State__ResidentCount)
+    for function in functions:
+        REGISTRY.register_aggregate_function(function)
+    yield module
+    for function in functions:
+        REGISTRY.aggregate_functions.pop(function._function_name, None)
+
+
+def _replay(session, messages):
+    for message in messages:
+        session(message)
+    return entity_state(session.fact_store)
+
+
+def _values(state, attribute):
+    return {
+        key: row[attribute] for key, row in state.items() if attribute in row
+    }
+
+
+@pytest.mark.parametrize("backend", BACKENDS[1:])
+def test_backends_agree(make_session, messages, example_aggregates, backend):
+    expected = _replay(make_session("memory"), messages)
+    assert _values(expected, "ResidentCount")
+    assert _values(expected, "NameUpdates")
+    assert _replay(make_session(backend), messages) == expected
+
+
+def test_sharded_matches_memory(make_session, messages, example_aggregates):
+    expected = _replay(make_session("memory"), messages)
+    sharded = _replay(
+        make_session(ShardedFactStore, {"shard_count": 3}), messages
+    )
+    for attribute in ("ResidentCount", "NameUpdates"):
+        assert _values(sharded, attribute) == _values(expected, attribute)
+
+
+def test_resident_count_counts_distinct_people(
+    make_session, messages, example_aggregates
+):
+    store = make_session("memory").fact_store
+    for message in messages:
+        store.session(message)
+    state = entity_state(store)
+    residents = {}
+    for edge in store:
+        if getattr(edge, "relationship", None) is not None:
+            residents.setdefault(edge.target_entity_id, set()).add(
+                edge.source_entity_id
+            )
+    assert _values(state, "ResidentCount") == {
+        ("State", state_id): len(people)
+        for state_id, people in residents.items()
+    }
+
+
+def test_window_decays(make_session, example_aggregates):
+    store = make_session("memory").fact_store
+    created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for _ in range(3):
+        fact = AttributeFact(
+            entity_type=Person,
+            attribute=REGISTRY.attributes["FirstName"],
+            entity_id=1,
+            value="Alice",
+        )
+        fact.created_at = created_at
+        store(fact)
+    name_updates = example_aggregates.NameUpdates
+    assert store.get_attribute(Person, name_updates, 1).value == 3
+    store.advance_aggregates(created_at.timestamp() + 3600 + 60)
+    assert store.get_attribute(Person, name_updates, 1).value == 0
@@ -0,0 +1,32 @@
+"""
+``Session.backfill`` leaves every backend holding what replaying the same
+messages one by one does, derived attributes included.
+"""
+import pytest
+
+from conftest import BACKENDS, entity_state
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backfill_matches_replay(make_session, messages, backend):
+    replayed = make_session(backend)
+    for message in messages:
+        replayed(message)
+    backfilled = make_session(backend)
+    assert backfilled.backfill(messages, batch_size=100) == len(messages)
+    assert entity_state(backfilled.fact_store) == entity_state(
+        replayed.fact_store
+    )
+
+
+def test_backfill_persists_on_cached_sqlite(make_session, messages):
+    replayed = make_session("sqlite")
+    for message in messages:
+        replayed(message)
+    backfilled = make_session("sqlite+cache")
+    backfilled.backfill(messages, batch_size=100)
+    backfilled.fact_store.flush()
+    # What reached the database, not what the wrapper caches.
+    assert entity_state(backfilled.fact_store.backend) == entity_state(
+        replayed.fact_store
+    )
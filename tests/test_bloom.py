@@ -0,0 +1,150 @@
+"""
+``BloomFilter`` and the sqlite store's negative-lookup filter: a key that
+was added is never ruled out, including after the filter is rebuilt on
+``compact`` or when it saturates.
+"""
+import pytest
+
+import sqlite_fact_store
+from attribute import Attribute, LivesIn
+from bloom import BloomFilter
+from conftest import entity_state
+from entities import Person, State
+from fact import AttributeFact, RelationshipFact
+from fact_store import __MISSING__
+from sqlite_fact_store import SqliteFactStore
+
+
+class BloomTag(Attribute):
+    """
+    Nothing is derived from it.
+    """
+
+
+def test_added_keys_are_found():
+    # Shaped like the store's keys.
+    keys = [("Person", entity_id) for entity_id in range(11000)]
+    bloom = BloomFilter.from_keys(keys[:1000], capacity=1000)
+    assert all(key in bloom for key in keys[:1000])
+    false_positives = sum(key in bloom for key in keys[1000:])
+    # Sized for 1%.
+    assert false_positives < 300
+    assert not bloom.saturated
+
+
+def test_saturation_counts_distinct_keys():
+    bloom = BloomFilter(capacity=10)
+    for _ in range(3):
+        for key in range(10):
+            bloom.add(key)
+    assert len(bloom) <= 10 and not bloom.saturated
+    for key in range(10, 40):
+        bloom.add(key)
+    assert bloom.saturated
+
+
+@pytest.mark.parametrize(
+    "capacity, error_rate", [(0, 0.01), (10, 0.0), (10, 1.0)]
+)
+def test_bad_sizes(capacity, error_rate):
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, error_rate)
+
+
+@pytest.fixture
+def small_filter(monkeypatch):
+    # Small enough to saturate, and be rebuilt, many times.
+    monkeypatch.setattr(sqlite_fact_store, "BLOOM_MIN_CAPACITY", 8)
+
+
+@pytest.fixture
+def store(make_session, small_filter):
+    store = make_session("sqlite").fact_store
+    # Every read goes to the filter.
+    store.entity_cache = None
+    return store
+
+
+def _put(store, entity_id):
+    store(
+        AttributeFact(
+            entity_type=Person,
+            attribute=BloomTag,
+            entity_id=entity_id,
+            value=entity_id,
+        )
+    )
+    store(
+        RelationshipFact(
+            relationship=LivesIn,
+            source_entity_type=Person,
+            source_entity_id=entity_id,
+            target_entity_type=State,
+            target_entity_id=f"S{entity_id}",
+        )
+    )
+
+
+def _assert_found(store, entity_ids):
+    for entity_id in entity_ids:
+        fact = store.get_attribute(Person, BloomTag, entity_id)
+        assert fact is not __MISSING__ and fact.value == entity_id
+        assert store.get_entity(Person, entity_id)
+        assert store.has_entity(State, f"S{entity_id}")
+
+
+def test_no_false_negatives_across_saturation(store):
+    filters = set()
+    for entity_id in range(200):
+        _put(store, entity_id)
+        filters.add(id(store._bloom))
+        _assert_found(store, [entity_id])
+    # Rebuilt, at growing capacities, as it filled up.
+    assert len(filters) > 3
+    assert not store._bloom.saturated
+    _assert_found(store, range(200))
+
+
+def test_no_false_negatives_after_compact(store):
+    for entity_id in range(100):
+        _put(store, entity_id)
+    before = store._bloom
+    store.compact()
+    assert store._bloom is not before
+    _assert_found(store, range(100))
+    # Absent keys are still ruled out.
+    assert store._maybe_absent(("Person", b"missing", "BloomTag"))
+    assert store.get_attribute(Person, BloomTag, 1000) is __MISSING__
+    assert not store.has_entity(Person, 1000)
+
+
+def test_no_false_negatives_within_a_transaction(store):
+    store.begin()
+    for entity_id in range(100):
+        _put(store, entity_id)
+    _assert_found(store, range(100))
+    store.commit()
+    _assert_found(store, range(100))
+
+
+def test_filter_is_rebuilt_on_reopen(store):
+    for entity_id in range(50):
+        _put(store, entity_id)
+    store.close()
+    reopened = SqliteFactStore(path=store.path)
+    reopened.entity_cache = None
+    try:
+        _assert_found(reopened, range(50))
+    finally:
+        reopened.close()
+
+
+def test_no_false_negatives_after_bulk_load(
+    make_session, memory_store, messages, small_filter
+):
+    session = make_session("sqlite")
+    session.ingest(messages)
+    store = session.fact_store
+    store.entity_cache = None
+    assert store._bloom is not None
+    assert entity_state(store) == entity_state(memory_store)
@@ -0,0 +1,79 @@
+"""
+``CachingFactStore``: reads through the row cache see every write, whether
+buffered or already flushed to the backend.
+"""
+from caching import CachingFactStore
+from fact_store import MemoryFactStore
+from sqlite_fact_store import SqliteFactStore
+
+from conftest import entity_state
+
+
+def test_reads_match_replay_on_memory(make_session, messages):
+    expected = make_session("memory")
+    cached = make_session("sqlite+cache")
+    for message in messages:
+        expected(message)
+        cached(message)
+    assert entity_state(cached.fact_store) == entity_state(
+        expected.fact_store
+    )
+
+
+def test_reads_after_flush_match_backend(make_session, messages, tmp_path):
+    session = make_session("sqlite+cache")
+    for message in messages:
+        session(message)
+    store = session.fact_store
+    store.flush()
+    state = entity_state(store)
+    store.entity_cache.clear()
+    assert entity_state(store) == state
+    assert entity_state(store.backend) == state
+
+
+def test_backend_row_cache_is_off(tmp_path):
+    store = CachingFactStore(
+        fact_store_cls=SqliteFactStore,
+        fact_store_kwargs={"path": str(tmp_path / "facts.db")},
+    )
+    try:
+        assert store.backend.entity_cache is None
+    finally:
+        store.close()
+    wrapped = CachingFactStore(fact_store_cls=MemoryFactStore)
+    assert wrapped.backend.entity_cache is None
+
+
+def test_writes_wait_for_a_full_batch(make_session, messages, tmp_path):
+    session = make_session(
+        CachingFactStore,
+        {
+            "fact_store_cls": SqliteFactStore,
+            "fact_store_kwargs": {"path": str(tmp_path / "facts.db")},
+            "max_pending": 10_000,
+            "max_age": None,
+        },
+    )
+    store = session.fact_store
+    session(messages[0])
+    assert store.pending_count()
+    assert not list(store.backend)
+    store.flush()
+    assert not store.pending_count()
+    assert list(store.backend)
+
+
+def test_flush_on_commit(make_session, messages, tmp_path):
+    session = make_session(
+        CachingFactStore,
+        {
+            "fact_store_cls": SqliteFactStore,
+            "fact_store_kwargs": {"path": str(tmp_path / "facts.db")},
+            "max_pending": 10_000,
+            "flush_on_commit": True,
+        },
+    )
+    session(messages[0])
+    assert not session.fact_store.pending_count()
+    assert list(session.fact_store.backend)
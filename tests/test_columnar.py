@@ -0,0 +1,124 @@
+"""
+Columnar export and ``ColumnarFactStore``: what is exported reads back the
+same, value columns of any kind included, and ``ColumnIndex`` answers
+range lookups like a scan.
+"""
+import operator
+
+import pytest
+
+from attribute import Attribute
+from columnar import ColumnarFactStore, export
+from conftest import QUERIES, entity_state, query_rows
+from entities import Person
+from fact import AttributeFact
+from registry import REGISTRY
+
+RELATIONS = {
+    "EQUALS": operator.eq,
+    "LT": operator.lt,
+    "LTE": operator.le,
+    "GT": operator.gt,
+    "GTE": operator.ge,
+}
+
+
+class ColumnarPayload(Attribute):
+    """
+    Values of mixed types, which go in an OBJECT column.
+    """
+
+
+class ColumnarScore(Attribute):
+    """
+    Ints with gaps, which go in an int64 column with nulls.
+    """
+
+
+@pytest.fixture
+def columnar(memory_store, tmp_path):
+    export(memory_store, str(tmp_path / "columns"))
+    store = ColumnarFactStore(str(tmp_path / "columns"))
+    yield store
+    store.close()
+
+
+def test_round_trip(columnar, memory_store):
+    assert entity_state(columnar) == entity_state(memory_store)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_memory(columnar, memory_store, query):
+    assert query_rows(columnar, query) == query_rows(memory_store, query)
+
+
+def _scan(store, attribute, relation, value):
+    test = RELATIONS[relation]
+    out = set()
+    for entity_id in store.entity_ids(Person):
+        fact = store.get_attribute(Person, attribute, entity_id)
+        if fact != "__MISSING__" and type(fact.value) is type(value):
+            if test(fact.value, value):
+                out.add(entity_id)
+    return out
+
+
+@pytest.mark.parametrize("relation", sorted(RELATIONS))
+@pytest.mark.parametrize(
+    "attribute, value", [("UserID", 40), ("FirstName", "Judy")]
+)
+def test_index_lookups_match_a_scan(
+    columnar, memory_store, relation, attribute, value
+):
+    attribute = REGISTRY.attributes[attribute]
+    index = columnar.attribute_index(attribute)
+    found = set(index.lookup(Person, relation, value))
+    assert found == _scan(memory_store, attribute, relation, value)
+    assert index.estimate(Person, relation, value) == len(found)
+
+
+def test_numeric_columns_are_typed_views(columnar):
+    rows, values = columnar.column(REGISTRY.attributes["UserID"], Person)
+    assert len(rows) == len(values) == len(list(columnar.entity_ids(Person)))
+    ids = columnar.ids(Person)
+    for row, value in zip(rows, values):
+        assert ids[row] == value
+
+
+@pytest.fixture
+def odd_values(make_session, tmp_path):
+    store = make_session("memory").fact_store
+    payloads = [None, {"a": 1}, 3, "x", (1, 2), 2.5]
+    scores = [1, None, 3, None, 5, 6]
+    for entity_id, (payload, score) in enumerate(zip(payloads, scores)):
+        for attribute, value in (
+            (ColumnarPayload, payload),
+            (ColumnarScore, score),
+        ):
+            store(
+                AttributeFact(
+                    entity_type=Person,
+                    attribute=attribute,
+                    entity_id=entity_id,
+                    value=value,
+                )
+            )
+    export(store, str(tmp_path / "odd"))
+    columnar = ColumnarFactStore(str(tmp_path / "odd"))
+    yield store, columnar
+    columnar.close()
+
+
+def test_object_and_null_values_round_trip(odd_values):
+    store, columnar = odd_values
+    assert entity_state(columnar) == entity_state(store)
+
+
+def test_null_columns_are_indexed(odd_values):
+    _, columnar = odd_values
+    index = columnar.attribute_index(ColumnarScore)
+    assert set(index.lookup(Person, "EQUALS", None)) == {1, 3}
+    assert set(index.lookup(Person, "GTE", 3)) == {2, 4, 5}
+    payloads = columnar.attribute_index(ColumnarPayload)
+    assert set(payloads.lookup(Person, "EQUALS", "x")) == {3}
+    assert set(payloads.lookup(Person, "EQUALS", (1, 2))) == {4}
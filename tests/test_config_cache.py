@@ -0,0 +1,33 @@
+"""
+The parsed-config cache: entries persist as JSON for later processes, and
+values JSON would change are parsed every time.
+"""
+import datetime
+
+from registry import _ConfigCache
+
+CONFIG = """
+route:
+  keypath: [metadata, table]
+  value_match: users
+"""
+
+
+def test_entries_are_read_back(tmp_path):
+    path = str(tmp_path / "configs.json")
+    cache = _ConfigCache(path)
+    parsed = cache(CONFIG)
+    cache.save()
+    reopened = _ConfigCache(path)
+    reopened._load()
+    assert list(reopened._entries.values()) == [parsed]
+    assert reopened(CONFIG) == parsed
+
+
+def test_values_json_would_change_are_not_cached(tmp_path):
+    cache = _ConfigCache(str(tmp_path / "configs.json"))
+    assert cache("when: 2020-01-02") == {"when": datetime.date(2020, 1, 2)}
+    assert cache("{1: one}") == {1: "one"}
+    cache.save()
+    assert not cache._entries
+    assert not (tmp_path / "configs.json").exists()
@@ -0,0 +1,129 @@
+"""
+``get_entity`` and ``EntityRowCache``: rows are kept in LRU order up to
+the cache size and follow the puts made through the store.
+"""
+import pytest
+
+from attribute import Attribute
+from entities import Person
+from fact import AttributeFact
+from fact_store import EntityRowCache
+
+
+class CachedName(Attribute):
+    """
+    Nothing is derived from it.
+    """
+
+
+class CachedScore(Attribute):
+    """
+    Nothing is derived from it.
+    """
+
+
+def _fact(entity_id, attribute, value):
+    return AttributeFact(
+        entity_type=Person,
+        attribute=attribute,
+        entity_id=entity_id,
+        value=value,
+    )
+
+
+def _values(row):
+    return {attribute: fact.value for attribute, fact in row.items()}
+
+
+def test_least_recently_used_rows_are_evicted():
+    cache = EntityRowCache(2)
+    cache.put((Person, 1), {})
+    cache.put((Person, 2), {})
+    assert cache.get((Person, 1)) == {}
+    cache.put((Person, 3), {})
+    assert cache.get((Person, 2)) is None
+    assert cache.get((Person, 1)) == cache.get((Person, 3)) == {}
+    assert len(cache) == 2
+
+
+def test_updates_only_touch_cached_rows():
+    cache = EntityRowCache(2)
+    cache.put((Person, 1), {})
+    cache.update(_fact(1, CachedName, "Ann"))
+    cache.update(_fact(2, CachedName, "Bo"))
+    assert _values(cache.get((Person, 1))) == {CachedName: "Ann"}
+    assert cache.get((Person, 2)) is None
+    cache.discard((Person, 1))
+    assert not len(cache)
+
+
+@pytest.fixture
+def store(make_session):
+    store = make_session("sqlite").fact_store
+    for entity_id in range(4):
+        store(_fact(entity_id, CachedName, f"name {entity_id}"))
+    reads = []
+    backend_read = store._get_entity
+
+    def counted(entity_type, entity_id):
+        reads.append(entity_id)
+        return backend_read(entity_type, entity_id)
+
+    store._get_entity = counted
+    store.reads = reads
+    return store
+
+
+def test_rows_are_read_once(store):
+    assert store.entity_cache is not None
+    for _ in range(3):
+        assert _values(store.get_entity(Person, 1)) == {CachedName: "name 1"}
+    assert store.reads == [1]
+
+
+def test_rows_follow_puts(store):
+    store.get_entity(Person, 1)
+    store(_fact(1, CachedName, "renamed"))
+    store(_fact(1, CachedScore, 7))
+    assert _values(store.get_entity(Person, 1)) == {
+        CachedName: "renamed",
+        CachedScore: 7,
+    }
+    assert store.reads == [1]
+    # Uncached rows are read whole on their next miss.
+    store(_fact(2, CachedScore, 8))
+    assert _values(store.get_entity(Person, 2)) == {
+        CachedName: "name 2",
+        CachedScore: 8,
+    }
+    assert store.reads == [1, 2]
+
+
+def test_evicted_rows_are_read_again(store):
+    store.entity_cache = EntityRowCache(2)
+    for entity_id in (0, 1, 0, 2, 0, 1):
+        store.get_entity(Person, entity_id)
+    # 1 was the least recently used when 2 was read.
+    assert store.reads == [0, 1, 2, 1]
+    assert len(store.entity_cache) == 2
+
+
+def test_returned_rows_are_copies(store):
+    row = store.get_entity(Person, 1)
+    row.clear()
+    assert _values(store.get_entity(Person, 1)) == {CachedName: "name 1"}
+
+
+def test_caching_store_rows_follow_puts(make_session):
+    store = make_session("sqlite+cache").fact_store
+    for entity_id in range(8):
+        store(_fact(entity_id, CachedName, f"name {entity_id}"))
+    store.flush()
+    for entity_id in range(8):
+        store(_fact(entity_id, CachedScore, entity_id))
+        assert _values(store.get_entity(Person, entity_id)) == {
+            CachedName: f"name {entity_id}",
+            CachedScore: entity_id,
+        }
+    # Fewer rows than entities fit in the cache.
+    assert len(store.entity_cache) == 4
@@ -0,0 +1,71 @@
+"""
+``EXPLAIN``: the planner starts from the most selective node and reports
+its estimates.
+"""
+import pytest
+
+from query import execute, explain
+from registry import REGISTRY
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, make_session, messages):
+    session = make_session(request.param)
+    session.ingest(messages)
+    return session.fact_store
+
+
+def _operators(store, query) -> list:
+    return [
+        line.split(": ", 1)[1] for line in explain(store, query).split("\n")
+    ]
+
+
+@pytest.mark.parametrize(
+    "query, start",
+    [
+        # An id is more selective than a scan of the other side.
+        ("MATCH (a:Person)-->(b:State) WHERE b = 'FL'", "NodeById(b:State"),
+        ("MATCH (b:State)<--(a:Person) WHERE a = 3", "NodeById(a:Person"),
+    ],
+)
+def test_selective_start(store, query, start):
+    operators = _operators(store, query)
+    assert operators[0].startswith(start)
+    assert len(operators) == 2 and operators[1].startswith("Expand")
+
+
+def test_index_replaces_the_filtered_scan(memory_store):
+    query = "MATCH (b:State)<--(a:Person) WHERE a.FirstName = 'Judy'"
+    assert _operators(memory_store, query)[0].startswith(
+        "NodeScan(a:Person) filter [FirstName = 'Judy']"
+    )
+    memory_store.create_index(REGISTRY.attributes["FirstName"])
+    assert _operators(memory_store, query)[0].startswith(
+        "IndexSeek(a:Person FirstName = 'Judy')"
+    )
+
+
+def test_estimates_are_reported(store):
+    first, second = explain(
+        store, "MATCH (a:Person)-->(b:State) WHERE b = 'FL'"
+    ).split("\n")
+    assert first.endswith("(estimated rows: 1.0)")
+    assert "(estimated rows: " in second
+
+
+def test_filter_is_checked_after_a_more_selective_start(store):
+    # Without an index, an attribute filter is checked while expanding
+    # rather than scanning every person for it.
+    operators = _operators(
+        store, "MATCH (a:Person)-->(b:State) WHERE b = 'FL', a.LuckyNumber = 7"
+    )
+    assert operators[0].startswith("NodeById(b:State")
+    assert "LuckyNumber = 7" in operators[1]
+
+
+def test_explain_prefix(store):
+    query = "MATCH (a:Person)-->(b:State) WHERE b = 'FL' LIMIT 5"
+    (row,) = list(execute(store, f"EXPLAIN {query}"))
+    assert row == {"plan": explain(store, query)}
+    assert row["plan"].endswith("2: Limit(5)")
@@ -0,0 +1,62 @@
+"""
+``python ingest.py``: facts reach the ``--sqlite`` database, and a run
+resumed from its checkpoint ends with what one run over the whole input
+stores.
+"""
+import json
+
+import pytest
+
+from benchmarks.generator import CDCGenerator
+from conftest import entity_state
+import ingest
+from sqlite_fact_store import SqliteFactStore
+
+# One ``users`` table, which the routes in ``message_configs`` cover.
+MESSAGES = list(CDCGenerator(seed=3, entity_cardinality=100)(500))
+
+
+def _write(path, messages):
+    path.write_text(
+        "".join(json.dumps(message) + "\n" for message in messages)
+    )
+
+
+def _state(path):
+    store = SqliteFactStore(path=str(path))
+    try:
+        return entity_state(store)
+    finally:
+        store.close()
+
+
+def test_checkpoint_requires_sqlite(tmp_path):
+    source = tmp_path / "dump.jsonl"
+    _write(source, [])
+    with pytest.raises(SystemExit):
+        ingest.main(
+            [str(source), "--checkpoint", str(tmp_path / "dump.offset")]
+        )
+
+
+def test_resume_matches_one_run(tmp_path):
+    whole = tmp_path / "whole.jsonl"
+    _write(whole, MESSAGES)
+    ingest.main(
+        [str(whole), "--workers", "1", "--sqlite", str(tmp_path / "a.db")]
+    )
+
+    source = tmp_path / "dump.jsonl"
+    checkpoint = str(tmp_path / "dump.offset")
+    resumed = ["--workers", "1", "--sqlite", str(tmp_path / "b.db")]
+    _write(source, MESSAGES[:300])
+    ingest.main([str(source), *resumed, "--checkpoint", checkpoint])
+    assert ingest.read_checkpoint(checkpoint) == source.stat().st_size
+    _write(source, MESSAGES)
+    ingest.main(
+        [str(source), *resumed, "--checkpoint", checkpoint, "--resume"]
+    )
+
+    expected = _state(tmp_path / "a.db")
+    assert expected
+    assert _state(tmp_path / "b.db") == expected
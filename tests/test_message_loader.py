@@ -0,0 +1,75 @@
+"""
+Hot reloading of message types: ``Session.reload_message_types`` updates
+the routes in the session's ``MessageRoundabout``.
+"""
+import pytest
+
+from fact_store import MemoryFactStore
+from message_loader import MessageTypeLoader
+from route import MessageRoundabout
+from session import Session
+
+CONFIG = """
+UserTableMessageType:
+  argument_mapping:
+    user_id: [cdc, columns, id]
+    user_name: [cdc, columns, name]
+    state: [cdc, columns, state]
+  route:
+    keypath: [metadata, table]
+    value_match: {table}
+"""
+
+
+def _message(table, user_id=1):
+    return {
+        "metadata": {"table": table},
+        "cdc": {"columns": {"id": user_id, "name": "Ann Lee", "state": "FL"}},
+    }
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "message_config.yaml"
+    path.write_text(CONFIG.format(table="users"))
+    return path
+
+
+@pytest.fixture
+def session(config_path):
+    loader = MessageTypeLoader(str(config_path.parent))
+    roundabout = MessageRoundabout()
+    for route in loader.routes():
+        roundabout.add_route(route)
+    return Session(
+        fact_store_cls=MemoryFactStore,
+        message_roundabout=roundabout,
+        message_loader=loader,
+    )
+
+
+def test_reload_reroutes_changed_route(session, config_path):
+    session(_message("users"))
+    config_path.write_text(CONFIG.format(table="people"))
+    session.reload_message_types()
+    session(_message("people", user_id=2))
+    with pytest.raises(AssertionError, match="no routes"):
+        session(_message("users", user_id=3))
+    assert len(session.message_roundabout.routes) == 1
+
+
+def test_reload_drops_routes_of_removed_types(session, config_path):
+    config_path.unlink()
+    session.reload_message_types()
+    assert session.message_roundabout.routes == []
+    with pytest.raises(AssertionError, match="no routes"):
+        session(_message("users"))
+
+
+def test_reload_keeps_other_routes(session, config_path):
+    message_type = session.message_roundabout.routes[0].message_type
+    config_path.write_text(CONFIG.format(table="users") + "\n# edited\n")
+    session.reload_message_types()
+    routes = session.message_roundabout.routes
+    assert [route.message_type for route in routes] == [message_type]
+    session(_message("users"))
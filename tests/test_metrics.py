@@ -0,0 +1,43 @@
+"""
+Gauges registered by stores are per instance and go away with them.
+"""
+import gc
+
+from caching import CachingFactStore
+from fact_store import MemoryFactStore
+from metrics import METRICS
+
+
+def _gauges(store):
+    suffix = f"[{store.metrics_label}]"
+    return {name for name in METRICS.gauges if name.endswith(suffix)}
+
+
+def test_each_store_reports_its_own_gauges():
+    first, second = MemoryFactStore(), MemoryFactStore()
+    try:
+        assert first.metrics_label != second.metrics_label
+        assert f"fact_store.attributes[{first.metrics_label}]" in _gauges(
+            first
+        )
+        assert len(_gauges(first)) == len(_gauges(second))
+    finally:
+        first.close()
+        second.close()
+
+
+def test_close_drops_the_gauges():
+    store = CachingFactStore(fact_store_cls=MemoryFactStore)
+    backend = store.backend
+    assert _gauges(store) and _gauges(backend)
+    store.close()
+    assert not _gauges(store)
+    assert not _gauges(backend)
+
+
+def test_collected_store_drops_its_gauges():
+    store = MemoryFactStore()
+    suffix = f"[{store.metrics_label}]"
+    del store
+    gc.collect()
+    assert not [name for name in METRICS.gauges if name.endswith(suffix)]
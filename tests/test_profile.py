@@ -0,0 +1,70 @@
+"""
+``PROFILE``: the rows, and per operator the rows in and out, fact store
+calls and value index hits and misses.
+"""
+import json
+
+import pytest
+
+from conftest import QUERIES, comparable_rows, query_rows
+from query import execute, profile
+from registry import REGISTRY
+
+JUDY = "MATCH (a:Person)-->(b:State) WHERE a.FirstName = 'Judy'"
+NOBODY = "MATCH (a:Person)-->(b:State) WHERE a.FirstName = 'Nobody'"
+
+
+@pytest.fixture
+def indexed_store(memory_store):
+    memory_store.create_index(REGISTRY.attributes["FirstName"])
+    return memory_store
+
+
+@pytest.mark.parametrize("query", QUERIES + [JUDY])
+def test_rows_match_execute(indexed_store, query):
+    result = profile(indexed_store, query)
+    assert comparable_rows(result.rows) == query_rows(indexed_store, query)
+    upstream = 1
+    for operator in result.operators:
+        assert operator.rows_in == upstream
+        upstream = operator.rows_out
+    assert upstream == len(result.rows)
+
+
+def test_store_calls_and_index_hits(indexed_store):
+    seek, expand = profile(indexed_store, JUDY).operators
+    assert seek.description.startswith("IndexSeek")
+    assert dict(seek.store_calls) == {"attribute_index": 1}
+    assert (seek.index_hits, seek.index_misses) == (1, 0)
+    # One edge scan per person found.
+    assert dict(expand.store_calls) == {"edges": seek.rows_out}
+    assert expand.rows_in == seek.rows_out > 0
+    assert (expand.index_hits, expand.index_misses) == (0, 0)
+
+
+def test_index_misses(indexed_store):
+    result = profile(indexed_store, NOBODY)
+    seek = result.operators[0]
+    assert (seek.index_hits, seek.index_misses) == (0, 1)
+    assert not result.rows
+
+
+def test_limit_is_profiled(indexed_store):
+    result = profile(indexed_store, f"{JUDY} LIMIT 3")
+    limit = result.operators[-1]
+    assert limit.description == "Limit(3)"
+    assert limit.rows_out == len(result.rows) == 3
+    assert result.operators[-2].rows_out == 3
+
+
+def test_profile_prefix(indexed_store):
+    (row,) = list(execute(indexed_store, f"PROFILE {JUDY}"))
+    result = row["profile"]
+    assert row["plan"] == result.render()
+    assert "index hits 1, misses 0" in row["plan"]
+    assert "store calls 1 (attribute_index 1)" in row["plan"]
+    data = json.loads(json.dumps(result.as_dict()))
+    assert data["rows"] == len(result.rows)
+    assert [operator["rows_out"] for operator in data["operators"]] == [
+        operator.rows_out for operator in result.operators
+    ]
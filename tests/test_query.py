@@ -0,0 +1,62 @@
+"""
+Query text compilation and its plan cache.
+"""
+import gc
+
+from fact_store import MemoryFactStore
+from planner import plan
+from query import compile_query, execute, normalize, parse
+
+
+def test_whitespace_outside_literals_shares_a_plan():
+    assert compile_query(
+        "MATCH (a:Person)-->(b:State)\n  WHERE b = 'FL'   LIMIT 10"
+    ) is compile_query("MATCH (a:Person)-->(b:State) WHERE b = 'FL' LIMIT 10")
+
+
+def test_whitespace_inside_literals_is_kept():
+    assert normalize("WHERE b  =  'A  B'") == "WHERE b = 'A  B'"
+    assert normalize('WHERE b = "A \t B"') == 'WHERE b = "A \t B"'
+    assert compile_query(
+        "MATCH (a:Person)-->(b:State) WHERE b = 'A  B'"
+    ) is not compile_query("MATCH (a:Person)-->(b:State) WHERE b = 'A B'")
+
+
+def test_literal_whitespace_changes_results(make_session, messages):
+    session = make_session("memory")
+    session.ingest(messages)
+    store = session.fact_store
+    assert list(execute(store, "MATCH (a:Person)-->(b:State) WHERE b = 'FL'"))
+    assert not list(
+        execute(store, "MATCH (a:Person)-->(b:State) WHERE b = 'F  L'")
+    )
+
+
+def test_cached_plan_is_reusable_across_stores(make_session, messages):
+    query = "MATCH (a:Person)-->(b:State) WHERE b = 'FL'"
+    first = make_session("memory")
+    first.ingest(messages[:300])
+    second = make_session("sqlite")
+    second.ingest(messages)
+    expected = len(list(execute(second.fact_store, query)))
+    hits = compile_query.cache_info().hits
+    assert len(list(execute(first.fact_store, query))) < expected
+    assert compile_query.cache_info().hits > hits
+    assert len(list(execute(second.fact_store, query))) == expected
+
+
+def test_cached_orders_belong_to_their_store(make_session, messages):
+    compiled = plan(parse("MATCH (a:Person)-->(b:State) WHERE b = 'FL'"))
+    session = make_session("memory")
+    session.ingest(messages)
+    empty = MemoryFactStore()
+    assert compiled.explain(session.fact_store).startswith(
+        "0: NodeById(b:State"
+    )
+    assert compiled.explain(empty).startswith("0: NodeScan(a:Person)")
+    assert len(compiled._orders) == 2
+    # A store's orders go with it, so a store that later reuses its id
+    # is planned afresh.
+    del empty
+    gc.collect()
+    assert list(compiled._orders) == [session.fact_store]
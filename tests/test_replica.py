@@ -0,0 +1,124 @@
+"""
+Replicas: a published generation reads back what the store held, its
+value indexes answer range lookups like a scan, and readers move between
+generations only when they refresh.
+"""
+import operator
+import os
+
+import pytest
+
+from attribute import Attribute
+from conftest import QUERIES, entity_state, query_rows
+from entities import Person
+from fact import AttributeFact
+from registry import REGISTRY
+from replica import ReplicaFactStore, current_generation, publish
+
+RELATIONS = {
+    "EQUALS": operator.eq,
+    "LT": operator.lt,
+    "LTE": operator.le,
+    "GT": operator.gt,
+    "GTE": operator.ge,
+}
+
+INDEXED = ("UserID", "FirstName")
+
+
+class ReplicaPayload(Attribute):
+    """
+    Values of mixed types, None included.
+    """
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "replica")
+
+
+@pytest.fixture
+def replica(memory_store, directory):
+    for name in INDEXED:
+        memory_store.create_index(REGISTRY.attributes[name])
+    publish(memory_store, directory)
+    store = ReplicaFactStore(directory)
+    yield store
+    store.close()
+
+
+def test_round_trip(replica, memory_store):
+    assert entity_state(replica) == entity_state(memory_store)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_memory(replica, memory_store, query):
+    assert query_rows(replica, query) == query_rows(memory_store, query)
+
+
+@pytest.mark.parametrize("relation", sorted(RELATIONS))
+@pytest.mark.parametrize(
+    "attribute, value", [("UserID", 40), ("FirstName", "Judy")]
+)
+def test_index_lookups_match_a_scan(
+    replica, memory_store, relation, attribute, value
+):
+    attribute = REGISTRY.attributes[attribute]
+    index = replica.attribute_index(attribute)
+    found = set(index.lookup(Person, relation, value))
+    test = RELATIONS[relation]
+    expected = set()
+    for entity_id in memory_store.entity_ids(Person):
+        fact = memory_store.get_attribute(Person, attribute, entity_id)
+        if fact != "__MISSING__" and test(fact.value, value):
+            expected.add(entity_id)
+    assert found == expected
+    assert index.estimate(Person, relation, value) == len(found)
+
+
+def test_unindexed_attributes_have_no_index(replica):
+    assert replica.attribute_index(REGISTRY.attributes["LuckyNumber"]) is None
+
+
+def test_object_and_null_values_round_trip(make_session, directory):
+    store = make_session("memory").fact_store
+    for entity_id, value in enumerate([None, {"a": 1}, 3, "x", (1, 2), 2.5]):
+        store(
+            AttributeFact(
+                entity_type=Person,
+                attribute=ReplicaPayload,
+                entity_id=entity_id,
+                value=value,
+            )
+        )
+    store.create_index(ReplicaPayload)
+    publish(store, directory)
+    with ReplicaFactStore(directory) as replica:
+        assert entity_state(replica) == entity_state(store)
+        index = replica.attribute_index(ReplicaPayload)
+        assert set(index.lookup(Person, "EQUALS", "x")) == {3}
+        assert set(index.lookup(Person, "EQUALS", 3)) == {2}
+        assert set(index.lookup(Person, "GT", 2)) == {2, 5}
+
+
+def test_readers_switch_generations_on_refresh(
+    make_session, messages, directory
+):
+    session = make_session("memory")
+    store = session.fact_store
+    session.ingest(messages[:300])
+    assert session.publish(directory) == 1
+    first = entity_state(store)
+    with ReplicaFactStore(directory) as reader:
+        session.ingest(messages[300:])
+        # Generation 1 is unlinked by the third publish.
+        session.publish(directory)
+        session.publish(directory)
+        assert current_generation(directory) == 3
+        assert not os.path.exists(os.path.join(directory, "facts.1.replica"))
+        assert reader.generation == 1
+        assert entity_state(reader) == first
+        assert reader.refresh()
+        assert reader.generation == 3
+        assert entity_state(reader) == entity_state(store)
+        assert not reader.refresh()
@@ -0,0 +1,253 @@
+"""
+``IngestServer`` on a temporary socket, driven with ``Client`` and
+``ClientPool``.
+"""
+import asyncio
+import struct
+
+import pytest
+
+from configs import SERVER_MAX_FRAME
+from entities import Person
+from server import (
+    Client,
+    ClientPool,
+    IngestServer,
+    ServerError,
+    encode_frame,
+    read_frame,
+)
+
+# Matches no route.
+BAD_MESSAGE = {"metadata": {"table": "unknown"}, "cdc": {"columns": {}}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "facts.sock")
+
+
+@pytest.fixture
+def users(messages):
+    """
+    The first message for each of a few people in the ``users`` table.
+    """
+    first = {}
+    for message in messages:
+        if message["metadata"]["table"] == "users":
+            first.setdefault(message["cdc"]["columns"]["id"], message)
+    return list(first.values())[:20]
+
+
+def _first_name(message):
+    return message["cdc"]["columns"]["name"].split(" ")[0]
+
+
+def _serve(session, path, test, **kwargs):
+    """
+    Returns ``await test(server)``, run against a started server for
+    ``session`` that is closed afterwards.
+    """
+
+    async def main():
+        server = IngestServer(session, path, **kwargs)
+        await server.start()
+        try:
+            return await test(server)
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+async def _raw(path, data: bytes):
+    """
+    Sends ``data`` as it is and returns the response frames until the
+    server closes the connection.
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(data)
+    await writer.drain()
+    responses = []
+    while True:
+        response = await read_frame(reader)
+        if response is None:
+            break
+        responses.append(response)
+    writer.close()
+    return responses
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_reads_see_acknowledged_puts(make_session, users, path, backend):
+    message = users[0]
+    user_id = message["cdc"]["columns"]["id"]
+
+    async def test(server):
+        client = await Client.connect(path)
+        try:
+            assert await client.get_entity("Person", user_id) == {}
+            await client.put(message)
+            name = await client.get_attribute("Person", "FirstName", user_id)
+            entity = await client.get_entity("Person", user_id)
+        finally:
+            await client.close()
+        return name, entity
+
+    name, entity = _serve(make_session(backend), path, test)
+    assert name == entity["FirstName"] == _first_name(message)
+
+
+def test_failed_put_does_not_hold_back_its_batch(make_session, users, path):
+    session = make_session("memory")
+    puts = [users[0], BAD_MESSAGE, users[1]]
+
+    async def test(server):
+        client = await Client.connect(path)
+        try:
+            return await asyncio.gather(
+                *(client.put(message) for message in puts),
+                return_exceptions=True,
+            )
+        finally:
+            await client.close()
+
+    results = _serve(session, path, test)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ServerError)
+    for message in (users[0], users[1]):
+        assert session.fact_store.has_entity(
+            Person, message["cdc"]["columns"]["id"]
+        )
+
+
+def test_bad_requests_are_answered(make_session, path):
+    async def test(server):
+        client = await Client.connect(path)
+        try:
+            errors = []
+            for request in (
+                {"op": "drop_everything"},
+                {"op": "get_entity", "entity_type": "Planet"},
+                {"op": "get_attribute", "entity_type": "Person"},
+            ):
+                with pytest.raises(ServerError) as error:
+                    await client.request(request)
+                errors.append(str(error.value))
+            # The connection is still usable.
+            assert await client.get_entity("Person", 1) == {}
+        finally:
+            await client.close()
+        return errors
+
+    errors = _serve(make_session("memory"), path, test)
+    assert "Unknown op" in errors[0]
+    assert "Unknown entity type" in errors[1]
+    assert "Unknown attribute" in errors[2]
+
+
+def test_non_object_request_keeps_the_connection(make_session, path):
+    async def test(server):
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(encode_frame([1, 2]) + encode_frame({"id": 5, "op": "x"}))
+        responses = [await read_frame(reader), await read_frame(reader)]
+        writer.close()
+        return responses
+
+    first, second = _serve(make_session("memory"), path, test)
+    assert not first["ok"] and first["id"] is None
+    assert second["id"] == 5 and not second["ok"]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        struct.pack("!I", SERVER_MAX_FRAME + 1),
+        struct.pack("!I", 3) + b"{{{",
+    ],
+    ids=["too-large", "not-json"],
+)
+def test_bad_frame_closes_the_connection(make_session, path, data):
+    async def test(server):
+        responses = await _raw(path, data)
+        # Other connections are not affected.
+        client = await Client.connect(path)
+        try:
+            assert await client.get_entity("Person", 1) == {}
+        finally:
+            await client.close()
+        return responses
+
+    (response,) = _serve(make_session("memory"), path, test)
+    assert not response["ok"]
+
+
+def test_snapshots_are_swapped_and_released(make_session, users, path):
+    session = make_session("memory")
+
+    async def test(server):
+        first = server._snapshot
+        client = await Client.connect(path)
+        try:
+            await client.put(users[0])
+            await client.put(users[1])
+        finally:
+            await client.close()
+        return first, server._snapshot
+
+    first, last = _serve(session, path, test)
+    assert first is not last
+    assert first.released and last.released
+    assert not session.fact_store._pins
+
+
+def test_close_commits_the_queued_puts(make_session, users, path):
+    session = make_session("memory")
+
+    async def main():
+        server = IngestServer(session, path, batch_size=2, queue_size=4)
+        await server.start()
+        pool = ClientPool(path, size=3)
+        puts = [
+            asyncio.ensure_future(pool.put(message)) for message in users
+        ]
+        # Let the puts reach the server, then close it under them.
+        while not server.queued():
+            await asyncio.sleep(0.001)
+        await server.close()
+        results = await asyncio.gather(*puts, return_exceptions=True)
+        await pool.close()
+        return results
+
+    results = asyncio.run(main())
+    for message, result in zip(users, results):
+        if result is None:
+            # Acknowledged puts are committed.
+            assert session.fact_store.has_entity(
+                Person, message["cdc"]["columns"]["id"]
+            )
+        else:
+            assert isinstance(result, (ServerError, ConnectionError))
+    assert any(result is None for result in results)
+
+
+def test_pool_spreads_requests(make_session, users, path):
+    async def test(server):
+        pool = ClientPool(path, size=2)
+        try:
+            await asyncio.gather(*(pool.put(message) for message in users))
+            names = await asyncio.gather(
+                *(
+                    pool.get_attribute(
+                        "Person", "FirstName", message["cdc"]["columns"]["id"]
+                    )
+                    for message in users
+                )
+            )
+            return names, len(pool._clients)
+        finally:
+            await pool.close()
+
+    names, clients = _serve(make_session("memory"), path, test)
+    assert names == [_first_name(message) for message in users]
+    assert clients == 2
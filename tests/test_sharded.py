@@ -0,0 +1,81 @@
+"""
+``ShardedFactStore`` holds what the in-memory store holds after the same
+messages and answers queries, counts included, the same way.
+"""
+import collections
+
+import pytest
+
+from conftest import QUERIES, entity_state, query_rows
+from query import execute
+from sharded import ShardedFactStore
+
+
+@pytest.fixture
+def sharded(make_session, messages):
+    session = make_session(ShardedFactStore, {"shard_count": 3})
+    for message in messages:
+        session(message)
+    return session.fact_store
+
+
+def test_state_matches_memory(sharded, memory_store):
+    assert entity_state(sharded) == entity_state(memory_store)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_memory(sharded, memory_store, query):
+    assert query_rows(sharded, query) == query_rows(memory_store, query)
+
+
+def test_count_matches_memory(sharded, memory_store):
+    by_state = collections.Counter(
+        row["b"] for row in execute(memory_store, QUERIES[0])
+    )
+    assert sharded.count(QUERIES[0]) == sum(by_state.values())
+    assert sharded.count(QUERIES[0], group_by="b") == by_state
+
+
+@pytest.fixture
+def closed_queries(sharded, monkeypatch):
+    """
+    Query ids the coordinator has told the shards to close.
+    """
+    closed = []
+    broadcast = sharded._broadcast
+
+    def spy(command, *args):
+        if command == "close":
+            closed.append(args[0])
+        return broadcast(command, *args)
+
+    monkeypatch.setattr(sharded, "_broadcast", spy)
+    return closed
+
+
+def test_limit_closes_the_query(sharded, closed_queries):
+    with execute(sharded, QUERIES[0] + " LIMIT 1") as rows:
+        assert len(list(rows)) == 1
+        assert len(closed_queries) == 1
+
+
+def test_closing_a_stream_closes_the_query(sharded, closed_queries):
+    rows = execute(sharded, QUERIES[0])
+    next(rows)
+    assert not closed_queries
+    rows.close()
+    assert len(closed_queries) == 1
+
+
+def test_leaving_a_with_block_closes_the_query(sharded, closed_queries):
+    with execute(sharded, QUERIES[0]) as rows:
+        next(rows)
+    assert len(closed_queries) == 1
+
+
+def test_stream_outliving_the_store(sharded, closed_queries):
+    rows = execute(sharded, QUERIES[0])
+    next(rows)
+    sharded.close()
+    rows.close()
+    assert not closed_queries
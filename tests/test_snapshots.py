@@ -0,0 +1,42 @@
+"""
+MVCC snapshots of ``MemoryFactStore``: a snapshot keeps reading the
+version it was taken at while the store moves on.
+"""
+from conftest import entity_state
+
+
+def test_snapshot_ignores_later_writes(make_session, messages):
+    session = make_session("memory")
+    session.ingest(messages[:300])
+    store = session.fact_store
+    before = entity_state(store)
+    with store.snapshot() as snapshot:
+        session.ingest(messages[300:])
+        assert entity_state(store) != before
+        assert entity_state(snapshot) == before
+
+
+def test_snapshot_sees_only_committed_writes(make_session, messages):
+    session = make_session("memory")
+    session.ingest(messages[:300])
+    store = session.fact_store
+    before = entity_state(store)
+    with store.transaction():
+        for message in messages[300:400]:
+            session(message)
+        with store.snapshot() as snapshot:
+            assert entity_state(snapshot) == before
+
+
+def test_released_snapshots_let_history_go(make_session, messages):
+    session = make_session("memory")
+    store = session.fact_store
+    session.ingest(messages[:300])
+    snapshot = store.snapshot()
+    for message in messages[300:]:
+        session(message)
+    pinned = store.history_size()
+    assert pinned
+    snapshot.release()
+    session(messages[0])
+    assert store.history_size() < pinned
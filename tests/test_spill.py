@@ -0,0 +1,37 @@
+"""
+A ``MemoryFactStore`` over its ``memory_budget`` spills rows to disk and
+reads them back as if they had never left.
+"""
+import pytest
+
+from conftest import QUERIES, entity_state, query_rows
+
+
+@pytest.fixture
+def spilled(make_session, messages):
+    session = make_session("memory+spill")
+    session.ingest(messages)
+    return session.fact_store
+
+
+def test_rows_are_read_back(spilled, memory_store):
+    assert spilled.spilled_rows()
+    assert spilled.memory_usage()["spilled"]["facts"]
+    assert entity_state(spilled) == entity_state(memory_store)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_memory(spilled, memory_store, query):
+    assert query_rows(spilled, query) == query_rows(memory_store, query)
+
+
+def test_spilling_frees_memory(spilled, memory_store):
+    # Edges are not spilled, so the store can stay over its budget.
+    assert spilled.memory_usage()["budget"] == 50_000
+    assert spilled.memory_bytes() < memory_store.memory_bytes()
+
+
+def test_close_removes_the_tier(spilled, tmp_path):
+    assert list(tmp_path.iterdir())
+    spilled.close()
+    assert not [path for path in tmp_path.iterdir() if path.is_file()]
@@ -0,0 +1,56 @@
+"""
+Standing queries: their rows stay equal to running the query afresh, and
+subscribers hear about every row that comes and goes.
+"""
+import pytest
+
+from query import execute
+
+QUERY = "MATCH (a:Person)-[r:LivesIn]->(b:State) WHERE b = 'FL'"
+
+
+def _keys(rows):
+    return sorted((repr(row["a"]), repr(row["b"])) for row in rows)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite+cache"])
+def test_rows_follow_the_store(make_session, messages, backend):
+    session = make_session(backend)
+    session.ingest(messages[:200])
+    store = session.fact_store
+    standing = store.subscribe(QUERY)
+    current = set(_keys(standing.rows()))
+
+    def subscriber(added, removed):
+        current.difference_update(_keys(removed))
+        current.update(_keys(added))
+
+    standing.subscribe(subscriber)
+    for message in messages[200:]:
+        session(message)
+    assert _keys(standing.rows()) == _keys(execute(store, QUERY))
+    assert sorted(current) == _keys(standing.rows())
+    assert current
+
+
+def test_unsubscribed_subscriber_is_not_called(make_session, messages):
+    session = make_session("memory")
+    calls = []
+    standing = session.fact_store.subscribe(
+        QUERY, lambda added, removed: calls.append((added, removed))
+    )
+    session.ingest(messages[:100])
+    assert calls
+    standing.unsubscribe(standing.subscribers[0])
+    calls.clear()
+    session.ingest(messages[100:])
+    assert not calls
+
+
+def test_bulk_load_reloads_standing_queries(make_session, messages):
+    session = make_session("memory")
+    standing = session.fact_store.subscribe(QUERY)
+    session.backfill(messages, batch_size=100)
+    assert _keys(standing.rows()) == _keys(
+        execute(session.fact_store, QUERY)
+    )
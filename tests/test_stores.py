@@ -0,0 +1,38 @@
+"""
+The persistent stores, with and without the write-behind cache, hold what
+the in-memory store holds after the same messages and answer queries the
+same way.
+"""
+import pytest
+
+from conftest import QUERIES, entity_state, query_rows
+from sqlite_fact_store import SqliteFactStore
+
+
+@pytest.fixture(params=["sqlite", "sqlite+cache"])
+def store(request, make_session, messages):
+    session = make_session(request.param)
+    for message in messages:
+        session(message)
+    return session.fact_store
+
+
+def test_state_matches_memory(store, memory_store):
+    assert entity_state(store) == entity_state(memory_store)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_memory(store, memory_store, query):
+    assert query_rows(store, query) == query_rows(memory_store, query)
+
+
+def test_sqlite_reopens_with_the_same_state(make_session, messages, tmp_path):
+    session = make_session("sqlite+cache")
+    session.ingest(messages)
+    state = entity_state(session.fact_store)
+    session.fact_store.close()
+    reopened = SqliteFactStore(path=str(tmp_path / "facts.db"))
+    try:
+        assert entity_state(reopened) == state
+    finally:
+        reopened.close()
@@ -0,0 +1,120 @@
+"""
+Streaming execution: ``LIMIT`` and closing a ``ResultStream`` stop the
+store reads feeding it, and ``cancel`` stops a query running in another
+thread.
+"""
+import threading
+
+import pytest
+
+from operators import QueryCancelled
+from query import execute
+
+QUERY = "MATCH (a:Person)-->(b:State)"
+
+
+class CountingStore:
+    """
+    Passes reads through to ``store``, counting the edges handed out and
+    the edge scans still open.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.edges_read = 0
+        self.open_scans = 0
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def edges(self, *args, **kwargs):
+        self.open_scans += 1
+        try:
+            for edge in self.store.edges(*args, **kwargs):
+                self.edges_read += 1
+                yield edge
+        finally:
+            self.open_scans -= 1
+
+
+@pytest.fixture
+def counting_store(memory_store):
+    return CountingStore(memory_store)
+
+
+def test_limit_stops_upstream_reads(counting_store):
+    everything = len(list(execute(counting_store, QUERY)))
+    read_everything = counting_store.edges_read
+    assert everything > 10
+    counting_store.edges_read = 0
+    rows = list(execute(counting_store, f"{QUERY} LIMIT 3"))
+    assert len(rows) == 3
+    assert counting_store.edges_read < read_everything / 2
+    assert counting_store.open_scans == 0
+
+
+@pytest.mark.parametrize("limit", [0, 1, 5])
+def test_execute_limit_closes_the_pipeline(counting_store, limit):
+    rows = execute(counting_store, QUERY, limit=limit)
+    assert len(list(rows)) == limit
+    assert counting_store.open_scans == 0
+
+
+def test_closing_the_stream_closes_the_scans(counting_store):
+    with execute(counting_store, QUERY) as rows:
+        next(rows)
+        assert counting_store.open_scans
+    assert counting_store.open_scans == 0
+    with pytest.raises(StopIteration):
+        next(rows)
+
+
+class BlockingStore(CountingStore):
+    """
+    Stops inside its first edge scan until ``proceed`` is set.
+    """
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.reading = threading.Event()
+        self.proceed = threading.Event()
+
+    def edges(self, *args, **kwargs):
+        for edge in super().edges(*args, **kwargs):
+            yield edge
+            if not self.reading.is_set():
+                self.reading.set()
+                assert self.proceed.wait(10)
+
+
+def test_cancel_from_another_thread(memory_store):
+    store = BlockingStore(memory_store)
+    rows = execute(store, QUERY)
+    outcome = []
+
+    def consume():
+        try:
+            outcome.append(len(list(rows)))
+        except QueryCancelled as error:
+            outcome.append(error)
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    assert store.reading.wait(10)
+    rows.cancel()
+    store.proceed.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    (result,) = outcome
+    assert isinstance(result, QueryCancelled)
+    full = CountingStore(memory_store)
+    list(execute(full, QUERY))
+    assert store.edges_read < full.edges_read
+
+
+def test_cancelled_stream_raises(memory_store):
+    rows = execute(memory_store, QUERY)
+    next(rows)
+    rows.cancel()
+    with pytest.raises(QueryCancelled):
+        next(rows)
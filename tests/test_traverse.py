@@ -0,0 +1,120 @@
+"""
+``FactStore.traverse`` and variable-length patterns: hop limits, each
+entity once at its shortest distance, and cycles, on every store that
+implements its own walk.
+"""
+import pytest
+
+from attribute import LivesIn, Relationship
+from conftest import comparable_rows
+from entities import Person, State
+from fact import RelationshipFact
+from operators import EntityRef
+from query import execute
+from replica import ReplicaFactStore, publish
+
+
+class Follows(Relationship):
+    """
+    Between people, in a cycle with a shortcut and a diamond.
+    """
+
+
+FOLLOWS = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 0), (0, 2), (1, 5), (2, 5)]
+
+# Shortest distances from person 0 along ``Follows``.
+DISTANCES = {1: 1, 2: 1, 3: 2, 5: 2, 4: 3}
+
+
+def _fill(store):
+    for source, target in FOLLOWS:
+        store(
+            RelationshipFact(
+                relationship=Follows,
+                source_entity_type=Person,
+                source_entity_id=source,
+                target_entity_type=Person,
+                target_entity_id=target,
+            )
+        )
+    store(
+        RelationshipFact(
+            relationship=LivesIn,
+            source_entity_type=Person,
+            source_entity_id=3,
+            target_entity_type=State,
+            target_entity_id="FL",
+        )
+    )
+
+
+@pytest.fixture(params=["memory", "sqlite", "sqlite+cache", "replica"])
+def store(request, make_session, tmp_path):
+    if request.param != "replica":
+        store = make_session(request.param).fact_store
+        _fill(store)
+        yield store
+        return
+    source = make_session("memory").fact_store
+    _fill(source)
+    publish(source, str(tmp_path / "replica"))
+    with ReplicaFactStore(str(tmp_path / "replica")) as replica:
+        yield replica
+
+
+def _walk(store, **kwargs) -> dict:
+    found = {}
+    for entity_type, entity_id, hops in store.traverse(Person, 0, **kwargs):
+        # Each entity once.
+        assert (entity_type, entity_id) not in found
+        found[(entity_type, entity_id)] = hops
+    return found
+
+
+def _people(distances: dict) -> dict:
+    return {(Person, person): hops for person, hops in distances.items()}
+
+
+@pytest.mark.parametrize(
+    "min_hops, max_hops", [(1, None), (1, 1), (2, 2), (2, 3), (3, None)]
+)
+def test_hop_limits(store, min_hops, max_hops):
+    expected = {
+        person: hops
+        for person, hops in DISTANCES.items()
+        if hops >= min_hops and (max_hops is None or hops <= max_hops)
+    }
+    found = _walk(
+        store, relationship=Follows, min_hops=min_hops, max_hops=max_hops
+    )
+    assert found == _people(expected)
+
+
+def test_zero_hops_includes_the_start(store):
+    found = _walk(store, relationship=Follows, min_hops=0, max_hops=1)
+    assert found == {(Person, 0): 0, (Person, 1): 1, (Person, 2): 1}
+
+
+def test_incoming_edges(store):
+    # 0 is followed by 4, which is followed by 3, and so on back.
+    found = _walk(store, relationship=Follows, direction="in", max_hops=3)
+    assert found == _people({4: 1, 3: 2, 2: 3})
+
+
+def test_any_relationship(store):
+    found = _walk(store)
+    assert found == {**_people(DISTANCES), (State, "FL"): 3}
+
+
+def test_unknown_start_finds_nothing(store):
+    assert not list(store.traverse(Person, 99, relationship=Follows))
+
+
+def test_var_length_pattern(store):
+    rows = execute(
+        store, "MATCH (a:Person)-[:Follows*2..3]->(b:Person) WHERE a = 0"
+    )
+    assert comparable_rows(rows) == comparable_rows(
+        {"a": EntityRef(Person, 0), "b": EntityRef(Person, person)}
+        for person in (3, 4, 5)
+    )
@@ -0,0 +1,93 @@
+"""
+Facts of attribute and relationship classes with a ``ttl`` expire from
+``MemoryFactStore``.
+"""
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from attribute import Attribute, Relationship
+from entities import Person, State
+from fact import AttributeFact, RelationshipFact
+
+class SessionToken(Attribute):
+    """
+    Kept for a minute.
+    """
+
+    ttl = 60.0
+
+
+class VisitedRecently(Relationship):
+    """
+    Kept for a minute.
+    """
+
+    ttl = 60.0
+
+
+def _stamp(fact, created_at):
+    fact.created_at = datetime.fromtimestamp(created_at, tz=timezone.utc)
+    return fact
+
+
+@pytest.fixture
+def created_at():
+    # Recent enough that the store, which expires facts as transactions
+    # begin, keeps them until the tests pass a later time.
+    return time.time()
+
+
+@pytest.fixture
+def store(make_session, created_at):
+    store = make_session("memory").fact_store
+    store(
+        _stamp(
+            AttributeFact(
+                entity_type=Person,
+                attribute=SessionToken,
+                entity_id=1,
+                value="abc",
+            ),
+            created_at,
+        )
+    )
+    store(
+        _stamp(
+            RelationshipFact(
+                relationship=VisitedRecently,
+                source_entity_type=Person,
+                source_entity_id=1,
+                target_entity_type=State,
+                target_entity_id="FL",
+            ),
+            created_at,
+        )
+    )
+    return store
+
+
+def _edges(store):
+    return list(store.edges(VisitedRecently, Person, 1, direction="out"))
+
+
+def test_facts_live_until_their_ttl(store, created_at):
+    assert store.expire(created_at + 59) == 0
+    assert store.get_attribute(Person, SessionToken, 1).value == "abc"
+    assert _edges(store)
+    assert store.ttl_pending() == 2
+
+
+def test_facts_expire_after_their_ttl(store, created_at):
+    assert store.expire(created_at + 61) == 2
+    assert store.get_attribute(Person, SessionToken, 1) == "__MISSING__"
+    assert not _edges(store)
+    assert store.ttl_pending() == 0
+    assert store.has_entity(Person, 1)
+
+
+def test_snapshots_keep_expired_facts(store, created_at):
+    with store.snapshot() as snapshot:
+        store.expire(created_at + 61)
+        assert snapshot.get_attribute(Person, SessionToken, 1).value == "abc"
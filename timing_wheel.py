@@ -0,0 +1,172 @@
+"""
+Hierarchical timing wheels, for expiring many timers cheaply.
+
+A ``TimingWheel`` keeps timers in ``levels`` wheels of ``slots`` slots. A
+slot of level 0 covers one ``tick``, a slot of level 1 one whole turn of
+level 0, and so on; timers too far out for the top level wait in an
+overflow heap. Scheduling puts a timer in one slot. When a level finishes
+a turn, the timers in the next slot of the level above are moved down, so
+a timer is moved at most ``levels`` times before it fires. Advancing jumps
+over the ticks of empty levels, so both costs are O(1) per timer however
+far out the deadlines are and however long the wheel sat idle.
+
+Timers can not be cancelled: whoever receives a fired timer checks whether
+it still applies. Deadlines are rounded up to whole ticks, so nothing fires
+early.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import time
+from typing import Any, List, Optional, Tuple
+
+
+class TimingWheel:
+    """
+    Timers on wall-clock deadlines, fired by ``advance`` to ``tick``
+    resolution. ``slots`` must be a power of two.
+    """
+
+    def __init__(
+        self,
+        tick: float = 1.0,
+        slots: int = 64,
+        levels: int = 4,
+        start: Optional[float] = None,
+    ):
+        if tick <= 0:
+            raise ValueError("tick must be positive")
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        if levels < 1:
+            raise ValueError("levels must be at least 1")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        # level -> slot -> (deadline tick, item)
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [
+            [[] for _ in range(slots)] for _ in range(levels)
+        ]
+        self._counts = [0] * levels
+        # (deadline tick, sequence, item), for timers beyond the top level
+        self._overflow: List[Tuple[int, int, Any]] = []
+        self._sequence = itertools.count()
+        # Scheduled with a deadline that had already passed.
+        self._ready: List[Any] = []
+        self._len = 0
+        # The last tick advanced to.
+        self._now = int((time.time() if start is None else start) // tick)
+        self.due = math.inf
+
+    def __len__(self) -> int:
+        """
+        Number of timers that have not fired.
+        """
+        return self._len
+
+    @property
+    def now(self) -> float:
+        """
+        The time the wheel was last advanced to, to ``tick`` resolution:
+        every deadline up to it has fired.
+        """
+        return self._now * self.tick
+
+    def schedule(self, deadline: float, item: Any):
+        """
+        Fires ``item`` from the first ``advance`` to ``deadline`` or later.
+        """
+        tick = math.ceil(deadline / self.tick)
+        self._len += 1
+        if tick <= self._now:
+            self._ready.append(item)
+            self.due = -math.inf
+            return
+        level = self._insert(tick, item)
+        due = self._boundary(level) * self.tick
+        if due < self.due:
+            self.due = due
+
+    def _insert(self, tick: int, item: Any) -> int:
+        # The lowest level whose current turn includes ``tick``.
+        now = self._now
+        bits = self._bits
+        for level in range(self.levels):
+            shift = bits * (level + 1)
+            if tick >> shift == now >> shift:
+                slot = (tick >> (bits * level)) & self._mask
+                self._wheels[level][slot].append((tick, item))
+                self._counts[level] += 1
+                return level
+        heapq.heappush(self._overflow, (tick, next(self._sequence), item))
+        return self.levels
+
+    def _boundary(self, level: int) -> int:
+        # The next tick at which timers on ``level`` can move or fire.
+        shift = self._bits * level
+        boundary = ((self._now >> shift) + 1) << shift
+        if level == self.levels:
+            # Straight to the turn of the earliest overflow timer.
+            boundary = max(boundary, self._overflow[0][0] >> shift << shift)
+        return boundary
+
+    def _lowest(self) -> Optional[int]:
+        for level, count in enumerate(self._counts):
+            if count:
+                return level
+        return self.levels if self._overflow else None
+
+    def advance(self, now: Optional[float] = None) -> List[Any]:
+        """
+        Moves the wheel up to ``now`` (default: the current time). Returns
+        the items whose deadline is ``now`` or earlier, in deadline order
+        to ``tick`` resolution.
+        """
+        target = int((time.time() if now is None else now) // self.tick)
+        fired, self._ready = self._ready, []
+        bits, mask = self._bits, self._mask
+        wheels, counts = self._wheels, self._counts
+        while self._now < target:
+            # Levels below the lowest one in use are empty, so no tick
+            # before its next boundary does anything.
+            level = self._lowest()
+            if level is None:
+                self._now = target
+                break
+            tick = self._boundary(level)
+            if tick > target:
+                self._now = target
+                break
+            self._now = tick
+            # Move timers down from the levels finishing a turn, the
+            # highest first.
+            overflow = self._overflow
+            top = bits * self.levels
+            while overflow and overflow[0][0] >> top == tick >> top:
+                deadline, _, item = heapq.heappop(overflow)
+                self._insert(deadline, item)
+            for upper in range(self.levels - 1, 0, -1):
+                if tick & ((1 << bits * upper) - 1):
+                    continue
+                slot = wheels[upper][(tick >> bits * upper) & mask]
+                if slot:
+                    entries = slot[:]
+                    slot.clear()
+                    counts[upper] -= len(entries)
+                    for entry in entries:
+                        self._insert(*entry)
+            slot = wheels[0][tick & mask]
+            if slot:
+                counts[0] -= len(slot)
+                fired.extend(item for _, item in slot)
+                slot.clear()
+        self._len -= len(fired)
+        level = self._lowest()
+        self.due = (
+            math.inf if level is None else self._boundary(level) * self.tick
+        )
+        return fired